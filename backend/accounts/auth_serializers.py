@@ -5,10 +5,10 @@ from django.contrib.auth.hashers import make_password
 from django.utils import timezone
 import os
 from .models import UserDevice
-try:
-    import pyotp
-except Exception:
-    pyotp = None
+from communications import sdk
+
+# Imported on first use
+pyotp = sdk.lazy('pyotp')
 
 User = get_user_model()
 
@@ -45,7 +45,7 @@ class EmailOrUsernameTokenObtainPairSerializer(TokenObtainPairSerializer):
             otp = (self.initial_data.get('otp') or '').strip()
             if not otp:
                 raise serializers.ValidationError({'otp_required': True, 'detail': 'OTP required'})
-            if pyotp is None:
+            if not sdk.available('pyotp'):
                 raise serializers.ValidationError({'detail': 'TOTP not available'})
             totp = pyotp.TOTP(getattr(user, 'totp_secret', '') or '')
             if not getattr(user, 'totp_secret', '') or not totp.verify(otp, valid_window=1):
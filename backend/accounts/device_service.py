@@ -9,6 +9,7 @@ from django.db.models import Q
 from django.utils import timezone
 
 from .models import UserDevice
+from .push_registry import invalidate_device_tokens
 
 _ACTIVE_STATUSES = {UserDevice.Status.PRIMARY, UserDevice.Status.ACTIVE}
 
@@ -193,6 +194,7 @@ def reject_device(*, user, acting_device: UserDevice, pending_token: Optional[st
     if not qs.exists():
         raise LookupError('pending_not_found')
     qs.update(status=UserDevice.Status.REVOKED, pending_token='', pending_expires_at=None, push_token='')
+    invalidate_device_tokens([user.id])
 
 
 @transaction.atomic
@@ -8,10 +8,13 @@ import logging
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 
-import firebase_admin
-from firebase_admin import credentials, messaging
 from django.conf import settings
 
+# firebase_admin pulls in googleapiclient/httplib2; it is imported on first use
+from communications import sdk
+
+messaging = sdk.lazy('firebase.messaging')
+
 # Import notification icon helper
 from accounts.site_settings import get_notification_icon_url
 
@@ -20,6 +23,19 @@ logger = logging.getLogger(__name__)
 # Initialize Firebase Admin SDK
 _firebase_app = None
 
+FIREBASE_NOT_INITIALIZED = 'Firebase not initialized'
+
+
+def _is_token_error(exc: Exception) -> bool:
+    """FCM rejected the token itself (unregistered, other sender, malformed such as an Expo token).
+
+    These are answers about one device, not FCM being unavailable: the token is
+    pruned like an unregistered one and never counts against the provider.
+    """
+    if isinstance(exc, (messaging.UnregisteredError, messaging.SenderIdMismatchError)):
+        return True
+    return getattr(exc, 'code', None) == 'INVALID_ARGUMENT'
+
 def _initialize_firebase():
     """Initialize Firebase Admin SDK with service account"""
     global _firebase_app
@@ -44,8 +60,10 @@ def _initialize_firebase():
             logger.error(f"Firebase service account file not found: {service_account_path}")
             return None
         
-        cred = credentials.Certificate(str(service_account_path))
-        _firebase_app = firebase_admin.initialize_app(cred)
+        cred = sdk.load('firebase.credentials').Certificate(str(service_account_path))
+        from communications.providers import FCM, provider_timeout
+        # Bound every FCM HTTP call (the SDK default is two minutes)
+        _firebase_app = sdk.load('firebase').initialize_app(cred, {'httpTimeout': provider_timeout(FCM)})
         
         logger.info("✅ Firebase Admin SDK initialized successfully")
         return _firebase_app
@@ -77,7 +95,7 @@ def send_fcm_notifications(tokens: List[str], title: str, body: str, data: Optio
     # Initialize Firebase if needed
     if _initialize_firebase() is None:
         logger.error("Cannot send notifications: Firebase not initialized")
-        return {'success': 0, 'failure': len(tokens), 'errors': ['Firebase not initialized']}
+        return {'success': 0, 'failure': len(tokens), 'errors': [FIREBASE_NOT_INITIALIZED]}
     
     results = {
         'success': 0,
@@ -150,12 +168,12 @@ def send_fcm_notifications(tokens: List[str], title: str, body: str, data: Optio
             results['success'] += 1
             logger.info(f"✅ Notification sent successfully: {response}")
             
-        except messaging.UnregisteredError:
-            logger.warning(f"⚠️ Invalid token (unregistered): {token}")
-            results['failure'] += 1
-            results['invalid_tokens'].append(token)
-            
         except Exception as e:
+            if _is_token_error(e):
+                logger.warning(f"⚠️ Invalid token ({type(e).__name__}): {token}")
+                results['failure'] += 1
+                results['invalid_tokens'].append(token)
+                continue
             logger.error(f"❌ Failed to send notification to {token}: {e}")
             results['failure'] += 1
             results['errors'].append(str(e))
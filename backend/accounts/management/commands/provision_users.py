@@ -0,0 +1,57 @@
+import csv
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.provisioning import FIELDS, ProvisioningError, provision_users
+
+
+class Command(BaseCommand):
+    help = (
+        "Create many users at once from a CSV file (header row with any of: "
+        f"{', '.join(FIELDS)}; password is always hashed, password_hash takes an already encoded hash). Users, wallets and trial subscriptions are written in set-based batches "
+        "inside one transaction; nothing is written if a username is duplicated or already taken.\n"
+        "Example:\n"
+        "  python manage.py provision_users partners.csv --default-password 'Temp-2024!' --created-by admin"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_path', help="CSV file ('-' for stdin)")
+        parser.add_argument('--default-password', default=None, help='Password for rows without one (otherwise unusable)')
+        parser.add_argument('--created-by', default=None, help='Username recorded as creator')
+        parser.add_argument('--skip-existing', action='store_true', help='Skip taken usernames instead of aborting')
+        parser.add_argument('--no-trial', action='store_true', help='Do not grant the trial subscription')
+        parser.add_argument('--batch', type=int, default=1000, help='Rows per INSERT')
+
+    def handle(self, *args, **options):
+        created_by = None
+        if options['created_by']:
+            created_by = get_user_model().objects.filter(username__iexact=options['created_by']).first()
+            if created_by is None:
+                raise CommandError(f"Unknown --created-by user: {options['created_by']}")
+        path = options['csv_path']
+        fh = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+        try:
+            rows = list(csv.DictReader(fh))
+        finally:
+            if fh is not sys.stdin:
+                fh.close()
+        try:
+            result = provision_users(
+                rows,
+                created_by=created_by,
+                default_password=options['default_password'],
+                skip_existing=options['skip_existing'],
+                grant_trial=not options['no_trial'],
+                batch_size=max(1, options['batch']),
+            )
+        except ProvisioningError as e:
+            listed = ', '.join(e.usernames[:20]) + (' ...' if len(e.usernames) > 20 else '')
+            raise CommandError(f"{e}: {listed}" if listed else str(e))
+        for username in result.skipped:
+            self.stdout.write(f"[SKIP] {username} already exists")
+        self.stdout.write(
+            f"Summary: created={len(result.created)} skipped={len(result.skipped)} "
+            f"wallets={result.wallets} trials={result.trials}"
+        )
@@ -21,6 +21,27 @@ def _generate_pending_token() -> str:
     return secrets.token_urlsafe(32)
 
 
+def is_encoded_password(value: str) -> bool:
+    """True only for a hash a configured hasher can decode, or a ``make_password(None)`` marker.
+
+    A raw password that merely starts with ``!`` or a hasher prefix (``argon2$...``) is not one.
+    """
+    from django.contrib.auth.hashers import (
+        UNUSABLE_PASSWORD_PREFIX, UNUSABLE_PASSWORD_SUFFIX_LENGTH, identify_hasher,
+    )
+    if not value:
+        return False
+    if value.startswith(UNUSABLE_PASSWORD_PREFIX):
+        marker = value[len(UNUSABLE_PASSWORD_PREFIX):]
+        return len(marker) == UNUSABLE_PASSWORD_SUFFIX_LENGTH and marker.isascii() and marker.isalnum()
+    try:
+        decoded = identify_hasher(value).decode(value)
+    except Exception:
+        # Unknown algorithm, malformed fields, or a hasher whose library is missing
+        return False
+    return bool(decoded.get('hash'))
+
+
 class CustomUser(AbstractUser):
     """Custom user model with additional profile fields.
 
@@ -51,7 +72,7 @@ class CustomUser(AbstractUser):
             raw = f"{self.country_code}{self.phone}".replace(' ', '')
             self.phone_e164 = raw
         # Ensure password hashed if someone assigned raw value directly (no admin logic path)
-        if self.password and not self.password.startswith('pbkdf2_'):
+        if self.password and not is_encoded_password(self.password):
             # Only set new hash if it's not already a valid algorithm signature.
             raw_pw = self.password
             from django.contrib.auth.hashers import make_password
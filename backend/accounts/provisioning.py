@@ -0,0 +1,136 @@
+"""Bulk user provisioning.
+
+Creating users one by one runs ``CustomUser.save`` (a password hash per row)
+and two post_save signals per user: ``create_wallets_for_new_user`` and
+``grant_trial_on_user_creation``. ``provision_users`` does the same work
+set-based inside one transaction:
+
+* usernames are checked against the table in one query (case-insensitive);
+* each distinct raw password is hashed once (rows sharing a temporary
+  password share its hash); ``password`` is always treated as raw, and an
+  existing hash is only accepted through the ``password_hash`` column;
+* users, wallets (``finance.wallets.ensure_wallets``) and trial subscriptions
+  (``UserSubscription.grant_trials``) are written with ``bulk_create``.
+
+Used by ``manage.py provision_users``.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Mapping, Optional
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from .models import is_encoded_password
+
+FIELDS = ('username', 'password', 'password_hash', 'email', 'display_name', 'first_name', 'last_name', 'phone', 'country_code')
+
+
+class ProvisioningError(ValueError):
+    def __init__(self, message: str, usernames: Iterable[str] = ()):
+        super().__init__(message)
+        self.usernames = sorted(usernames)
+
+
+@dataclass
+class ProvisionResult:
+    created: List = field(default_factory=list)
+    skipped: List[str] = field(default_factory=list)
+    wallets: int = 0
+    trials: int = 0
+
+
+def _password_encoder():
+    cache: Dict[str, str] = {}
+
+    def encode(raw: Optional[str]) -> str:
+        if not raw:
+            return make_password(None)  # unusable
+        if raw not in cache:
+            cache[raw] = make_password(raw)
+        return cache[raw]
+
+    return encode
+
+
+def provision_users(rows: Iterable[Mapping[str, str]], *, created_by=None, default_password: Optional[str] = None,
+                    skip_existing: bool = False, grant_trial: bool = True, batch_size: int = 1000) -> ProvisionResult:
+    """Create users from dicts with ``FIELDS`` keys; all or nothing.
+
+    Raises ``ProvisioningError`` for duplicate or existing usernames (unless
+    ``skip_existing``), or a ``password_hash`` no configured hasher can decode,
+    before anything is written.
+    """
+    User = get_user_model()
+    entries = []
+    seen = set()
+    duplicates = set()
+    for row in rows:
+        username = (row.get('username') or '').strip()
+        if not username:
+            raise ProvisioningError("Every row needs a username")
+        key = username.lower()
+        if key in seen:
+            duplicates.add(username)
+        seen.add(key)
+        entries.append((username, row))
+    if duplicates:
+        raise ProvisioningError("Duplicate usernames in input", duplicates)
+    bad_hashes = [u for u, row in entries if (row.get('password_hash') or '').strip() and not is_encoded_password(row['password_hash'].strip())]
+    if bad_hashes:
+        raise ProvisioningError("password_hash is not a valid encoded password", bad_hashes)
+
+    result = ProvisionResult()
+    if not entries:
+        return result
+    existing = set()
+    for start in range(0, len(entries), batch_size):
+        chunk = [username.lower() for username, _ in entries[start:start + batch_size]]
+        existing.update(User.objects.annotate(username_lower=Lower('username')).filter(username_lower__in=chunk).values_list('username_lower', flat=True))
+    if existing and not skip_existing:
+        raise ProvisioningError("Usernames already exist", [u for u, _ in entries if u.lower() in existing])
+
+    encode = _password_encoder()
+    now = timezone.now()
+    users = []
+    for username, row in entries:
+        if username.lower() in existing:
+            result.skipped.append(username)
+            continue
+        password_hash = (row.get('password_hash') or '').strip()
+        raw_password = row.get('password') or default_password
+        user = User(
+            username=username,
+            password=password_hash or encode(raw_password),
+            email=(row.get('email') or '').strip(),
+            display_name=(row.get('display_name') or '').strip(),
+            first_name=(row.get('first_name') or '').strip(),
+            last_name=(row.get('last_name') or '').strip(),
+            phone=(row.get('phone') or '').strip(),
+            country_code=(row.get('country_code') or '').strip(),
+            created_by=created_by,
+            date_joined=now,
+            last_password_change=now if (password_hash or raw_password) else None,
+        )
+        # Same normalization as CustomUser.save
+        if user.country_code and user.phone:
+            user.phone_e164 = f"{user.country_code}{user.phone}".replace(' ', '')
+        users.append(user)
+
+    with transaction.atomic():
+        result.created = User.objects.bulk_create(users, batch_size=batch_size)
+        if any(u.pk is None for u in result.created):
+            # Backends without RETURNING: read the ids back
+            ids = dict(User.objects.filter(username__in=[u.username for u in users]).values_list('username', 'id'))
+            for user in result.created:
+                user.pk = ids.get(user.username)
+        from finance.wallets import ensure_wallets
+        result.wallets = ensure_wallets([u.pk for u in result.created], batch_size=batch_size)
+        if grant_trial:
+            from subscriptions.models import UserSubscription
+            result.trials = UserSubscription.grant_trials(result.created, batch_size=batch_size)
+    return result
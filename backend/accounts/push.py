@@ -4,23 +4,23 @@ import logging
 from dataclasses import dataclass
 from typing import Any, Dict, Iterable, List, Sequence
 
-import requests
 from django.conf import settings
+from django.core.cache import cache
 from django.db import transaction
 
+from communications import sdk
+from communications.providers import EXPO, FCM, ProviderUnavailable, call_provider, provider_timeout
+
 from .models import UserDevice
+from .push_registry import TOKENS_CACHE_KEY, invalidate_device_tokens, registry_enabled, registry_ttl
 
 logger = logging.getLogger(__name__)
 
-# Try to import Firebase Admin SDK (optional, falls back to Expo API)
-try:
-    from .fcm_push import send_fcm_multicast
-    FCM_AVAILABLE = True
-    logger.info("✅ Firebase Admin SDK imported successfully - FCM_AVAILABLE=True")
-except ImportError as e:
-    FCM_AVAILABLE = False
-    send_fcm_multicast = None
-    logger.error(f"❌ Failed to import Firebase Admin SDK: {e} - FCM_AVAILABLE=False")
+# Firebase Admin SDK is optional (falls back to Expo API); fcm_push imports it on first send
+from .fcm_push import FIREBASE_NOT_INITIALIZED, send_fcm_multicast
+FCM_AVAILABLE = sdk.available('firebase')
+if not FCM_AVAILABLE:
+    logger.error("❌ Firebase Admin SDK not installed - FCM_AVAILABLE=False")
 
 EXPO_PUSH_URL = getattr(settings, "EXPO_PUSH_URL", "https://exp.host/--/api/v2/push/send")
 INVALID_EXPO_ERRORS = {
@@ -58,22 +58,60 @@ class PushMessage:
         return payload
 
 
+def clear_push_tokens(tokens: Iterable[str]) -> None:
+    """Blank rejected push tokens and invalidate the owners' cached token lists."""
+    unique_tokens = list({token for token in tokens if token})
+    if not unique_tokens:
+        return
+    with transaction.atomic():
+        qs = UserDevice.objects.filter(push_token__in=unique_tokens)
+        owner_ids = list(qs.values_list("user_id", flat=True).distinct())
+        qs.update(push_token="")
+        invalidate_device_tokens(owner_ids)
+
+
 def get_active_device_tokens(user_ids: Iterable[int]) -> Dict[int, List[str]]:
+    """Active push tokens per user, served from the cache registry when possible."""
     ids = list({uid for uid in user_ids if uid})
     if not ids:
         return {}
-    qs = (
-        UserDevice.objects.filter(user_id__in=ids, status__in=ACTIVE_STATUSES)
-        .exclude(push_token__exact="")
-        .values_list("user_id", "push_token")
-    )
+    keys = {uid: TOKENS_CACHE_KEY.format(uid) for uid in ids}
+    use_cache = registry_enabled()
+    try:
+        cached = cache.get_many(list(keys.values())) if use_cache else {}
+    except Exception:
+        cached = {}
+    per_user: Dict[int, List[str]] = {}
+    missing: List[int] = []
+    for uid, key in keys.items():
+        if key in cached:
+            per_user[uid] = cached[key]
+        else:
+            missing.append(uid)
+    if missing:
+        loaded: Dict[int, List[str]] = {uid: [] for uid in missing}
+        qs = (
+            UserDevice.objects.filter(user_id__in=missing, status__in=ACTIVE_STATUSES)
+            .exclude(push_token__exact="")
+            .values_list("user_id", "push_token")
+        )
+        for user_id, token in qs:
+            loaded[user_id].append(token)
+        try:
+            # Users without tokens are cached too (empty list) so they cost nothing next time
+            if use_cache:
+                cache.set_many({keys[uid]: value for uid, value in loaded.items()}, registry_ttl())
+        except Exception:
+            logger.debug("push token cache fill failed", exc_info=True)
+        per_user.update(loaded)
     tokens: Dict[int, List[str]] = {}
     seen: set[str] = set()
-    for user_id, token in qs:
-        if not token or token in seen:
-            continue
-        seen.add(token)
-        tokens.setdefault(user_id, []).append(token)
+    for user_id in ids:
+        for token in per_user.get(user_id) or []:
+            if not token or token in seen:
+                continue
+            seen.add(token)
+            tokens.setdefault(user_id, []).append(token)
     return tokens
 
 
@@ -105,12 +143,78 @@ def _handle_expo_response(batch: Sequence[PushMessage], response_json: Dict[str,
             },
         )
     if invalid_tokens:
-        unique_tokens = list({token for token in invalid_tokens})
-        with transaction.atomic():
-            UserDevice.objects.filter(push_token__in=unique_tokens).update(push_token="")
+        clear_push_tokens(invalid_tokens)
+
+
+def _expo_headers() -> Dict[str, str]:
+    headers = {"Content-Type": "application/json"}
+    auth_token = getattr(settings, "EXPO_ACCESS_TOKEN", None)
+    if auth_token:
+        headers["Authorization"] = f"Bearer {auth_token}"
+    return headers
+
+
+def _post_expo(payloads: List[Dict[str, Any]]) -> Dict[str, Any]:
+    response = sdk.load('requests').post(EXPO_PUSH_URL, json=payloads, headers=_expo_headers(), timeout=provider_timeout(EXPO))
+    response.raise_for_status()
+    return response.json()
+
+
+def _send_fcm_message(msg: PushMessage) -> Dict[str, Any]:
+    """One FCM send; raises when FCM itself failed (rejected tokens are a normal result)."""
+    result = send_fcm_multicast(
+        tokens=[msg.to],
+        title=msg.title,
+        body=msg.body,
+        data=msg.data,
+        badge=msg.badge
+    )
+    errors = [err for err in result.get('errors') or [] if err != FIREBASE_NOT_INITIALIZED]
+    # Token rejections land in invalid_tokens, so anything left is transport/5xx/quota/timeout
+    if errors:
+        raise RuntimeError("; ".join(errors)[:500])
+    return result
+
+
+def _fcm_retry_payload(msg: PushMessage) -> Dict[str, Any]:
+    return {"to": msg.to, "title": msg.title, "body": msg.body, "data": msg.data, "badge": msg.badge}
+
+
+def _message_from_payload(payload: Dict[str, Any]) -> PushMessage:
+    return PushMessage(
+        to=payload.get("to") or "",
+        title=payload.get("title") or "",
+        body=payload.get("body") or "",
+        data=payload.get("data"),
+        badge=payload.get("badge"),
+        sound=payload.get("sound"),
+    )
+
+
+def replay_fcm(payload: Dict[str, Any]) -> None:
+    """Re-send a queued FCM message (see ``communications.providers.REPLAY_HANDLERS``)."""
+    if not FCM_AVAILABLE:
+        return
+    result = _send_fcm_message(_message_from_payload(payload))
+    if result.get('invalid_tokens'):
+        clear_push_tokens(result['invalid_tokens'])
+
+
+def replay_expo(payload: Dict[str, Any]) -> None:
+    """Re-send a queued Expo chunk (see ``communications.providers.REPLAY_HANDLERS``)."""
+    payloads = payload.get("messages") or []
+    if not payloads:
+        return
+    data = _post_expo(payloads)
+    _handle_expo_response([_message_from_payload(p) for p in payloads], data)
 
 
 def send_push_messages(messages: Sequence[PushMessage]) -> None:
+    """Deliver pushes via FCM (or Expo), behind per-provider timeouts and circuit breakers.
+
+    Sends that fail, or hit an open breaker, are queued for ``retry_provider_sends``
+    instead of blocking the caller.
+    """
     batch = [msg for msg in messages if msg.to]
     if not batch:
         logger.info("⚠️ No messages to send (empty batch)")
@@ -129,13 +233,12 @@ def send_push_messages(messages: Sequence[PushMessage]) -> None:
             all_invalid_tokens = []
             
             for msg in batch:
-                result = send_fcm_multicast(
-                    tokens=[msg.to],
-                    title=msg.title,
-                    body=msg.body,
-                    data=msg.data,
-                    badge=msg.badge
-                )
+                try:
+                    result = call_provider(FCM, _send_fcm_message, msg, retry=_fcm_retry_payload(msg))
+                except ProviderUnavailable as exc:
+                    all_failure += 1
+                    logger.warning(f"⏳ FCM send deferred to retry queue: {exc.reason}")
+                    continue
                 all_success += result['success']
                 all_failure += result['failure']
                 if result.get('invalid_tokens'):
@@ -145,10 +248,7 @@ def send_push_messages(messages: Sequence[PushMessage]) -> None:
             
             # Remove invalid tokens
             if all_invalid_tokens:
-                with transaction.atomic():
-                    UserDevice.objects.filter(
-                        push_token__in=all_invalid_tokens
-                    ).update(push_token="")
+                clear_push_tokens(all_invalid_tokens)
                 logger.info(f"🗑️ Removed {len(all_invalid_tokens)} invalid tokens")
             
             return
@@ -157,20 +257,14 @@ def send_push_messages(messages: Sequence[PushMessage]) -> None:
     
     # Fallback to Expo Push API (legacy method)
     logger.info(f"📤 Sending {len(batch)} notifications via Expo Push API")
-    headers = {"Content-Type": "application/json"}
-    auth_token = getattr(settings, "EXPO_ACCESS_TOKEN", None)
-    if auth_token:
-        headers["Authorization"] = f"Bearer {auth_token}"
     chunk_size = 100
     for start in range(0, len(batch), chunk_size):
         chunk = batch[start : start + chunk_size]
         payloads = [msg.to_payload() for msg in chunk]
         try:
-            response = requests.post(EXPO_PUSH_URL, json=payloads, headers=headers, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-        except Exception:
-            logger.exception("expo_push_request_failed", extra={"count": len(chunk)})
+            data = call_provider(EXPO, _post_expo, payloads, retry={"messages": payloads})
+        except ProviderUnavailable:
+            logger.warning("expo_push_request_deferred", extra={"count": len(chunk)})
             continue
         try:
             _handle_expo_response(chunk, data)
@@ -0,0 +1,49 @@
+"""Cache keys and invalidation for push targeting data.
+
+Kept free of push-provider imports so device and signal code can invalidate
+without loading the SDKs.
+"""
+from __future__ import annotations
+
+import logging
+from typing import Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+TOKENS_CACHE_KEY = "push:tokens:{}"
+
+
+def registry_ttl() -> int:
+    """Safety-net lifetime (seconds) of cached push targeting data; changes invalidate explicitly."""
+    return int(getattr(settings, "PUSH_REGISTRY_TTL", 300))
+
+
+def registry_enabled() -> bool:
+    """Whether push targeting data may be cached: invalidation only reaches a cache all workers share."""
+    return bool(getattr(settings, "SHARED_CACHE", False))
+
+
+def invalidate_keys(keys: Iterable[str]) -> None:
+    """Drop cache entries now and again once the surrounding transaction commits."""
+    keys = list(keys)
+    if not keys:
+        return
+
+    def _drop() -> None:
+        try:
+            cache.delete_many(keys)
+        except Exception:
+            logger.debug("push registry invalidation failed", exc_info=True)
+
+    _drop()
+    # A read inside the same transaction may re-cache uncommitted rows; drop again after commit
+    transaction.on_commit(_drop)
+
+
+def invalidate_device_tokens(user_ids: Iterable[int]) -> None:
+    """Forget cached push tokens for ``user_ids``."""
+    invalidate_keys(TOKENS_CACHE_KEY.format(uid) for uid in {uid for uid in user_ids if uid})
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import UserDevice
+from .push_registry import invalidate_device_tokens
+
+
+@receiver(post_save, sender=UserDevice)
+@receiver(post_delete, sender=UserDevice)
+def invalidate_user_device_tokens(sender, instance, **kwargs):
+    # Covers link/approve/revoke/rename and DeviceUpdateTokenView, which all save the instance
+    invalidate_device_tokens([instance.user_id])
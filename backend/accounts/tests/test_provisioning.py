@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import io
+import os
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+
+from accounts.provisioning import ProvisioningError, provision_users
+from finance.models import Currency, Wallet
+from subscriptions.models import SubscriptionPlan, UserSubscription
+
+User = get_user_model()
+
+
+class BulkProvisioningTests(TestCase):
+    def setUp(self):
+        self.usd = Currency.objects.create(code='PUS', name='P1', symbol='$')
+        self.try_ = Currency.objects.create(code='PTR', name='P2', symbol='T')
+        Currency.objects.create(code='POF', name='off', is_active=False)
+        SubscriptionPlan.objects.get_or_create(code='trial')
+
+    def test_query_count_does_not_grow_with_users(self):
+        def run(prefix, n):
+            rows = [{'username': f'{prefix}{i}', 'password': 'Shared-pass-1'} for i in range(n)]
+            with CaptureQueriesContext(connection) as ctx:
+                result = provision_users(rows)
+            self.assertEqual(len(result.created), n)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(run('small', 3), run('large', 25))
+        users = User.objects.filter(username__startswith='large')
+        self.assertEqual(Wallet.objects.filter(user__in=users).count(), 50)
+        self.assertFalse(Wallet.objects.filter(user__in=users, currency__code='POF').exists())
+        self.assertEqual(UserSubscription.objects.filter(user__in=users, plan__code='trial').count(), 25)
+        user = users.first()
+        self.assertTrue(user.check_password('Shared-pass-1'))
+        self.assertIsNotNone(user.last_password_change)
+
+    def test_fields_hashes_and_conflicts(self):
+        User.objects.create_user(username='Taken', password='x-pass-123')
+        encoded = make_password('pre-hashed-1')
+        with self.assertRaises(ProvisioningError) as ctx:
+            provision_users([{'username': 'taken'}, {'username': 'fresh'}])
+        self.assertEqual(ctx.exception.usernames, ['taken'])
+        with self.assertRaises(ProvisioningError):
+            provision_users([{'username': 'dup'}, {'username': 'DUP'}])
+        self.assertFalse(User.objects.filter(username__in=['fresh', 'dup']).exists())
+
+        result = provision_users([
+            {'username': 'taken'},
+            {'username': 'hashed', 'password_hash': encoded, 'country_code': '+90', 'phone': '555 1', 'display_name': 'H'},
+            {'username': 'nopass'},
+        ], skip_existing=True, grant_trial=False)
+        self.assertEqual(result.skipped, ['taken'])
+        hashed = User.objects.get(username='hashed')
+        self.assertTrue(hashed.check_password('pre-hashed-1'))
+        self.assertEqual(hashed.phone_e164, '+905551')
+        self.assertFalse(User.objects.get(username='nopass').has_usable_password())
+        self.assertFalse(UserSubscription.objects.filter(user=hashed).exists())
+
+    def test_prefixed_raw_passwords_are_hashed(self):
+        result = provision_users([
+            {'username': 'bang', 'password': '!Welcome2024'},
+            {'username': 'argon', 'password': 'argon2$not-a-hash'},
+            {'username': 'looks', 'password': make_password('other')},
+        ], grant_trial=False)
+        self.assertEqual(len(result.created), 3)
+        for username, raw in (('bang', '!Welcome2024'), ('argon', 'argon2$not-a-hash')):
+            user = User.objects.get(username=username)
+            self.assertNotEqual(user.password, raw)
+            self.assertTrue(user.check_password(raw))
+        # Without the password_hash column a hash is just an odd raw password
+        self.assertFalse(User.objects.get(username='looks').check_password('other'))
+        with self.assertRaises(ProvisioningError) as ctx:
+            provision_users([{'username': 'fake', 'password_hash': '!Welcome2024'}])
+        self.assertEqual(ctx.exception.usernames, ['fake'])
+
+        user = User(username='direct', password='!Welcome2024')
+        user.save()
+        self.assertTrue(user.check_password('!Welcome2024'))
+        user = User(username='direct2', password='argon2$raw')
+        user.save()
+        self.assertTrue(user.check_password('argon2$raw'))
+
+    def test_save_keeps_encoded_and_unusable_passwords(self):
+        user = User.objects.create_user(username='keeper', password='pw-123456')
+        user.set_unusable_password()
+        user.save()
+        user.refresh_from_db()
+        self.assertFalse(user.has_usable_password())
+
+    def test_command_and_currency_backfill(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w', encoding='utf-8') as fh:
+            fh.write('username,email,display_name\ncsv1,a@x.io,One\ncsv2,b@x.io,Two\n')
+        out = io.StringIO()
+        try:
+            call_command('provision_users', path, '--default-password', 'Temp-pass-9', stdout=out)
+            with self.assertRaises(CommandError):
+                call_command('provision_users', path, stdout=io.StringIO())
+        finally:
+            os.remove(path)
+        self.assertIn('created=2', out.getvalue())
+        self.assertTrue(User.objects.get(username='csv2').check_password('Temp-pass-9'))
+
+        eur = Currency.objects.create(code='PEU', name='P3')
+        out = io.StringIO()
+        call_command('backfill_wallets', 'PEU', stdout=out)
+        self.assertIn(f'wallets_created={User.objects.count()}', out.getvalue())
+        self.assertEqual(Wallet.objects.filter(currency=eur).count(), User.objects.count())
+        call_command('backfill_wallets', stdout=out)
+        self.assertEqual(Wallet.objects.filter(currency=eur).count(), User.objects.count())
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 from django.contrib.auth import get_user_model
+from django.test import override_settings
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase
@@ -172,3 +173,26 @@ class UserDeviceFlowTests(APITestCase):
         labels = {device['device_id']: device['label'] for device in list_resp.json()['devices']}
         self.assertEqual(labels[primary_id], 'المكتب الرئيسي')
         self.assertEqual(labels[pending_id], 'لوحي الميداني')
+
+
+@override_settings(SHARED_CACHE=True)
+class PushTokenRegistryTests(APITestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='token_owner', password='StrongPass123')
+        self.device = UserDevice.objects.create(user=self.user, status=UserDevice.Status.PRIMARY, push_token='tok-1')
+
+    def test_tokens_are_cached_and_invalidated_on_change(self):
+        from accounts.push import clear_push_tokens, get_active_device_tokens
+        self.assertEqual(get_active_device_tokens([self.user.id]), {self.user.id: ['tok-1']})
+        with self.assertNumQueries(0):
+            self.assertEqual(get_active_device_tokens([self.user.id]), {self.user.id: ['tok-1']})
+
+        self.device.push_token = 'tok-2'
+        self.device.save(update_fields=['push_token'])
+        self.assertEqual(get_active_device_tokens([self.user.id]), {self.user.id: ['tok-2']})
+
+        clear_push_tokens(['tok-2'])
+        self.assertEqual(get_active_device_tokens([self.user.id]), {})
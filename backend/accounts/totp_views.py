@@ -5,10 +5,10 @@ from rest_framework import status
 from django.contrib.auth import get_user_model
 import os
 import base64
-try:
-    import pyotp
-except Exception:  # pragma: no cover
-    pyotp = None
+from communications import sdk
+
+# Imported on first use
+pyotp = sdk.lazy('pyotp')
 
 User = get_user_model()
 
@@ -29,7 +29,7 @@ class TOTPStatusView(APIView):
 class TOTPSetupView(APIView):
     permission_classes = [IsAuthenticated]
     def post(self, request):
-        if pyotp is None:
+        if not sdk.available('pyotp'):
             return Response({'detail': 'TOTP library missing'}, status=500)
         u = request.user
         # generate new secret and save to user (not enabled yet)
@@ -47,7 +47,7 @@ class TOTPSetupView(APIView):
 class TOTPEnableView(APIView):
     permission_classes = [IsAuthenticated]
     def post(self, request):
-        if pyotp is None:
+        if not sdk.available('pyotp'):
             return Response({'detail': 'TOTP library missing'}, status=500)
         u = request.user
         code = (request.data.get('otp') or '').strip()
@@ -63,7 +63,7 @@ class TOTPEnableView(APIView):
 class TOTPDisableView(APIView):
     permission_classes = [IsAuthenticated]
     def post(self, request):
-        if pyotp is None:
+        if not sdk.available('pyotp'):
             return Response({'detail': 'TOTP library missing'}, status=500)
         u = request.user
         code = (request.data.get('otp') or '').strip()
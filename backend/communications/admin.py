@@ -20,6 +20,10 @@ from .models import (
     CustomEmoji,
     TeamMember,
     ConversationMember,
+    ProviderCircuit,
+    ProviderRetry,
+    ConversationPurge,
+    AttachmentSweep,
 )
 
 @admin.register(ContactRelation)
@@ -270,3 +274,38 @@ class ConversationMemberAdmin(admin.ModelAdmin):
         except Exception:
             return "N/A"
     member_display.short_description = "Member"
+
+
+@admin.register(ProviderCircuit)
+class ProviderCircuitAdmin(admin.ModelAdmin):
+    list_display = ("provider", "state", "consecutive_failures", "opened_at", "updated_at")
+    list_filter = ("state",)
+    readonly_fields = ("provider", "state", "consecutive_failures", "opened_at", "last_error", "updated_at")
+
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(ProviderRetry)
+class ProviderRetryAdmin(admin.ModelAdmin):
+    list_display = ("id", "provider", "attempts", "next_attempt_at", "last_error", "created_at")
+    list_filter = ("provider",)
+    readonly_fields = ("provider", "payload", "attempts", "last_error", "created_at")
+
+@admin.register(AttachmentSweep)
+class AttachmentSweepAdmin(admin.ModelAdmin):
+    list_display = ("id", "dry_run", "counts", "mark_cursor", "scan_cursor", "started_at", "finished_at")
+    list_filter = ("dry_run",)
+    readonly_fields = ("dry_run", "mark_cursor", "scan_cursor", "counts", "started_at", "finished_at")
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ConversationPurge)
+class ConversationPurgeAdmin(admin.ModelAdmin):
+    list_display = ("id", "kind", "conversation_id", "status", "estimated_messages", "progress", "attempts", "created_at", "finished_at")
+    list_filter = ("kind", "status")
+    readonly_fields = ("conversation_id", "kind", "up_to_message_id", "requested_by", "user_ids", "estimated_messages", "progress", "attempts", "last_error", "created_at", "finished_at")
+
+    def has_add_permission(self, request):
+        return False
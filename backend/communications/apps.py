@@ -4,3 +4,7 @@ class CommunicationsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'communications'
     verbose_name = 'Site Settings & Communications'
+
+    def ready(self):  # pragma: no cover
+        from . import signals  # noqa
+        from . import instrumentation  # noqa: F401  (installs the DB query wrapper)
@@ -0,0 +1,241 @@
+"""Garbage collection of orphaned ``Message.attachment`` files.
+
+Clearing or deleting a conversation removes message rows (raw DELETEs in
+``communications.purge``, cascades elsewhere) but never their files, so
+``MEDIA_ROOT`` only grew. Every stored attachment now has an
+``AttachmentFile`` row (written when the message is created, backfilled by
+``index_existing``) and ``run_gc`` works against that index in three phases:
+
+* mark: index rows whose message is gone, or no longer points at the file,
+  get ``orphaned_at``. Purges flag their batches directly, so this DB-only
+  pass is the safety net for other deletions; it resumes from a cursor.
+* scan: a few storage directories per run (``attachments/YYYY/MM`` and the
+  legacy flat ``attachments/``) are listed and files missing from the index
+  are added, flagged unless a message references them. Files younger than the
+  grace period are left alone, they may belong to an upload still in flight.
+* delete: files flagged for longer than the grace period are removed from
+  storage in batches, after checking once more that no message uses them.
+
+Each run is recorded as an ``AttachmentSweep`` with its counts and cursors,
+so consecutive runs cover the index and the directory tree a slice at a time
+instead of walking everything. ``manage.py gc_attachments`` runs it.
+"""
+from __future__ import annotations
+
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import AttachmentFile, AttachmentSweep, Message
+
+logger = logging.getLogger(__name__)
+
+ROOT = 'attachments'
+COUNTS = ('checked', 'orphaned', 'relinked', 'scanned_dirs', 'scanned_files', 'discovered', 'deleted', 'bytes_freed', 'errors')
+
+
+def grace_period() -> timedelta:
+    return timedelta(hours=max(0.0, float(getattr(settings, 'ATTACHMENT_GC_GRACE_HOURS', 24))))
+
+
+def batch_size() -> int:
+    return max(1, int(getattr(settings, 'ATTACHMENT_GC_BATCH_SIZE', 500)))
+
+
+def _storage():
+    return Message._meta.get_field('attachment').storage
+
+
+def _chunks(items: List, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _referenced(paths: Iterable[str]) -> Dict[str, int]:
+    """Paths still used by a message, mapped to that message's id."""
+    paths = list(paths)
+    if not paths:
+        return {}
+    return {path: mid for mid, path in Message.objects.filter(attachment__in=paths).values_list('id', 'attachment')}
+
+
+def index_existing(message_model=None, attachment_model=None, *, batch_size: int = 1000) -> int:
+    """Index every message attachment not indexed yet; safe with historical models."""
+    message_model = message_model or Message
+    attachment_model = attachment_model or AttachmentFile
+    qs = message_model.objects.exclude(attachment__isnull=True).exclude(attachment='')
+    created = 0
+    last_id = 0
+    while True:
+        rows = list(qs.filter(id__gt=last_id).order_by('id').values_list('id', 'attachment', 'attachment_size', 'created_at')[:batch_size])
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        known = set(attachment_model.objects.filter(path__in=[path for _, path, _, _ in rows]).values_list('path', flat=True))
+        fresh = [
+            attachment_model(path=path, size=size or 0, message_id=mid, created_at=created_at)
+            for mid, path, size, created_at in rows if path not in known
+        ]
+        attachment_model.objects.bulk_create(fresh, batch_size=batch_size, ignore_conflicts=True)
+        created += len(fresh)
+    return created
+
+
+def mark_orphans(counts: Dict[str, int], *, cursor: int, limit: int, size: int, now: datetime, dry_run: bool) -> int:
+    """Flag up to ``limit`` index rows after ``cursor``; returns the next cursor (0 once the end is reached)."""
+    checked = 0
+    while checked < limit:
+        rows = list(
+            AttachmentFile.objects.filter(id__gt=cursor, orphaned_at__isnull=True)
+            .order_by('id').values_list('id', 'path', 'message_id')[:min(size, limit - checked)]
+        )
+        if not rows:
+            return 0
+        cursor = rows[-1][0]
+        checked += len(rows)
+        counts['checked'] += len(rows)
+        live = dict(Message.objects.filter(id__in=[mid for _, _, mid in rows if mid]).values_list('id', 'attachment'))
+        lost = [(row_id, path) for row_id, path, mid in rows if live.get(mid) != path]
+        # Another message may have picked the path up (re-sent file); follow it instead
+        relinked = _referenced(path for _, path in lost)
+        orphan_ids = [row_id for row_id, path in lost if path not in relinked]
+        counts['orphaned'] += len(orphan_ids)
+        counts['relinked'] += len(lost) - len(orphan_ids)
+        if dry_run:
+            continue
+        for path, mid in relinked.items():
+            AttachmentFile.objects.filter(path=path).update(message_id=mid)
+        if orphan_ids:
+            AttachmentFile.objects.filter(id__in=orphan_ids).update(orphaned_at=now)
+    return cursor
+
+
+def _directories(storage) -> List[str]:
+    if not storage.exists(ROOT):
+        return []
+    # Listing ROOT also returns the legacy flat files' names, but nothing below the months is opened here
+    years, _ = storage.listdir(ROOT)
+    units = [ROOT]
+    for year in years:
+        months, _ = storage.listdir(f'{ROOT}/{year}')
+        units.extend(f'{ROOT}/{year}/{month}' for month in months)
+    return sorted(units)
+
+
+def _scan_directory(storage, unit: str, counts: Dict[str, int], *, size: int, now: datetime, grace: timedelta, dry_run: bool) -> None:
+    _, files = storage.listdir(unit)
+    counts['scanned_dirs'] += 1
+    counts['scanned_files'] += len(files)
+    for chunk in _chunks([f'{unit}/{name}' for name in sorted(files)], size):
+        known = set(AttachmentFile.objects.filter(path__in=chunk).values_list('path', flat=True))
+        settled = []
+        for path in chunk:
+            if path in known:
+                continue
+            try:
+                if storage.get_modified_time(path) > now - grace:
+                    continue
+                settled.append((path, storage.size(path)))
+            except Exception:
+                counts['errors'] += 1
+        if not settled:
+            continue
+        referenced = _referenced(path for path, _ in settled)
+        counts['discovered'] += len(settled)
+        counts['orphaned'] += len(settled) - len(referenced)
+        if dry_run:
+            continue
+        AttachmentFile.objects.bulk_create([
+            AttachmentFile(path=path, size=file_size, message_id=referenced.get(path), orphaned_at=None if path in referenced else now)
+            for path, file_size in settled
+        ], ignore_conflicts=True)
+
+
+def scan_directories(counts: Dict[str, int], *, cursor: str, dirs: int, size: int, now: datetime, grace: timedelta, dry_run: bool) -> str:
+    """Index unknown files in the next ``dirs`` directories after ``cursor``; returns the next cursor."""
+    storage = _storage()
+    try:
+        units = _directories(storage)
+    except Exception:
+        # Storages without listdir (or a missing mount) still get the index-driven phases
+        counts['errors'] += 1
+        logger.exception("Attachment scan could not list storage", extra={"event": "attachment_gc_error"})
+        return cursor
+    chosen = ([unit for unit in units if unit > cursor] or units)[:max(1, dirs)]
+    for unit in chosen:
+        try:
+            _scan_directory(storage, unit, counts, size=size, now=now, grace=grace, dry_run=dry_run)
+        except Exception:
+            counts['errors'] += 1
+            logger.exception("Attachment scan failed", extra={"event": "attachment_gc_error", "directory": unit})
+    if not chosen or chosen[-1] == units[-1]:
+        return ''
+    return chosen[-1]
+
+
+def delete_orphans(counts: Dict[str, int], *, limit: int, size: int, now: datetime, grace: timedelta, dry_run: bool) -> None:
+    """Remove up to ``limit`` files flagged before ``now - grace`` together with their index rows."""
+    storage = _storage()
+    cutoff = now - grace
+    last_id = 0
+    handled = 0
+    while handled < limit:
+        rows = list(
+            AttachmentFile.objects.filter(orphaned_at__lte=cutoff, id__gt=last_id)
+            .order_by('id').values_list('id', 'path', 'size')[:min(size, limit - handled)]
+        )
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        handled += len(rows)
+        referenced = _referenced(path for _, path, _ in rows)
+        doomed = [(row_id, path, file_size) for row_id, path, file_size in rows if path not in referenced]
+        counts['relinked'] += len(rows) - len(doomed)
+        if dry_run:
+            counts['deleted'] += len(doomed)
+            counts['bytes_freed'] += sum(file_size for _, _, file_size in doomed)
+            continue
+        for path, mid in referenced.items():
+            AttachmentFile.objects.filter(path=path).update(message_id=mid, orphaned_at=None)
+        removed = []
+        for row_id, path, file_size in doomed:
+            try:
+                storage.delete(path)
+            except Exception:
+                # Keep the row; the next run tries again
+                counts['errors'] += 1
+                logger.warning("Could not delete orphaned attachment", extra={"event": "attachment_gc_error", "path": path})
+                continue
+            removed.append(row_id)
+            counts['deleted'] += 1
+            counts['bytes_freed'] += file_size
+        if removed:
+            AttachmentFile.objects.filter(id__in=removed).delete()
+
+
+def run_gc(*, dry_run: bool = False, grace: Optional[timedelta] = None, size: Optional[int] = None,
+           max_rows: Optional[int] = None, dirs: int = 2, now: Optional[datetime] = None) -> AttachmentSweep:
+    """Run one collector pass; returns its sweep (saved unless ``dry_run``).
+
+    ``max_rows`` caps both the index rows checked and the files deleted in this run.
+    """
+    now = now or timezone.now()
+    grace = grace_period() if grace is None else grace
+    size = size or batch_size()
+    max_rows = max_rows or size * 20
+    previous = AttachmentSweep.objects.filter(dry_run=False, finished_at__isnull=False).order_by('-id').first()
+    counts = dict.fromkeys(COUNTS, 0)
+    sweep = AttachmentSweep(dry_run=dry_run)
+    if not dry_run:
+        sweep.save()
+    sweep.mark_cursor = mark_orphans(counts, cursor=previous.mark_cursor if previous else 0, limit=max_rows, size=size, now=now, dry_run=dry_run)
+    sweep.scan_cursor = scan_directories(counts, cursor=previous.scan_cursor if previous else '', dirs=dirs, size=size, now=now, grace=grace, dry_run=dry_run)
+    delete_orphans(counts, limit=max_rows, size=size, now=now, grace=grace, dry_run=dry_run)
+    sweep.counts = counts
+    sweep.finished_at = timezone.now()
+    if not dry_run:
+        sweep.save(update_fields=['mark_cursor', 'scan_cursor', 'counts', 'finished_at'])
+    return sweep
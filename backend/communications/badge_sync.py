@@ -0,0 +1,150 @@
+"""Debounced badge refresh pushes.
+
+Reading a chat used to send a silent badge push straight away, so scrolling
+through a few conversations produced one push per chat to every device.
+``schedule_badge_sync`` instead collects requests per user for
+``BADGE_SYNC_DELAY`` seconds (measured from the first request), then computes
+the unread total once and pushes it only if it differs from the last badge
+value delivered to that user's devices. Message pushes record the badge they
+carried through ``remember_badge`` so the comparison stays accurate.
+
+The last delivered value lives in Django's cache and is only trusted when the
+cache is shared between workers (``SHARED_CACHE``); with a per-process cache
+another worker may have delivered a different value since, so nothing is
+skipped. Windows are per process; they close on the shared
+``communications.deadlines`` timer and worker pool rather than one timer
+thread per user.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from .deadlines import Deadlines, get_deadlines
+
+logger = logging.getLogger(__name__)
+
+_CACHE_PREFIX = 'badge:last:'
+_CACHE_TTL = 7 * 24 * 3600
+
+
+def _cache_key(user_id: int) -> str:
+    return f"{_CACHE_PREFIX}{user_id}"
+
+
+def _shared() -> bool:
+    return bool(getattr(settings, 'SHARED_CACHE', False))
+
+
+def remember_badge(user_id: int, value: int) -> None:
+    """Record the badge value last delivered to ``user_id``'s devices."""
+    if not _shared():
+        return
+    try:
+        cache.set(_cache_key(user_id), int(value), _CACHE_TTL)
+    except Exception:
+        logger.debug("Failed to remember badge value", exc_info=True)
+
+
+def last_badge(user_id: int) -> Optional[int]:
+    if not _shared():
+        return None
+    try:
+        return cache.get(_cache_key(user_id))
+    except Exception:
+        return None
+
+
+def _in_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class BadgeSyncScheduler:
+    def __init__(self, delay: Optional[float] = None, deadlines: Optional[Deadlines] = None):
+        self._delay = delay
+        self._deadlines = deadlines if deadlines is not None else get_deadlines()
+        self._lock = threading.Lock()
+        # user_id -> (reason, conversation_id) of the latest request in the window
+        self._pending: Dict[int, tuple] = {}
+        self._windows: Dict[int, list] = {}
+        self.stats = {'requested': 0, 'sent': 0, 'skipped_unchanged': 0}
+
+    @property
+    def delay(self) -> float:
+        if self._delay is not None:
+            return self._delay
+        return float(getattr(settings, 'BADGE_SYNC_DELAY', 2.0))
+
+    def schedule(self, user_id: int, *, reason: str = 'badge.update', conversation_id: Optional[int] = None) -> None:
+        delay = self.delay
+        # Consumers call this from the event loop, where the unread query may not run
+        inline = delay <= 0 and not _in_event_loop()
+        with self._lock:
+            self.stats['requested'] += 1
+            self._pending[user_id] = (reason, conversation_id)
+            if not inline and user_id not in self._windows:
+                self._windows[user_id] = self._deadlines.call_later(max(0.0, delay), self._fire, user_id)
+        if inline:
+            self.flush(user_id)
+
+    def _fire(self, user_id: int) -> None:
+        try:
+            self.flush(user_id)
+        finally:
+            # Deadline workers get their own DB connections; don't leak them
+            connections.close_all()
+
+    def flush(self, user_id: Optional[int] = None) -> None:
+        """Deliver pending syncs now (one user, or everyone when ``user_id`` is None)."""
+        with self._lock:
+            user_ids = list(self._pending) if user_id is None else [user_id]
+            work = []
+            for uid in user_ids:
+                request = self._pending.pop(uid, None)
+                self._deadlines.cancel(self._windows.pop(uid, None))
+                if request is not None:
+                    work.append((uid, request))
+        for uid, (reason, conversation_id) in work:
+            self._deliver(uid, reason, conversation_id)
+
+    def _deliver(self, user_id: int, reason: str, conversation_id: Optional[int]) -> None:
+        from .push import _total_unread_for_user, send_unread_badge_push
+        try:
+            count = max(0, int(_total_unread_for_user(user_id)))
+            if last_badge(user_id) == count:
+                with self._lock:
+                    self.stats['skipped_unchanged'] += 1
+                return
+            send_unread_badge_push(user_id, count, reason=reason, conversation_id=conversation_id)
+            with self._lock:
+                self.stats['sent'] += 1
+        except Exception:
+            logger.exception("Badge sync failed", extra={"event": "badge_sync_error", "user_id": user_id})
+
+
+_scheduler: Optional[BadgeSyncScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> BadgeSyncScheduler:
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = BadgeSyncScheduler()
+    return _scheduler
+
+
+def schedule_badge_sync(user_id: int, *, reason: str = 'badge.update', conversation_id: Optional[int] = None) -> None:
+    """Ask for a badge refresh push for ``user_id``; cheap and safe to call often."""
+    get_scheduler().schedule(user_id, reason=reason, conversation_id=conversation_id)
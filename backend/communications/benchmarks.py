@@ -0,0 +1,387 @@
+"""Benchmark suite for the chat, ledger and realtime hot paths.
+
+Used by ``manage.py run_benchmarks``. Everything runs in-process: HTTP
+scenarios go through the full middleware/DRF stack with ``APIClient``, the
+WebSocket loop drives ``ConversationConsumer`` with channels'
+``WebsocketCommunicator`` over the configured (in-memory by default) channel
+layer. Provider sends (Expo/FCM, web push, Pusher) are stubbed out so only our
+own work is measured; push targeting, bundling and badge logic still run.
+
+``seed`` builds a synthetic data set at a given ``Scale``; ``run_suite`` times
+each scenario and returns a JSON-serializable report with latency percentiles
+and DB queries per operation. ``compare`` flags regressions against a stored
+baseline report: any increase in queries per operation, or a p50 latency above
+the baseline by more than ``tolerance``.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import platform
+import random
+import statistics
+import time
+from dataclasses import asdict, dataclass
+from decimal import Decimal
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.db.models import Max
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+SCENARIOS = ('inbox', 'messages', 'send', 'read', 'transaction', 'ws_loop')
+
+
+@dataclass
+class Scale:
+    users: int = 50
+    conversations: int = 100
+    messages: int = 50
+    iterations: int = 30
+    ws_clients: int = 10
+    ws_rounds: int = 5
+    seed: int = 1
+
+
+@dataclass
+class Dataset:
+    hero: Any
+    conversations: List[Any]
+    currency: Any
+
+
+# ---------------------------------------------------------------------------
+# Seeding
+# ---------------------------------------------------------------------------
+
+def seed(scale: Scale, prefix: str = 'bench') -> Dataset:
+    """Create users, conversations and message histories; the first user is in most conversations."""
+    from datetime import timedelta
+    from finance.models import Currency, Wallet
+    from subscriptions.models import SubscriptionPlan, UserSubscription
+    from .models import Conversation, ConversationReadMarker, Message
+
+    User = get_user_model()
+    rng = random.Random(scale.seed)
+    password = make_password('bench-pass-123')
+    User.objects.bulk_create([
+        User(username=f'{prefix}_{i}', password=password, display_name=f'Bench {i}')
+        for i in range(max(scale.users, 2))
+    ])
+    users = list(User.objects.filter(username__startswith=f'{prefix}_').order_by('id'))
+    hero, others = users[0], users[1:]
+    # Sending requires an active subscription
+    plan, _ = SubscriptionPlan.objects.get_or_create(code='king', defaults={'name': 'King'})
+    UserSubscription.objects.bulk_create([
+        UserSubscription(user=u, plan=plan, start_at=timezone.now() - timedelta(days=1), end_at=timezone.now() + timedelta(days=365))
+        for u in users
+    ])
+
+    pairs = []
+    seen = set()
+    for other in others[:scale.conversations]:
+        pairs.append((hero, other))
+        seen.add((hero.id, other.id))
+    attempts = 0
+    while len(pairs) < scale.conversations and attempts < scale.conversations * 20 and len(others) > 1:
+        attempts += 1
+        a, b = rng.sample(others, 2)
+        key = (min(a.id, b.id), max(a.id, b.id))
+        if key in seen:
+            continue
+        seen.add(key)
+        pairs.append((a, b))
+    Conversation.objects.bulk_create([Conversation(user_a=a, user_b=b) for a, b in pairs])
+    conversations = list(Conversation.objects.filter(user_a__username__startswith=f'{prefix}_').order_by('id'))
+
+    now = timezone.now()
+    batch = []
+    for conv in conversations:
+        for n in range(scale.messages):
+            sender_id = conv.user_a_id if n % 2 == 0 else conv.user_b_id
+            batch.append(Message(
+                conversation=conv, sender_id=sender_id, body=f'bench message {n}',
+                delivery_status=2, delivered_at=now, read_at=now,
+            ))
+        if len(batch) >= 5000:
+            Message.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        Message.objects.bulk_create(batch)
+    # History is fully read: both participants' markers sit on the last message
+    last_ids = dict(Message.objects.filter(conversation__in=conversations).values('conversation_id').annotate(last=Max('id')).values_list('conversation_id', 'last'))
+    ConversationReadMarker.objects.bulk_create([
+        ConversationReadMarker(conversation=conv, user_id=uid, last_read_message_id=last_ids[conv.id])
+        for conv in conversations if conv.id in last_ids for uid in (conv.user_a_id, conv.user_b_id)
+    ])
+    for conv in conversations:
+        conv.last_message_at = now
+        conv.last_activity_at = now
+        conv.last_message_preview = f'bench message {scale.messages - 1}'
+    Conversation.objects.bulk_update(conversations, ['last_message_at', 'last_activity_at', 'last_message_preview'])
+
+    currency, _ = Currency.objects.get_or_create(code='BNC', defaults={'symbol': 'B', 'name': 'Bench', 'precision': 2})
+    existing = set(Wallet.objects.filter(currency=currency).values_list('user_id', flat=True))
+    Wallet.objects.bulk_create([Wallet(user=u, currency=currency, balance=0) for u in users if u.id not in existing])
+    hero_convs = [c for c in conversations if hero.id in (c.user_a_id, c.user_b_id)]
+    return Dataset(hero=hero, conversations=hero_convs, currency=currency)
+
+
+# ---------------------------------------------------------------------------
+# Measurement
+# ---------------------------------------------------------------------------
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(samples_ms: List[float], queries: Optional[List[int]] = None) -> Dict[str, Any]:
+    values = sorted(samples_ms)
+    out = {
+        'n': len(values),
+        'mean_ms': round(statistics.fmean(values), 3) if values else 0.0,
+        'p50_ms': round(_percentile(values, 50), 3),
+        'p95_ms': round(_percentile(values, 95), 3),
+        'p99_ms': round(_percentile(values, 99), 3),
+        'max_ms': round(values[-1], 3) if values else 0.0,
+    }
+    if queries:
+        out['queries_per_op'] = round(statistics.fmean(queries), 2)
+    return out
+
+
+def _timed(iterations: int, op: Callable[[int], Any], prepare: Optional[Callable[[int], Any]] = None) -> Dict[str, Any]:
+    samples, queries = [], []
+    for i in range(iterations):
+        if prepare is not None:
+            prepare(i)
+        with CaptureQueriesContext(connection) as ctx:
+            started = time.perf_counter()
+            response = op(i)
+            elapsed = (time.perf_counter() - started) * 1000
+        status = getattr(response, 'status_code', 200)
+        if status >= 400:
+            raise RuntimeError(f"benchmark request failed with {status}: {getattr(response, 'content', b'')[:300]!r}")
+        samples.append(elapsed)
+        queries.append(len(ctx.captured_queries))
+    return summarize(samples, queries)
+
+
+def _client(user):
+    from rest_framework.test import APIClient
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+def bench_inbox(data: Dataset, scale: Scale) -> Dict[str, Any]:
+    client = _client(data.hero)
+    return _timed(scale.iterations, lambda i: client.get('/api/conversations/'))
+
+
+def bench_messages(data: Dataset, scale: Scale) -> Dict[str, Any]:
+    client = _client(data.hero)
+    convs = data.conversations
+    return _timed(scale.iterations, lambda i: client.get(f'/api/conversations/{convs[i % len(convs)].id}/messages/'))
+
+
+def bench_send(data: Dataset, scale: Scale) -> Dict[str, Any]:
+    client = _client(data.hero)
+    convs = data.conversations
+    return _timed(
+        scale.iterations,
+        lambda i: client.post(f'/api/conversations/{convs[i % len(convs)].id}/send/', {'body': f'bench send {i}'}, format='json'),
+    )
+
+
+def bench_read(data: Dataset, scale: Scale) -> Dict[str, Any]:
+    from .models import Message
+    client = _client(data.hero)
+    convs = data.conversations
+
+    def inbound(i):
+        conv = convs[i % len(convs)]
+        other_id = conv.user_b_id if conv.user_a_id == data.hero.id else conv.user_a_id
+        Message.objects.create(conversation=conv, sender_id=other_id, body=f'bench inbound {i}', delivery_status=1)
+
+    return _timed(scale.iterations, lambda i: client.post(f'/api/conversations/{convs[i % len(convs)].id}/read/'), prepare=inbound)
+
+
+def bench_transaction(data: Dataset, scale: Scale) -> Dict[str, Any]:
+    client = _client(data.hero)
+    convs = data.conversations
+    return _timed(scale.iterations, lambda i: client.post('/api/transactions/', {
+        'conversation': convs[i % len(convs)].id,
+        'currency_id': data.currency.id,
+        'amount': str(Decimal('1.25') + i),
+        'direction': 'lna' if i % 2 == 0 else 'lkm',
+        'note': 'bench',
+    }, format='json'))
+
+
+def bench_ws_loop(data: Dataset, scale: Scale) -> Dict[str, Any]:
+    """``ws_clients`` conversation pairs at once: send -> ack (sender echo) -> peer delivery -> read receipt."""
+    from asgiref.sync import async_to_sync
+    from channels.testing import WebsocketCommunicator
+    from .consumers import ConversationConsumer
+
+    User = get_user_model()
+    convs = data.conversations[:max(1, scale.ws_clients)]
+    users = User.objects.in_bulk({c.user_a_id for c in convs} | {c.user_b_id for c in convs})
+    ack, deliver, read = [], [], []
+
+    async def wait_for(comm, kind, **match):
+        # Skip unrelated frames (connect-time read/status events, the peer's echoes)
+        while True:
+            frame = await comm.receive_json_from(timeout=10)
+            if frame.get('type') == kind and all(frame.get(k) == v for k, v in match.items()):
+                return frame
+
+    async def open_socket(conv, user):
+        comm = WebsocketCommunicator(ConversationConsumer.as_asgi(), f'/ws/conversations/{conv.id}/')
+        comm.scope['user'] = user
+        comm.scope['url_route'] = {'kwargs': {'conversation_id': conv.id}}
+        connected, _ = await comm.connect()
+        if not connected:
+            raise RuntimeError(f"websocket connect refused for conversation {conv.id}")
+        return comm
+
+    async def pair(conv):
+        sender = await open_socket(conv, users[conv.user_a_id])
+        peer = await open_socket(conv, users[conv.user_b_id])
+        try:
+            for r in range(scale.ws_rounds):
+                started = time.perf_counter()
+                body = f'ws bench {conv.id}/{r}'
+                await sender.send_json_to({'type': 'text', 'body': body})
+                echo = await wait_for(sender, 'chat.message', body=body)
+                ack.append((time.perf_counter() - started) * 1000)
+                await wait_for(peer, 'chat.message', body=body)
+                deliver.append((time.perf_counter() - started) * 1000)
+                started = time.perf_counter()
+                await peer.send_json_to({'type': 'read', 'last_read_id': echo['id']})
+                await wait_for(sender, 'chat.read', last_read_id=echo['id'])
+                read.append((time.perf_counter() - started) * 1000)
+        finally:
+            await sender.disconnect()
+            await peer.disconnect()
+
+    async def run():
+        await asyncio.gather(*(pair(conv) for conv in convs))
+
+    started = time.perf_counter()
+    async_to_sync(run)()
+    wall = time.perf_counter() - started
+    return {
+        'clients': len(convs) * 2,
+        'rounds': scale.ws_rounds,
+        'throughput_msgs_per_s': round(len(ack) / wall, 2) if wall else 0.0,
+        'ack': summarize(ack),
+        'deliver': summarize(deliver),
+        'read': summarize(read),
+    }
+
+
+BENCHMARKS: Dict[str, Callable[[Dataset, Scale], Dict[str, Any]]] = {
+    'inbox': bench_inbox,
+    'messages': bench_messages,
+    'send': bench_send,
+    'read': bench_read,
+    'transaction': bench_transaction,
+    'ws_loop': bench_ws_loop,
+}
+
+
+@contextlib.contextmanager
+def stubbed_providers():
+    """No network: provider sends are no-ops, background push/badge timers are drained on exit."""
+    from .badge_sync import get_scheduler
+    from .push_bundler import get_bundler
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(mock.patch('communications.push.send_push_messages', lambda messages: None))
+        stack.enter_context(mock.patch('accounts.push.send_push_messages', lambda messages: None))
+        stack.enter_context(mock.patch('communications.views.send_web_push_to_user', lambda *a, **k: 0))
+        stack.enter_context(mock.patch('communications.pusher_client.pusher_client', None))
+        stack.enter_context(override_settings(REALTIME_BACKENDS=['communications.realtime.ChannelsBackend']))
+        # Measure the deployed (Redis-cached) push registry; one process, so the local cache stands in
+        stack.enter_context(override_settings(SHARED_CACHE=True))
+        from .realtime import reset_dispatcher
+        reset_dispatcher()
+        try:
+            yield
+        finally:
+            get_bundler().reset()
+            get_scheduler().flush()
+            reset_dispatcher()
+
+
+def run_suite(scale: Scale, scenarios: Optional[Iterable[str]] = None, progress: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """Seed and run the selected scenarios; returns the report dict."""
+    names = list(scenarios or SCENARIOS)
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        raise ValueError(f"unknown benchmark(s): {', '.join(unknown)}")
+    with stubbed_providers():
+        started = time.perf_counter()
+        data = seed(scale)
+        seed_seconds = time.perf_counter() - started
+        results = {}
+        for name in names:
+            if progress:
+                progress(name)
+            results[name] = BENCHMARKS[name](data, scale)
+    import django
+    return {
+        'meta': {
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'channel_layer': settings.CHANNEL_LAYERS['default']['BACKEND'],
+            'scale': asdict(scale),
+            'seed_seconds': round(seed_seconds, 3),
+        },
+        'results': results,
+    }
+
+
+def _flatten(results: Dict[str, Any], prefix: str = '') -> Dict[str, Dict[str, Any]]:
+    out = {}
+    for name, value in results.items():
+        if not isinstance(value, dict):
+            continue
+        if 'p50_ms' in value:
+            out[prefix + name] = value
+        else:
+            out.update(_flatten(value, f'{prefix}{name}.'))
+    return out
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.5) -> List[Dict[str, Any]]:
+    """Rows for every measured operation present in both reports; ``regression`` marks the bad ones."""
+    rows = []
+    now, before = _flatten(current.get('results', {})), _flatten(baseline.get('results', {}))
+    for name in sorted(set(now) & set(before)):
+        cur, base = now[name], before[name]
+        reasons = []
+        if 'queries_per_op' in cur and 'queries_per_op' in base and cur['queries_per_op'] > base['queries_per_op']:
+            reasons.append(f"queries {base['queries_per_op']} -> {cur['queries_per_op']}")
+        if base['p50_ms'] and cur['p50_ms'] > base['p50_ms'] * (1 + tolerance):
+            reasons.append(f"p50 {base['p50_ms']}ms -> {cur['p50_ms']}ms")
+        rows.append({
+            'name': name,
+            'p50_ms': cur['p50_ms'],
+            'baseline_p50_ms': base['p50_ms'],
+            'queries_per_op': cur.get('queries_per_op'),
+            'baseline_queries_per_op': base.get('queries_per_op'),
+            'regression': '; '.join(reasons),
+        })
+    return rows
@@ -0,0 +1,62 @@
+"""Channel layers that journal conversation events for WebSocket resume.
+
+These are drop-in replacements for the stock layers configured in
+``CHANNEL_LAYERS``. Every group_send to a ``conv_<id>`` group goes through the
+event journal (see ``event_journal``), so resume works no matter which view,
+model or consumer emitted the event. The frame's JSON text is produced here,
+once, after ``event_seq`` is stamped. Group sends are also counted for
+``instrumentation``.
+"""
+from __future__ import annotations
+
+import logging
+
+from channels.layers import InMemoryChannelLayer
+
+from .event_journal import EPHEMERAL_EVENT_TYPES, conversation_id_for_group, get_journal
+from .instrumentation import record_group_send
+from .realtime import encode_event
+
+logger = logging.getLogger(__name__)
+
+
+class JournaledChannelLayerMixin:
+    async def group_send(self, group, message):
+        conversation_id = conversation_id_for_group(group)
+        data = message.get('data') if isinstance(message, dict) else None
+        original = data
+        if conversation_id is not None and isinstance(data, dict) and 'conversation_id' not in data:
+            # Multiplexed sockets share one channel across conversations; tag every frame.
+            data = {**data, 'conversation_id': conversation_id}
+            message = {**message, 'data': data}
+        if (
+            conversation_id is not None
+            and message.get('type') == 'broadcast.message'
+            and isinstance(data, dict)
+            and data.get('type') not in EPHEMERAL_EVENT_TYPES
+        ):
+            try:
+                seq = await get_journal().aappend(conversation_id, data)
+                message = {**message, 'data': {**data, 'event_seq': seq}}
+            except Exception:
+                logger.exception("Failed to journal conversation event", extra={"conv": group})
+        if conversation_id is not None and message.get('type') == 'broadcast.message' and isinstance(message.get('data'), dict):
+            if 'text' not in message or message['data'] is not original:
+                # Encoded here, after stamping, so every subscriber shares one JSON text.
+                # ChannelsBackend leaves conversation frames unencoded for this reason.
+                message = {**message, 'text': encode_event(message['data'])}
+        record_group_send(group)
+        return await super().group_send(group, message)
+
+
+class JournaledInMemoryChannelLayer(JournaledChannelLayerMixin, InMemoryChannelLayer):
+    pass
+
+
+try:
+    from channels_redis.core import RedisChannelLayer
+except Exception:  # pragma: no cover - channels_redis is optional without REDIS_URL
+    RedisChannelLayer = None
+else:
+    class JournaledRedisChannelLayer(JournaledChannelLayerMixin, RedisChannelLayer):
+        pass
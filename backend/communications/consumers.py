@@ -1,34 +1,67 @@
 import json
 import logging
+from asgiref.sync import sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 from django.contrib.auth.models import AnonymousUser
+from django.db import models as dj_models, transaction
+from django.utils import timezone
 from .models import Conversation, Message, ConversationMember, TeamMember, get_conversation_viewer_ids, ConversationReadMarker
 from decimal import Decimal
 from .group_registry import add_channel, remove_channel, get_count
-from .push import _total_unread_for_user, send_unread_badge_push
+from .instrumentation import InstrumentedConsumerMixin
+from .outbound import OutboundQueueMixin
+from .badge_sync import schedule_badge_sync
+from .push import _total_unread_by_user
+from .realtime import get_dispatcher, message_event, new_message_entries, notify_event, status_event, status_range_event
 
 logger = logging.getLogger(__name__)
 
-class ConversationConsumer(AsyncWebsocketConsumer):
+
+class ConversationAccessRevoked(Exception):
+    """The conversation was deleted, or the sender removed from it, while the socket stayed open."""
+
+
+def _persist_inbound_message(conv, user_id: int, body: str, msg_type: str, team_member_id=None):
+    """Write side of a WS text frame, as one transaction.
+
+    The conversation and its ACL are cached per connection, so deletion and
+    membership are re-checked here first (``ConversationAccessRevoked``). Then
+    creates the message and advances the sender's read marker past it (the
+    sender is clearly looking at the chat, so prior inbound counts as read). Unread
+    totals for the other viewers are computed afterwards in the same thread hop.
+    """
+    kwargs = {'conversation_id': conv.id, 'sender_id': user_id, 'body': body, 'type': msg_type}
+    if team_member_id:
+        kwargs['sender_team_member_id'] = team_member_id
+    allowed = dj_models.Q(user_a_id=user_id) | dj_models.Q(user_b_id=user_id) | dj_models.Q(extra_members__member_user_id=user_id)
+    if team_member_id:
+        allowed |= dj_models.Q(extra_members__member_team_id=team_member_id)
+    with transaction.atomic():
+        if not Conversation.objects.filter(allowed, pk=conv.id, deleted_at__isnull=True).exists():
+            raise ConversationAccessRevoked(conv.id)
+        msg = Message.objects.create(**kwargs)
+        try:
+            with transaction.atomic():
+                ConversationReadMarker.advance(conv.id, user_id, msg.id)
+        except Exception:
+            logger.exception("Failed to mark inbound messages read on send", extra={"event": "read_on_send_error", "conversation_id": conv.id})
+    try:
+        viewer_unread = _total_unread_by_user(uid for uid in get_conversation_viewer_ids(conv) if uid != user_id)
+    except Exception:
+        viewer_unread = {}
+        logger.exception(
+            "Failed to compute inbox unread counts",
+            extra={"event": "inbox_unread_error", "conversation_id": conv.id},
+        )
+    return msg, viewer_unread
+
+
+
+class ConversationConsumer(InstrumentedConsumerMixin, OutboundQueueMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.conversation_id = self.scope['url_route']['kwargs']['conversation_id']
         user = self.scope.get('user')
-        reason = None
-        if not user or isinstance(user, AnonymousUser) or not user.is_authenticated:
-            reason = 'unauthorized'
-        else:
-            try:
-                conv = await self.get_conversation()
-            except Conversation.DoesNotExist:
-                reason = 'not_found'
-            else:
-                if user.id not in [conv.user_a_id, conv.user_b_id]:
-                    try:
-                        allowed = await self._is_extra_member(user.id, conv.id)
-                    except Exception:
-                        allowed = False
-                    if not allowed:
-                        reason = 'forbidden'
+        reason = await self._access_denied_reason(user)
         if reason:
             # RFC: subprotocol close codes are limited; use policy violation 1008
             await self.close(code=4001)
@@ -47,75 +80,143 @@ class ConversationConsumer(AsyncWebsocketConsumer):
             logger.info("WS subscribed", extra={"event": "ws_subscribed", "user_id": uid, "conv": self.group_name, "subscribers": cnt})
         except Exception:
             pass
-        await self.accept()
-        # Upon entering the conversation, mark all inbound messages as read (and delivered)
+        await self.accept(subprotocol=self._negotiate_wire())
+        # Resume: replay journaled events newer than ?resume_from=<event_seq>.
+        # Events may also arrive live from the group meanwhile; clients dedupe by event_seq.
         try:
-            from asgiref.sync import sync_to_async
-            from django.utils import timezone
-            from django.db import models as dj_models
-            from django.db.models import Q, Max
-            last_read_id = None
-            async_filter = sync_to_async(list)
-            # Get ids of messages from others which are not read yet
-            from .models import Message
-            ids = await sync_to_async(list)(
-                Message.objects
-                    .filter(conversation_id=self.conversation_id, delivery_status__lt=2)
-                    .exclude(sender_id=user.id)
-                    .order_by('id')
-                    .values_list('id', flat=True)
-            )
-            if ids:
-                now = timezone.now()
-                await sync_to_async(Message.objects.filter(id__in=ids).update)(
-                    read_at=now,
-                    delivered_at=now,
-                    delivery_status=dj_models.Case(
-                        dj_models.When(delivery_status__lt=2, then=dj_models.Value(2, output_field=dj_models.PositiveSmallIntegerField())),
-                        default=dj_models.F('delivery_status'),
-                        output_field=dj_models.PositiveSmallIntegerField()
-                    )
-                )
-                last_read_id = max(ids)
-            else:
-                # حتى لو لم تكن هناك رسائل تحتاج ترقية الآن، احصل على أعلى معرف لرسالة للطرف الآخر لتجميد الحالة بعد إعادة التحميل.
-                try:
-                    last_read_id = await sync_to_async(lambda: Message.objects.filter(conversation_id=self.conversation_id).exclude(sender_id=user.id).order_by('-id').values_list('id', flat=True).first())()
-                except Exception:
-                    last_read_id = None
+            await self._replay_journal(self._resume_from())
+        except Exception:
+            logger.exception("Failed to replay journaled events", extra={"event": "ws_resume_error", "conv": self.group_name})
+        await self._mark_read_on_enter(user)
 
-            # Persist / advance read marker (even if no unread messages existed now)
+    async def _access_denied_reason(self, user):
+        """Return why ``user`` may not join ``self.conversation_id`` (None when allowed)."""
+        if not user or isinstance(user, AnonymousUser) or not user.is_authenticated:
+            return 'unauthorized'
+        acl = self.__dict__.setdefault('_acl', {})
+        key = int(self.conversation_id)
+        if key in acl:
+            return acl[key]
+        try:
+            conv = await self.get_conversation()
+        except Conversation.DoesNotExist:
+            return 'not_found'
+        reason = None
+        if user.id not in [conv.user_a_id, conv.user_b_id]:
             try:
-                await sync_to_async(ConversationReadMarker.objects.update_or_create)(
-                    conversation_id=self.conversation_id,
-                    user_id=user.id,
-                    defaults={"last_read_message_id": (last_read_id or 0)}
-                )
+                allowed = await self._is_extra_member(user.id, conv.id)
             except Exception:
-                pass
+                allowed = False
+            if not allowed:
+                reason = 'forbidden'
+        acl[key] = reason
+        return reason
+
+    def _forget_conversation(self, conversation_id: int) -> None:
+        """Drop the cached conversation/ACL so a later join re-checks membership."""
+        self.__dict__.get('_conversations', {}).pop(int(conversation_id), None)
+        self.__dict__.get('_acl', {}).pop(int(conversation_id), None)
+
+    async def _access_revoked(self, conversation_id: int) -> None:
+        """The bound conversation is gone or no longer open to this user: close the socket."""
+        await self.close(code=4001)
+
+    async def _mark_read_on_enter(self, user):
+        # Upon entering the conversation, everything inbound so far counts as read: advance the marker
+        try:
+            inbound = Message.objects.filter(conversation_id=self.conversation_id).exclude(sender_id=user.id)
+            last_read_id = await inbound.order_by('-id').values_list('id', flat=True).afirst()
+            previous = await sync_to_async(ConversationReadMarker.advance)(self.conversation_id, user.id, last_read_id) if last_read_id else None
             try:
-                logger.info("READ on connect", extra={"event": "read_on_connect", "conv": self.group_name, "user": getattr(user,'username',None), "count": len(ids), "last_read_id": last_read_id})
+                logger.info("READ on connect", extra={"event": "read_on_connect", "conv": self.group_name, "user": getattr(user,'username',None), "previous": previous, "last_read_id": last_read_id})
             except Exception:
                 pass
             # Broadcast chat.read once with last_read_id (if any)
             if last_read_id:
                 payload = { 'type': 'chat.read', 'conversation_id': int(self.conversation_id), 'reader': getattr(user, 'username', None), 'last_read_id': int(last_read_id) }
                 await self.channel_layer.group_send(self.group_name, {'type': 'broadcast.message', 'data': payload})
-            # Broadcast per-message status updates (only if we actually upgraded some)
-            if ids:
-                read_iso = now.isoformat()
-                for mid in ids[:300]:
-                    try:
-                        await self.channel_layer.group_send(self.group_name, {
-                            'type': 'broadcast.message',
-                            'data': { 'type': 'message.status', 'conversation_id': int(self.conversation_id), 'id': int(mid), 'message_id': int(mid), 'delivery_status': 2, 'status': 'read', 'read_at': read_iso }
-                        })
-                    except Exception:
-                        pass
+            # One status frame for the newly read inbound span (only if the marker moved)
+            if previous is not None:
+                await self.channel_layer.group_send(self.group_name, {
+                    'type': 'broadcast.message',
+                    'data': status_range_event(int(self.conversation_id), previous + 1, int(last_read_id), 2, read_at=timezone.now().isoformat()),
+                })
         except Exception:
             logger.exception("Failed to mark messages as read on connect", extra={"event": "read_on_connect_error", "conv": getattr(self, 'group_name', None)})
 
+    async def _broadcast_read_span(self, user, previous: int, last_read_id: int):
+        """``message.status`` range for inbound messages in ``(previous, last_read_id]``."""
+        span = await (Message.objects
+                      .filter(conversation_id=self.conversation_id, id__gt=previous, id__lte=last_read_id)
+                      .exclude(sender_id=user.id)
+                      .aaggregate(first=dj_models.Min('id'), last=dj_models.Max('id'), n=dj_models.Count('id')))
+        if not span['n']:
+            return
+        await self.channel_layer.group_send(self.group_name, {
+            'type': 'broadcast.message',
+            'data': status_range_event(int(self.conversation_id), span['first'], span['last'], 2, count=span['n'], read_at=timezone.now().isoformat()),
+        })
+
+    def _resume_from(self):
+        from urllib.parse import parse_qs
+        try:
+            qs = parse_qs((self.scope.get('query_string') or b'').decode())
+            raw = (qs.get('resume_from') or [None])[0]
+            return int(raw) if raw not in (None, '') else None
+        except (TypeError, ValueError):
+            return None
+
+    async def _replay_journal(self, resume_from):
+        from .event_journal import get_journal
+        journal = get_journal()
+        conv_id = int(self.conversation_id)
+        if resume_from is not None:
+            events, complete = await journal.asince(conv_id, resume_from)
+            if not complete:
+                await self.send_frame({
+                    'type': 'resync.required',
+                    'conversation_id': conv_id,
+                    'last_seq': await journal.alast_seq(conv_id),
+                })
+                return
+            for event in events:
+                await self.send_frame(event)
+            logger.info("WS resume", extra={"event": "ws_resume", "conv": self.group_name, "from": resume_from, "replayed": len(events)})
+            return
+        # Fresh connection: tell the client where the journal is so it can resume later
+        await self.send_frame({
+            'type': 'journal.position',
+            'conversation_id': conv_id,
+            'last_seq': await journal.alast_seq(conv_id),
+        })
+
+    def _typing(self):
+        coalescer = getattr(self, '_typing_coalescer', None)
+        if coalescer is None:
+            from .typing_state import TypingCoalescer
+            coalescer = self._typing_coalescer = TypingCoalescer(self._emit_typing)
+        return coalescer
+
+    async def _emit_typing(self, conversation_id: int, state: str):
+        payload = {
+            'type': 'chat.typing',
+            'user': self.scope['user'].username,
+            'state': state,
+            'conversation_id': conversation_id,
+        }
+        await self.channel_layer.group_send(f"conv_{conversation_id}", {'type': 'broadcast.message', 'data': payload})
+
+    async def _close_typing(self):
+        coalescer = getattr(self, '_typing_coalescer', None)
+        if coalescer is not None:
+            try:
+                await coalescer.close()
+            except Exception:
+                logger.exception("Failed to flush typing state on disconnect")
+
     async def disconnect(self, code):
+        self._close_outbound()
+        await self._close_typing()
         if hasattr(self, 'group_name'):
             await self.channel_layer.group_discard(self.group_name, self.channel_name)
             try:
@@ -129,6 +230,7 @@ class ConversationConsumer(AsyncWebsocketConsumer):
         user = self.scope['user']
         if not user.is_authenticated:
             return
+        text_data = self._inbound_text(text_data, bytes_data)
         if not text_data:
             return
         original = text_data
@@ -150,18 +252,12 @@ class ConversationConsumer(AsyncWebsocketConsumer):
                             except (TypeError, ValueError):
                                 pass
                         if requested_ids:
-                            from asgiref.sync import sync_to_async
-                            from django.utils import timezone
-                            from django.db import models as dj_models
                             # With status 0 removed, ACK becomes largely informational. We still stamp delivered_at if missing.
                             base_qs = Message.objects.filter(conversation_id=self.conversation_id, id__in=requested_ids, delivered_at__isnull=True).exclude(sender_id=user.id)
-                            ids_to_update = await sync_to_async(list)(base_qs.values_list('id', flat=True))
+                            ids_to_update = [mid async for mid in base_qs.values_list('id', flat=True)]
                             applied = 0
                             if ids_to_update:
-                                now = timezone.now()
-                                applied = await sync_to_async(Message.objects.filter(id__in=ids_to_update).update)(
-                                    delivered_at=now
-                                )
+                                applied = await Message.objects.filter(id__in=ids_to_update).aupdate(delivered_at=timezone.now())
                                 for mid in ids_to_update[:300]:
                                     try:
                                         await self.channel_layer.group_send(self.group_name, {
@@ -180,13 +276,8 @@ class ConversationConsumer(AsyncWebsocketConsumer):
                 # typing indicator event
                 if data.get('type') == 'typing':
                     state = data.get('state') or 'start'
-                    payload = {
-                        'type': 'chat.typing',
-                        'user': user.username,
-                        'state': 'start' if state not in ['stop', 'end'] else 'stop',
-                        'conversation_id': int(self.conversation_id),
-                    }
-                    await self.channel_layer.group_send(self.group_name, {'type': 'broadcast.message', 'data': payload})
+                    # Coalesced per conversation: only transitions / periodic keep-alives reach the group
+                    await self._typing().update(int(self.conversation_id), 'start' if state not in ['stop', 'end'] else 'stop')
                     return
                 # read receipts event (ephemeral)
                 if data.get('type') == 'read':
@@ -195,49 +286,18 @@ class ConversationConsumer(AsyncWebsocketConsumer):
                         last_read_id = int(last_read_id) if last_read_id is not None else None
                     except (TypeError, ValueError):
                         last_read_id = None
-                    # Persist read_at for messages sent by the other participant (reader consumed them)
+                    # Advance the reader's marker (clamped to a message of this conversation)
                     try:
                         if last_read_id:
-                            from asgiref.sync import sync_to_async
-                            from django.utils import timezone
-                            from django.db import models as dj_models
-                            qs = Message.objects.filter(conversation_id=self.conversation_id, id__lte=last_read_id, delivery_status__lt=2).exclude(sender_id=user.id)
-                            # Capture IDs BEFORE updating, as filter changes after update (delivery_status becomes 2)
-                            ids = await sync_to_async(list)(qs.values_list('id', flat=True))
-                            async_update = sync_to_async(qs.update)
-                            now = timezone.now()
-                            await async_update(
-                                read_at=now,
-                                delivered_at=now,
-                                delivery_status=dj_models.Case(
-                                    dj_models.When(delivery_status__lt=2, then=dj_models.Value(2, output_field=dj_models.PositiveSmallIntegerField())),
-                                    default=dj_models.F('delivery_status'),
-                                    output_field=dj_models.PositiveSmallIntegerField()
-                                )
-                            )
-                            # Update read marker even if there were no rows to update (freeze blue ticks on refresh)
-                            try:
-                                max_id = max(ids) if ids else last_read_id
-                                if max_id:
-                                    await sync_to_async(ConversationReadMarker.objects.update_or_create)(
-                                        conversation_id=self.conversation_id,
-                                        user_id=user.id,
-                                        defaults={"last_read_message_id": int(max_id)}
-                                    )
-                            except Exception:
-                                logger.exception("Failed to update ConversationReadMarker", extra={"event": "read_marker_error", "conv": self.group_name, "user": getattr(user,'id',None)})
-                            # Broadcast per-message read status (cap at 300)
-                            read_iso = now.isoformat()
-                            for mid in ids[:300]:
-                                try:
-                                    await self.channel_layer.group_send(self.group_name, {
-                                        'type': 'broadcast.message',
-                                        'data': { 'type': 'message.status', 'conversation_id': int(self.conversation_id), 'id': int(mid), 'message_id': int(mid), 'delivery_status': 2, 'status': 'read', 'read_at': read_iso }
-                                    })
-                                except Exception:
-                                    logger.exception("Failed broadcasting message.status", extra={"event": "broadcast_status_error", "conv": self.group_name, "message_id": mid})
+                            last_read_id = await (Message.objects
+                                                  .filter(conversation_id=self.conversation_id, id__lte=last_read_id)
+                                                  .order_by('-id').values_list('id', flat=True).afirst())
+                        if last_read_id:
+                            previous = await sync_to_async(ConversationReadMarker.advance)(self.conversation_id, user.id, last_read_id)
+                            if previous is not None:
+                                await self._broadcast_read_span(user, previous, last_read_id)
                             try:
-                                logger.info("READ recv", extra={"event": "read_recv", "conv": self.group_name, "user": getattr(user,'username',None), "to_id": last_read_id, "updated": len(ids)})
+                                logger.info("READ recv", extra={"event": "read_recv", "conv": self.group_name, "user": getattr(user,'username',None), "to_id": last_read_id, "previous": previous})
                             except Exception:
                                 pass
                     except Exception:
@@ -250,14 +310,8 @@ class ConversationConsumer(AsyncWebsocketConsumer):
                     }
                     await self.channel_layer.group_send(self.group_name, {'type': 'broadcast.message', 'data': payload})
                     try:
-                        from asgiref.sync import sync_to_async
-                        unread_total = await sync_to_async(_total_unread_for_user)(user.id)
-                        await sync_to_async(send_unread_badge_push)(
-                            user.id,
-                            unread_total,
-                            reason="chat.read",
-                            conversation_id=int(self.conversation_id),
-                        )
+                        # Debounced per user; the unread total is computed off the event loop
+                        schedule_badge_sync(user.id, reason="chat.read", conversation_id=int(self.conversation_id))
                     except Exception:
                         logger.exception(
                             "Failed to send badge update push after chat.read",
@@ -280,71 +334,26 @@ class ConversationConsumer(AsyncWebsocketConsumer):
         MAX_LEN = 1000
         if len(body) > MAX_LEN:
             body = body[:MAX_LEN]
-        from asgiref.sync import sync_to_async
-        async_create = sync_to_async(Message.objects.create)
-        # Try to attach team member from token in query (if present in scope['token_payload'])
-        kwargs = { 'conversation_id': self.conversation_id, 'sender_id': user.id, 'body': body, 'type': msg_type }
-        tm = None
-        try:
-            token_payload = self.scope.get('token_payload') if hasattr(self.scope, 'get') else None
-            acting_team_id = (token_payload or {}).get('team_member_id') if isinstance(token_payload, dict) else None
-            if acting_team_id:
-                tm = await sync_to_async(TeamMember.objects.filter(id=acting_team_id, owner_id=user.id, is_active=True).first)()
-                if tm:
-                    kwargs['sender_team_member_id'] = tm.id
-        except Exception:
-            pass
-
-        # Persist the new message (initial status logically 1=delivered)
-        msg = await async_create(**kwargs)
-
-        # Failsafe: since user is actively sending in this conversation, mark prior inbound messages as read (upgrade to 2)
+        tm = await self._acting_team_member(user)
+        conv = await self.get_conversation()
+        # One thread hop, one transaction: access re-check + create + marker, then viewer unread counts
         try:
-            from django.utils import timezone
-            from django.db import models as dj_models
-            from asgiref.sync import sync_to_async
-            now = timezone.now()
-            qs = Message.objects.filter(conversation_id=self.conversation_id, id__lte=msg.id, delivery_status__lt=2).exclude(sender_id=user.id)
-            await sync_to_async(qs.update)(
-                read_at=now,
-                delivered_at=now,
-                delivery_status=dj_models.Case(
-                    dj_models.When(delivery_status__lt=2, then=dj_models.Value(2, output_field=dj_models.PositiveSmallIntegerField())),
-                    default=dj_models.F('delivery_status'),
-                    output_field=dj_models.PositiveSmallIntegerField()
-                )
+            msg, viewer_unread = await sync_to_async(_persist_inbound_message)(
+                conv, user.id, body, msg_type, tm.id if tm else None,
             )
-            # Update read marker as well (msg.id covers all prior inbound)
-            try:
-                await sync_to_async(ConversationReadMarker.objects.update_or_create)(
-                    conversation_id=self.conversation_id,
-                    user_id=user.id,
-                    defaults={"last_read_message_id": msg.id}
-                )
-            except Exception:
-                pass
-        except Exception:
-            pass
+        except ConversationAccessRevoked:
+            logger.info("WS send refused", extra={"event": "ws_access_revoked", "conv": self.group_name, "user_id": user.id})
+            self._forget_conversation(conv.id)
+            await self._access_revoked(conv.id)
+            return
+        # Sending ends the typing burst; avoid a trailing keep-alive "start" after the bubble
+        if getattr(self, '_typing_coalescer', None) is not None:
+            await self._typing_coalescer.update(int(self.conversation_id), 'stop')
 
-        # Broadcast chat.message to conversation group
+        # Realtime fan-out: chat.message + status to the conversation (Channels and Pusher),
+        # inbox.update / notify to every other viewer. Each event is encoded once.
         sender_display = (getattr(tm, 'display_name', '') or getattr(tm, 'username', '')) if tm else (getattr(user, 'display_name', '') or user.username)
-        payload_message = {
-            'type': 'chat.message',
-            'conversation_id': int(self.conversation_id),
-            'id': msg.id,
-            'message_id': msg.id,
-            'seq': msg.id,
-            'sender': user.username,
-            'senderDisplay': sender_display,
-            'body': body,
-            'created_at': msg.created_at.isoformat(),
-            'delivered_at': msg.created_at.isoformat(),
-            'read_at': None,
-            'kind': msg_type,
-            'client_id': client_id,
-            'delivery_status': 1,
-            'status': 'delivered',
-        }
+        payload_message = message_event(msg, sender=user, sender_display=sender_display, body=body, kind=msg_type, client_id=client_id)
         # Instrumentation: log the outgoing realtime payload to diagnose missing recipient updates.
         try:
             logger.info("WS chat.message broadcast", extra={
@@ -359,78 +368,55 @@ class ConversationConsumer(AsyncWebsocketConsumer):
             })
         except Exception:
             pass
-        await self.channel_layer.group_send(self.group_name, {'type': 'broadcast.message', 'data': payload_message})
-        # Explicit status broadcast (redundant) kept for downstream listeners not capturing initial message
-        try:
-            await self.channel_layer.group_send(self.group_name, {'type': 'broadcast.message', 'data': { 'type': 'message.status', 'conversation_id': int(self.conversation_id), 'id': msg.id, 'message_id': msg.id, 'delivery_status': 1, 'status': 'delivered' }})
-        except Exception:
-            pass
-        # Mirror to Pusher so deployments using Pusher-only listeners remain in sync
-        try:
-            from .pusher_client import pusher_client
-            if pusher_client:
-                from asgiref.sync import sync_to_async
-                await sync_to_async(pusher_client.trigger)(
-                    f"chat_{self.conversation_id}",
-                    'message',
-                    {
-                        'username': user.username,
-                        'display_name': sender_display,
-                        'senderDisplay': sender_display,
-                        'message': body,
-                        'conversation_id': int(self.conversation_id),
-                        'id': msg.id,
-                        'message_id': msg.id,
-                        'delivered_at': msg.created_at.isoformat(),
-                        'read_at': None,
-                    }
-                )
-        except Exception:
-            pass
-        # Also notify recipient's inbox channel so their conversation list updates instantly
+        own_display = getattr(user, 'display_name', '') or user.username
+        await get_dispatcher().apublish_many(new_message_entries(
+            int(self.conversation_id),
+            payload_message,
+            viewer_unread=viewer_unread,
+            preview=msg.body,
+            last_message_at=msg.created_at,
+            notify=notify_event('message', int(self.conversation_id), own_display, msg.body, msg.created_at),
+            # Explicit status broadcast (redundant) kept for downstream listeners not capturing initial message
+            status_events=[status_event(msg.id, 1, conversation_id=self.conversation_id)],
+        ))
+
+    async def get_conversation(self):
+        """The bound conversation, fetched once per connection (per conversation on mux sockets)."""
+        cache = self.__dict__.setdefault('_conversations', {})
+        key = int(self.conversation_id)
+        conv = cache.get(key)
+        if conv is None:
+            conv = cache[key] = await Conversation.objects.aget(pk=key, deleted_at__isnull=True)
+        return conv
+
+    def _acting_team_id(self):
         try:
-            conv = await self.get_conversation()
-            from asgiref.sync import sync_to_async
-            for uid in get_conversation_viewer_ids(conv):
-                if uid == user.id:
-                    continue
-                unread_total = await sync_to_async(_total_unread_for_user)(uid)
-                inbox_group = f"user_{uid}"
-                await self.channel_layer.group_send(inbox_group, {
-                    'type': 'broadcast.message',
-                    'data': {
-                        'type': 'inbox.update',
-                        'conversation_id': int(self.conversation_id),
-                        'last_message_preview': msg.body[:80],
-                        'last_message_at': msg.created_at.isoformat(),
-                        'unread_count': unread_total,
-                    }
-                })
+            token_payload = self.scope.get('token_payload') if hasattr(self.scope, 'get') else None
+            return (token_payload or {}).get('team_member_id') if isinstance(token_payload, dict) else None
         except Exception:
-            logger.exception(
-                "Failed to broadcast inbox.update with accurate unread count",
-                extra={"event": "inbox_unread_error", "conversation_id": getattr(self, 'conversation_id', None)},
-            )
+            return None
 
-    async def broadcast_message(self, event):
-        await self.send(text_data=json.dumps(event['data']))
-
-    async def get_conversation(self):
-        from asgiref.sync import sync_to_async
-        return await sync_to_async(Conversation.objects.get)(pk=self.conversation_id)
+    async def _acting_team_member(self, user):
+        """Team member acting through this socket's token (resolved once per connection)."""
+        if '_team_member' not in self.__dict__:
+            tm = None
+            try:
+                acting_team_id = self._acting_team_id()
+                if acting_team_id:
+                    tm = await TeamMember.objects.filter(id=acting_team_id, owner_id=user.id, is_active=True).afirst()
+            except Exception:
+                tm = None
+            self._team_member = tm
+        return self._team_member
 
     async def _is_extra_member(self, user_id: int, conversation_id: int) -> bool:
-        from asgiref.sync import sync_to_async
         # Allow if added by user_id or acting team member
-        exists_user = await sync_to_async(ConversationMember.objects.filter(conversation_id=conversation_id, member_user_id=user_id).exists)()
-        if exists_user:
+        if await ConversationMember.objects.filter(conversation_id=conversation_id, member_user_id=user_id).aexists():
             return True
         try:
-            token_payload = self.scope.get('token_payload') if hasattr(self.scope, 'get') else None
-            acting_team_id = (token_payload or {}).get('team_member_id') if isinstance(token_payload, dict) else None
+            acting_team_id = self._acting_team_id()
             if acting_team_id:
-                exists_team = await sync_to_async(ConversationMember.objects.filter(conversation_id=conversation_id, member_team_id=acting_team_id).exists)()
-                return bool(exists_team)
+                return await ConversationMember.objects.filter(conversation_id=conversation_id, member_team_id=acting_team_id).aexists()
         except Exception:
             pass
         return False
@@ -0,0 +1,95 @@
+"""Delayed in-process callbacks: one timing thread, a small worker pool.
+
+Push bundling and badge sync both close a window some seconds after it opens.
+They used to start a ``threading.Timer`` (one OS thread each) per recipient,
+so a busy process could hold thousands of sleeping threads. ``Deadlines`` keeps
+the due callbacks in a heap watched by a single daemon thread, which only does
+the timing: due callbacks are handed to a small worker pool
+(``PUSH_DELIVERY_WORKERS`` threads), so a slow provider send delays the
+deliveries queued behind it in the pool, not every other window's deadline.
+"""
+from __future__ import annotations
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Deadlines:
+    def __init__(self, name: str = 'deadlines', workers: Optional[int] = None):
+        self.name = name
+        if workers is None:
+            workers = int(getattr(settings, 'PUSH_DELIVERY_WORKERS', 4))
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=f'{name}-worker')
+        self._cond = threading.Condition()
+        # [due, seq, callback, args]; a cancelled entry has callback None and is skipped
+        self._heap: List[list] = []
+        self._seq = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+
+    def call_later(self, delay: float, callback: Callable[..., Any], *args) -> list:
+        """Run ``callback(*args)`` after ``delay`` seconds; returns a handle for ``cancel``."""
+        entry = [time.monotonic() + max(0.0, delay), next(self._seq), callback, args]
+        with self._cond:
+            heapq.heappush(self._heap, entry)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return entry
+
+    def cancel(self, handle: Optional[list]) -> None:
+        """Drop a pending callback; no-op once it ran."""
+        if handle is not None:
+            with self._cond:
+                handle[2] = None
+
+    def __len__(self) -> int:
+        with self._cond:
+            return sum(1 for entry in self._heap if entry[2] is not None)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while self._heap and self._heap[0][2] is None:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                wait = self._heap[0][0] - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                _, _, callback, args = heapq.heappop(self._heap)
+            try:
+                self._pool.submit(self._call, callback, args)
+            except RuntimeError:
+                # Pool shut down (interpreter exit): nothing left to deliver to
+                return
+
+    def _call(self, callback: Callable[..., Any], args: tuple) -> None:
+        try:
+            callback(*args)
+        except Exception:
+            logger.exception("Deadline callback failed", extra={"event": "deadline_error", "scheduler": self.name})
+
+
+_deadlines: Optional[Deadlines] = None
+_deadlines_lock = threading.Lock()
+
+
+def get_deadlines() -> Deadlines:
+    global _deadlines
+    if _deadlines is None:
+        with _deadlines_lock:
+            if _deadlines is None:
+                _deadlines = Deadlines('push-deadlines')
+    return _deadlines
@@ -0,0 +1,168 @@
+"""Bounded per-conversation journal of realtime events.
+
+Every ``broadcast.message`` sent to a ``conv_<id>`` group is stamped with a
+per-conversation ``event_seq`` and kept in a ring buffer so a reconnecting
+WebSocket can ask for ``?resume_from=<seq>`` and receive what it missed instead
+of refetching history over REST. The buffer lives in Redis when ``REDIS_URL`` is
+configured (shared across workers, like the channel layer) and in process memory
+otherwise (matching ``InMemoryChannelLayer``).
+"""
+from __future__ import annotations
+
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Events that are only meaningful live and are never replayed.
+EPHEMERAL_EVENT_TYPES = frozenset({'chat.typing'})
+
+_CONV_GROUP_RE = re.compile(r'^conv_(\d+)$')
+
+
+def conversation_id_for_group(group: str) -> Optional[int]:
+    match = _CONV_GROUP_RE.match(group or '')
+    return int(match.group(1)) if match else None
+
+
+def _journal_size() -> int:
+    return max(1, int(getattr(settings, 'WS_EVENT_JOURNAL_SIZE', 500)))
+
+
+class InMemoryEventJournal:
+    """Process-local stand-in used when no Redis is configured."""
+
+    def __init__(self, size: int, max_conversations: int = 10000):
+        self.size = size
+        self.max_conversations = max_conversations
+        self._events: "OrderedDict[int, Deque[dict]]" = OrderedDict()
+        self._seq: Dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def append(self, conversation_id: int, data: dict) -> int:
+        with self._lock:
+            seq = self._seq.get(conversation_id, 0) + 1
+            self._seq[conversation_id] = seq
+            buf = self._events.get(conversation_id)
+            if buf is None:
+                buf = deque(maxlen=self.size)
+                self._events[conversation_id] = buf
+                while len(self._events) > self.max_conversations:
+                    evicted, _ = self._events.popitem(last=False)
+                    self._seq.pop(evicted, None)
+            else:
+                self._events.move_to_end(conversation_id)
+            buf.append({**data, 'event_seq': seq})
+            return seq
+
+    def last_seq(self, conversation_id: int) -> int:
+        return self._seq.get(conversation_id, 0)
+
+    def since(self, conversation_id: int, seq: int) -> Tuple[List[dict], bool]:
+        with self._lock:
+            last = self._seq.get(conversation_id, 0)
+            events = [e for e in self._events.get(conversation_id, ()) if e['event_seq'] > seq]
+        return events, _is_complete(seq, last, events)
+
+    async def aappend(self, conversation_id: int, data: dict) -> int:
+        return self.append(conversation_id, data)
+
+    async def asince(self, conversation_id: int, seq: int) -> Tuple[List[dict], bool]:
+        return self.since(conversation_id, seq)
+
+    async def alast_seq(self, conversation_id: int) -> int:
+        return self.last_seq(conversation_id)
+
+
+class RedisEventJournal:
+    """Ring buffer per conversation: an INCR counter plus a sorted set scored by seq."""
+
+    def __init__(self, url: str, size: int, ttl: int, prefix: str = 'wsjournal'):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.size = size
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _keys(self, conversation_id: int) -> Tuple[str, str]:
+        base = f"{self.prefix}:{conversation_id}"
+        return f"{base}:seq", f"{base}:events"
+
+    def append(self, conversation_id: int, data: dict) -> int:
+        seq_key, events_key = self._keys(conversation_id)
+        seq = int(self.client.incr(seq_key))
+        pipe = self.client.pipeline()
+        pipe.zadd(events_key, {json.dumps({**data, 'event_seq': seq}): seq})
+        pipe.zremrangebyrank(events_key, 0, -(self.size + 1))
+        pipe.expire(events_key, self.ttl)
+        pipe.expire(seq_key, self.ttl)
+        pipe.execute()
+        return seq
+
+    def last_seq(self, conversation_id: int) -> int:
+        seq_key, _ = self._keys(conversation_id)
+        return int(self.client.get(seq_key) or 0)
+
+    def since(self, conversation_id: int, seq: int) -> Tuple[List[dict], bool]:
+        seq_key, events_key = self._keys(conversation_id)
+        pipe = self.client.pipeline()
+        pipe.get(seq_key)
+        pipe.zrangebyscore(events_key, f"({seq}", '+inf')
+        raw_last, raw_events = pipe.execute()
+        events = [json.loads(item) for item in raw_events]
+        return events, _is_complete(seq, int(raw_last or 0), events)
+
+    async def aappend(self, conversation_id: int, data: dict) -> int:
+        return await sync_to_async(self.append, thread_sensitive=False)(conversation_id, data)
+
+    async def asince(self, conversation_id: int, seq: int) -> Tuple[List[dict], bool]:
+        return await sync_to_async(self.since, thread_sensitive=False)(conversation_id, seq)
+
+    async def alast_seq(self, conversation_id: int) -> int:
+        return await sync_to_async(self.last_seq, thread_sensitive=False)(conversation_id)
+
+
+def _is_complete(seq: int, last: int, events: List[dict]) -> bool:
+    """True when ``events`` covers every event after ``seq`` (no trimmed gap)."""
+    if seq > last:
+        # Client is ahead of the journal (counter reset/expired): cannot vouch for anything.
+        return False
+    if seq == last:
+        return True
+    return bool(events) and events[0]['event_seq'] <= seq + 1
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_journal():
+    global _journal
+    if _journal is None:
+        with _journal_lock:
+            if _journal is None:
+                redis_url = getattr(settings, 'REDIS_URL', None)
+                if redis_url:
+                    _journal = RedisEventJournal(
+                        redis_url,
+                        _journal_size(),
+                        int(getattr(settings, 'WS_EVENT_JOURNAL_TTL', 3600)),
+                    )
+                else:
+                    _journal = InMemoryEventJournal(_journal_size())
+    return _journal
+
+
+def reset_journal() -> None:
+    """Drop the cached journal (tests / settings overrides)."""
+    global _journal
+    with _journal_lock:
+        _journal = None
@@ -4,7 +4,8 @@ from channels.generic.websocket import AsyncWebsocketConsumer
 from django.contrib.auth.models import AnonymousUser
 from django.conf import settings
 from .group_registry import add_channel, remove_channel, get_count
-from django.db import models
+from .instrumentation import InstrumentedConsumerMixin
+from .outbound import OutboundQueueMixin
 
 
 def _debug_log(message: str) -> None:
@@ -19,7 +20,74 @@ def _debug_log(message: str) -> None:
         pass
 
 
-class InboxConsumer(AsyncWebsocketConsumer):
+# Same cap as the delivered frames of ConversationViewSet.messages
+STATUS_FRAMES_PER_CONVERSATION = 300
+
+
+def _deliver_inbound(user_id: int):
+    """Upgrade every undelivered inbound message of ``user_id`` in one UPDATE.
+
+    Covers direct conversations and those the user was added to as an extra
+    member. Returns ``(unread_by_conversation, upgraded)`` where ``upgraded`` maps a
+    conversation id to the upgraded message ids, oldest first, at most the newest
+    ``STATUS_FRAMES_PER_CONVERSATION`` of them.
+    """
+    from django.utils import timezone
+    from .models import Message
+    from .push import _conversation_ids_for_user, _unread_counts_by_conversation
+    conv_ids = _conversation_ids_for_user(user_id)
+    if not conv_ids:
+        return {}, {}
+    limit = int(getattr(settings, 'WS_DELIVERY_UPGRADE_LIMIT', 2000))
+    rows = list(
+        Message.objects
+            .filter(conversation_id__in=conv_ids, delivery_status__lt=1)
+            .exclude(sender_id=user_id)
+            .order_by('-id')
+            .values_list('id', 'conversation_id')[:limit]
+    )
+    upgraded = {}
+    if rows:
+        Message.objects.filter(id__in=[mid for mid, _ in rows], delivery_status__lt=1).update(
+            delivered_at=timezone.now(),
+            delivery_status=1,
+        )
+        for mid, conv_id in rows:
+            ids = upgraded.setdefault(conv_id, [])
+            if len(ids) < STATUS_FRAMES_PER_CONVERSATION:
+                ids.append(mid)
+        for ids in upgraded.values():
+            ids.reverse()
+    return _unread_counts_by_conversation(user_id, conv_ids), upgraded
+
+
+async def mark_inbound_delivered(channel_layer, user_id: int) -> dict:
+    """Mark undelivered inbound messages as delivered for a user that just came online.
+
+    One thread hop running a handful of set-based queries, then one
+    ``message.status`` frame per upgraded message (clients match status by id),
+    capped per conversation like ``ConversationViewSet.messages``.
+    Returns the ``inbox.hello`` frame carrying the per-conversation unread snapshot.
+    """
+    hello = {'type': 'inbox.hello', 'unread': {}, 'unread_total': 0}
+    try:
+        from asgiref.sync import sync_to_async
+        from .realtime import CHANNELS, conversation_route, get_dispatcher, status_event
+        unread, upgraded = await sync_to_async(_deliver_inbound)(user_id)
+        hello['unread'] = {str(cid): count for cid, count in unread.items()}
+        hello['unread_total'] = sum(unread.values())
+        if upgraded:
+            # Senders update ticks to double gray; published as one batch
+            await get_dispatcher().apublish_many([
+                (conversation_route(conv_id), status_event(mid, 1, conversation_id=conv_id), {CHANNELS})
+                for conv_id, ids in upgraded.items() for mid in ids
+            ])
+    except Exception:
+        pass
+    return hello
+
+
+class InboxConsumer(InstrumentedConsumerMixin, OutboundQueueMixin, AsyncWebsocketConsumer):
     async def connect(self):
         user = self.scope.get('user')
         if not user or isinstance(user, AnonymousUser) or not user.is_authenticated:
@@ -33,50 +101,12 @@ class InboxConsumer(AsyncWebsocketConsumer):
         except Exception:
             pass
         await self.channel_layer.group_add(self.group_name, self.channel_name)
-        await self.accept()
-        # optional: send hello
+        await self.accept(subprotocol=self._negotiate_wire())
+        # Mark undelivered inbound messages as delivered now that user is online (outside conversation),
+        # then greet with the unread snapshot
+        hello = await mark_inbound_delivered(self.channel_layer, self.user_id)
         try:
-            await self.send(text_data=json.dumps({'type':'inbox.hello'}))
-        except Exception:
-            pass
-        # Mark undelivered inbound messages as delivered now that user is online (outside conversation)
-        try:
-            from asgiref.sync import sync_to_async
-            from django.utils import timezone
-            from .models import Message, Conversation
-            from django.db import models as dj_models
-            async_get_convs = sync_to_async(list)
-            convs = await async_get_convs(Conversation.objects.filter(models.Q(user_a_id=self.user_id) | models.Q(user_b_id=self.user_id)).only('id'))
-            now = timezone.now()
-            for c in convs:
-                # Fetch up to last 100 inbound messages that are not yet delivered
-                async_get_ids = sync_to_async(list)
-                ids = await async_get_ids(
-                    Message.objects
-                        .filter(conversation_id=c.id, delivery_status__lt=1)
-                        .exclude(sender_id=self.user_id)
-                        .order_by('-id')
-                        .values_list('id', flat=True)[:100]
-                )
-                if not ids:
-                    continue
-                async_update = sync_to_async(Message.objects.filter(id__in=ids).update)
-                await async_update(
-                    delivered_at=now,
-                    delivery_status=dj_models.Case(
-                        dj_models.When(delivery_status__lt=1, then=dj_models.Value(1)),
-                        default=dj_models.F('delivery_status')
-                    )
-                )
-                # Broadcast per-message status so senders update ticks to double gray
-                for mid in ids:
-                    try:
-                        await self.channel_layer.group_send(f"conv_{c.id}", {
-                            'type': 'broadcast.message',
-                            'data': { 'type': 'message.status', 'id': int(mid), 'delivery_status': 1, 'status': 'delivered' }
-                        })
-                    except Exception:
-                        pass
+            await self.send_frame(hello)
         except Exception:
             pass
         try:
@@ -87,6 +117,7 @@ class InboxConsumer(AsyncWebsocketConsumer):
             pass
 
     async def disconnect(self, code):
+        self._close_outbound()
         if hasattr(self, 'group_name'):
             await self.channel_layer.group_discard(self.group_name, self.channel_name)
         try:
@@ -98,6 +129,7 @@ class InboxConsumer(AsyncWebsocketConsumer):
 
     async def receive(self, text_data=None, bytes_data=None):
         # Support simple heartbeat from client
+        text_data = self._inbound_text(text_data, bytes_data)
         if not text_data:
             return
         try:
@@ -111,7 +143,4 @@ class InboxConsumer(AsyncWebsocketConsumer):
                 _debug_log(f"ping user={self.user_id}")
             except Exception:
                 pass
-            await self.send(text_data=json.dumps({'type': 'pong'}))
-
-    async def broadcast_message(self, event):
-        await self.send(text_data=json.dumps(event['data']))
+            await self.send_frame({'type': 'pong'})
@@ -0,0 +1,373 @@
+"""Per-route / per-event latency, DB query and group_send instrumentation.
+
+Every HTTP request (``MetricsMiddleware``) and every inbound WebSocket frame
+(``InstrumentedConsumerMixin``) runs inside a ``Scope`` kept in a context
+variable. While a scope is active:
+
+* a DB execute wrapper, installed on each connection as it is opened, counts
+  queries and their time (``sync_to_async`` copies the context, so queries run
+  from consumers are attributed too);
+* the journaled channel layers report every ``group_send``.
+
+When the scope ends its numbers go into in-process histograms/counters keyed
+by route (the URL pattern, not the path) or by consumer and event type. They
+are rendered in Prometheus text format by ``render_prometheus`` together with
+the realtime backend, WebSocket queue and provider breaker counters.
+
+Requests slower than ``METRICS_SLOW_REQUEST_MS`` are sampled
+(``METRICS_SLOW_SAMPLE_RATE``) and logged with their slowest and most repeated
+SQL statements, which is usually enough to spot an N+1.
+"""
+from __future__ import annotations
+
+import contextvars
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import msgpack
+import orjson
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'mutabaka_'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 250)
+# Statements kept per scope for slow-request logs
+SQL_SAMPLE_LIMIT = 200
+
+Labels = Tuple[Tuple[str, str], ...]
+
+_REGEX_GROUP = re.compile(r'\(\?P<(\w+)>[^)]*\)')
+
+
+class Scope:
+    __slots__ = ('queries', 'db_seconds', 'group_sends', 'statements')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.group_sends = 0
+        self.statements: List[Tuple[str, float]] = []
+
+
+_scope: contextvars.ContextVar[Optional[Scope]] = contextvars.ContextVar('metrics_scope', default=None)
+
+
+def enabled() -> bool:
+    return bool(getattr(settings, 'METRICS_ENABLED', True))
+
+
+# ---------------------------------------------------------------------------
+# Registry
+# ---------------------------------------------------------------------------
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, _Histogram]] = {}
+
+    def inc(self, name: str, labels: Dict[str, str], value: float = 1, help: str = '') -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._help.setdefault(name, ('counter', help))
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, labels: Dict[str, str], value: float, buckets: Sequence[float], help: str = '') -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._help.setdefault(name, ('histogram', help))
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = _Histogram(buckets)
+            hist.observe(value)
+
+    def counter_value(self, name: str, labels: Dict[str, str]) -> float:
+        with self._lock:
+            return self._counters.get(name, {}).get(tuple(sorted(labels.items())), 0)
+
+    def histogram_count(self, name: str, labels: Dict[str, str]) -> int:
+        with self._lock:
+            hist = self._histograms.get(name, {}).get(tuple(sorted(labels.items())))
+            return hist.count if hist else 0
+
+    def reset(self) -> None:
+        with self._lock:
+            self._help.clear()
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self) -> List[str]:
+        lines: List[str] = []
+        with self._lock:
+            for name in sorted(self._help):
+                kind, help_text = self._help[name]
+                full = PREFIX + name
+                if help_text:
+                    lines.append(f"# HELP {full} {help_text}")
+                lines.append(f"# TYPE {full} {kind}")
+                if kind == 'counter':
+                    for key, value in sorted(self._counters.get(name, {}).items()):
+                        lines.append(f"{full}{_labels(key)} {_num(value)}")
+                    continue
+                for key, hist in sorted(self._histograms.get(name, {}).items()):
+                    cumulative = 0
+                    for bound, n in zip(hist.buckets, hist.counts):
+                        cumulative += n
+                        lines.append(f"{full}_bucket{_labels(key + (('le', _num(bound)),))} {cumulative}")
+                    lines.append(f"{full}_bucket{_labels(key + (('le', '+Inf'),))} {hist.count}")
+                    lines.append(f"{full}_sum{_labels(key)} {_num(hist.sum)}")
+                    lines.append(f"{full}_count{_labels(key)} {hist.count}")
+        return lines
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(key: Labels) -> str:
+    if not key:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in key) + '}'
+
+
+def _num(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(round(float(value), 6))
+
+
+registry = Registry()
+
+
+# ---------------------------------------------------------------------------
+# Collection
+# ---------------------------------------------------------------------------
+
+def _record_query(execute, sql, params, many, context):
+    scope = _scope.get()
+    if scope is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        scope.queries += 1
+        scope.db_seconds += elapsed
+        if len(scope.statements) < SQL_SAMPLE_LIMIT:
+            scope.statements.append((sql, elapsed))
+
+
+def install_query_wrapper(sender=None, connection=None, **kwargs) -> None:
+    if connection is not None and _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+connection_created.connect(install_query_wrapper, dispatch_uid='communications.instrumentation')
+
+
+def record_group_send(group: str) -> None:
+    """Called by the journaled channel layers for every ``group_send``."""
+    if not enabled():
+        return
+    kind = group.split('_', 1)[0] if '_' in group else 'other'
+    registry.inc('channel_group_sends_total', {'group': kind}, help='Channel layer group_send calls by group kind')
+    scope = _scope.get()
+    if scope is not None:
+        scope.group_sends += 1
+
+
+def begin() -> Tuple[Scope, contextvars.Token]:
+    scope = Scope()
+    return scope, _scope.set(scope)
+
+
+def end(token: contextvars.Token) -> None:
+    _scope.reset(token)
+
+
+def _finish(prefix: str, labels: Dict[str, str], scope: Scope, elapsed: float) -> None:
+    registry.observe(f'{prefix}_duration_seconds', labels, elapsed, LATENCY_BUCKETS, help='Handling latency in seconds')
+    registry.observe(f'{prefix}_db_queries', labels, scope.queries, QUERY_BUCKETS, help='DB queries per request/event')
+    registry.inc(f'{prefix}_db_seconds_total', labels, scope.db_seconds, help='Time spent in DB queries')
+    registry.inc(f'{prefix}_group_sends_total', labels, scope.group_sends, help='Channel layer group_send calls')
+
+
+def _maybe_log_slow(what: str, labels: Dict[str, str], scope: Scope, elapsed: float) -> None:
+    threshold = float(getattr(settings, 'METRICS_SLOW_REQUEST_MS', 1000)) / 1000
+    if elapsed < threshold:
+        return
+    if random.random() >= float(getattr(settings, 'METRICS_SLOW_SAMPLE_RATE', 1.0)):
+        return
+    slowest = sorted(scope.statements, key=lambda s: s[1], reverse=True)[:5]
+    repeated = Counter(sql for sql, _ in scope.statements).most_common(3)
+    logger.warning(
+        "Slow %s %s: %.0fms, %d queries (%.0fms in DB)",
+        what, ' '.join(labels.values()), elapsed * 1000, scope.queries, scope.db_seconds * 1000,
+        extra={
+            "event": "slow_request",
+            "labels": labels,
+            "duration_ms": round(elapsed * 1000, 1),
+            "queries": scope.queries,
+            "db_ms": round(scope.db_seconds * 1000, 1),
+            "group_sends": scope.group_sends,
+            "slowest_sql": [{"sql": sql, "ms": round(t * 1000, 2)} for sql, t in slowest],
+            "repeated_sql": [{"sql": sql, "count": n} for sql, n in repeated if n > 1],
+        },
+    )
+
+
+def route_label(match) -> str:
+    """``api/conversations/<pk>/`` for both path() and DRF router (regex) patterns."""
+    route = getattr(match, 'route', '') if match is not None else ''
+    if not route:
+        return 'unmatched'
+    return _REGEX_GROUP.sub(r'<\1>', route.replace('^', '').replace('$', ''))
+
+
+class MetricsMiddleware:
+    """Records latency, DB queries and group_sends per URL route."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not enabled():
+            return self.get_response(request)
+        scope, token = begin()
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            end(token)
+            try:
+                labels = {'route': route_label(getattr(request, 'resolver_match', None)), 'method': request.method}
+                _finish('http', labels, scope, elapsed)
+                registry.inc('http_requests_total', {**labels, 'status': f'{status // 100}xx'}, help='HTTP responses by status class')
+                _maybe_log_slow('request', labels, scope, elapsed)
+            except Exception:
+                logger.debug("Failed to record request metrics", exc_info=True)
+
+
+def _event_type(text_data, bytes_data) -> str:
+    try:
+        data = orjson.loads(text_data) if text_data else msgpack.unpackb(bytes_data, raw=False)
+        kind = data.get('type') if isinstance(data, dict) else None
+    except Exception:
+        return 'invalid'
+    if isinstance(kind, str) and 0 < len(kind) <= 40 and kind.replace('.', '').replace('_', '').isalnum():
+        return kind
+    return 'unknown'
+
+
+class InstrumentedConsumerMixin:
+    """Records latency, DB queries and group_sends per consumer and inbound event type.
+
+    Put it first in the bases of an ``AsyncWebsocketConsumer`` subclass.
+    """
+
+    async def _instrumented(self, event: str, handler, message):
+        if not enabled():
+            return await handler(message)
+        scope, token = begin()
+        started = time.perf_counter()
+        try:
+            return await handler(message)
+        finally:
+            elapsed = time.perf_counter() - started
+            end(token)
+            try:
+                labels = {'consumer': type(self).__name__, 'event': event}
+                _finish('ws', labels, scope, elapsed)
+                _maybe_log_slow('ws event', labels, scope, elapsed)
+            except Exception:
+                logger.debug("Failed to record ws metrics", exc_info=True)
+
+    async def websocket_connect(self, message):
+        await self._instrumented('connect', super().websocket_connect, message)
+
+    async def websocket_receive(self, message):
+        event = _event_type(message.get('text'), message.get('bytes'))
+        await self._instrumented(event, super().websocket_receive, message)
+
+
+# ---------------------------------------------------------------------------
+# Export
+# ---------------------------------------------------------------------------
+
+_BREAKER_STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+
+def _collected_lines() -> List[str]:
+    """Counters owned by other modules, in the same text format."""
+    from .outbound import metrics_snapshot as outbound_snapshot
+    from .providers import breaker_states
+    from .realtime import metrics_snapshot as realtime_snapshot
+
+    extra = Registry()
+    for backend, m in realtime_snapshot().items():
+        extra.inc('realtime_backend_calls_total', {'backend': backend}, m['calls'], help='Realtime backend publish calls')
+        extra.inc('realtime_backend_events_total', {'backend': backend}, m['events'], help='Realtime events published')
+        extra.inc('realtime_backend_errors_total', {'backend': backend}, m['errors'], help='Realtime backend errors')
+    outbound = outbound_snapshot()
+    max_depth = outbound.pop('max_depth', 0)
+    for name, value in outbound.items():
+        extra.inc(f'ws_outbound_{name}_total', {}, value, help='WebSocket outbound queue counter')
+    lines = extra.render()
+    _gauge(lines, 'ws_outbound_max_depth', 'Deepest WebSocket outbound queue seen', {(): max_depth})
+    _gauge(
+        lines, 'provider_circuit_state', 'Provider breaker state (0 closed, 1 half-open, 2 open)',
+        {(('provider', name),): _BREAKER_STATES.get(snap['state'], 0) for name, snap in breaker_states().items()},
+    )
+    return lines
+
+
+def _gauge(lines: List[str], name: str, help_text: str, series: Dict[Labels, float]) -> None:
+    if not series:
+        return
+    lines.append(f"# HELP {PREFIX}{name} {help_text}")
+    lines.append(f"# TYPE {PREFIX}{name} gauge")
+    for key, value in sorted(series.items()):
+        lines.append(f"{PREFIX}{name}{_labels(key)} {_num(value)}")
+
+
+def render_prometheus() -> str:
+    lines = registry.render()
+    try:
+        lines.extend(_collected_lines())
+    except Exception:
+        logger.debug("Failed to collect realtime metrics", exc_info=True)
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,448 @@
+"""Synthetic production-scale data for local benchmarks and index experiments.
+
+Used by ``manage.py seed_load_data``. Everything is written with
+``bulk_create`` in batches, so the per-row work of ``save()`` and the
+post_save signals (``create_wallets_for_new_user``,
+``grant_trial_on_user_creation``, sync change log, cache invalidation) is
+skipped; what those signals would have created (a wallet per active currency,
+a trial subscription) is bulk-created instead.
+
+The shape aims at what production looks like rather than uniform noise:
+
+* contacts follow a power law: a few users are in a large share of the
+  conversations (Zipf weights over users, exponent ``alpha``);
+* message volume per conversation is Pareto distributed;
+* timestamps are spread over the last ``days`` days, in order per conversation;
+* transactions go through the same balance math as
+  ``Transaction.create_transaction`` in global time order, so
+  ``balance_after_*`` and the final wallet balances are consistent;
+* most conversations are fully read; ``unread_ratio`` of them end with a few
+  unread messages for the recipient, and read markers match the message state;
+* a share of users own team members that are added to some of their
+  conversations; every user has a primary device with a push token.
+
+Plain text messages can be inserted by several worker processes
+(``workers``); SQLite does not take concurrent writers, so it always uses one.
+"""
+from __future__ import annotations
+
+import contextlib
+import multiprocessing
+import random
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, connections
+from django.db.models import F, Max, Q
+from django.utils import timezone
+
+from .tx_meta import backfill as tx_backfill
+
+CENT = Decimal('0.01')
+FIVE_DP = Decimal('0.00001')
+
+# (conversation_id, user_a_id, user_b_id, text_messages, unread_tail, start, end, planned_transactions)
+ConversationJob = Tuple[int, int, int, int, int, Any, Any, List[Dict[str, Any]]]
+
+
+@dataclass
+class LoadSpec:
+    users: int = 1000
+    conversations: int = 5000
+    messages: int = 1_000_000
+    transactions: int = 20_000
+    currencies: Sequence[str] = ('USD', 'TRY', 'EUR')
+    team_ratio: float = 0.05
+    unread_ratio: float = 0.2
+    alpha: float = 1.2
+    days: int = 180
+    batch_size: int = 5000
+    workers: int = 1
+    seed: int = 1
+    prefix: str = 'load'
+
+
+@contextlib.contextmanager
+def explicit_timestamps(*models):
+    """Keep the ``created_at`` values set on unsaved rows (``auto_now_add`` would overwrite them)."""
+    fields = [model._meta.get_field('created_at') for model in models]
+    saved = [field.auto_now_add for field in fields]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in zip(fields, saved):
+            field.auto_now_add = value
+
+
+def _chunks(items: Sequence, size: int) -> Iterable[Sequence]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _bulk(model, rows: List[Any], batch_size: int) -> None:
+    for chunk in _chunks(rows, batch_size):
+        model.objects.bulk_create(chunk)
+
+
+def _spread(total: int, weights: List[float]) -> List[int]:
+    """Split ``total`` proportionally to ``weights`` (largest remainders get the leftovers)."""
+    if not weights or total <= 0:
+        return [0] * len(weights)
+    norm = sum(weights)
+    exact = [total * w / norm for w in weights]
+    counts = [int(x) for x in exact]
+    leftovers = sorted(range(len(weights)), key=lambda i: exact[i] - counts[i], reverse=True)
+    for i in leftovers[:total - sum(counts)]:
+        counts[i] += 1
+    return counts
+
+
+# ---------------------------------------------------------------------------
+# Users, wallets, subscriptions, devices, team members
+# ---------------------------------------------------------------------------
+
+def _seed_users(spec: LoadSpec, rng: random.Random, now) -> List[int]:
+    User = get_user_model()
+    password = make_password('load-pass-123')
+    start = now - timedelta(days=spec.days)
+    rows = [
+        User(
+            username=f'{spec.prefix}_{i}',
+            password=password,
+            display_name=f'Load {i}',
+            date_joined=start + timedelta(seconds=rng.uniform(0, spec.days * 86400 * 0.1)),
+        )
+        for i in range(spec.users)
+    ]
+    _bulk(User, rows, spec.batch_size)
+    return list(User.objects.filter(username__startswith=f'{spec.prefix}_').order_by('id').values_list('id', flat=True))
+
+
+def _seed_currencies(spec: LoadSpec):
+    from finance.models import Currency
+    for code in spec.currencies:
+        Currency.objects.get_or_create(code=code, defaults={'name': code, 'symbol': code[:1], 'precision': 2})
+    return list(Currency.objects.filter(code__in=list(spec.currencies)).order_by('code'))
+
+
+def _seed_signal_rows(spec: LoadSpec, user_ids: List[int], now) -> None:
+    """What ``create_wallets_for_new_user`` and ``grant_trial_on_user_creation`` would have created."""
+    from finance.models import Currency, Wallet
+    from subscriptions.models import SubscriptionPlan, UserSubscription
+
+    currency_ids = list(Currency.objects.filter(is_active=True).values_list('id', flat=True))
+    _bulk(Wallet, [Wallet(user_id=uid, currency_id=cid, balance=0) for uid in user_ids for cid in currency_ids], spec.batch_size)
+    plan = SubscriptionPlan.objects.filter(code='trial').first() or SubscriptionPlan.objects.order_by('code').first()
+    if plan is None:
+        plan, _ = SubscriptionPlan.objects.get_or_create(code='trial', defaults={'name': 'Trial'})
+    _bulk(UserSubscription, [
+        UserSubscription(
+            user_id=uid, plan=plan, start_at=now - timedelta(days=1), end_at=now + timedelta(days=30),
+            status=UserSubscription.STATUS_ACTIVE, notes='Load data',
+        )
+        for uid in user_ids
+    ], spec.batch_size)
+
+
+def _seed_devices(spec: LoadSpec, user_ids: List[int], now) -> int:
+    from accounts.models import UserDevice
+    rows = [
+        UserDevice(
+            user_id=uid, status=UserDevice.Status.PRIMARY, label='Load device', platform='android',
+            push_token=f'ExponentPushToken[{spec.prefix}-{uid}]', last_seen_at=now,
+        )
+        for uid in user_ids
+    ]
+    _bulk(UserDevice, rows, spec.batch_size)
+    return len(rows)
+
+
+def _seed_team_members(spec: LoadSpec, rng: random.Random, user_ids: List[int], conversations: List[Tuple[int, int, int]]) -> Tuple[int, int]:
+    from .models import ConversationMember, TeamMember
+    owners = rng.sample(user_ids, int(len(user_ids) * spec.team_ratio))
+    if not owners:
+        return 0, 0
+    password = make_password('team-pass-123')
+    _bulk(TeamMember, [
+        TeamMember(owner_id=owner, username=f'{spec.prefix}_tm{n}', display_name=f'Team {owner}/{n}', password_hash=password)
+        for owner in owners for n in range(rng.randint(1, 3))
+    ], spec.batch_size)
+    members = list(TeamMember.objects.filter(owner_id__in=owners, username__startswith=f'{spec.prefix}_tm').values_list('id', 'owner_id'))
+    by_owner: Dict[int, List[Tuple[int, int, int]]] = {}
+    for conv in conversations:
+        by_owner.setdefault(conv[1], []).append(conv)
+        by_owner.setdefault(conv[2], []).append(conv)
+    grants = []
+    for member_id, owner_id in members:
+        convs = by_owner.get(owner_id) or []
+        for conv_id, _, _ in rng.sample(convs, min(len(convs), 3)):
+            grants.append(ConversationMember(conversation_id=conv_id, member_team_id=member_id, added_by_id=owner_id))
+    _bulk(ConversationMember, grants, spec.batch_size)
+    return len(members), len(grants)
+
+
+# ---------------------------------------------------------------------------
+# Conversations and messages
+# ---------------------------------------------------------------------------
+
+def _seed_conversations(spec: LoadSpec, rng: random.Random, user_ids: List[int], now) -> List[Tuple[int, int, int]]:
+    from .models import Conversation
+    ranked = list(user_ids)
+    rng.shuffle(ranked)
+    weights = [1.0 / ((rank + 1) ** spec.alpha) for rank in range(len(ranked))]
+    target = min(spec.conversations, len(ranked) * (len(ranked) - 1) // 2)
+    pairs = set()
+    attempts = 0
+    while len(pairs) < target and attempts < target * 50:
+        attempts += 1
+        a = rng.choices(ranked, weights)[0]
+        b = rng.choice(ranked)  # the other side is anyone: hubs talk to everybody
+        if a != b:
+            pairs.add((min(a, b), max(a, b)))
+    start = now - timedelta(days=spec.days)
+    rows = [
+        Conversation(user_a_id=a, user_b_id=b, created_at=start + timedelta(seconds=rng.uniform(0, spec.days * 86400 * 0.2)))
+        for a, b in sorted(pairs)
+    ]
+    with explicit_timestamps(Conversation):
+        _bulk(Conversation, rows, spec.batch_size)
+    return list(
+        Conversation.objects.filter(user_a__username__startswith=f'{spec.prefix}_', user_b__username__startswith=f'{spec.prefix}_')
+        .order_by('id').values_list('id', 'user_a_id', 'user_b_id')
+    )
+
+
+def _message_times(count: int, start, end) -> List[Any]:
+    step = (end - start) / (count + 1)
+    return [start + step * (n + 1) for n in range(count)]
+
+
+def _insert_messages(args: Tuple[List[ConversationJob], int, int]) -> Tuple[int, Dict[int, Tuple[Any, str]]]:
+    """Insert the history of a slice of conversations: text messages and transactions, in time order.
+
+    Runs in worker processes, so it only takes plain values and opens its own
+    connection. Returns the number of transactions and ``{conversation_id: (last_at, preview)}``.
+    """
+    from .models import Message, Transaction
+    jobs, seed, batch_size = args
+    rng = random.Random(seed)
+    last: Dict[int, Tuple[Any, str]] = {}
+    batch: List[Tuple[Message, Optional[Transaction]]] = []
+    transactions = 0
+
+    def flush():
+        Message.objects.bulk_create([message for message, _ in batch])
+        txns = []
+        for message, txn in batch:
+            if txn is not None:
+                txn.message_id = message.id
+                txns.append(txn)
+        Transaction.objects.bulk_create(txns)
+        batch.clear()
+        return len(txns)
+
+    with explicit_timestamps(Message, Transaction):
+        for conv_id, user_a_id, user_b_id, count, unread_tail, start, end, planned in jobs:
+            times = _message_times(count, start, end)
+            events = [(created, 0, n) for n, created in enumerate(times)]
+            events.extend((txn['created_at'], 1, txn) for txn in planned)
+            events.sort(key=lambda event: (event[0], event[1]))
+            for created, kind, item in events:
+                if kind == 0:
+                    # The unread tail is inbound for user_a: sent by user_b, still only delivered
+                    unread = item >= count - unread_tail
+                    sender_id = user_b_id if unread or rng.random() < 0.5 else user_a_id
+                    body = f'load message {item}'
+                    message = Message(
+                        conversation_id=conv_id, sender_id=sender_id, body=body, created_at=created,
+                        delivery_status=1 if unread else 2, delivered_at=created, read_at=None if unread else created,
+                    )
+                    batch.append((message, None))
+                else:
+                    body = item['body']
+                    message = Message(
+                        conversation_id=conv_id, sender_id=item['from_user_id'], type='transaction', body=body,
+                        created_at=created, delivery_status=2, delivered_at=created, read_at=created,
+                    )
+                    txn = Transaction(conversation_id=conv_id, **{k: v for k, v in item.items() if k != 'body'})
+                    batch.append((message, txn))
+                last[conv_id] = (created, body)
+                if len(batch) >= batch_size:
+                    transactions += flush()
+        if batch:
+            transactions += flush()
+    connection.close()
+    return transactions, last
+
+
+def _run_message_jobs(spec: LoadSpec, jobs: List[ConversationJob], progress: Callable[[str], None]) -> Tuple[int, Dict[int, Tuple[Any, str]]]:
+    slices = [(list(chunk), spec.seed + i, spec.batch_size) for i, chunk in enumerate(_chunks(jobs, max(1, len(jobs) // max(1, spec.workers * 4))))]
+    workers = spec.workers if connection.vendor != 'sqlite' else 1
+    transactions = 0
+    last: Dict[int, Tuple[Any, str]] = {}
+    if workers <= 1:
+        results = map(_insert_messages, slices)
+        executor = contextlib.nullcontext()
+    else:
+        # Forked workers must not share the parent's connection
+        connections.close_all()
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+        results = executor.map(_insert_messages, slices)
+    with executor:
+        for i, (created, slice_last) in enumerate(results, 1):
+            transactions += created
+            last.update(slice_last)
+            progress(f"messages: slice {i}/{len(slices)} ({workers} worker{'s' if workers > 1 else ''})")
+    return transactions, last
+
+
+# ---------------------------------------------------------------------------
+# Transactions and balances
+# ---------------------------------------------------------------------------
+
+def _plan_transactions(spec: LoadSpec, rng: random.Random, jobs: List[ConversationJob], weights: List[float],
+                       currencies: list) -> Dict[Tuple[int, int], Decimal]:
+    """Attach transactions to the conversation jobs, with running balances in global time order.
+
+    Each transaction lands before the conversation's unread tail, so read
+    markers can stay id-based. Returns the final ``{(user_id, currency_id): balance}``.
+    """
+    counts = _spread(spec.transactions, weights)
+    planned = []
+    for (conv_id, user_a_id, user_b_id, count, unread_tail, start, end, items), n_txn in zip(jobs, counts):
+        times = _message_times(count, start, end)
+        limit = times[count - unread_tail] if unread_tail else end
+        for _ in range(n_txn):
+            actor_id = rng.choice((user_a_id, user_b_id))
+            planned.append((
+                start + (limit - start) * rng.random(),
+                items,
+                actor_id,
+                user_b_id if actor_id == user_a_id else user_a_id,
+                rng.choice(currencies),
+                Decimal(str(rng.uniform(1, 5000))).quantize(CENT, rounding=ROUND_HALF_UP),
+                rng.choice(('lna', 'lkm')),
+            ))
+    planned.sort(key=lambda row: row[0])
+
+    # Same balance math as Transaction.create_transaction
+    balances: Dict[Tuple[int, int], Decimal] = {}
+    for created_at, items, actor_id, other_id, currency, amount, direction in planned:
+        sign = 1 if direction == 'lna' else -1
+        actor_key, other_key = (actor_id, currency.id), (other_id, currency.id)
+        balances[actor_key] = (balances.get(actor_key, Decimal('0')) + sign * amount).quantize(FIVE_DP, rounding=ROUND_HALF_UP)
+        balances[other_key] = (balances.get(other_key, Decimal('0')) - sign * amount).quantize(FIVE_DP, rounding=ROUND_HALF_UP)
+        items.append({
+            'created_at': created_at,
+            'from_user_id': actor_id,
+            'to_user_id': other_id,
+            'currency_id': currency.id,
+            'amount': amount,
+            'direction': direction,
+            'balance_after_from': balances[actor_key],
+            'balance_after_to': balances[other_key],
+            'body': f"معاملة: {'لنا' if direction == 'lna' else 'لكم'} {amount:.2f} {currency.symbol or currency.code}",
+        })
+    return balances
+
+
+def _apply_balances(spec: LoadSpec, balances: Dict[Tuple[int, int], Decimal]) -> None:
+    from finance.models import Wallet
+    wallets = list(Wallet.objects.filter(
+        user_id__in={user_id for user_id, _ in balances},
+        currency_id__in={currency_id for _, currency_id in balances},
+    ))
+    for wallet in wallets:
+        wallet.balance = balances.get((wallet.user_id, wallet.currency_id), wallet.balance)
+    Wallet.objects.bulk_update(wallets, ['balance'], batch_size=spec.batch_size)
+
+
+# ---------------------------------------------------------------------------
+# Read markers and conversation summaries
+# ---------------------------------------------------------------------------
+
+def _seed_read_markers(spec: LoadSpec, conversations: List[Tuple[int, int, int]]) -> int:
+    """Each side's marker is its newest message, or the newest inbound message it has read."""
+    from .models import ConversationReadMarker, Message
+    rows = []
+    for chunk in _chunks(conversations, spec.batch_size):
+        sides = {conv_id: (user_a_id, user_b_id) for conv_id, user_a_id, user_b_id in chunk}
+        read_by = (
+            Message.objects.filter(conversation_id__in=list(sides)).order_by().values('conversation_id')
+            .annotate(
+                a=Max('id', filter=Q(sender_id=F('conversation__user_a_id')) | Q(read_at__isnull=False)),
+                b=Max('id', filter=Q(sender_id=F('conversation__user_b_id')) | Q(read_at__isnull=False)),
+            )
+        )
+        for row in read_by:
+            user_a_id, user_b_id = sides[row['conversation_id']]
+            for user_id, last_read in ((user_a_id, row['a']), (user_b_id, row['b'])):
+                if last_read:
+                    rows.append(ConversationReadMarker(conversation_id=row['conversation_id'], user_id=user_id, last_read_message_id=last_read))
+    _bulk(ConversationReadMarker, rows, spec.batch_size)
+    return len(rows)
+
+
+def _update_conversation_summaries(spec: LoadSpec, last: Dict[int, Tuple[Any, str]]) -> None:
+    from .models import Conversation
+    rows = []
+    for conv_id, (last_at, preview) in last.items():
+        rows.append(Conversation(id=conv_id, last_message_at=last_at, last_activity_at=last_at, last_message_preview=preview[:120]))
+    Conversation.objects.bulk_update(rows, ['last_message_at', 'last_activity_at', 'last_message_preview'], batch_size=spec.batch_size)
+
+
+# ---------------------------------------------------------------------------
+# Entry point
+# ---------------------------------------------------------------------------
+
+def generate(spec: LoadSpec, progress: Optional[Callable[[str], None]] = None) -> Dict[str, int]:
+    """Create the whole data set; returns row counts per kind."""
+    progress = progress or (lambda message: None)
+    rng = random.Random(spec.seed)
+    now = timezone.now()
+
+    currencies = _seed_currencies(spec)
+    user_ids = _seed_users(spec, rng, now)
+    _seed_signal_rows(spec, user_ids, now)
+    devices = _seed_devices(spec, user_ids, now)
+    progress(f"users: {len(user_ids)}")
+
+    conversations = _seed_conversations(spec, rng, user_ids, now)
+    team_members, team_grants = _seed_team_members(spec, rng, user_ids, conversations)
+    progress(f"conversations: {len(conversations)} team members: {team_members}")
+
+    weights = [rng.paretovariate(spec.alpha) for _ in conversations]
+    counts = _spread(spec.messages, weights)
+    end = now - timedelta(minutes=5)
+    jobs: List[ConversationJob] = []
+    for (conv_id, user_a_id, user_b_id), count in zip(conversations, counts):
+        unread_tail = min(count, rng.randint(1, 5)) if rng.random() < spec.unread_ratio else 0
+        start = now - timedelta(seconds=rng.uniform(0.2, 1.0) * spec.days * 86400)
+        jobs.append((conv_id, user_a_id, user_b_id, count, unread_tail, start, end, []))
+    balances = _plan_transactions(spec, rng, jobs, weights, currencies)
+    transactions, last = _run_message_jobs(spec, jobs, progress)
+    _apply_balances(spec, balances)
+    # Transaction ids only exist after the insert; fill Message.tx_meta the way the backfill does
+    tx_backfill(batch_size=spec.batch_size)
+    progress(f"transactions: {transactions}")
+    _update_conversation_summaries(spec, last)
+    markers = _seed_read_markers(spec, conversations)
+    progress(f"read markers: {markers}")
+
+    return {
+        'users': len(user_ids),
+        'conversations': len(conversations),
+        'messages': sum(counts),
+        'transactions': transactions,
+        'read_markers': markers,
+        'devices': devices,
+        'team_members': team_members,
+        'team_grants': team_grants,
+    }
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from communications.tx_meta import backfill
+
+
+class Command(BaseCommand):
+    help = "Fill Message.tx_meta on transaction messages from their Transaction row (or the body for legacy rows)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=1000, help='Messages per batch')
+        parser.add_argument('--rebuild', action='store_true', help='Rewrite rows that already have tx_meta')
+        parser.add_argument('--dry-run', action='store_true', help='Do not write updates, just report counts')
+
+    def handle(self, *args, **options):
+        counts = backfill(
+            batch_size=max(1, options.get('batch') or 1000),
+            rebuild=options.get('rebuild'),
+            dry_run=options.get('dry_run'),
+        )
+        prefix = '[DRY] ' if options.get('dry_run') else ''
+        summary = ' '.join(f"{name}={value}" for name, value in counts.items())
+        self.stdout.write(f"{prefix}Summary: {summary}")
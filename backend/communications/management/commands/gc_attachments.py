@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from communications.attachment_gc import COUNTS, run_gc
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete message attachment files no message references any more. Each run checks a slice of the "
+        "attachment index, scans a few storage directories for unindexed files and deletes files orphaned "
+        "for longer than the grace period; cursors carry over to the next run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be flagged and deleted without changing anything')
+        parser.add_argument('--grace-hours', type=float, default=None, help='Keep orphans this long before deleting (default: ATTACHMENT_GC_GRACE_HOURS)')
+        parser.add_argument('--batch-size', type=int, default=None, help='Rows per query batch (default: ATTACHMENT_GC_BATCH_SIZE)')
+        parser.add_argument('--max-rows', type=int, default=None, help='Max index rows checked and files deleted in this run (default: 20 batches)')
+        parser.add_argument('--dirs', type=int, default=2, help='Storage directories scanned for unindexed files in this run')
+
+    def handle(self, *args, **options):
+        grace = None if options['grace_hours'] is None else timedelta(hours=max(0.0, options['grace_hours']))
+        sweep = run_gc(
+            dry_run=options['dry_run'],
+            grace=grace,
+            size=options['batch_size'],
+            max_rows=options['max_rows'],
+            dirs=max(1, options['dirs']),
+        )
+        prefix = '[DRY] ' if options['dry_run'] else ''
+        self.stdout.write(f"{prefix}next mark_cursor={sweep.mark_cursor} scan_cursor={sweep.scan_cursor or '-'}")
+        summary = ' '.join(f"{name}={sweep.counts.get(name, 0)}" for name in COUNTS)
+        self.stdout.write(f"{prefix}Summary: {summary}")
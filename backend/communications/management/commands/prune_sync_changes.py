@@ -0,0 +1,36 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from communications.models import SyncChange
+
+
+class Command(BaseCommand):
+    help = "Delete delta sync change log rows older than the retention window."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='Retention in days (default: SYNC_CHANGELOG_RETENTION_DAYS)')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many rows would be deleted')
+        parser.add_argument('--batch', type=int, default=5000, help='Rows deleted per statement')
+
+    def handle(self, *args, **options):
+        days = options.get('days')
+        if days is None:
+            days = getattr(settings, 'SYNC_CHANGELOG_RETENTION_DAYS', 14)
+        dry = options.get('dry_run')
+        batch = options.get('batch') or 5000
+        cutoff = timezone.now() - timedelta(days=days)
+        qs = SyncChange.objects.filter(created_at__lt=cutoff)
+        if dry:
+            self.stdout.write(f"[DRY] would delete {qs.count()} sync changes older than {cutoff.isoformat()}")
+            return
+        total = 0
+        while True:
+            ids = list(qs.order_by('id').values_list('id', flat=True)[:batch])
+            if not ids:
+                break
+            deleted, _ = SyncChange.objects.filter(id__in=ids).delete()
+            total += deleted
+        self.stdout.write(f"Summary: deleted={total} cutoff={cutoff.isoformat()}")
@@ -6,7 +6,10 @@ from communications.models import ConversationReadMarker, Message
 
 
 class Command(BaseCommand):
-    help = "Reconcile Message.read_at / delivery_status from ConversationReadMarker ground truth."
+    help = (
+        "Materialize Message.read_at / delivery_status from ConversationReadMarker ground truth. "
+        "Reads only move the markers and the API derives ticks from them; run this when a copy on the rows is needed."
+    )
 
     def add_arguments(self, parser):
         parser.add_argument('--conversation', type=int, help='Limit to a single conversation id')
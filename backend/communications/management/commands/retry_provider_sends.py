@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from communications.models import ProviderRetry
+from communications.providers import replay, retry_backoff
+
+
+class Command(BaseCommand):
+    help = "Replay push/realtime provider sends queued while a provider was failing or its circuit was open."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many sends are due')
+        parser.add_argument('--batch', type=int, default=200, help='Max queued sends processed in this run')
+        parser.add_argument('--max-attempts', type=int, default=None, help='Drop a send after this many failed replays (default: PROVIDER_RETRY_MAX_ATTEMPTS)')
+
+    def handle(self, *args, **options):
+        max_attempts = options.get('max_attempts')
+        if max_attempts is None:
+            max_attempts = getattr(settings, 'PROVIDER_RETRY_MAX_ATTEMPTS', 5)
+        batch = options.get('batch') or 200
+        now = timezone.now()
+        due = ProviderRetry.objects.filter(next_attempt_at__lte=now).order_by('next_attempt_at', 'id')
+        if options.get('dry_run'):
+            self.stdout.write(f"[DRY] {due.count()} queued sends due")
+            return
+        sent = failed = dropped = 0
+        for entry in list(due[:batch]):
+            try:
+                replay(entry)
+            except Exception as exc:
+                entry.attempts += 1
+                entry.last_error = f"{type(exc).__name__}: {exc}"[:2000]
+                if entry.attempts >= max_attempts:
+                    entry.delete()
+                    dropped += 1
+                    continue
+                entry.next_attempt_at = timezone.now() + retry_backoff(entry.attempts)
+                entry.save(update_fields=['attempts', 'last_error', 'next_attempt_at'])
+                failed += 1
+                continue
+            entry.delete()
+            sent += 1
+        self.stdout.write(f"Summary: sent={sent} failed={failed} dropped={dropped}")
@@ -0,0 +1,87 @@
+import contextlib
+import io
+import json
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from communications.benchmarks import SCENARIOS, Scale, compare, run_suite
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark send/messages/read/transaction/inbox and the WS send-ack-read loop on a throwaway "
+        "database (the test database of the configured DATABASES: SQLite by default, Postgres when "
+        "DATABASE_URL is set). Push providers are stubbed. Writes a JSON report; --compare flags regressions."
+    )
+
+    def add_arguments(self, parser):
+        defaults = Scale()
+        parser.add_argument('--users', type=int, default=defaults.users)
+        parser.add_argument('--conversations', type=int, default=defaults.conversations)
+        parser.add_argument('--messages', type=int, default=defaults.messages, help='History size per conversation')
+        parser.add_argument('--iterations', type=int, default=defaults.iterations, help='Timed requests per HTTP scenario')
+        parser.add_argument('--ws-clients', type=int, default=defaults.ws_clients, help='Concurrent conversation pairs in the WS loop')
+        parser.add_argument('--ws-rounds', type=int, default=defaults.ws_rounds, help='send/ack/read rounds per WS pair')
+        parser.add_argument('--seed', type=int, default=defaults.seed)
+        parser.add_argument('--only', default='', help=f"Comma separated subset of: {', '.join(SCENARIOS)}")
+        parser.add_argument('--output', default='', help='Write the JSON report here (default: print it)')
+        parser.add_argument('--compare', default='', help='Baseline JSON report to compare against')
+        parser.add_argument('--tolerance', type=float, default=0.5, help='Allowed p50 slowdown vs baseline (0.5 = +50%%)')
+        parser.add_argument('--fail-on-regression', action='store_true', help='Exit non-zero when --compare finds regressions')
+
+    def handle(self, *args, **options):
+        scale = Scale(
+            users=options['users'],
+            conversations=options['conversations'],
+            messages=options['messages'],
+            iterations=options['iterations'],
+            ws_clients=options['ws_clients'],
+            ws_rounds=options['ws_rounds'],
+            seed=options['seed'],
+        )
+        scenarios = [s.strip() for s in (options.get('only') or '').split(',') if s.strip()] or None
+        baseline = None
+        if options.get('compare'):
+            with open(options['compare'], encoding='utf-8') as fh:
+                baseline = json.load(fh)
+
+        report = self._run(scale, scenarios)
+        text = json.dumps(report, indent=2, ensure_ascii=False)
+        if options.get('output'):
+            with open(options['output'], 'w', encoding='utf-8') as fh:
+                fh.write(text + '\n')
+            self.stdout.write(f"Report written to {options['output']}")
+        else:
+            self.stdout.write(text)
+
+        if baseline is None:
+            return
+        rows = compare(report, baseline, tolerance=options['tolerance'])
+        regressions = [r for r in rows if r['regression']]
+        for r in rows:
+            mark = 'REGRESSION ' + r['regression'] if r['regression'] else 'ok'
+            self.stdout.write(
+                f"{r['name']:<22} p50 {r['p50_ms']:>9.3f}ms (baseline {r['baseline_p50_ms']:.3f}) "
+                f"queries {r['queries_per_op']} (baseline {r['baseline_queries_per_op']})  {mark}"
+            )
+        self.stdout.write(f"Summary: compared={len(rows)} regressions={len(regressions)}")
+        if regressions and options.get('fail_on_regression'):
+            raise CommandError(f"{len(regressions)} benchmark regression(s)")
+
+    def _run(self, scale, scenarios):
+        from django.test.runner import DiscoverRunner
+        from django.test.utils import setup_test_environment, teardown_test_environment
+
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        setup_test_environment()
+        old_config = runner.setup_databases()
+        # Consumers print connect/disconnect lines and push logs warn about missing tokens; keep the report readable
+        logging.disable(logging.WARNING)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                return run_suite(scale, scenarios, progress=lambda name: self.stderr.write(f"running {name}..."))
+        finally:
+            logging.disable(logging.NOTSET)
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
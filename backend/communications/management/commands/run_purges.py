@@ -0,0 +1,42 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from communications.models import ConversationPurge
+from communications.purge import run_purge
+
+
+class Command(BaseCommand):
+    help = "Run conversation clear/delete purge jobs that are pending, failed, or stalled in 'running'."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only list the jobs that would run')
+        parser.add_argument('--batch-size', type=int, default=None, help='Rows per delete batch (default: PURGE_BATCH_SIZE)')
+        parser.add_argument('--stale-minutes', type=int, default=30, help="Take over 'running' jobs with no progress for this long")
+        parser.add_argument('--limit', type=int, default=100, help='Max jobs processed in this run')
+
+    def handle(self, *args, **options):
+        stale_after = timedelta(minutes=max(0, options['stale_minutes']))
+        jobs = list(
+            ConversationPurge.objects.exclude(status=ConversationPurge.STATUS_DONE)
+            .order_by('created_at', 'id')
+            .values_list('id', 'kind', 'conversation_id', 'status')[:max(1, options['limit'])]
+        )
+        if options['dry_run']:
+            for job_id, kind, conversation_id, status in jobs:
+                self.stdout.write(f"[DRY] purge={job_id} kind={kind} conv={conversation_id} status={status}")
+            self.stdout.write(f"[DRY] Summary: jobs={len(jobs)}")
+            return
+        done = failed = skipped = 0
+        for job_id, _, _, _ in jobs:
+            job = run_purge(job_id, size=options['batch_size'], stale_after=stale_after)
+            if job is None:
+                skipped += 1
+            elif job.status == ConversationPurge.STATUS_DONE:
+                done += 1
+                removed = ' '.join(f"{name}={count}" for name, count in job.progress.items())
+                self.stdout.write(f"purge={job.id} kind={job.kind} conv={job.conversation_id} {removed}".rstrip())
+            else:
+                failed += 1
+                self.stderr.write(f"purge={job.id} failed: {job.last_error}")
+        self.stdout.write(f"Summary: done={done} failed={failed} skipped={skipped}")
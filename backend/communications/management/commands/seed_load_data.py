@@ -0,0 +1,59 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from communications.load_data import LoadSpec, generate
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-create a synthetic production-scale data set (users, power-law conversations, messages, "
+        "transactions with consistent wallet balances, read markers, devices, team members) in the "
+        "configured database. Intended for local benchmarks and index experiments."
+    )
+
+    def add_arguments(self, parser):
+        defaults = LoadSpec()
+        parser.add_argument('--users', type=int, default=defaults.users)
+        parser.add_argument('--conversations', type=int, default=defaults.conversations)
+        parser.add_argument('--messages', type=int, default=defaults.messages, help='Total text messages across all conversations')
+        parser.add_argument('--transactions', type=int, default=defaults.transactions)
+        parser.add_argument('--currencies', default=','.join(defaults.currencies), help='Comma separated currency codes (created if missing)')
+        parser.add_argument('--team-ratio', type=float, default=defaults.team_ratio, help='Share of users that own team members')
+        parser.add_argument('--unread-ratio', type=float, default=defaults.unread_ratio, help='Share of conversations ending with unread messages')
+        parser.add_argument('--alpha', type=float, default=defaults.alpha, help='Power-law exponent for contacts and message volume')
+        parser.add_argument('--days', type=int, default=defaults.days, help='History spread in days')
+        parser.add_argument('--batch-size', type=int, default=defaults.batch_size)
+        parser.add_argument('--workers', type=int, default=defaults.workers, help='Processes inserting messages (ignored on SQLite)')
+        parser.add_argument('--seed', type=int, default=defaults.seed)
+        parser.add_argument('--prefix', default=defaults.prefix, help='Username prefix of the generated users')
+        parser.add_argument('--force', action='store_true', help='Allow running with DEBUG off')
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError("Refusing to generate load data with DEBUG off; pass --force if this database is disposable")
+        prefix = options['prefix']
+        if get_user_model().objects.filter(username__startswith=f'{prefix}_').exists():
+            raise CommandError(f"Users with prefix '{prefix}_' already exist; pick another --prefix")
+        spec = LoadSpec(
+            users=options['users'],
+            conversations=options['conversations'],
+            messages=options['messages'],
+            transactions=options['transactions'],
+            currencies=tuple(c.strip().upper() for c in options['currencies'].split(',') if c.strip()),
+            team_ratio=options['team_ratio'],
+            unread_ratio=options['unread_ratio'],
+            alpha=options['alpha'],
+            days=options['days'],
+            batch_size=max(1, options['batch_size']),
+            workers=max(1, options['workers']),
+            seed=options['seed'],
+            prefix=prefix,
+        )
+        started = time.monotonic()
+        counts = generate(spec, progress=lambda line: self.stderr.write(line))
+        elapsed = time.monotonic() - started
+        summary = ' '.join(f"{name}={value}" for name, value in counts.items())
+        self.stdout.write(f"Summary: {summary} elapsed={elapsed:.1f}s")
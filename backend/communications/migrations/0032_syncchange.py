@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-19 06:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('communications', '0031_customemoji'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('conversation_id', models.BigIntegerField()),
+                ('kind', models.CharField(choices=[('message', 'Message'), ('read', 'Read marker'), ('cleared', 'Cleared'), ('deleted', 'Deleted')], max_length=16)),
+                ('message_id', models.BigIntegerField(blank=True, null=True)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sync_changes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['conversation_id', 'id'], name='communicati_convers_99537c_idx'), models.Index(fields=['user', 'id'], name='communicati_user_id_82044e_idx'), models.Index(fields=['created_at'], name='communicati_created_35496e_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations, models
+
+
+def backfill_tx_meta(apps, schema_editor):
+    from communications.tx_meta import backfill
+    backfill(apps.get_model('communications', 'Message'), apps.get_model('communications', 'Transaction'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('communications', '0033_provider_retry_circuit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='tx_meta',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_tx_meta, migrations.RunPython.noop),
+    ]
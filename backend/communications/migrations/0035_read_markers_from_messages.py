@@ -0,0 +1,59 @@
+from django.db import migrations, models
+
+
+def lift_markers(apps, schema_editor):
+    """Raise read markers to the newest message each reader had marked read.
+
+    Reads now only move markers, and the API derives ticks from them, so
+    per-message read state written before that must be reflected in the
+    markers: for every (conversation, sender) the newest read message moves
+    the other participant's marker up to it.
+    """
+    Conversation = apps.get_model('communications', 'Conversation')
+    Message = apps.get_model('communications', 'Message')
+    Marker = apps.get_model('communications', 'ConversationReadMarker')
+    rows = (Message.objects
+            .filter(models.Q(delivery_status__gte=2) | models.Q(read_at__isnull=False))
+            .order_by()
+            .values('conversation_id', 'sender_id')
+            .annotate(last=models.Max('id')))
+    wanted = {}
+    for row in rows.iterator():
+        wanted.setdefault(row['conversation_id'], []).append((row['sender_id'], row['last']))
+    conv_ids = list(wanted)
+    for start in range(0, len(conv_ids), 1000):
+        chunk = conv_ids[start:start + 1000]
+        parties = {c['id']: (c['user_a_id'], c['user_b_id']) for c in Conversation.objects.filter(id__in=chunk).values('id', 'user_a_id', 'user_b_id')}
+        targets = {}
+        for conv_id in chunk:
+            if conv_id not in parties:
+                continue
+            user_a_id, user_b_id = parties[conv_id]
+            for sender_id, last in wanted[conv_id]:
+                if sender_id not in (user_a_id, user_b_id):
+                    continue
+                reader_id = user_b_id if sender_id == user_a_id else user_a_id
+                key = (conv_id, reader_id)
+                targets[key] = max(targets.get(key, 0), last)
+        existing = {(m.conversation_id, m.user_id): m for m in Marker.objects.filter(conversation_id__in=chunk)}
+        to_create, to_update = [], []
+        for key, last in targets.items():
+            marker = existing.get(key)
+            if marker is None:
+                to_create.append(Marker(conversation_id=key[0], user_id=key[1], last_read_message_id=last))
+            elif (marker.last_read_message_id or 0) < last:
+                marker.last_read_message_id = last
+                to_update.append(marker)
+        Marker.objects.bulk_create(to_create, batch_size=500)
+        Marker.objects.bulk_update(to_update, ['last_read_message_id'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('communications', '0034_message_tx_meta'),
+    ]
+
+    operations = [
+        migrations.RunPython(lift_markers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def index_attachments(apps, schema_editor):
+    from communications.attachment_gc import index_existing
+    index_existing(apps.get_model('communications', 'Message'), apps.get_model('communications', 'AttachmentFile'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('communications', '0036_conversation_purge'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttachmentSweep',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dry_run', models.BooleanField(default=False)),
+                ('mark_cursor', models.BigIntegerField(default=0)),
+                ('scan_cursor', models.CharField(blank=True, max_length=255)),
+                ('counts', models.JSONField(blank=True, default=dict)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-id'],
+            },
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='attachment',
+            field=models.FileField(blank=True, null=True, upload_to='attachments/%Y/%m/'),
+        ),
+        migrations.CreateModel(
+            name='AttachmentFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255, unique=True)),
+                ('size', models.BigIntegerField(default=0)),
+                ('message_id', models.BigIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('orphaned_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['message_id'], name='communicati_message_dffecd_idx'), models.Index(fields=['orphaned_at'], name='communicati_orphane_340da4_idx')],
+            },
+        ),
+        migrations.RunPython(index_attachments, migrations.RunPython.noop),
+    ]
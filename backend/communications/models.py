@@ -1,6 +1,7 @@
 from __future__ import annotations
 from django.db import models, transaction
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
 from finance.models import Currency, Wallet
 from decimal import Decimal, ROUND_HALF_UP, InvalidOperation
@@ -318,6 +319,10 @@ class Conversation(models.Model):
     # طلب حذف يحتاج موافقة الطرف الآخر
     delete_requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='conversations_delete_requested')
     delete_requested_at = models.DateTimeField(null=True, blank=True)
+    # Tombstones written in the request while a ConversationPurge removes the rows (communications.purge):
+    # a deleted conversation is hidden everywhere, a cleared one hides messages up to this id
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    cleared_up_to_id = models.BigIntegerField(default=0)
 
     class Meta:
         unique_together = ("user_a", "user_b")
@@ -331,9 +336,11 @@ class Conversation(models.Model):
 class ConversationReadMarker(models.Model):
     """Persist the last read message id per (conversation,user).
 
-    This gives an idempotent, monotonic source of truth so that even if some
-    individual Message.read_at updates were skipped (race / disconnect), the
-    frontend can still render blue ticks permanently (never regress).
+    This is the read state: a read moves one marker row forward (``advance``)
+    and never touches Message rows. Ticks and ``read_at`` in API payloads are
+    derived from the markers at serialization time (``for_conversations``);
+    ``manage.py reconcile_read_markers`` writes them onto the messages when a
+    materialized copy is needed.
     """
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='read_markers')
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_read_markers')
@@ -351,6 +358,50 @@ class ConversationReadMarker(models.Model):
     def __str__(self):  # pragma: no cover
         return f"ReadMarker(conv={self.conversation_id}, user={self.user_id}, last={self.last_read_message_id})"
 
+    @classmethod
+    def advance(cls, conversation_id: int, user_id: int, message_id) -> int | None:
+        """Move the marker forward to ``message_id``; it never moves back.
+
+        Returns the previous position when the marker moved (0 for a new
+        marker), ``None`` when it was already at or past ``message_id``.
+        """
+        from django.db import IntegrityError
+        try:
+            message_id = int(message_id or 0)
+        except (TypeError, ValueError):
+            return None
+        if message_id <= 0:
+            return None
+        markers = cls.objects.filter(conversation_id=conversation_id, user_id=user_id)
+        previous = markers.values_list('last_read_message_id', flat=True).first()
+        if previous is None:
+            try:
+                with transaction.atomic():
+                    cls.objects.create(conversation_id=conversation_id, user_id=user_id, last_read_message_id=message_id)
+                return 0
+            except IntegrityError:
+                previous = 0  # created concurrently; the conditional update below settles it
+        if previous >= message_id:
+            return None
+        moved = markers.filter(last_read_message_id__lt=message_id).update(last_read_message_id=message_id, updated_at=timezone.now())
+        if not moved:
+            return None
+        # .update() skips post_save, so record the delta-sync change here
+        SyncChange.record(conversation_id, SyncChange.KIND_READ, message_id=message_id, payload={'reader_id': user_id})
+        return previous
+
+    @classmethod
+    def for_conversations(cls, conversation_ids) -> dict[int, dict[int, tuple[int, object]]]:
+        """``{conversation_id: {user_id: (last_read_message_id, updated_at)}}`` in one query."""
+        out: dict[int, dict[int, tuple[int, object]]] = {}
+        ids = [cid for cid in conversation_ids if cid]
+        if not ids:
+            return out
+        rows = cls.objects.filter(conversation_id__in=ids).values_list('conversation_id', 'user_id', 'last_read_message_id', 'updated_at')
+        for conversation_id, user_id, last_id, updated_at in rows:
+            out.setdefault(conversation_id, {})[user_id] = (int(last_id or 0), updated_at)
+        return out
+
 class ConversationMute(models.Model):
     """Per-user mute state for a conversation.
 
@@ -383,8 +434,8 @@ class Message(models.Model):
     type = models.CharField(max_length=16, choices=TYPE_CHOICES, default='text')
     body = models.TextField(blank=True)
     client_id = models.CharField(max_length=64, blank=True, null=True, db_index=True)
-    # Optional attachment (image or PDF)
-    attachment = models.FileField(upload_to='attachments/', null=True, blank=True)
+    # Optional attachment (image or PDF); month directories keep each GC scan unit small
+    attachment = models.FileField(upload_to='attachments/%Y/%m/', null=True, blank=True)
     attachment_name = models.CharField(max_length=255, blank=True)
     attachment_mime = models.CharField(max_length=100, blank=True)
     attachment_size = models.PositiveIntegerField(null=True, blank=True)
@@ -393,6 +444,8 @@ class Message(models.Model):
     delivery_status = models.PositiveSmallIntegerField(default=1)
     delivered_at = models.DateTimeField(null=True, blank=True)
     read_at = models.DateTimeField(null=True, blank=True)
+    # Serialized ``tx`` payload of transaction messages (see communications.tx_meta)
+    tx_meta = models.JSONField(null=True, blank=True)
 
     class Meta:
         ordering = ['-created_at']
@@ -582,107 +635,52 @@ class Transaction(models.Model):
             )
 
             display_amount = format_display_amount(amount)
+            tx_payload = txn.build_message_meta()
             # Create a chat message reflecting the transaction
             chat_message = Message.objects.create(
                 conversation=conversation,
                 sender=actor,
                 sender_team_member=sender_team_member,
                 type='transaction',
-                body=f"معاملة: {( 'لنا' if direction=='lna' else 'لكم')} {display_amount} {currency.symbol or currency.code}{(' - ' + note) if note else ''}".strip()
+                body=f"معاملة: {( 'لنا' if direction=='lna' else 'لكم')} {display_amount} {currency.symbol or currency.code}{(' - ' + note) if note else ''}".strip(),
+                tx_meta=tx_payload,
             )
 
             if not txn.message_id:
                 txn.message = chat_message
                 txn.save(update_fields=["message"])
 
-            tx_payload = txn.build_message_meta()
-
             # Compute display for realtime (prefer team member if present)
             sender_display = (sender_team_member.display_name or sender_team_member.username) if sender_team_member else (getattr(actor, 'display_name', '') or actor.username)
 
-            # Optional realtime broadcast via Channels
-            try:
-                from channels.layers import get_channel_layer
-                from asgiref.sync import async_to_sync
-                channel_layer = get_channel_layer()
-                if channel_layer is not None:
-                    group = f"conv_{conversation.id}"
-                    preview_body = f"معاملة: {( 'لنا' if direction=='lna' else 'لكم')} {display_amount} {currency.symbol or currency.code}{(' - ' + note) if note else ''}".strip()
-                    delivered_at = chat_message.delivered_at.isoformat() if chat_message.delivered_at else None
-                    read_at = chat_message.read_at.isoformat() if chat_message.read_at else None
-                    async_to_sync(channel_layer.group_send)(group, {
-                        'type': 'broadcast.message',
-                        'data': {
-                            'type': 'chat.message',
-                            'conversation_id': conversation.id,
-                            'id': chat_message.id,
-                            'message_id': chat_message.id,
-                            'seq': chat_message.id,
-                            'sender': actor.username,
-                            'senderDisplay': sender_display,
-                            'body': preview_body,
-                            'created_at': chat_message.created_at.isoformat(),
-                            'kind': 'transaction',
-                            'tx': tx_payload,
-                            'delivery_status': chat_message.delivery_status,
-                            'status': 'delivered' if (chat_message.delivery_status or 0) >= 1 else 'sent',
-                            'delivered_at': delivered_at,
-                            'read_at': read_at,
-                        }
-                    })
-                    from .models import get_conversation_viewer_ids  # local import
-                    last_msg_iso = chat_message.created_at.isoformat()
-                    from .push import _total_unread_for_user  # local import to avoid circular reference
-                    for uid in get_conversation_viewer_ids(conversation):
-                        if uid == actor.id:
-                            continue
-                        unread_total = _total_unread_for_user(uid)
-                        async_to_sync(channel_layer.group_send)(f"user_{uid}", {
-                            'type': 'broadcast.message',
-                            'data': {
-                                'type': 'inbox.update',
-                                'conversation_id': conversation.id,
-                                'last_message_preview': preview_body[:80],
-                                'last_message_at': last_msg_iso,
-                                'unread_count': unread_total,
-                            }
-                        })
-            except Exception:
-                # Don't fail transaction due to optional broadcasting
-                pass
+            preview_body = chat_message.body
 
-            # Pusher fallback (optional)
-            try:
-                from .pusher_client import pusher_client
-                if pusher_client:
-                    preview_body = f"معاملة: {( 'لنا' if direction=='lna' else 'لكم')} {display_amount} {currency.symbol or currency.code}{(' - ' + note) if note else ''}".strip()
-                    pusher_client.trigger(f"chat_{conversation.id}", 'message', {
-                        'username': actor.username,
-                        'display_name': sender_display,
-                        'senderDisplay': sender_display,
-                        'message': preview_body,
-                        'conversation_id': conversation.id,
-                        'id': chat_message.id,
-                        'message_id': chat_message.id,
-                        'tx': tx_payload,
-                        'seq': chat_message.id,
-                        'delivered_at': chat_message.delivered_at.isoformat() if chat_message.delivered_at else None,
-                        'read_at': chat_message.read_at.isoformat() if chat_message.read_at else None,
-                    })
-                    from .models import get_conversation_viewer_ids  # local import
-                    last_msg_iso = chat_message.created_at.isoformat()
-                    for uid in get_conversation_viewer_ids(conversation):
-                        if uid == actor.id:
-                            continue
-                        pusher_client.trigger(f"user_{uid}", 'notify', {
-                            'type': 'transaction',
-                            'conversation_id': conversation.id,
-                            'from': getattr(actor, 'display_name', '') or actor.username,
-                            'preview': preview_body[:80],
-                            'last_message_at': last_msg_iso,
-                        })
-            except Exception:
-                pass
+            def fan_out(message, *, body, kind, notify_type, notify_from, **extra):
+                # Realtime fan-out (Channels + Pusher); optional, never fails the transaction
+                try:
+                    from .push import _total_unread_by_user  # local import to avoid circular reference
+                    from .realtime import get_dispatcher, message_event, new_message_entries, notify_event
+                    viewer_ids = [uid for uid in get_conversation_viewer_ids(conversation) if uid != actor.id]
+                    get_dispatcher().publish_many(new_message_entries(
+                        conversation.id,
+                        message_event(message, sender=actor, sender_display=sender_display, body=body, kind=kind, **extra),
+                        viewer_unread=_total_unread_by_user(viewer_ids),
+                        preview=body,
+                        last_message_at=message.created_at,
+                        notify=notify_event(notify_type, conversation.id, notify_from, body, message.created_at),
+                    ))
+                except Exception:
+                    import logging
+                    logging.getLogger(__name__).exception("Realtime fan-out failed", extra={"conversation_id": conversation.id, "message_id": message.id})
+
+            fan_out(
+                chat_message,
+                body=preview_body,
+                kind='transaction',
+                notify_type='transaction',
+                notify_from=getattr(actor, 'display_name', '') or actor.username,
+                tx=tx_payload,
+            )
 
             settlement_msg = None
             settlement_time = None
@@ -702,77 +700,15 @@ class Transaction(models.Model):
                     settled_at=settlement_time
                 )
 
-                try:
-                    from channels.layers import get_channel_layer
-                    from asgiref.sync import async_to_sync
-                    channel_layer = get_channel_layer()
-                    if channel_layer is not None:
-                        group = f"conv_{conversation.id}"
-                        payload = {
-                            'type': 'chat.message',
-                            'conversation_id': conversation.id,
-                            'id': settlement_msg.id,
-                            'message_id': settlement_msg.id,
-                            'seq': settlement_msg.id,
-                            'sender': actor.username,
-                            'senderDisplay': sender_display,
-                            'body': settlement_msg.body,
-                            'created_at': settlement_msg.created_at.isoformat(),
-                            'kind': 'system',
-                            'systemSubtype': 'wallet_settled',
-                            'settled_at': settlement_time.isoformat(),
-                        }
-                        async_to_sync(channel_layer.group_send)(group, {'type': 'broadcast.message', 'data': payload})
-                        from .models import get_conversation_viewer_ids  # local import
-                        last_msg_iso = settlement_msg.created_at.isoformat()
-                        from .push import _total_unread_for_user  # local import to avoid circular reference
-                        for uid in get_conversation_viewer_ids(conversation):
-                            if uid == actor.id:
-                                continue
-                            unread_total = _total_unread_for_user(uid)
-                            async_to_sync(channel_layer.group_send)(f"user_{uid}", {
-                                'type': 'broadcast.message',
-                                'data': {
-                                    'type': 'inbox.update',
-                                    'conversation_id': conversation.id,
-                                    'last_message_preview': settlement_msg.body[:80],
-                                    'last_message_at': last_msg_iso,
-                                    'unread_count': unread_total,
-                                }
-                            })
-                except Exception:
-                    pass
-
-                try:
-                    from .pusher_client import pusher_client
-                    if pusher_client:
-                        pusher_client.trigger(f"chat_{conversation.id}", 'message', {
-                            'username': actor.username,
-                            'display_name': sender_display,
-                            'senderDisplay': sender_display,
-                            'message': settlement_msg.body,
-                            'conversation_id': conversation.id,
-                            'id': settlement_msg.id,
-                            'message_id': settlement_msg.id,
-                            'seq': settlement_msg.id,
-                            'kind': 'system',
-                            'systemSubtype': 'wallet_settled',
-                            'settled_at': settlement_time.isoformat(),
-                        })
-                        from .models import get_conversation_viewer_ids  # local import
-                        last_msg_iso = settlement_msg.created_at.isoformat()
-                        for uid in get_conversation_viewer_ids(conversation):
-                            if uid == actor.id:
-                                continue
-                            pusher_client.trigger(f"user_{uid}", 'notify', {
-                                'type': 'system',
-                                'conversation_id': conversation.id,
-                                'from': sender_display,
-                                'preview': settlement_msg.body[:80],
-                                'last_message_at': last_msg_iso,
-                            })
-                except Exception:
-                    pass
+                fan_out(
+                    settlement_msg,
+                    body=settlement_msg.body,
+                    kind='system',
+                    notify_type='system',
+                    notify_from=sender_display,
+                    systemSubtype='wallet_settled',
+                    settled_at=settlement_time.isoformat(),
+                )
 
             activity_now = timezone.now()
             update_kwargs = {'last_activity_at': activity_now}
@@ -873,6 +809,206 @@ class ConversationMember(models.Model):
         return f"ConvMember(conv={self.conversation_id}, user={self.member_user_id}, team={self.member_team_id})"
 
 
+class SyncChange(models.Model):
+    """Append-only change log backing the delta sync endpoint.
+
+    The auto-increment id is the global cursor handed to clients. Rows are
+    scoped to a conversation (visible to all of its viewers) or, when ``user``
+    is set, to a single user (used for deletions/removals where the user can no
+    longer be resolved through the conversation itself). ``conversation_id`` is
+    a plain integer so entries survive the conversation being deleted.
+    """
+    KIND_MESSAGE = 'message'
+    KIND_READ = 'read'
+    KIND_CLEARED = 'cleared'
+    KIND_DELETED = 'deleted'
+    KIND_CHOICES = (
+        (KIND_MESSAGE, 'Message'),
+        (KIND_READ, 'Read marker'),
+        (KIND_CLEARED, 'Cleared'),
+        (KIND_DELETED, 'Deleted'),
+    )
+
+    conversation_id = models.BigIntegerField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='sync_changes')
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    message_id = models.BigIntegerField(null=True, blank=True)
+    payload = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["conversation_id", "id"]),
+            models.Index(fields=["user", "id"]),
+            models.Index(fields=["created_at"]),
+        ]
+
+    def __str__(self):  # pragma: no cover
+        return f"SyncChange(#{self.id} conv={self.conversation_id} kind={self.kind})"
+
+    @classmethod
+    def record(cls, conversation_id: int, kind: str, *, message_id: int | None = None,
+               payload: dict | None = None, user_ids=None) -> None:
+        """Append a change; never raises so callers can fire-and-forget."""
+        try:
+            if user_ids:
+                cls.objects.bulk_create([
+                    cls(conversation_id=conversation_id, user_id=uid, kind=kind, message_id=message_id, payload=payload or {})
+                    for uid in dict.fromkeys(user_ids) if uid
+                ])
+            else:
+                cls.objects.create(conversation_id=conversation_id, kind=kind, message_id=message_id, payload=payload or {})
+        except Exception:
+            import logging
+            logging.getLogger(__name__).exception("Failed to record sync change", extra={"conversation_id": conversation_id, "kind": kind})
+
+
+class ConversationPurge(models.Model):
+    """A chunked clear or delete of a conversation's rows, run outside the request.
+
+    ``progress`` maps each step (settlements, transactions, messages, ...) to
+    the rows removed so far; ``communications.purge`` documents the steps.
+    """
+    KIND_CLEAR = 'clear'
+    KIND_DELETE = 'delete'
+    KIND_CHOICES = (
+        (KIND_CLEAR, 'Clear messages'),
+        (KIND_DELETE, 'Delete conversation'),
+    )
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    )
+    # Plain id: the conversation row itself goes away at the end of a delete
+    conversation_id = models.BigIntegerField()
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    # clear: newest message id covered (later messages are kept)
+    up_to_message_id = models.BigIntegerField(default=0)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    # Users allowed to read the job's progress (the conversation's viewers at request time)
+    user_ids = models.JSONField(default=list, blank=True)
+    estimated_messages = models.PositiveIntegerField(default=0)
+    progress = models.JSONField(default=dict, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created_at"]),
+            models.Index(fields=["conversation_id"]),
+        ]
+
+    def __str__(self):  # pragma: no cover
+        return f"Purge(#{self.id} {self.kind} conv={self.conversation_id} {self.status})"
+
+
+class AttachmentFile(models.Model):
+    """A stored ``Message.attachment`` file, indexed for the orphan collector.
+
+    Rows are written when an attachment message is created and flagged with
+    ``orphaned_at`` once no message references the path any more;
+    ``communications.attachment_gc`` deletes flagged files after a grace period.
+    """
+    path = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField(default=0)
+    # Plain id: purges remove messages with raw DELETEs
+    message_id = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    orphaned_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["message_id"]),
+            models.Index(fields=["orphaned_at"]),
+        ]
+
+    def __str__(self):  # pragma: no cover
+        return f"AttachmentFile({self.path} msg={self.message_id})"
+
+    @classmethod
+    def record(cls, message) -> None:
+        name = getattr(message.attachment, 'name', '') or ''
+        if not name:
+            return
+        cls.objects.update_or_create(
+            path=name,
+            defaults={'message_id': message.id, 'size': message.attachment_size or 0, 'orphaned_at': None},
+        )
+
+
+class AttachmentSweep(models.Model):
+    """One run of the attachment collector: what it found and where the next run resumes."""
+    dry_run = models.BooleanField(default=False)
+    # Last AttachmentFile id checked against messages (0: start over)
+    mark_cursor = models.BigIntegerField(default=0)
+    # Last storage directory scanned for unindexed files ('': start over)
+    scan_cursor = models.CharField(max_length=255, blank=True)
+    counts = models.JSONField(default=dict, blank=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-id']
+
+    def __str__(self):  # pragma: no cover
+        return f"AttachmentSweep(#{self.id}{' dry' if self.dry_run else ''})"
+
+
+class ProviderRetry(models.Model):
+    """An external provider send (Pusher/Expo/FCM/web push) waiting to be retried.
+
+    Rows are written when a send fails or its circuit breaker is open, and are
+    replayed by the ``retry_provider_sends`` command (see ``communications.providers``).
+    """
+    provider = models.CharField(max_length=32)
+    payload = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["provider", "next_attempt_at"]),
+            models.Index(fields=["next_attempt_at"]),
+        ]
+
+    def __str__(self):  # pragma: no cover
+        return f"ProviderRetry(#{self.id} {self.provider} attempts={self.attempts})"
+
+
+class ProviderCircuit(models.Model):
+    """Last known circuit breaker state per provider, mirrored for the admin."""
+    STATE_CLOSED = 'closed'
+    STATE_OPEN = 'open'
+    STATE_HALF_OPEN = 'half_open'
+    STATE_CHOICES = (
+        (STATE_CLOSED, 'Closed'),
+        (STATE_OPEN, 'Open'),
+        (STATE_HALF_OPEN, 'Half-open'),
+    )
+
+    provider = models.CharField(max_length=32, unique=True)
+    state = models.CharField(max_length=16, choices=STATE_CHOICES, default=STATE_CLOSED)
+    consecutive_failures = models.PositiveIntegerField(default=0)
+    opened_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):  # pragma: no cover
+        return f"{self.provider}: {self.state}"
+
+
 def get_conversation_viewer_ids(conv: Conversation) -> list[int]:
     """Return all user IDs that should be notified/authorized for a conversation.
 
@@ -0,0 +1,137 @@
+import json
+import logging
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+
+from .consumers import ConversationConsumer
+from .group_registry import add_channel, remove_channel
+from .inbox_consumer import mark_inbound_delivered
+
+logger = logging.getLogger(__name__)
+
+
+class MultiplexConsumer(ConversationConsumer):
+    """One authenticated socket per client carrying the inbox and any number of conversations.
+
+    Replaces ``ws/inbox/`` + one ``ws/conversations/<id>/`` socket per open chat.
+    The client drives membership with frames::
+
+        {"type": "subscribe", "conversation_id": 12, "resume_from": 40}
+        {"type": "unsubscribe", "conversation_id": 12}
+
+    Every other conversation frame (text/typing/read/ack) carries
+    ``conversation_id`` and is handled by the same code paths as
+    ``ConversationConsumer``. Outgoing conversation events are tagged with
+    ``conversation_id`` by the channel layer.
+    """
+
+    async def connect(self):
+        user = self.scope.get('user')
+        if not user or isinstance(user, AnonymousUser) or not user.is_authenticated:
+            await self.close(code=4001)
+            return
+        self.user_id = user.id
+        self.inbox_group = f"user_{self.user_id}"
+        self.subscriptions: set[int] = set()
+        await self.channel_layer.group_add(self.inbox_group, self.channel_name)
+        add_channel(self.inbox_group, self.channel_name)
+        await self.accept(subprotocol=self._negotiate_wire())
+        hello = await mark_inbound_delivered(self.channel_layer, self.user_id)
+        await self.send_frame(hello)
+
+    async def disconnect(self, code):
+        self._close_outbound()
+        await self._close_typing()
+        for conversation_id in list(getattr(self, 'subscriptions', ())):
+            await self._unsubscribe(conversation_id)
+        if hasattr(self, 'inbox_group'):
+            await self.channel_layer.group_discard(self.inbox_group, self.channel_name)
+            remove_channel(self.inbox_group, self.channel_name)
+        logger.info("WS mux disconnect", extra={"event": "ws_mux_disconnect", "user_id": getattr(self, 'user_id', None), "code": code})
+
+    def _bind(self, conversation_id: int) -> None:
+        self.conversation_id = conversation_id
+        self.group_name = f"conv_{conversation_id}"
+
+    async def _error(self, detail: str, conversation_id=None):
+        await self.send_frame({'type': 'error', 'detail': detail, 'conversation_id': conversation_id})
+
+    async def _subscribe(self, user, conversation_id: int, resume_from=None):
+        if conversation_id in self.subscriptions:
+            await self.send_frame({'type': 'subscribed', 'conversation_id': conversation_id})
+            return
+        limit = int(getattr(settings, 'WS_MUX_MAX_SUBSCRIPTIONS', 50))
+        if len(self.subscriptions) >= limit:
+            await self._error('too_many_subscriptions', conversation_id)
+            return
+        self._bind(conversation_id)
+        reason = await self._access_denied_reason(user)
+        if reason:
+            await self._error(reason, conversation_id)
+            return
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        add_channel(self.group_name, self.channel_name)
+        self.subscriptions.add(conversation_id)
+        await self.send_frame({'type': 'subscribed', 'conversation_id': conversation_id})
+        try:
+            await self._replay_journal(resume_from)
+        except Exception:
+            logger.exception("Failed to replay journaled events", extra={"event": "ws_resume_error", "conv": self.group_name})
+        await self._mark_read_on_enter(user)
+
+    async def _access_revoked(self, conversation_id: int) -> None:
+        # Only this subscription ends; the inbox and other conversations stay on the socket
+        await self._unsubscribe(conversation_id)
+        await self._error('forbidden', conversation_id)
+
+    async def _unsubscribe(self, conversation_id: int):
+        if conversation_id not in self.subscriptions:
+            return
+        if getattr(self, '_typing_coalescer', None) is not None:
+            await self._typing_coalescer.update(conversation_id, 'stop')
+        self.subscriptions.discard(conversation_id)
+        self._forget_conversation(conversation_id)
+        group = f"conv_{conversation_id}"
+        await self.channel_layer.group_discard(group, self.channel_name)
+        remove_channel(group, self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        user = self.scope['user']
+        text_data = self._inbound_text(text_data, bytes_data)
+        if not text_data:
+            return
+        try:
+            data = json.loads(text_data)
+        except json.JSONDecodeError:
+            await self._error('invalid_frame')
+            return
+        if not isinstance(data, dict):
+            await self._error('invalid_frame')
+            return
+        frame_type = data.get('type')
+        if frame_type == 'ping':
+            await self.send_frame({'type': 'pong'})
+            return
+        try:
+            conversation_id = int(data.get('conversation_id'))
+        except (TypeError, ValueError):
+            await self._error('conversation_id_required')
+            return
+        if frame_type == 'subscribe':
+            resume_from = data.get('resume_from')
+            try:
+                resume_from = int(resume_from) if resume_from is not None else None
+            except (TypeError, ValueError):
+                resume_from = None
+            await self._subscribe(user, conversation_id, resume_from)
+            return
+        if frame_type == 'unsubscribe':
+            await self._unsubscribe(conversation_id)
+            await self.send_frame({'type': 'unsubscribed', 'conversation_id': conversation_id})
+            return
+        if conversation_id not in self.subscriptions:
+            await self._error('not_subscribed', conversation_id)
+            return
+        self._bind(conversation_id)
+        await super().receive(text_data=text_data)
@@ -0,0 +1,232 @@
+"""Per-connection outbound queues for WebSocket consumers.
+
+``broadcast_message`` handlers used to ``await self.send(...)`` inline, so a slow
+client stalled the consumer's channel-layer reader until the layer started
+dropping messages for it. Consumers now hand events to an ``OutboundQueue``
+that a writer task drains:
+
+* frames that supersede a queued one replace it in place (``message.status``
+  for the same message, ``inbox.update`` for the same conversation,
+  ``chat.typing`` for the same user) instead of growing the queue;
+* typing frames are shed once the queue is half full;
+* a full queue, or a single send taking longer than ``WS_SEND_TIMEOUT``, marks
+  the client as hopeless: it gets a ``resync.required`` hint and is closed with
+  ``BACKPRESSURE_CLOSE_CODE`` so it reconnects and resumes from its last seq;
+* a send that raises loses only that frame (counted as ``failed``), the writer
+  keeps draining.
+
+Counters are process-wide and exposed via ``metrics_snapshot()``.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+BACKPRESSURE_CLOSE_CODE = 4008
+
+SendEvent = Callable[[dict], Awaitable[None]]
+OnOverflow = Callable[[str], Awaitable[None]]
+
+_metrics: Dict[str, int] = {}
+_metrics_lock = threading.Lock()
+
+
+def _count(name: str, amount: int = 1) -> None:
+    with _metrics_lock:
+        _metrics[name] = _metrics.get(name, 0) + amount
+
+
+def _observe_depth(depth: int) -> None:
+    with _metrics_lock:
+        if depth > _metrics.get('max_depth', 0):
+            _metrics['max_depth'] = depth
+
+
+def metrics_snapshot() -> Dict[str, int]:
+    with _metrics_lock:
+        out = {'sent': 0, 'failed': 0, 'coalesced': 0, 'dropped': 0, 'overflow_disconnects': 0, 'max_depth': 0}
+        out.update(_metrics)
+        return out
+
+
+def reset_metrics() -> None:
+    with _metrics_lock:
+        _metrics.clear()
+
+
+def coalesce_key(data) -> Optional[Hashable]:
+    """Key under which a newer frame replaces a queued one (None: never coalesced)."""
+    if not isinstance(data, dict):
+        return None
+    kind = data.get('type')
+    if kind == 'message.status' and data.get('id') is not None:
+        # A range frame (from_id..to_id, id = to_id) must not be replaced by a single-message one
+        return ('status', data.get('conversation_id'), data.get('id'), data.get('from_id'))
+    if kind == 'inbox.update' and data.get('conversation_id') is not None:
+        return ('inbox', data.get('conversation_id'))
+    if kind == 'chat.typing':
+        return ('typing', data.get('conversation_id'), data.get('user'))
+    return None
+
+
+def _supersedes(new, old) -> bool:
+    if new.get('type') == 'message.status':
+        # Status only moves forward (delivered -> read); never let a late "delivered" win
+        return (new.get('delivery_status') or 0) >= (old.get('delivery_status') or 0)
+    return True
+
+
+class OutboundQueue:
+    def __init__(self, send_event: SendEvent, on_overflow: OnOverflow,
+                 maxsize: Optional[int] = None, send_timeout: Optional[float] = None):
+        self.send_event = send_event
+        self.on_overflow = on_overflow
+        self.maxsize = max(2, int(getattr(settings, 'WS_OUTBOUND_QUEUE_SIZE', 256) if maxsize is None else maxsize))
+        self.send_timeout = float(getattr(settings, 'WS_SEND_TIMEOUT', 10.0) if send_timeout is None else send_timeout)
+        self._frames: "OrderedDict[Hashable, dict]" = OrderedDict()
+        self._serial = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.closed = False
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    async def put(self, event: dict) -> None:
+        if self.closed:
+            return
+        data = event.get('data')
+        key = coalesce_key(data)
+        if key is not None and key in self._frames:
+            if _supersedes(data, self._frames[key].get('data') or {}):
+                self._frames[key] = event
+            _count('coalesced')
+            return
+        depth = len(self._frames)
+        if key is not None and key[0] == 'typing' and depth >= self.maxsize // 2:
+            _count('dropped')
+            return
+        if depth >= self.maxsize:
+            await self._overflow('queue_full')
+            return
+        if key is None:
+            self._serial += 1
+            key = ('frame', self._serial)
+        self._frames[key] = event
+        _observe_depth(depth + 1)
+        self._wakeup.set()
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._drain())
+
+    async def _drain(self) -> None:
+        try:
+            while not self.closed:
+                if not self._frames:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                _, event = self._frames.popitem(last=False)
+                try:
+                    await asyncio.wait_for(self.send_event(event), self.send_timeout)
+                except asyncio.TimeoutError:
+                    await self._overflow('send_timeout')
+                    return
+                except Exception:
+                    # One bad frame (encoding, a closing transport) must not stop the writer for good
+                    _count('failed')
+                    logger.exception("WS outbound frame failed")
+                    continue
+                _count('sent')
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            logger.exception("WS outbound writer failed")
+        finally:
+            # Let the next put() start a fresh writer if this one died
+            if self._task is asyncio.current_task():
+                self._task = None
+
+    async def _overflow(self, reason: str) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        _count('dropped', len(self._frames) + 1)
+        _count('overflow_disconnects')
+        self._frames.clear()
+        logger.warning("WS slow consumer disconnected", extra={"event": "ws_backpressure", "reason": reason})
+        try:
+            await self.on_overflow(reason)
+        except Exception:
+            logger.exception("WS overflow handler failed")
+
+    def close(self) -> None:
+        """Stop the writer; frames still queued are discarded (the socket is gone)."""
+        self.closed = True
+        self._frames.clear()
+        task, self._task = self._task, None
+        if task and not task.done() and task is not asyncio.current_task():
+            task.cancel()
+
+
+class OutboundQueueMixin:
+    """``broadcast_message`` for AsyncWebsocketConsumer subclasses, queued per connection.
+
+    Also owns the connection's wire codec (see ``wire``): consumers accept with
+    ``subprotocol=self._negotiate_wire()``, send their own frames with
+    ``send_frame`` and normalise incoming frames with ``_inbound_text``.
+    """
+
+    def _negotiate_wire(self) -> Optional[str]:
+        from .wire import negotiate
+        self._wire = negotiate(self.scope)
+        return self._wire.subprotocol
+
+    def _wire_codec(self):
+        codec = getattr(self, '_wire', None)
+        if codec is None:
+            from .wire import WireCodec
+            codec = self._wire = WireCodec()
+        return codec
+
+    async def send_frame(self, data: dict, text: Optional[str] = None) -> None:
+        text_data, bytes_data = self._wire_codec().encode(data, text)
+        await self.send(text_data=text_data, bytes_data=bytes_data)
+
+    def _inbound_text(self, text_data, bytes_data):
+        return self._wire_codec().decode(text_data, bytes_data)
+
+    def _outbound(self) -> OutboundQueue:
+        queue = getattr(self, '_outbound_queue', None)
+        if queue is None:
+            queue = self._outbound_queue = OutboundQueue(self._send_outbound, self._outbound_overflow)
+        return queue
+
+    async def _send_outbound(self, event: dict) -> None:
+        # Events published through communications.realtime arrive pre-encoded as JSON
+        await self.send_frame(event['data'], event.get('text'))
+
+    async def _outbound_overflow(self, reason: str) -> None:
+        hint = {'type': 'resync.required', 'reason': 'backpressure', 'detail': reason}
+        conversation_id = getattr(self, 'conversation_id', None)
+        if conversation_id is not None and not hasattr(self, 'subscriptions'):
+            hint['conversation_id'] = int(conversation_id)
+        try:
+            await asyncio.wait_for(self.send_frame(hint), 1.0)
+        except Exception:
+            pass
+        await self.close(code=BACKPRESSURE_CLOSE_CODE)
+
+    def _close_outbound(self) -> None:
+        queue = getattr(self, '_outbound_queue', None)
+        if queue is not None:
+            queue.close()
+
+    async def broadcast_message(self, event):
+        await self._outbound().put(event)
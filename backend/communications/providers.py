@@ -0,0 +1,200 @@
+"""Guarded calls to external delivery providers (Pusher, Expo, FCM, web push).
+
+Every provider call goes through ``call_provider``:
+
+* each provider has its own timeout (``PROVIDER_TIMEOUTS``), applied by the
+  provider client itself (requests/pusher/pywebpush ``timeout``, firebase
+  ``httpTimeout``);
+* a per-provider circuit breaker opens after ``PROVIDER_BREAKER_FAILURES``
+  consecutive failures, short-circuits calls for ``PROVIDER_BREAKER_RESET``
+  seconds, then lets a single probe through (half-open) and closes again on
+  success;
+* sends that fail or are short-circuited are stored as ``ProviderRetry`` rows
+  and replayed later by ``manage.py retry_provider_sends``.
+
+Breaker transitions are mirrored to ``ProviderCircuit`` so the current state is
+visible in the admin. Breakers themselves are per process.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+PUSHER = 'pusher'
+EXPO = 'expo'
+FCM = 'fcm'
+WEBPUSH = 'webpush'
+
+DEFAULT_TIMEOUTS = {PUSHER: 3.0, EXPO: 5.0, FCM: 5.0, WEBPUSH: 5.0}
+
+# provider -> dotted path of ``replay(payload)`` used by retry_provider_sends
+REPLAY_HANDLERS = {
+    PUSHER: 'communications.pusher_client.replay',
+    EXPO: 'accounts.push.replay_expo',
+    FCM: 'accounts.push.replay_fcm',
+    WEBPUSH: 'communications.views.replay_web_push',
+}
+
+
+class ProviderUnavailable(Exception):
+    """The provider call failed or was short-circuited by an open breaker."""
+
+    def __init__(self, provider: str, reason: str):
+        super().__init__(f"{provider}: {reason}")
+        self.provider = provider
+        self.reason = reason
+
+
+def provider_timeout(provider: str) -> float:
+    timeouts = getattr(settings, 'PROVIDER_TIMEOUTS', None) or {}
+    return float(timeouts.get(provider, DEFAULT_TIMEOUTS.get(provider, 5.0)))
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: Optional[int] = None, reset_timeout: Optional[float] = None):
+        self.name = name
+        self.failure_threshold = int(failure_threshold if failure_threshold is not None else getattr(settings, 'PROVIDER_BREAKER_FAILURES', 5))
+        self.reset_timeout = float(reset_timeout if reset_timeout is not None else getattr(settings, 'PROVIDER_BREAKER_RESET', 30.0))
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.last_error = ''
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - (self.opened_at or 0) >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+                changed = True
+            else:
+                changed = False
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                allowed = True
+            else:
+                allowed = False
+        if changed:
+            self._mirror()
+        return allowed
+
+    def record_success(self) -> None:
+        with self._lock:
+            changed = self.state != self.CLOSED
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self._probe_in_flight = False
+        if changed:
+            logger.info("Provider circuit closed", extra={"event": "provider_circuit_closed", "provider": self.name})
+            self._mirror()
+
+    def record_failure(self, error: str = '') -> None:
+        with self._lock:
+            self.failures += 1
+            self.last_error = error[:500]
+            opening = self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold)
+            if opening:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+        if opening:
+            logger.warning("Provider circuit opened", extra={"event": "provider_circuit_open", "provider": self.name, "failures": self.failures})
+            self._mirror()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'state': self.state, 'failures': self.failures, 'last_error': self.last_error}
+
+    def _mirror(self) -> None:
+        try:
+            from .models import ProviderCircuit
+            snap = self.snapshot()
+            ProviderCircuit.objects.update_or_create(
+                provider=self.name,
+                defaults={
+                    'state': snap['state'],
+                    'consecutive_failures': snap['failures'],
+                    'last_error': snap['last_error'],
+                    'opened_at': timezone.now() if snap['state'] == self.OPEN else None,
+                },
+            )
+        except Exception:
+            logger.debug("Failed to mirror provider circuit state", exc_info=True)
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    breaker = _breakers.get(provider)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(provider)
+            if breaker is None:
+                breaker = _breakers[provider] = CircuitBreaker(provider)
+    return breaker
+
+
+def breaker_states() -> Dict[str, Dict[str, Any]]:
+    return {name: breaker.snapshot() for name, breaker in list(_breakers.items())}
+
+
+def reset_breakers() -> None:
+    with _breakers_lock:
+        _breakers.clear()
+
+
+def enqueue_retry(provider: str, payload: Dict[str, Any], error: str = '') -> None:
+    """Store a send for later replay; never raises."""
+    try:
+        from .models import ProviderRetry
+        ProviderRetry.objects.create(provider=provider, payload=payload, last_error=error[:2000])
+    except Exception:
+        logger.exception("Failed to queue provider retry", extra={"provider": provider})
+
+
+def call_provider(provider: str, fn: Callable, *args, retry: Optional[Dict[str, Any]] = None, **kwargs):
+    """Run ``fn`` behind ``provider``'s breaker; queue ``retry`` if it cannot be delivered now."""
+    breaker = get_breaker(provider)
+    if not breaker.allow():
+        if retry is not None:
+            enqueue_retry(provider, retry, 'circuit open')
+        raise ProviderUnavailable(provider, 'circuit open')
+    try:
+        result = fn(*args, **kwargs)
+    except Exception as exc:
+        breaker.record_failure(f"{type(exc).__name__}: {exc}")
+        if retry is not None:
+            enqueue_retry(provider, retry, f"{type(exc).__name__}: {exc}")
+        raise ProviderUnavailable(provider, str(exc)) from exc
+    breaker.record_success()
+    return result
+
+
+def retry_backoff(attempts: int) -> timedelta:
+    base = float(getattr(settings, 'PROVIDER_RETRY_BACKOFF', 30.0))
+    return timedelta(seconds=min(base * (2 ** max(attempts - 1, 0)), 3600))
+
+
+def replay(entry) -> None:
+    """Replay one ``ProviderRetry`` row through its provider's breaker (raises on failure)."""
+    handler = import_string(REPLAY_HANDLERS[entry.provider])
+    call_provider(entry.provider, handler, entry.payload)
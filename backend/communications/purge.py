@@ -0,0 +1,234 @@
+"""Chunked clear/delete of conversations.
+
+``ConversationViewSet.clear`` and ``approve_delete`` used to delete everything
+inside the request, so Django's deletion collector loaded a whole chat history
+for cascades and held the locks for as long as that took. They now call
+``start_purge``, which only tombstones the conversation in the request
+(``Conversation.cleared_up_to_id`` hides the cleared history,
+``Conversation.deleted_at`` hides a deleted conversation) and records a
+``ConversationPurge`` job.
+
+``run_purge`` then works through the job's steps in batches of
+``PURGE_BATCH_SIZE`` rows, one short transaction per batch, saving progress
+after each one so an interrupted job resumes where it stopped. Links into a
+batch are cleared with set-based UPDATEs first (what ``SET_NULL`` would do),
+after which nothing references the rows and they are removed with a raw DELETE
+instead of going through the collector. Members and mutes are few and have
+signal handlers, so they are deleted normally.
+
+Jobs run in a daemon thread once the request commits (``PURGE_IN_BACKGROUND``);
+``manage.py run_purges`` picks up pending, failed or stalled jobs.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+from datetime import timedelta
+from typing import Callable, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import (
+    AttachmentFile,
+    Conversation,
+    ConversationMember,
+    ConversationMute,
+    ConversationPurge,
+    ConversationReadMarker,
+    ConversationSettlement,
+    Message,
+    Transaction,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def batch_size() -> int:
+    return max(1, int(getattr(settings, 'PURGE_BATCH_SIZE', 2000)))
+
+
+def _next_ids(qs, size: int) -> List[int]:
+    return list(qs.order_by('id').values_list('id', flat=True)[:size])
+
+
+def _raw_delete(model, ids: List[int]) -> int:
+    # Callers have already cleared every reference to these rows, so the collector has nothing to do
+    qs = model.objects.filter(id__in=ids)
+    return qs._raw_delete(qs.db)
+
+
+def _transactions_step(job: ConversationPurge, size: int) -> int:
+    ids = _next_ids(Transaction.objects.filter(conversation_id=job.conversation_id), size)
+    if ids:
+        ConversationSettlement.objects.filter(transaction_id__in=ids).update(transaction=None)
+        _raw_delete(Transaction, ids)
+    return len(ids)
+
+
+def _messages_step(job: ConversationPurge, size: int) -> int:
+    qs = Message.objects.filter(conversation_id=job.conversation_id)
+    if job.kind == ConversationPurge.KIND_CLEAR:
+        qs = qs.filter(id__lte=job.up_to_message_id)
+    ids = _next_ids(qs, size)
+    if ids:
+        # Clearing keeps the ledger: transactions just lose their chat bubble
+        Transaction.objects.filter(message_id__in=ids).update(message=None)
+        # Their files are left to the attachment collector (communications.attachment_gc)
+        AttachmentFile.objects.filter(message_id__in=ids, orphaned_at__isnull=True).update(orphaned_at=timezone.now())
+        _raw_delete(Message, ids)
+    return len(ids)
+
+
+def _raw_step(model) -> Callable[[ConversationPurge, int], int]:
+    def step(job: ConversationPurge, size: int) -> int:
+        ids = _next_ids(model.objects.filter(conversation_id=job.conversation_id), size)
+        if ids:
+            _raw_delete(model, ids)
+        return len(ids)
+    return step
+
+
+def _signalled_step(model) -> Callable[[ConversationPurge, int], int]:
+    def step(job: ConversationPurge, size: int) -> int:
+        ids = _next_ids(model.objects.filter(conversation_id=job.conversation_id), size)
+        if ids:
+            model.objects.filter(id__in=ids).delete()
+        return len(ids)
+    return step
+
+
+def _conversation_step(job: ConversationPurge, size: int) -> int:
+    # Every dependent table is empty by now; this is a single-row delete
+    deleted, _ = Conversation.objects.filter(id=job.conversation_id).delete()
+    return 1 if deleted else 0
+
+
+STEPS = {
+    ConversationPurge.KIND_CLEAR: (
+        ('messages', _messages_step),
+    ),
+    ConversationPurge.KIND_DELETE: (
+        ('settlements', _raw_step(ConversationSettlement)),
+        ('transactions', _transactions_step),
+        ('messages', _messages_step),
+        ('read_markers', _raw_step(ConversationReadMarker)),
+        ('mutes', _signalled_step(ConversationMute)),
+        ('members', _signalled_step(ConversationMember)),
+        ('conversation', _conversation_step),
+    ),
+}
+
+
+def start_purge(conv: Conversation, kind: str, *, requested_by=None, user_ids: Iterable[int] = ()) -> ConversationPurge:
+    """Tombstone ``conv`` and queue its purge; the rows go after the surrounding transaction commits."""
+    with transaction.atomic():
+        up_to = conv.messages.order_by('-id').values_list('id', flat=True).first() or 0
+        if kind == ConversationPurge.KIND_CLEAR:
+            Conversation.objects.filter(pk=conv.pk).update(
+                cleared_up_to_id=up_to,
+                last_message_at=None,
+                last_activity_at=None,
+                last_message_preview="",
+            )
+            conv.cleared_up_to_id = up_to
+            # Hidden messages must not linger in unread counts while they are purged
+            if up_to:
+                for uid in {conv.user_a_id, conv.user_b_id}:
+                    ConversationReadMarker.advance(conv.id, uid, up_to)
+            estimated = conv.messages.filter(id__lte=up_to).count() if up_to else 0
+        else:
+            now = timezone.now()
+            Conversation.objects.filter(pk=conv.pk).update(deleted_at=now)
+            conv.deleted_at = now
+            estimated = conv.messages.count()
+        job = ConversationPurge.objects.create(
+            conversation_id=conv.id,
+            kind=kind,
+            up_to_message_id=up_to,
+            requested_by=requested_by,
+            user_ids=sorted({int(uid) for uid in user_ids if uid}),
+            estimated_messages=estimated,
+        )
+        transaction.on_commit(lambda: schedule_purge(job.id))
+    return job
+
+
+def schedule_purge(job_id: int) -> None:
+    if getattr(settings, 'PURGE_IN_BACKGROUND', True):
+        threading.Thread(target=_run_in_thread, args=(job_id,), name=f'purge-{job_id}', daemon=True).start()
+    else:
+        run_purge(job_id)
+
+
+def _run_in_thread(job_id: int) -> None:
+    try:
+        run_purge(job_id)
+    finally:
+        # The thread got its own DB connection; don't leak it
+        connections.close_all()
+
+
+def _claim(job_id: int, stale_after: Optional[timedelta]) -> bool:
+    claimable = Q(status__in=[ConversationPurge.STATUS_PENDING, ConversationPurge.STATUS_FAILED])
+    if stale_after is not None:
+        claimable |= Q(status=ConversationPurge.STATUS_RUNNING, updated_at__lte=timezone.now() - stale_after)
+    return bool(ConversationPurge.objects.filter(claimable, id=job_id).update(status=ConversationPurge.STATUS_RUNNING, updated_at=timezone.now()))
+
+
+def run_purge(job_id: int, *, size: Optional[int] = None, stale_after: Optional[timedelta] = None) -> Optional[ConversationPurge]:
+    """Run (or resume) a purge job to completion; returns the job, or None if another runner owns it.
+
+    ``stale_after`` also takes over jobs left ``running`` for that long (a worker died mid-way).
+    """
+    if not _claim(job_id, stale_after):
+        return None
+    job = ConversationPurge.objects.get(id=job_id)
+    job.attempts += 1
+    job.last_error = ''
+    job.save(update_fields=['attempts', 'last_error', 'updated_at'])
+    size = size or batch_size()
+    try:
+        for name, step in STEPS[job.kind]:
+            while True:
+                with transaction.atomic():
+                    removed = step(job, size)
+                    if removed:
+                        job.progress[name] = job.progress.get(name, 0) + removed
+                        job.save(update_fields=['progress', 'updated_at'])
+                if removed < size:
+                    break
+    except Exception as exc:
+        job.status = ConversationPurge.STATUS_FAILED
+        job.last_error = f"{type(exc).__name__}: {exc}"[:2000]
+        job.save(update_fields=['status', 'last_error', 'updated_at'])
+        logger.exception("Conversation purge failed", extra={"event": "purge_error", "job": job.id, "conversation_id": job.conversation_id})
+        return job
+    job.status = ConversationPurge.STATUS_DONE
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'finished_at', 'updated_at'])
+    return job
+
+
+def finish_tombstoned(conv: Conversation) -> None:
+    """Finish a deleted conversation's purge inline, so the same pair can start a new conversation."""
+    jobs = ConversationPurge.objects.filter(conversation_id=conv.id, kind=ConversationPurge.KIND_DELETE).exclude(status=ConversationPurge.STATUS_DONE)
+    for job_id in jobs.values_list('id', flat=True):
+        run_purge(job_id, stale_after=timedelta(0))
+    # A tombstone without a job (or one another runner still owns) is removed directly
+    Conversation.objects.filter(id=conv.id, deleted_at__isnull=False).delete()
+
+
+def progress_payload(job: ConversationPurge) -> dict:
+    return {
+        'id': job.id,
+        'conversation_id': job.conversation_id,
+        'kind': job.kind,
+        'status': job.status,
+        'estimated_messages': job.estimated_messages,
+        'progress': job.progress,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
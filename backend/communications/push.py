@@ -4,10 +4,16 @@ import logging
 from decimal import Decimal
 from typing import Any, Dict, Iterable, List, Optional
 
-from django.db.models import F, OuterRef, Q, Subquery
+from django.core.cache import cache
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
 from accounts.push import PushMessage, get_active_device_tokens, send_push_messages
+from accounts.push_registry import invalidate_keys, registry_enabled, registry_ttl
+
+from .badge_sync import remember_badge
+from .push_bundler import get_bundler
 from .models import (
     Conversation,
     ConversationMember,
@@ -31,8 +37,8 @@ def _normalize_value(value: Any) -> Any:
 
 
 def _conversation_ids_for_user(user_id: int) -> List[int]:
-    base_ids = Conversation.objects.filter(Q(user_a_id=user_id) | Q(user_b_id=user_id)).values_list("id", flat=True)
-    member_ids = ConversationMember.objects.filter(member_user_id=user_id).values_list("conversation_id", flat=True)
+    base_ids = Conversation.objects.filter(Q(user_a_id=user_id) | Q(user_b_id=user_id), deleted_at__isnull=True).values_list("id", flat=True)
+    member_ids = ConversationMember.objects.filter(member_user_id=user_id, conversation__deleted_at__isnull=True).values_list("conversation_id", flat=True)
     ordered: List[int] = []
     seen: set[int] = set()
     for conv_id in list(base_ids) + list(member_ids):
@@ -59,19 +65,145 @@ def _total_unread_for_user(user_id: int) -> int:
     return unread_qs.count()
 
 
+def _total_unread_by_user(user_ids: Iterable[int]) -> Dict[int, int]:
+    """``_total_unread_for_user`` for several users in three queries, however many users there are."""
+    ids = [uid for uid in dict.fromkeys(user_ids) if uid]
+    if not ids:
+        return {}
+    conv_ids: Dict[int, set[int]] = {uid: set() for uid in ids}
+    pairs = Conversation.objects.filter(Q(user_a_id__in=ids) | Q(user_b_id__in=ids), deleted_at__isnull=True).values_list("id", "user_a_id", "user_b_id")
+    for conv_id, user_a_id, user_b_id in pairs:
+        for uid in (user_a_id, user_b_id):
+            if uid in conv_ids:
+                conv_ids[uid].add(conv_id)
+    for uid, conv_id in ConversationMember.objects.filter(member_user_id__in=ids, conversation__deleted_at__isnull=True).values_list("member_user_id", "conversation_id"):
+        if conv_id:
+            conv_ids[uid].add(conv_id)
+    all_conv_ids = set().union(*conv_ids.values())
+    totals = {uid: 0 for uid in ids}
+    if not all_conv_ids:
+        return totals
+    aggregates = {}
+    for uid in ids:
+        if not conv_ids[uid]:
+            continue
+        marker_subquery = ConversationReadMarker.objects.filter(
+            conversation_id=OuterRef("conversation_id"),
+            user_id=uid,
+        ).values("last_read_message_id")[:1]
+        aggregates[f"unread_{uid}"] = Count("id", filter=(
+            Q(conversation_id__in=conv_ids[uid])
+            & ~Q(sender_id=uid)
+            & Q(id__gt=Coalesce(Subquery(marker_subquery), Value(0)))
+        ))
+    if aggregates:
+        row = Message.objects.filter(conversation_id__in=all_conv_ids).aggregate(**aggregates)
+        for uid in ids:
+            totals[uid] = int(row.get(f"unread_{uid}") or 0)
+    return totals
+
+
+def _unread_counts_by_conversation(user_id: int, conversation_ids: Iterable[int]) -> Dict[int, int]:
+    """Per-conversation unread counts for ``user_id`` in a single grouped query."""
+    ids = [cid for cid in conversation_ids if cid]
+    if not ids:
+        return {}
+    marker_subquery = ConversationReadMarker.objects.filter(
+        conversation_id=OuterRef("conversation_id"),
+        user_id=user_id,
+    ).values("last_read_message_id")[:1]
+    rows = (
+        Message.objects.filter(conversation_id__in=ids)
+        .exclude(sender_id=user_id)
+        .annotate(last_read_id=Subquery(marker_subquery))
+        .filter(Q(last_read_id__isnull=True) | Q(id__gt=F("last_read_id")))
+        .order_by()
+        .values("conversation_id")
+        .annotate(n=Count("id"))
+    )
+    return {row["conversation_id"]: row["n"] for row in rows}
+
+
+MUTES_CACHE_KEY = "push:mutes:{}"
+VIEWERS_CACHE_KEY = "push:viewers:{}"
+
+
+def invalidate_mutes(user_ids: Iterable[int]) -> None:
+    invalidate_keys(MUTES_CACHE_KEY.format(uid) for uid in {uid for uid in user_ids if uid})
+
+
+def invalidate_conversation_viewers(conversation_ids: Iterable[int]) -> None:
+    invalidate_keys(VIEWERS_CACHE_KEY.format(cid) for cid in {cid for cid in conversation_ids if cid})
+
+
+def _mute_windows(user_ids: Iterable[int]) -> Dict[int, Dict[int, Any]]:
+    """``{user_id: {conversation_id: muted_until}}`` from the cache registry (DB on miss)."""
+    ids = list({uid for uid in user_ids if uid})
+    keys = {uid: MUTES_CACHE_KEY.format(uid) for uid in ids}
+    use_cache = registry_enabled()
+    try:
+        cached = cache.get_many(list(keys.values())) if use_cache else {}
+    except Exception:
+        cached = {}
+    windows: Dict[int, Dict[int, Any]] = {}
+    missing: List[int] = []
+    for uid, key in keys.items():
+        if key in cached:
+            windows[uid] = cached[key]
+        else:
+            missing.append(uid)
+    if missing:
+        loaded: Dict[int, Dict[int, Any]] = {uid: {} for uid in missing}
+        rows = ConversationMute.objects.filter(user_id__in=missing).values_list("user_id", "conversation_id", "muted_until")
+        for user_id, conversation_id, muted_until in rows:
+            loaded[user_id][conversation_id] = muted_until
+        try:
+            if use_cache:
+                cache.set_many({keys[uid]: value for uid, value in loaded.items()}, registry_ttl())
+        except Exception:
+            logger.debug("mute cache fill failed", exc_info=True)
+        windows.update(loaded)
+    return windows
+
+
 def _muted_user_ids(conversation_id: int, user_ids: Iterable[int]) -> set[int]:
     audience = [uid for uid in user_ids if uid]
     if not audience:
         return set()
-    muted_qs = ConversationMute.objects.filter(conversation_id=conversation_id, user_id__in=audience)
     now = timezone.now()
     muted: set[int] = set()
-    for mute in muted_qs:
-        if mute.muted_until is None or mute.muted_until > now:
-            muted.add(mute.user_id)
+    for user_id, mutes in _mute_windows(audience).items():
+        if conversation_id not in mutes:
+            continue
+        muted_until = mutes[conversation_id]
+        if muted_until is None or muted_until > now:
+            muted.add(user_id)
     return muted
 
 
+def _push_viewer_ids(conversation: Conversation) -> List[int]:
+    """``get_conversation_viewer_ids`` with the extra-member part served from the cache registry."""
+    key = VIEWERS_CACHE_KEY.format(conversation.id)
+    use_cache = registry_enabled()
+    try:
+        extras = cache.get(key) if use_cache else None
+    except Exception:
+        extras = None
+    if extras is None:
+        base = {conversation.user_a_id, conversation.user_b_id}
+        extras = [uid for uid in get_conversation_viewer_ids(conversation) if uid not in base]
+        try:
+            if use_cache:
+                cache.set(key, extras, registry_ttl())
+        except Exception:
+            logger.debug("viewer cache fill failed", exc_info=True)
+    out: List[int] = []
+    for uid in [conversation.user_a_id, conversation.user_b_id, *extras]:
+        if uid and uid not in out:
+            out.append(uid)
+    return out
+
+
 def send_message_push(
     conversation: Conversation,
     message: Message,
@@ -84,7 +216,7 @@ def send_message_push(
         logger.warning("⚠️ No conversation or message provided")
         return
     try:
-        all_viewers = get_conversation_viewer_ids(conversation)
+        all_viewers = _push_viewer_ids(conversation)
         logger.info(f"📋 All conversation viewers: {all_viewers}")
         
         target_user_ids = [uid for uid in all_viewers if uid and uid != message.sender_id]
@@ -104,8 +236,7 @@ def send_message_push(
         muted_ids = _muted_user_ids(conversation.id, tokens_by_user.keys())
         logger.info(f"🔇 Muted user IDs: {muted_ids}")
         
-        unread_cache: Dict[int, int] = {}
-        push_batch: List[PushMessage] = []
+        admitted: Dict[int, List[str]] = {}
         for user_id, tokens in tokens_by_user.items():
             if user_id in muted_ids:
                 logger.info(f"⏭️ Skipping muted user {user_id}")
@@ -113,10 +244,17 @@ def send_message_push(
             if not tokens:
                 logger.info(f"⏭️ Skipping user {user_id} - no tokens")
                 continue
-            unread = unread_cache.get(user_id)
-            if unread is None:
-                unread = _total_unread_for_user(user_id)
-                unread_cache[user_id] = unread
+            bundle_data = {**(data or {}), "message_id": message.id, "sender_id": message.sender_id}
+            if not get_bundler().admit(user_id, conversation.id, title=title, data=bundle_data):
+                logger.info(f"🧺 Bundling push for user {user_id} in conversation {conversation.id}")
+                continue
+            admitted[user_id] = tokens
+
+        unread_by_user = _total_unread_by_user(admitted.keys())
+        delivered_badges: Dict[int, int] = {}
+        push_batch: List[PushMessage] = []
+        for user_id, tokens in admitted.items():
+            unread = unread_by_user.get(user_id, 0)
             
             logger.info(f"📊 User {user_id}: unread={unread}, tokens={len(tokens)}")
             
@@ -133,6 +271,7 @@ def send_message_push(
             badge_value = int(unread) if unread and unread > 0 else 0
             
             logger.info(f"🔢 [PUSH] Preparing push for user {user_id}: badge_value={badge_value}, unread_count={unread}")
+            delivered_badges[user_id] = badge_value
             
             for token in tokens:
                 logger.info(f"➕ Adding push message for user {user_id}, token={token[:20]}..., badge={badge_value}")
@@ -152,6 +291,8 @@ def send_message_push(
             logger.info(f"🔥 Calling send_push_messages with {len(push_batch)} messages")
             send_push_messages(push_batch)
             logger.info(f"✅ send_push_messages completed")
+            for user_id, badge_value in delivered_badges.items():
+                remember_badge(user_id, badge_value)
         else:
             logger.warning("⚠️ push_batch is EMPTY - no messages to send!")
     except Exception:
@@ -164,6 +305,53 @@ def send_message_push(
         )
 
 
+BUNDLE_SUMMARY_MESSAGES = "رسائل جديدة: {count}"
+BUNDLE_SUMMARY_TRANSACTIONS = "معاملات جديدة: {count}"
+
+
+def send_bundled_message_push(
+    user_id: int,
+    conversation_id: int,
+    *,
+    count: int,
+    only_transactions: bool,
+    title: str,
+    data: Dict[str, Any] | None = None,
+) -> None:
+    """Send one summary push for ``count`` messages held back by the push bundler."""
+    if count <= 0:
+        return
+    if user_id in _muted_user_ids(conversation_id, [user_id]):
+        return
+    tokens = get_active_device_tokens([user_id]).get(user_id, [])
+    if not tokens:
+        return
+    template = BUNDLE_SUMMARY_TRANSACTIONS if only_transactions else BUNDLE_SUMMARY_MESSAGES
+    summary = template.format(count=count)
+    unread = _total_unread_for_user(user_id)
+    badge_value = int(unread) if unread and unread > 0 else 0
+    payload: Dict[str, Any] = {**(data or {})}
+    # Summary replaces per-message details; keep ids so taps still open the chat
+    payload.pop("transaction", None)
+    payload.update({
+        "type": "message",
+        "conversation_id": conversation_id,
+        "unread_count": unread,
+        "bundle_count": count,
+        "preview": summary,
+    })
+    normalized = _normalize_value(payload)
+    logger.info(
+        "🧺 Sending bundled push",
+        extra={"user_id": user_id, "conversation_id": conversation_id, "count": count, "tokens": len(tokens)},
+    )
+    send_push_messages([
+        PushMessage(to=token, title=title, body=summary, data=normalized, badge=badge_value)
+        for token in tokens
+    ])
+    remember_badge(user_id, badge_value)
+
+
 def send_unread_badge_push(
     user_id: int,
     unread_count: int,
@@ -216,3 +404,4 @@ def send_unread_badge_push(
         extra={"user_id": user_id, "unread_count": normalized_count, "tokens": len(push_batch)},
     )
     send_push_messages(push_batch)
+    remember_badge(user_id, normalized_count)
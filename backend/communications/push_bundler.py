@@ -0,0 +1,144 @@
+"""Bundling of message pushes for bursty conversations.
+
+The first message for a (recipient, conversation) pair is pushed immediately
+and opens a ``PUSH_BUNDLE_WINDOW`` second window. Messages arriving inside the
+window are not pushed one by one; when the window closes they go out as a
+single summary push ("5 new transactions"). The summary carries the same
+``conversation_id`` as the individual pushes, so FCM's per-conversation
+collapse key (see ``accounts.fcm_push``) replaces the earlier notification
+instead of stacking a new one. A window that produced a summary stays open for
+another period; a quiet one closes so the next message is immediate again.
+
+Windows are per process and kept in memory; they close on the shared
+``communications.deadlines`` timer and worker pool rather than one timer
+thread per pair.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.db import connections
+
+from .deadlines import Deadlines, get_deadlines
+
+logger = logging.getLogger(__name__)
+
+Key = Tuple[int, int]
+
+
+class _Bundle:
+    __slots__ = ('count', 'kinds', 'title', 'data', 'deadline')
+
+    def __init__(self):
+        self.count = 0
+        self.kinds: set = set()
+        self.title = ''
+        self.data: Dict[str, Any] = {}
+        self.deadline: Optional[list] = None
+
+
+class PushBundler:
+    def __init__(self, window: Optional[float] = None, deadlines: Optional[Deadlines] = None):
+        self._window = window
+        self._deadlines = deadlines if deadlines is not None else get_deadlines()
+        self._lock = threading.Lock()
+        self._bundles: Dict[Key, _Bundle] = {}
+        self.stats = {'immediate': 0, 'bundled': 0, 'summaries': 0}
+
+    @property
+    def window(self) -> float:
+        if self._window is not None:
+            return self._window
+        return float(getattr(settings, 'PUSH_BUNDLE_WINDOW', 30.0))
+
+    def _open(self, key: Key, window: float) -> _Bundle:
+        bundle = _Bundle()
+        bundle.deadline = self._deadlines.call_later(window, self._fire, key)
+        self._bundles[key] = bundle
+        return bundle
+
+    def admit(self, user_id: int, conversation_id: int, *, title: str, data: Optional[Dict[str, Any]] = None) -> bool:
+        """True when the push should go out now; False when it was folded into a bundle."""
+        window = self.window
+        if window <= 0:
+            return True
+        key = (user_id, conversation_id)
+        with self._lock:
+            bundle = self._bundles.get(key)
+            if bundle is None:
+                self._open(key, window)
+                self.stats['immediate'] += 1
+                return True
+            bundle.count += 1
+            bundle.kinds.add((data or {}).get('kind') or 'text')
+            bundle.title = title
+            bundle.data = dict(data or {})
+            self.stats['bundled'] += 1
+            return False
+
+    def _fire(self, key: Key) -> None:
+        try:
+            self.flush(key)
+        finally:
+            # Deadline workers get their own DB connections; don't leak them
+            connections.close_all()
+
+    def flush(self, key: Optional[Key] = None) -> None:
+        """Send due summaries now (one pair, or all when ``key`` is None)."""
+        due = []
+        with self._lock:
+            keys = list(self._bundles) if key is None else [key]
+            window = self.window
+            for k in keys:
+                bundle = self._bundles.pop(k, None)
+                if bundle is None:
+                    continue
+                self._deadlines.cancel(bundle.deadline)
+                if bundle.count:
+                    due.append((k, bundle))
+                    if window > 0:
+                        # Keep the burst throttled: the next message joins a new bundle
+                        self._open(k, window)
+        for (user_id, conversation_id), bundle in due:
+            self._deliver(user_id, conversation_id, bundle)
+
+    def reset(self) -> None:
+        with self._lock:
+            for bundle in self._bundles.values():
+                self._deadlines.cancel(bundle.deadline)
+            self._bundles.clear()
+
+    def _deliver(self, user_id: int, conversation_id: int, bundle: _Bundle) -> None:
+        from .push import send_bundled_message_push
+        try:
+            send_bundled_message_push(
+                user_id,
+                conversation_id,
+                count=bundle.count,
+                only_transactions=bundle.kinds == {'transaction'},
+                title=bundle.title,
+                data=bundle.data,
+            )
+            with self._lock:
+                self.stats['summaries'] += 1
+        except Exception:
+            logger.exception(
+                "Bundled push failed",
+                extra={"event": "push_bundle_error", "user_id": user_id, "conversation_id": conversation_id},
+            )
+
+
+_bundler: Optional[PushBundler] = None
+_bundler_lock = threading.Lock()
+
+
+def get_bundler() -> PushBundler:
+    global _bundler
+    if _bundler is None:
+        with _bundler_lock:
+            if _bundler is None:
+                _bundler = PushBundler()
+    return _bundler
@@ -1,19 +1,74 @@
 import os
-import pusher
+import threading
+
+from . import sdk
+from .providers import PUSHER, call_provider, provider_timeout
 
 PUSHER_APP_ID = os.environ.get('PUSHER_APP_ID')
 PUSHER_KEY = os.environ.get('PUSHER_KEY')
 PUSHER_SECRET = os.environ.get('PUSHER_SECRET')
 PUSHER_CLUSTER = os.environ.get('PUSHER_CLUSTER', 'eu')
 
+
+class GuardedPusher:
+    """Pusher client whose triggers go through the provider breaker and retry queue.
+
+    The ``pusher`` SDK is imported and the real client built on first use
+    (``client``). Everything else (``authenticate`` etc.) is forwarded to it.
+    """
+
+    def __init__(self, **options):
+        self._options = options
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = sdk.load('pusher').Pusher(**self._options)
+        return self._client
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.client, name)
+
+    def trigger(self, channels, event_name, data, *args, **kwargs):
+        return call_provider(
+            PUSHER, self.client.trigger, channels, event_name, data, *args,
+            retry={'batch': [{'channel': channels, 'name': event_name, 'data': data}]},
+            **kwargs,
+        )
+
+    def trigger_batch(self, batch, *args, **kwargs):
+        return call_provider(PUSHER, self.client.trigger_batch, batch, *args, retry={'batch': list(batch)}, **kwargs)
+
+
 if not (PUSHER_APP_ID and PUSHER_KEY and PUSHER_SECRET and PUSHER_CLUSTER):
     # Avoid crashing if not configured in this environment; you can assert in production
     pusher_client = None
 else:
-    pusher_client = pusher.Pusher(
+    pusher_client = GuardedPusher(
         app_id=PUSHER_APP_ID,
         key=PUSHER_KEY,
         secret=PUSHER_SECRET,
         cluster=PUSHER_CLUSTER,
         ssl=True,
+        timeout=provider_timeout(PUSHER),
     )
+
+
+def replay(payload):
+    """Re-send a queued Pusher batch (see ``providers.REPLAY_HANDLERS``)."""
+    if pusher_client is None:
+        return
+    raw = pusher_client.client
+    batch = payload.get('batch') or []
+    if len(batch) == 1:
+        item = batch[0]
+        raw.trigger(item['channel'], item['name'], item['data'])
+        return
+    for start in range(0, len(batch), 10):
+        raw.trigger_batch(batch[start:start + 10])
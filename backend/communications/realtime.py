@@ -0,0 +1,400 @@
+"""Realtime fan-out: build an event once, encode it once, deliver it to every backend.
+
+Call sites describe *what* happened as a list of ``(route, event, only)`` items:
+
+* ``route`` is ``conversation_route(id)`` or ``user_route(id)``; each backend maps it
+  to its own naming (Channels ``conv_<id>``/``user_<id>`` groups, Pusher
+  ``chat_<id>``/``user_<id>`` channels).
+* ``event`` is a plain dict; its JSON text is produced lazily by orjson and shared
+  by all backends (and by every consumer receiving it from the channel layer).
+  Conversation frames are the exception on Channels: the journaling layer stamps
+  ``event_seq`` first and encodes them itself, still once per event.
+* ``only`` optionally restricts the item to some backends by name, e.g. inbox
+  badges are Channels-only while the legacy ``notify`` shape is Pusher-only.
+
+Backends are configured with ``REALTIME_BACKENDS`` (dotted paths). Per-backend
+latency/error counters are kept in-process and exposed via ``metrics_snapshot()``.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import orjson
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+CHANNELS = 'channels'
+PUSHER = 'pusher'
+
+DEFAULT_BACKENDS = (
+    'communications.realtime.ChannelsBackend',
+    'communications.realtime.PusherBackend',
+)
+
+
+def encode_event(data: Any) -> str:
+    return orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+class RealtimeEvent:
+    """An event payload plus its cached JSON text."""
+
+    __slots__ = ('data', '_text')
+
+    def __init__(self, data: dict):
+        self.data = data
+        self._text: Optional[str] = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = encode_event(self.data)
+        return self._text
+
+
+Route = Tuple[str, int]
+Item = Tuple[Route, RealtimeEvent, Optional[frozenset]]
+
+
+def conversation_route(conversation_id: int) -> Route:
+    return ('conversation', int(conversation_id))
+
+
+def user_route(user_id: int) -> Route:
+    return ('user', int(user_id))
+
+
+# ---------------------------------------------------------------------------
+# Event builders (single source of truth for payload shapes)
+# ---------------------------------------------------------------------------
+
+def _iso(value) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def message_event(message, *, sender, sender_display: str, body: Optional[str] = None,
+                  kind: Optional[str] = None, client_id: Optional[str] = None, **extra) -> dict:
+    """``chat.message`` payload understood by both WS and Pusher clients."""
+    text = message.body if body is None else body
+    status_num = message.delivery_status or 0
+    data = {
+        'type': 'chat.message',
+        'id': message.id,
+        'message_id': message.id,
+        'seq': message.id,
+        'conversation_id': message.conversation_id,
+        'sender': sender.username,
+        'username': sender.username,
+        'senderDisplay': sender_display,
+        'display_name': sender_display,
+        'body': text,
+        'message': text,
+        'created_at': _iso(message.created_at),
+        'delivered_at': _iso(message.delivered_at),
+        'read_at': _iso(message.read_at),
+        'kind': kind or message.type,
+        'status': 'read' if status_num >= 2 else ('delivered' if status_num >= 1 else 'sent'),
+        'delivery_status': status_num,
+        'client_id': client_id if client_id is not None else message.client_id,
+    }
+    data.update({k: v for k, v in extra.items() if v is not None})
+    return data
+
+
+def status_event(message_id: int, delivery_status: int, *, read_at: Optional[str] = None,
+                 conversation_id: Optional[int] = None) -> dict:
+    data = {
+        'type': 'message.status',
+        'id': int(message_id),
+        'message_id': int(message_id),
+        'delivery_status': delivery_status,
+        'status': 'read' if delivery_status >= 2 else 'delivered',
+    }
+    if read_at:
+        data['read_at'] = read_at
+    if conversation_id is not None:
+        data['conversation_id'] = int(conversation_id)
+    return data
+
+
+def status_range_event(conversation_id: int, first_id: int, last_id: int, delivery_status: int,
+                       *, count: Optional[int] = None, read_at: Optional[str] = None) -> dict:
+    """``message.status`` covering every inbound message in ``[from_id, to_id]``.
+
+    ``id``/``message_id`` point at the newest message so clients that only
+    understand single-message status still tick the latest bubble.
+    """
+    data = status_event(last_id, delivery_status, read_at=read_at, conversation_id=conversation_id)
+    data['from_id'] = int(first_id)
+    data['to_id'] = int(last_id)
+    if count is not None:
+        data['count'] = int(count)
+    return data
+
+
+def inbox_update_event(conversation_id: int, preview: str, last_message_at, unread_count: int) -> dict:
+    return {
+        'type': 'inbox.update',
+        'conversation_id': conversation_id,
+        'last_message_preview': (preview or '')[:80],
+        'last_message_at': last_message_at if isinstance(last_message_at, str) or last_message_at is None else last_message_at.isoformat(),
+        'unread_count': unread_count,
+    }
+
+
+def notify_event(notify_type: str, conversation_id: int, sender_display: str, preview: str, last_message_at) -> dict:
+    """Legacy Pusher ``notify`` shape consumed by the web inbox."""
+    return {
+        'type': notify_type,
+        'conversation_id': conversation_id,
+        'from': sender_display,
+        'preview': (preview or '')[:80],
+        'last_message_at': last_message_at if isinstance(last_message_at, str) or last_message_at is None else last_message_at.isoformat(),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Backends
+# ---------------------------------------------------------------------------
+
+class RealtimeBackend:
+    name = 'base'
+    # Receive every item regardless of ``only`` (used by test/recording backends)
+    capture_all = False
+
+    def accepts(self, only: Optional[frozenset]) -> bool:
+        return self.capture_all or only is None or self.name in only
+
+    def send(self, items: Sequence[Item]) -> None:  # pragma: no cover - interface
+        raise NotImplementedError
+
+    async def asend(self, items: Sequence[Item]) -> None:
+        await sync_to_async(self.send, thread_sensitive=False)(items)
+
+
+class ChannelsBackend(RealtimeBackend):
+    name = CHANNELS
+
+    @staticmethod
+    def group_for(route: Route) -> str:
+        kind, key = route
+        return f"conv_{key}" if kind == 'conversation' else f"user_{key}"
+
+    def _layer(self):
+        from channels.layers import get_channel_layer
+        return get_channel_layer()
+
+    @staticmethod
+    def message_for(route: Route, event: RealtimeEvent) -> dict:
+        message = {'type': 'broadcast.message', 'data': event.data}
+        if route[0] != 'conversation':
+            # Conversation frames get event_seq from the journaling layer, which encodes them after stamping
+            message['text'] = event.text
+        return message
+
+    def send(self, items: Sequence[Item]) -> None:
+        layer = self._layer()
+        if layer is None:
+            return
+        for route, event, _ in items:
+            async_to_sync(layer.group_send)(self.group_for(route), self.message_for(route, event))
+
+    async def asend(self, items: Sequence[Item]) -> None:
+        layer = self._layer()
+        if layer is None:
+            return
+        for route, event, _ in items:
+            await layer.group_send(self.group_for(route), self.message_for(route, event))
+
+
+class PusherBackend(RealtimeBackend):
+    name = PUSHER
+    # Pusher's batch endpoint accepts at most 10 events per request
+    batch_size = 10
+
+    @staticmethod
+    def channel_for(route: Route) -> Tuple[str, str]:
+        kind, key = route
+        return (f"chat_{key}", 'message') if kind == 'conversation' else (f"user_{key}", 'notify')
+
+    def send(self, items: Sequence[Item]) -> None:
+        from .pusher_client import pusher_client
+        if not pusher_client or not items:
+            return
+        batch = []
+        for route, event, _ in items:
+            channel, name = self.channel_for(route)
+            batch.append({'channel': channel, 'name': name, 'data': event.text})
+        if len(batch) == 1:
+            only = batch[0]
+            pusher_client.trigger(only['channel'], only['name'], only['data'])
+            return
+        for start in range(0, len(batch), self.batch_size):
+            pusher_client.trigger_batch(batch[start:start + self.batch_size])
+
+
+class NullBackend(RealtimeBackend):
+    name = 'null'
+
+    def send(self, items: Sequence[Item]) -> None:
+        return None
+
+
+class RecordingBackend(RealtimeBackend):
+    """Keeps every delivered item in memory; handy in tests."""
+
+    name = 'recording'
+    capture_all = True
+    sent: List[Tuple[Route, dict, Optional[frozenset]]] = []
+
+    def send(self, items: Sequence[Item]) -> None:
+        for route, event, only in items:
+            RecordingBackend.sent.append((route, event.data, only))
+
+    async def asend(self, items: Sequence[Item]) -> None:
+        self.send(items)
+
+
+# ---------------------------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------------------------
+
+_metrics: Dict[str, Dict[str, float]] = {}
+_metrics_lock = threading.Lock()
+
+
+def _record(backend: str, elapsed: float, count: int, failed: bool) -> None:
+    with _metrics_lock:
+        m = _metrics.setdefault(backend, {'calls': 0, 'events': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+        m['calls'] += 1
+        m['events'] += count
+        m['total_seconds'] += elapsed
+        if elapsed > m['max_seconds']:
+            m['max_seconds'] = elapsed
+        if failed:
+            m['errors'] += 1
+
+
+def metrics_snapshot() -> Dict[str, Dict[str, float]]:
+    with _metrics_lock:
+        out = {}
+        for name, m in _metrics.items():
+            calls = m['calls'] or 1
+            out[name] = {
+                'calls': int(m['calls']),
+                'events': int(m['events']),
+                'errors': int(m['errors']),
+                'avg_ms': round(m['total_seconds'] * 1000 / calls, 3),
+                'max_ms': round(m['max_seconds'] * 1000, 3),
+            }
+        return out
+
+
+def reset_metrics() -> None:
+    with _metrics_lock:
+        _metrics.clear()
+
+
+# ---------------------------------------------------------------------------
+# Dispatcher
+# ---------------------------------------------------------------------------
+
+class RealtimeDispatcher:
+    def __init__(self, backends: Iterable[RealtimeBackend]):
+        self.backends = list(backends)
+
+    @staticmethod
+    def _items(entries) -> List[Item]:
+        items: List[Item] = []
+        for entry in entries:
+            route, data = entry[0], entry[1]
+            only = entry[2] if len(entry) > 2 else None
+            event = data if isinstance(data, RealtimeEvent) else RealtimeEvent(data)
+            items.append((route, event, frozenset(only) if only else None))
+        return items
+
+    def publish_many(self, entries) -> None:
+        items = self._items(entries)
+        for backend in self.backends:
+            selected = [item for item in items if backend.accepts(item[2])]
+            if not selected:
+                continue
+            started = time.perf_counter()
+            failed = False
+            try:
+                backend.send(selected)
+            except Exception:
+                failed = True
+                logger.exception("Realtime backend failed", extra={"backend": backend.name, "events": len(selected)})
+            _record(backend.name, time.perf_counter() - started, len(selected), failed)
+
+    async def apublish_many(self, entries) -> None:
+        items = self._items(entries)
+        for backend in self.backends:
+            selected = [item for item in items if backend.accepts(item[2])]
+            if not selected:
+                continue
+            started = time.perf_counter()
+            failed = False
+            try:
+                await backend.asend(selected)
+            except Exception:
+                failed = True
+                logger.exception("Realtime backend failed", extra={"backend": backend.name, "events": len(selected)})
+            _record(backend.name, time.perf_counter() - started, len(selected), failed)
+
+    def publish(self, route: Route, data, only: Optional[Iterable[str]] = None) -> None:
+        self.publish_many([(route, data, only)])
+
+    async def apublish(self, route: Route, data, only: Optional[Iterable[str]] = None) -> None:
+        await self.apublish_many([(route, data, only)])
+
+
+_dispatcher: Optional[RealtimeDispatcher] = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher() -> RealtimeDispatcher:
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                paths = getattr(settings, 'REALTIME_BACKENDS', None) or DEFAULT_BACKENDS
+                _dispatcher = RealtimeDispatcher(import_string(path)() for path in paths)
+    return _dispatcher
+
+
+def reset_dispatcher() -> None:
+    global _dispatcher
+    with _dispatcher_lock:
+        _dispatcher = None
+
+
+# ---------------------------------------------------------------------------
+# High level helpers
+# ---------------------------------------------------------------------------
+
+def new_message_entries(conversation_id: int, event: dict, *, viewer_unread: Dict[int, int],
+                        preview: str, last_message_at, notify: Optional[dict] = None,
+                        status_events: Sequence[dict] = ()) -> list:
+    """Entries for a freshly created message.
+
+    ``viewer_unread`` maps each recipient (sender excluded) to their total unread
+    count for the Channels ``inbox.update``. ``notify`` is the Pusher inbox ping,
+    identical for every recipient so it is encoded once.
+    """
+    route = conversation_route(conversation_id)
+    entries: list = [(route, event)]
+    entries.extend((route, status, {CHANNELS}) for status in status_events)
+    for uid, unread in viewer_unread.items():
+        entries.append((user_route(uid), inbox_update_event(conversation_id, preview, last_message_at, unread), {CHANNELS}))
+    if notify is not None:
+        shared = RealtimeEvent(notify)
+        entries.extend((user_route(uid), shared, {PUSHER}) for uid in viewer_unread)
+    return entries
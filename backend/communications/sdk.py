@@ -0,0 +1,125 @@
+"""Lazy loading of heavy third-party SDKs.
+
+Importing ``firebase_admin`` (googleapiclient, httplib2, pyparsing, ...),
+``pusher``, ``pywebpush`` or ``requests`` at module level made every Daphne
+worker and every ``manage.py`` run pay for them, even when nothing is sent.
+Code that talks to a provider asks this registry for the module at the moment
+it needs it:
+
+    messaging = sdk.load('firebase.messaging')
+
+``load`` imports once per process and returns ``None`` when the package is
+missing, so callers keep their "optional dependency" fallbacks. ``available``
+answers the same question without importing anything. ``lazy`` gives a
+module-level stand-in that imports on first attribute access, for modules that
+use an SDK throughout.
+
+``warm_up`` imports the configured SDKs and initializes the Firebase app and
+the Pusher client ahead of the first send; ``mujard.asgi`` runs it in a
+background thread when ``SDK_WARMUP`` is enabled.
+"""
+from __future__ import annotations
+
+import importlib
+import importlib.util
+import logging
+import threading
+from types import ModuleType
+from typing import Dict, Iterable, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SDKS = {
+    'firebase': 'firebase_admin',
+    'firebase.credentials': 'firebase_admin.credentials',
+    'firebase.messaging': 'firebase_admin.messaging',
+    'pusher': 'pusher',
+    'webpush': 'pywebpush',
+    'pyotp': 'pyotp',
+    'requests': 'requests',
+}
+
+_MISSING = object()
+_modules: Dict[str, object] = {}
+_lock = threading.Lock()
+
+
+def load(name: str) -> Optional[ModuleType]:
+    """Import the SDK registered as ``name`` (once per process); ``None`` if it is not installed."""
+    module = _modules.get(name)
+    if module is None:
+        with _lock:
+            module = _modules.get(name)
+            if module is None:
+                try:
+                    module = importlib.import_module(SDKS[name])
+                except ImportError as e:
+                    logger.warning("SDK %s unavailable: %s", name, e)
+                    module = _MISSING
+                _modules[name] = module
+    return None if module is _MISSING else module
+
+
+def available(name: str) -> bool:
+    """True when the SDK is installed; does not import it."""
+    module = _modules.get(name)
+    if module is not None:
+        return module is not _MISSING
+    try:
+        return importlib.util.find_spec(SDKS[name].split('.')[0]) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+class LazyModule:
+    """Module proxy that imports the registered SDK on first attribute access."""
+
+    def __init__(self, name: str):
+        self.__dict__['_sdk_name'] = name
+
+    def __getattr__(self, attr):
+        module = load(self._sdk_name)
+        if module is None:
+            raise AttributeError(f"SDK {self._sdk_name} is not installed")
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return f"<lazy sdk {self._sdk_name!r}>"
+
+
+def lazy(name: str) -> LazyModule:
+    return LazyModule(name)
+
+
+def loaded() -> Dict[str, bool]:
+    return {name: module is not _MISSING for name, module in list(_modules.items())}
+
+
+def warm_up(names: Optional[Iterable[str]] = None) -> None:
+    """Import SDKs and initialize provider clients ahead of the first send; never raises."""
+    if names is None:
+        names = getattr(settings, 'SDK_WARMUP_MODULES', None) or SDKS
+    for name in names:
+        try:
+            load(name)
+        except Exception:
+            logger.debug("SDK warm-up failed for %s", name, exc_info=True)
+    try:
+        from accounts.fcm_push import _initialize_firebase
+        _initialize_firebase()
+    except Exception:
+        logger.debug("Firebase warm-up failed", exc_info=True)
+    try:
+        from .pusher_client import pusher_client
+        if pusher_client is not None:
+            pusher_client.client
+    except Exception:
+        logger.debug("Pusher warm-up failed", exc_info=True)
+
+
+def start_warm_up() -> threading.Thread:
+    thread = threading.Thread(target=warm_up, name='sdk-warm-up', daemon=True)
+    thread.start()
+    return thread
@@ -14,12 +14,12 @@ from .models import (
     ContactLink,
     CustomEmoji,
     PrivacyPolicy,
-    ConversationSettlement,
     LoginPageSetting,
     LoginInstruction,
     is_wallet_settlement_body,
 )
 from .push import send_message_push
+from .tx_meta import parse_transaction_body
 from finance.models import Currency
 from django.core.exceptions import ValidationError
 from django.utils import timezone
@@ -56,37 +56,7 @@ class CurrencySerializer(serializers.ModelSerializer):
         fields = ["id", "code", "symbol", "name"]
 
 
-_TRANSACTION_BODY_RE = re.compile(r'^معاملة:\s*(لنا|لكم)\s*([0-9]+(?:\.[0-9]+)?)\s*([^\s]+)(?:\s*-\s*(.*))?$', re.DOTALL | re.MULTILINE)
-
-
-def _parse_transaction_body(body: str | None):
-    if not body:
-        return None
-    try:
-        text = body.strip()
-    except Exception:
-        return None
-    m = _TRANSACTION_BODY_RE.match(text)
-    if not m:
-        return None
-    direction = 'lna' if m.group(1) == 'لنا' else 'lkm'
-    amount_raw = m.group(2)
-    symbol = (m.group(3) or '').strip()
-    note = (m.group(4) or '').strip()
-    try:
-        amount_val = float(amount_raw)
-    except Exception:
-        try:
-            amount_val = float(amount_raw.replace(',', '.'))
-        except Exception:
-            amount_val = 0.0
-    return {
-        'direction': direction,
-        'amount': amount_val,
-        'currency': symbol,
-        'symbol': symbol,
-        'note': note,
-    }
+_parse_transaction_body = parse_transaction_body
 
 
 class ContactLinkSerializer(serializers.ModelSerializer):
@@ -219,12 +189,19 @@ class ConversationSerializer(serializers.ModelSerializer):
             "deleteRequestedBy", "deleteRequestedById", "deleteRequestedAt",
         ]
 
+    def _viewer_mute(self, obj, user):
+        # ConversationViewSet prefetches the viewer's mute as ``viewer_mutes``
+        prefetched = getattr(obj, 'viewer_mutes', None)
+        if prefetched is not None:
+            return prefetched[0] if prefetched else None
+        return ConversationMute.objects.filter(user=user, conversation=obj).first()
+
     def get_mutedUntil(self, obj):
         request = self.context.get('request') if hasattr(self, 'context') else None
         if not request or not request.user or not request.user.is_authenticated:
             return None
         try:
-            m = ConversationMute.objects.filter(user=request.user, conversation=obj).first()
+            m = self._viewer_mute(obj, request.user)
             return m.muted_until.isoformat() if (m and m.muted_until) else None
         except Exception:
             return None
@@ -261,7 +238,7 @@ class ConversationSerializer(serializers.ModelSerializer):
         if not request or not request.user or not request.user.is_authenticated:
             return False
         try:
-            m = ConversationMute.objects.filter(user=request.user, conversation=obj).first()
+            m = self._viewer_mute(obj, request.user)
             if not m:
                 return False
             if m.muted_until is None:
@@ -461,15 +438,7 @@ class MessageSerializer(serializers.ModelSerializer):
         subtype = self.get_systemSubtype(obj)
         if subtype != 'wallet_settled':
             return None
-        try:
-            settlement = ConversationSettlement.objects.filter(
-                conversation_id=obj.conversation_id,
-                settled_at=obj.created_at,
-            ).only('settled_at').first()
-            if settlement:
-                return settlement.settled_at.isoformat()
-        except Exception:
-            pass
+        # The settlement row is stamped with the system message's created_at, so no lookup is needed
         try:
             return obj.created_at.isoformat()
         except Exception:
@@ -489,10 +458,13 @@ class MessageSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
     def to_representation(self, instance):
-        """Guarantee monotonic delivery numeric status derived from timestamps.
+        """Guarantee monotonic delivery numeric status derived from timestamps and read markers.
 
-        Even if the stored delivery_status were stale (e.g. read_at set but delivery_status accidentally 1),
-        we upgrade it in the API response so the frontend never regresses blue ticks after refresh.
+        Reads only move ConversationReadMarker rows, so a message is reported read when any
+        viewer other than its sender has a marker at or past it (``read_markers`` context:
+        ``{user_id: (last_read_message_id, updated_at)}``, or ``read_markers_by_conversation``
+        keyed by conversation id for mixed lists); ``read_at`` falls back to the time
+        that marker last moved. Stored timestamps (legacy rows) still count.
         """
         data = super().to_representation(instance)
         try:
@@ -515,16 +487,25 @@ class MessageSerializer(serializers.ModelSerializer):
                 if data.get('delivery_status', 0) < 2:
                     data['delivery_status'] = 2
                     data['status'] = 'read'
+            if data.get('delivery_status', 0) < 2 or not data.get('read_at'):
+                read_markers = ctx.get('read_markers')
+                if read_markers is None:
+                    read_markers = (ctx.get('read_markers_by_conversation') or {}).get(instance.conversation_id)
+                for reader_id, (last_id, marked_at) in (read_markers or {}).items():
+                    if reader_id != instance.sender_id and instance.id <= last_id:
+                        data['delivery_status'] = 2
+                        data['status'] = 'read'
+                        if not data.get('read_at') and marked_at:
+                            data['read_at'] = self.fields['read_at'].to_representation(marked_at)
+                        if not data.get('delivered_at'):
+                            data['delivered_at'] = data['read_at']
+                        break
         except Exception:
             pass
         try:
             if instance.type == 'transaction':
-                tx_payload = None
-                txn = getattr(instance, 'transaction_record', None)
-                if txn is not None:
-                    tx_payload = txn.build_message_meta()
-                if not tx_payload:
-                    tx_payload = _parse_transaction_body(instance.body)
+                # Written by create_transaction; body parsing only covers rows not yet backfilled
+                tx_payload = instance.tx_meta or _parse_transaction_body(instance.body)
                 if tx_payload:
                     data['tx'] = tx_payload
         except Exception:
@@ -0,0 +1,43 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import AttachmentFile, ConversationMember, ConversationMute, ConversationReadMarker, Message, SyncChange
+
+
+@receiver(post_save, sender=Message)
+def record_message_sync_change(sender, instance, created, **kwargs):
+    if not created:
+        return
+    SyncChange.record(instance.conversation_id, SyncChange.KIND_MESSAGE, message_id=instance.id)
+
+
+@receiver(post_save, sender=Message)
+def index_message_attachment(sender, instance, created, **kwargs):
+    # The attachment collector (communications.attachment_gc) detects orphans against this index
+    if created and instance.attachment:
+        AttachmentFile.record(instance)
+
+
+@receiver(post_save, sender=ConversationReadMarker)
+def record_read_marker_sync_change(sender, instance, **kwargs):
+    SyncChange.record(
+        instance.conversation_id,
+        SyncChange.KIND_READ,
+        message_id=instance.last_read_message_id,
+        payload={'reader_id': instance.user_id},
+    )
+
+
+@receiver(post_save, sender=ConversationMute)
+@receiver(post_delete, sender=ConversationMute)
+def invalidate_mute_registry(sender, instance, **kwargs):
+    # mute/unmute actions go through update_or_create / queryset delete, both of which signal
+    from .push import invalidate_mutes
+    invalidate_mutes([instance.user_id])
+
+
+@receiver(post_save, sender=ConversationMember)
+@receiver(post_delete, sender=ConversationMember)
+def invalidate_viewer_registry(sender, instance, **kwargs):
+    from .push import invalidate_conversation_viewers
+    invalidate_conversation_viewers([instance.conversation_id])
@@ -1,8 +1,8 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from finance.models import Currency, Wallet
-from .models import Conversation, Transaction, Message, ContactLink, PrivacyPolicy, ConversationSettlement
+from .models import Conversation, Transaction, Message, ContactLink, PrivacyPolicy, ConversationSettlement, ConversationReadMarker, SyncChange, ConversationMember
 from rest_framework.test import APIClient
 
 User = get_user_model()
@@ -258,3 +258,1491 @@ class PrivacyPolicyAPITests(TestCase):
         client = APIClient()
         resp = client.get('/api/privacy-policy', {'type': 'non-existent'})
         self.assertEqual(resp.status_code, 404)
+
+
+class DeltaSyncAPITests(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='sync_u1', password='pass12345')
+        self.user2 = User.objects.create_user(username='sync_u2', password='pass12345')
+        self.user3 = User.objects.create_user(username='sync_u3', password='pass12345')
+        self.conv = Conversation.objects.create(user_a=self.user1, user_b=self.user2)
+        self.other_conv = Conversation.objects.create(user_a=self.user2, user_b=self.user3)
+        self.client = APIClient()
+        self.assertTrue(self.client.login(username='sync_u1', password='pass12345'))
+
+    def _cursor(self):
+        resp = self.client.get('/api/sync')
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.json()['reset'])
+        return resp.json()['cursor']
+
+    def test_returns_new_messages_reads_and_inbox_since_cursor(self):
+        Message.objects.create(conversation=self.conv, sender=self.user2, body='before')
+        cursor = self._cursor()
+        m1 = Message.objects.create(conversation=self.conv, sender=self.user2, body='hello')
+        m2 = Message.objects.create(conversation=self.conv, sender=self.user1, body='hi')
+        Message.objects.create(conversation=self.other_conv, sender=self.user3, body='not visible')
+        ConversationReadMarker.objects.create(conversation=self.conv, user=self.user2, last_read_message_id=m2.id)
+
+        resp = self.client.get('/api/sync', {'cursor': cursor})
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertFalse(data['reset'])
+        self.assertFalse(data['has_more'])
+        self.assertEqual([m['id'] for m in data['messages']], [m1.id, m2.id])
+        own = next(m for m in data['messages'] if m['id'] == m2.id)
+        self.assertEqual(own['delivery_status'], 2)
+        self.assertEqual(data['reads'], [{'conversation_id': self.conv.id, 'reader_id': self.user2.id, 'last_read_id': m2.id}])
+        self.assertEqual(len(data['inbox']), 1)
+        self.assertEqual(data['inbox'][0]['conversation_id'], self.conv.id)
+        self.assertEqual(data['inbox'][0]['unread_count'], 2)
+        self.assertEqual(data['unread_count'], 2)
+
+        follow_up = self.client.get('/api/sync', {'cursor': data['cursor']}).json()
+        self.assertEqual(follow_up['messages'], [])
+        self.assertEqual(follow_up['cursor'], data['cursor'])
+
+    def test_paginates_with_has_more(self):
+        cursor = self._cursor()
+        for i in range(3):
+            Message.objects.create(conversation=self.conv, sender=self.user2, body=f'm{i}')
+        first = self.client.get('/api/sync', {'cursor': cursor, 'limit': 2}).json()
+        self.assertTrue(first['has_more'])
+        self.assertEqual(len(first['messages']), 2)
+        second = self.client.get('/api/sync', {'cursor': first['cursor'], 'limit': 2}).json()
+        self.assertFalse(second['has_more'])
+        self.assertEqual(len(second['messages']), 1)
+
+    def test_cleared_and_deleted_conversations(self):
+        Message.objects.create(conversation=self.conv, sender=self.user2, body='x')
+        cursor = self._cursor()
+        resp = self.client.post(f'/api/conversations/{self.conv.id}/clear/')
+        self.assertEqual(resp.status_code, 200)
+        data = self.client.get('/api/sync', {'cursor': cursor}).json()
+        self.assertEqual(data['cleared'], [self.conv.id])
+
+        Conversation.objects.filter(pk=self.conv.pk).update(delete_requested_by=self.user2)
+        resp = self.client.post(f'/api/conversations/{self.conv.id}/approve_delete/')
+        self.assertEqual(resp.status_code, 200)
+        data = self.client.get('/api/sync', {'cursor': cursor}).json()
+        self.assertEqual(data['removed'], [{'conversation_id': self.conv.id, 'reason': 'deleted'}])
+        self.assertEqual(data['cleared'], [])
+
+    def test_stale_cursor_requests_reset(self):
+        Message.objects.create(conversation=self.conv, sender=self.user2, body='a')
+        cursor = self._cursor()
+        Message.objects.create(conversation=self.conv, sender=self.user2, body='b')
+        Message.objects.create(conversation=self.conv, sender=self.user2, body='c')
+        SyncChange.objects.filter(id__lte=cursor + 1).delete()
+        data = self.client.get('/api/sync', {'cursor': cursor}).json()
+        self.assertTrue(data['reset'])
+
+
+class EventJournalTests(TestCase):
+    def test_ring_buffer_replays_and_detects_gaps(self):
+        from .event_journal import InMemoryEventJournal
+        journal = InMemoryEventJournal(size=3)
+        for i in range(5):
+            journal.append(7, {'type': 'chat.message', 'id': i})
+        events, complete = journal.since(7, 2)
+        self.assertTrue(complete)
+        self.assertEqual([e['event_seq'] for e in events], [3, 4, 5])
+        events, complete = journal.since(7, 1)
+        self.assertFalse(complete)
+        self.assertEqual(journal.since(7, 5), ([], True))
+        self.assertFalse(journal.since(7, 9)[1])
+
+    def test_conversation_group_sends_are_stamped_and_resumable(self):
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+        from channels.testing import WebsocketCommunicator
+        from .consumers import ConversationConsumer
+        from .event_journal import get_journal, reset_journal
+
+        reset_journal()
+        self.addCleanup(reset_journal)
+        user1 = User.objects.create_user(username='ws_u1', password='pass12345')
+        user2 = User.objects.create_user(username='ws_u2', password='pass12345')
+        conv = Conversation.objects.create(user_a=user1, user_b=user2)
+        layer = get_channel_layer()
+        for i in range(2):
+            async_to_sync(layer.group_send)(f"conv_{conv.id}", {'type': 'broadcast.message', 'data': {'type': 'chat.message', 'id': i}})
+        async_to_sync(layer.group_send)(f"conv_{conv.id}", {'type': 'broadcast.message', 'data': {'type': 'chat.typing'}})
+        self.assertEqual(get_journal().last_seq(conv.id), 2)
+
+        async def run():
+            communicator = WebsocketCommunicator(ConversationConsumer.as_asgi(), f"/ws/conversations/{conv.id}/?resume_from=1")
+            communicator.scope['user'] = user1
+            communicator.scope['url_route'] = {'kwargs': {'conversation_id': conv.id}}
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            replayed = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return replayed
+
+        replayed = async_to_sync(run)()
+        self.assertEqual(replayed['event_seq'], 2)
+        self.assertEqual(replayed['id'], 1)
+
+    def test_conversation_events_are_encoded_once_after_stamping(self):
+        import orjson
+        from unittest import mock
+        from asgiref.sync import async_to_sync
+        from channels.layers import get_channel_layer
+        from .event_journal import reset_journal
+        from .realtime import ChannelsBackend, RealtimeDispatcher, conversation_route
+
+        reset_journal()
+        self.addCleanup(reset_journal)
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)('conv_41', channel)
+        with mock.patch.object(orjson, 'dumps', wraps=orjson.dumps) as dumps:
+            RealtimeDispatcher([ChannelsBackend()]).publish(conversation_route(41), {'type': 'chat.message', 'id': 9})
+        self.assertEqual(dumps.call_count, 1)
+        received = async_to_sync(layer.receive)(channel)
+        self.assertEqual(orjson.loads(received['text']), received['data'])
+        self.assertEqual((received['data']['event_seq'], received['data']['conversation_id']), (1, 41))
+
+
+class MultiplexConsumerTests(TestCase):
+    def setUp(self):
+        from .event_journal import reset_journal
+        reset_journal()
+        self.addCleanup(reset_journal)
+        self.user1 = User.objects.create_user(username='mux_u1', password='pass12345')
+        self.user2 = User.objects.create_user(username='mux_u2', password='pass12345')
+        self.user3 = User.objects.create_user(username='mux_u3', password='pass12345')
+        self.conv = Conversation.objects.create(user_a=self.user1, user_b=self.user2)
+        self.foreign = Conversation.objects.create(user_a=self.user2, user_b=self.user3)
+
+    def test_subscribe_send_and_unsubscribe_on_one_socket(self):
+        from asgiref.sync import async_to_sync
+        from channels.testing import WebsocketCommunicator
+        from .mux_consumer import MultiplexConsumer
+
+        async def run():
+            communicator = WebsocketCommunicator(MultiplexConsumer.as_asgi(), '/ws/stream/')
+            communicator.scope['user'] = self.user1
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            self.assertEqual((await communicator.receive_json_from())['type'], 'inbox.hello')
+
+            await communicator.send_json_to({'type': 'subscribe', 'conversation_id': self.foreign.id})
+            self.assertEqual(await communicator.receive_json_from(), {'type': 'error', 'detail': 'forbidden', 'conversation_id': self.foreign.id})
+
+            await communicator.send_json_to({'type': 'subscribe', 'conversation_id': self.conv.id})
+            self.assertEqual((await communicator.receive_json_from())['type'], 'subscribed')
+            self.assertEqual((await communicator.receive_json_from())['type'], 'journal.position')
+
+            await communicator.send_json_to({'type': 'text', 'conversation_id': self.conv.id, 'body': 'hello'})
+            frame = await communicator.receive_json_from()
+            self.assertEqual(frame['type'], 'chat.message')
+            self.assertEqual(frame['conversation_id'], self.conv.id)
+
+            await communicator.send_json_to({'type': 'unsubscribe', 'conversation_id': self.conv.id})
+            # drain until the unsubscribe acknowledgement
+            while (await communicator.receive_json_from())['type'] != 'unsubscribed':
+                pass
+            await communicator.send_json_to({'type': 'typing', 'conversation_id': self.conv.id})
+            frame = await communicator.receive_json_from()
+            while frame['type'] != 'error':
+                # late conversation events queued before the unsubscribe are fine
+                self.assertNotEqual(frame['type'], 'chat.typing')
+                frame = await communicator.receive_json_from()
+            self.assertEqual(frame['detail'], 'not_subscribed')
+            await communicator.disconnect()
+
+        async_to_sync(run)()
+        self.assertTrue(Message.objects.filter(conversation=self.conv, body='hello').exists())
+
+
+class RealtimeDispatchTests(TestCase):
+    def setUp(self):
+        from django.test import override_settings
+        from .realtime import RecordingBackend, reset_dispatcher, reset_metrics
+        override = override_settings(REALTIME_BACKENDS=['communications.realtime.RecordingBackend'])
+        override.enable()
+        self.addCleanup(override.disable)
+        reset_dispatcher()
+        reset_metrics()
+        self.addCleanup(reset_dispatcher)
+        RecordingBackend.sent = []
+        self.user1 = User.objects.create_user(username='rt_u1', password='pass12345')
+        self.user2 = User.objects.create_user(username='rt_u2', password='pass12345')
+        self.currency = Currency.objects.create(code='RTX', symbol='R', name='RT', precision=2)
+        self.conv = Conversation.objects.create(user_a=self.user1, user_b=self.user2)
+
+    def test_create_transaction_fans_out_one_event_per_route(self):
+        from .realtime import CHANNELS, PUSHER, RecordingBackend, conversation_route, metrics_snapshot, user_route
+        Transaction.create_transaction(self.conv, self.user1, self.currency, 5, 'lna')
+        sent = RecordingBackend.sent
+        messages = [data for route, data, only in sent if route == conversation_route(self.conv.id) and data['type'] == 'chat.message']
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0]['kind'], 'transaction')
+        self.assertEqual(messages[0]['tx']['amount'], 5.0)
+        inbox = [(data, only) for route, data, only in sent if route == user_route(self.user2.id)]
+        self.assertEqual([only for _, only in inbox], [frozenset({CHANNELS}), frozenset({PUSHER})])
+        self.assertEqual(inbox[0][0]['unread_count'], 1)
+        self.assertFalse([1 for route, _, _ in sent if route == user_route(self.user1.id)])
+        self.assertEqual(metrics_snapshot()['recording']['calls'], 1)
+
+    def test_pusher_backend_batches_multi_channel_sends(self):
+        from unittest import mock
+        from .realtime import PusherBackend, RealtimeDispatcher, conversation_route, user_route
+        client = mock.Mock()
+        with mock.patch('communications.pusher_client.pusher_client', client):
+            RealtimeDispatcher([PusherBackend()]).publish_many(
+                [(conversation_route(1), {'type': 'chat.message'})]
+                + [(user_route(uid), {'type': 'message'}) for uid in range(12)]
+            )
+        self.assertEqual(client.trigger_batch.call_count, 2)
+        first_batch = client.trigger_batch.call_args_list[0].args[0]
+        self.assertEqual(first_batch[0], {'channel': 'chat_1', 'name': 'message', 'data': '{"type":"chat.message"}'})
+        self.assertEqual(first_batch[1]['channel'], 'user_0')
+        self.assertEqual(first_batch[1]['name'], 'notify')
+        client.trigger.assert_not_called()
+
+
+class TypingCoalescerTests(TestCase):
+    def test_keystrokes_collapse_and_stale_start_expires(self):
+        import asyncio
+        from asgiref.sync import async_to_sync
+        from .typing_state import TypingCoalescer
+
+        emitted = []
+
+        async def emit(conversation_id, state):
+            emitted.append((conversation_id, state))
+
+        async def run():
+            coalescer = TypingCoalescer(emit, interval=0.05, expire=0.15)
+            for _ in range(20):
+                await coalescer.update(7, 'start')
+            self.assertEqual(emitted, [(7, 'start')])
+            # no refresh: the server turns the start into a stop on its own
+            await asyncio.sleep(0.3)
+            self.assertEqual(emitted, [(7, 'start'), (7, 'stop')])
+            # a stop while nothing is shown is not relayed
+            await coalescer.update(7, 'stop')
+            await coalescer.update(8, 'start')
+            await coalescer.close()
+            self.assertEqual(emitted, [(7, 'start'), (7, 'stop'), (8, 'start'), (8, 'stop')])
+
+        async_to_sync(run)()
+
+
+class ConversationConsumerAsyncTests(TestCase):
+    def setUp(self):
+        from .event_journal import reset_journal
+        reset_journal()
+        self.addCleanup(reset_journal)
+        self.user1 = User.objects.create_user(username='cc_u1', password='pass12345')
+        self.user2 = User.objects.create_user(username='cc_u2', password='pass12345')
+        self.conv = Conversation.objects.create(user_a=self.user1, user_b=self.user2)
+        self.inbound = Message.objects.create(conversation=self.conv, sender=self.user2, body='hi', delivery_status=1)
+
+    def test_conversation_is_fetched_once_and_frames_persist(self):
+        from unittest import mock
+        from asgiref.sync import async_to_sync
+        from channels.testing import WebsocketCommunicator
+        from .consumers import ConversationConsumer
+
+        real_aget = Conversation.objects.aget
+        lookups = []
+
+        async def counting_aget(*args, **kwargs):
+            lookups.append(kwargs)
+            return await real_aget(*args, **kwargs)
+
+        async def run():
+            communicator = WebsocketCommunicator(ConversationConsumer.as_asgi(), f'/ws/conversations/{self.conv.id}/')
+            communicator.scope['user'] = self.user1
+            communicator.scope['url_route'] = {'kwargs': {'conversation_id': self.conv.id}}
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            for body in ('one', 'two'):
+                await communicator.send_json_to({'type': 'text', 'body': body})
+                frame = await communicator.receive_json_from()
+                while frame['type'] != 'chat.message':
+                    frame = await communicator.receive_json_from()
+                self.assertEqual(frame['body'], body)
+            await communicator.disconnect()
+
+        with mock.patch.object(Conversation.objects, 'aget', counting_aget):
+            async_to_sync(run)()
+        self.assertEqual(len(lookups), 1)
+        self.assertEqual(list(Message.objects.filter(sender=self.user1).values_list('body', flat=True).order_by('id')), ['one', 'two'])
+        # Reads only move the marker; the inbound row is not rewritten
+        self.inbound.refresh_from_db()
+        self.assertEqual(self.inbound.delivery_status, 1)
+        last = Message.objects.filter(sender=self.user1).order_by('-id').first()
+        self.assertEqual(ConversationReadMarker.objects.get(conversation=self.conv, user=self.user1).last_read_message_id, last.id)
+
+    def test_read_frame_syncs_badge_with_zero_delay(self):
+        import threading
+        from unittest import mock
+        from asgiref.sync import async_to_sync
+        from channels.testing import WebsocketCommunicator
+        from .badge_sync import BadgeSyncScheduler
+        from django.utils.asyncio import async_unsafe
+        from .consumers import ConversationConsumer
+        # Stands in for the unread ORM query: refuses to run on the event loop the same way
+        pushed = threading.Event()
+
+        async def run():
+            communicator = WebsocketCommunicator(ConversationConsumer.as_asgi(), f'/ws/conversations/{self.conv.id}/')
+            communicator.scope['user'] = self.user1
+            communicator.scope['url_route'] = {'kwargs': {'conversation_id': self.conv.id}}
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.send_json_to({'type': 'read', 'last_read_id': self.inbound.id})
+            while (await communicator.receive_json_from())['type'] != 'chat.read':
+                pass
+            await communicator.disconnect()
+
+        with self.settings(BADGE_SYNC_DELAY=0), \
+                mock.patch('communications.badge_sync._scheduler', BadgeSyncScheduler()), \
+                mock.patch('communications.push._total_unread_for_user', async_unsafe(lambda user_id: 0)), \
+                mock.patch('communications.push.send_unread_badge_push', side_effect=lambda *a, **k: pushed.set()) as push:
+            async_to_sync(run)()
+            self.assertTrue(pushed.wait(5))
+        push.assert_called_once_with(self.user1.id, 0, reason='chat.read', conversation_id=self.conv.id)
+
+    def test_open_socket_stops_persisting_once_conversation_is_deleted(self):
+        from asgiref.sync import async_to_sync, sync_to_async
+        from channels.testing import WebsocketCommunicator
+        from .consumers import ConversationConsumer
+
+        async def run():
+            communicator = WebsocketCommunicator(ConversationConsumer.as_asgi(), f'/ws/conversations/{self.conv.id}/')
+            communicator.scope['user'] = self.user1
+            communicator.scope['url_route'] = {'kwargs': {'conversation_id': self.conv.id}}
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.send_json_to({'type': 'text', 'body': 'before'})
+            while (await communicator.receive_json_from())['type'] != 'chat.message':
+                pass
+            await sync_to_async(Conversation.objects.filter(pk=self.conv.id).update)(deleted_at=timezone.now())
+            await communicator.send_json_to({'type': 'text', 'body': 'after'})
+            while True:
+                output = await communicator.receive_output()
+                if output['type'] == 'websocket.close':
+                    break
+            self.assertEqual(output['code'], 4001)
+            await communicator.wait()
+
+        async_to_sync(run)()
+        self.assertEqual(list(Message.objects.filter(sender=self.user1).values_list('body', flat=True)), ['before'])
+
+    def test_removed_member_is_unsubscribed_on_send(self):
+        from asgiref.sync import async_to_sync, sync_to_async
+        from channels.testing import WebsocketCommunicator
+        from .mux_consumer import MultiplexConsumer
+        user3 = User.objects.create_user(username='cc_u3', password='pass12345')
+        member = ConversationMember.objects.create(conversation=self.conv, member_user=user3, added_by=self.user1)
+
+        async def run():
+            communicator = WebsocketCommunicator(MultiplexConsumer.as_asgi(), '/ws/stream/')
+            communicator.scope['user'] = user3
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.send_json_to({'type': 'subscribe', 'conversation_id': self.conv.id})
+            while (await communicator.receive_json_from())['type'] != 'subscribed':
+                pass
+            await sync_to_async(member.delete)()
+            await communicator.send_json_to({'type': 'text', 'conversation_id': self.conv.id, 'body': 'after'})
+            frame = await communicator.receive_json_from()
+            while frame['type'] != 'error':
+                frame = await communicator.receive_json_from()
+            self.assertEqual(frame, {'type': 'error', 'detail': 'forbidden', 'conversation_id': self.conv.id})
+            await communicator.send_json_to({'type': 'text', 'conversation_id': self.conv.id, 'body': 'again'})
+            frame = await communicator.receive_json_from()
+            while frame['type'] != 'error':
+                frame = await communicator.receive_json_from()
+            self.assertEqual(frame['detail'], 'not_subscribed')
+            await communicator.disconnect()
+
+        async_to_sync(run)()
+        self.assertFalse(Message.objects.filter(sender=user3).exists())
+
+
+class InboxConnectDeliveryTests(TestCase):
+    def setUp(self):
+        from django.test import override_settings
+        from .realtime import RecordingBackend, reset_dispatcher
+        override = override_settings(REALTIME_BACKENDS=['communications.realtime.RecordingBackend'])
+        override.enable()
+        self.addCleanup(override.disable)
+        reset_dispatcher()
+        self.addCleanup(reset_dispatcher)
+        RecordingBackend.sent = []
+        self.user1 = User.objects.create_user(username='ib_u1', password='pass12345')
+        self.user2 = User.objects.create_user(username='ib_u2', password='pass12345')
+        self.user3 = User.objects.create_user(username='ib_u3', password='pass12345')
+        self.direct = Conversation.objects.create(user_a=self.user1, user_b=self.user2)
+        self.extra = Conversation.objects.create(user_a=self.user2, user_b=self.user3)
+        ConversationMember.objects.create(conversation=self.extra, member_user=self.user1, added_by=self.user2)
+
+    def _inbound(self, conv, sender, count):
+        ids = []
+        for i in range(count):
+            ids.append(Message.objects.create(conversation=conv, sender=sender, body=f'm{i}', delivery_status=0).id)
+        return ids
+
+    def test_query_count_does_not_grow_with_conversations(self):
+        from .inbox_consumer import _deliver_inbound
+        self._inbound(self.direct, self.user2, 1)
+        with self.assertNumQueries(5):
+            _deliver_inbound(self.user1.id)
+        for i in range(3):
+            other = User.objects.create_user(username=f'ib_x{i}', password='pass12345')
+            self._inbound(Conversation.objects.create(user_a=other, user_b=self.user1), other, 2)
+        with self.assertNumQueries(5):
+            _deliver_inbound(self.user1.id)
+
+    def test_connect_upgrades_extra_member_conversations_and_sends_snapshot(self):
+        from asgiref.sync import async_to_sync
+        from channels.testing import WebsocketCommunicator
+        from .inbox_consumer import InboxConsumer
+        from .realtime import RecordingBackend, conversation_route
+        direct_ids = self._inbound(self.direct, self.user2, 3)
+        extra_ids = self._inbound(self.extra, self.user3, 2)
+
+        async def run():
+            communicator = WebsocketCommunicator(InboxConsumer.as_asgi(), '/ws/inbox/')
+            communicator.scope['user'] = self.user1
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            hello = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return hello
+
+        hello = async_to_sync(run)()
+        self.assertEqual(hello['type'], 'inbox.hello')
+        self.assertEqual(hello['unread'], {str(self.direct.id): 3, str(self.extra.id): 2})
+        self.assertEqual(hello['unread_total'], 5)
+        self.assertFalse(Message.objects.filter(id__in=direct_ids + extra_ids, delivery_status=0).exists())
+        # One frame per upgraded message: clients tick status by exact id
+        frames = [(route, data['id'], data['delivery_status']) for route, data, _ in RecordingBackend.sent]
+        self.assertEqual(sorted(frames), sorted([(conversation_route(self.direct.id), mid, 1) for mid in direct_ids]
+                                                + [(conversation_route(self.extra.id), mid, 1) for mid in extra_ids]))
+        self.assertFalse(any('from_id' in data for _, data, _ in RecordingBackend.sent))
+
+
+class OutboundQueueTests(TestCase):
+    def setUp(self):
+        from .outbound import reset_metrics
+        reset_metrics()
+        self.addCleanup(reset_metrics)
+
+    def test_superseded_frames_coalesce_and_stuck_client_is_cut_off(self):
+        import asyncio
+        from asgiref.sync import async_to_sync
+        from .outbound import OutboundQueue, metrics_snapshot
+
+        sent, overflows = [], []
+
+        async def run():
+            release = asyncio.Event()
+
+            async def send_event(event):
+                await release.wait()
+                sent.append(event['data'])
+
+            async def on_overflow(reason):
+                overflows.append(reason)
+
+            queue = OutboundQueue(send_event, on_overflow, maxsize=4, send_timeout=5)
+            await queue.put({'data': {'type': 'chat.message', 'id': 1}})
+            await asyncio.sleep(0)  # writer picks up frame 1 and blocks on the client
+            await queue.put({'data': {'type': 'message.status', 'id': 1, 'delivery_status': 1}})
+            await queue.put({'data': {'type': 'message.status', 'id': 1, 'delivery_status': 2}})
+            await queue.put({'data': {'type': 'message.status', 'id': 1, 'delivery_status': 1}})
+            await queue.put({'data': {'type': 'inbox.update', 'conversation_id': 3, 'unread_count': 1}})
+            await queue.put({'data': {'type': 'inbox.update', 'conversation_id': 3, 'unread_count': 2}})
+            self.assertEqual(len(queue), 2)
+            release.set()
+            for _ in range(10):
+                await asyncio.sleep(0)
+            self.assertEqual([f['type'] for f in sent], ['chat.message', 'message.status', 'inbox.update'])
+            self.assertEqual(sent[1]['delivery_status'], 2)
+            self.assertEqual(sent[2]['unread_count'], 2)
+
+            release.clear()
+            for i in range(6):
+                await queue.put({'data': {'type': 'chat.message', 'id': 10 + i}})
+                await asyncio.sleep(0)
+            self.assertEqual(overflows, ['queue_full'])
+            self.assertTrue(queue.closed)
+            queue.close()
+
+        async_to_sync(run)()
+        counters = metrics_snapshot()
+        self.assertEqual(counters['coalesced'], 3)
+        self.assertEqual(counters['overflow_disconnects'], 1)
+        self.assertEqual(counters['dropped'], 5)
+
+    def test_range_status_is_not_replaced_by_a_single_status(self):
+        import asyncio
+        from asgiref.sync import async_to_sync
+        from .outbound import OutboundQueue, coalesce_key
+
+        sent = []
+        span = {'type': 'message.status', 'conversation_id': 3, 'id': 9, 'from_id': 5, 'to_id': 9, 'delivery_status': 1}
+        single = {'type': 'message.status', 'conversation_id': 3, 'id': 9, 'delivery_status': 2}
+        self.assertNotEqual(coalesce_key(span), coalesce_key(single))
+
+        async def run():
+            release = asyncio.Event()
+
+            async def send_event(event):
+                await release.wait()
+                sent.append(event['data'])
+
+            async def on_overflow(reason):
+                raise AssertionError(reason)
+
+            queue = OutboundQueue(send_event, on_overflow, maxsize=8, send_timeout=5)
+            await queue.put({'data': {'type': 'chat.message', 'id': 1}})
+            await asyncio.sleep(0)
+            await queue.put({'data': span})
+            await queue.put({'data': single})
+            await queue.put({'data': {**span, 'delivery_status': 2}})
+            self.assertEqual(len(queue), 2)
+            release.set()
+            for _ in range(10):
+                await asyncio.sleep(0)
+            queue.close()
+
+        async_to_sync(run)()
+        self.assertEqual([(f.get('from_id'), f['delivery_status']) for f in sent[1:]], [(5, 2), (None, 2)])
+
+    def test_writer_survives_a_failing_send(self):
+        import asyncio
+        from asgiref.sync import async_to_sync
+        from .outbound import OutboundQueue, metrics_snapshot
+
+        sent = []
+
+        async def run():
+            async def send_event(event):
+                if event['data']['id'] == 1:
+                    raise RuntimeError('boom')
+                sent.append(event['data']['id'])
+
+            async def on_overflow(reason):
+                raise AssertionError(reason)
+
+            queue = OutboundQueue(send_event, on_overflow, maxsize=8, send_timeout=5)
+            for i in (1, 2, 3):
+                await queue.put({'data': {'type': 'chat.message', 'id': i}})
+            for _ in range(10):
+                await asyncio.sleep(0)
+            await queue.put({'data': {'type': 'chat.message', 'id': 4}})
+            for _ in range(10):
+                await asyncio.sleep(0)
+            self.assertFalse(queue.closed)
+            queue.close()
+
+        async_to_sync(run)()
+        self.assertEqual(sent, [2, 3, 4])
+        self.assertEqual((metrics_snapshot()['sent'], metrics_snapshot()['failed']), (3, 1))
+
+
+class CompactWireTests(TestCase):
+    def setUp(self):
+        from .event_journal import reset_journal
+        reset_journal()
+        self.addCleanup(reset_journal)
+        self.user1 = User.objects.create_user(username='wire_u1', password='pass12345')
+        self.user2 = User.objects.create_user(username='wire_u2', password='pass12345')
+        self.conv = Conversation.objects.create(user_a=self.user1, user_b=self.user2)
+
+    def test_compact_drops_duplicates_and_uses_epoch_millis(self):
+        from .wire import compact
+        out = compact({
+            'type': 'chat.message', 'id': 5, 'message_id': 5, 'seq': 5, 'body': 'hi', 'message': 'hi',
+            'sender': 'a', 'username': 'a', 'created_at': '2024-01-01T00:00:00+00:00', 'read_at': None,
+            'status': 'delivered', 'delivery_status': 1, 'tx': {'amount': 5.0},
+        })
+        self.assertEqual(out, {'t': 'chat.message', 'i': 5, 'b': 'hi', 's': 'a', 'ca': 1704067200000, 'ds': 1, 'tx': {'amount': 5.0}})
+
+    def test_msgpack_subprotocol_round_trip_on_mux_socket(self):
+        import msgpack
+        from asgiref.sync import async_to_sync
+        from channels.testing import WebsocketCommunicator
+        from .mux_consumer import MultiplexConsumer
+
+        async def run():
+            communicator = WebsocketCommunicator(MultiplexConsumer.as_asgi(), '/ws/stream/', subprotocols=['mutabaka.msgpack.v1'])
+            communicator.scope['user'] = self.user1
+            connected, subprotocol = await communicator.connect()
+            self.assertTrue(connected)
+            self.assertEqual(subprotocol, 'mutabaka.msgpack.v1')
+            hello = msgpack.unpackb(await communicator.receive_from())
+            self.assertEqual(hello['t'], 'inbox.hello')
+            await communicator.send_to(bytes_data=msgpack.packb({'type': 'subscribe', 'conversation_id': self.conv.id}))
+            self.assertEqual(msgpack.unpackb(await communicator.receive_from()), {'t': 'subscribed', 'c': self.conv.id})
+            await communicator.receive_from()  # journal.position
+            await communicator.send_to(bytes_data=msgpack.packb({'type': 'text', 'conversation_id': self.conv.id, 'body': 'hey'}))
+            frame = msgpack.unpackb(await communicator.receive_from())
+            while frame['t'] != 'chat.message':
+                frame = msgpack.unpackb(await communicator.receive_from())
+            await communicator.disconnect()
+            return frame
+
+        frame = async_to_sync(run)()
+        self.assertEqual(frame['b'], 'hey')
+        self.assertIsInstance(frame['ca'], int)
+        self.assertNotIn('message_id', frame)
+
+
+@override_settings(SHARED_CACHE=True)
+class BadgeSyncTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        self.user1 = User.objects.create_user(username='badge_u1', password='pass12345')
+        self.user2 = User.objects.create_user(username='badge_u2', password='pass12345')
+        self.conv = Conversation.objects.create(user_a=self.user1, user_b=self.user2)
+        Message.objects.create(conversation=self.conv, sender=self.user2, body='one')
+        Message.objects.create(conversation=self.conv, sender=self.user2, body='two')
+        cache.delete(f'badge:last:{self.user1.id}')
+
+    def test_requests_in_window_collapse_and_unchanged_count_is_skipped(self):
+        from unittest import mock
+        from .badge_sync import BadgeSyncScheduler
+        scheduler = BadgeSyncScheduler(delay=60)
+        with mock.patch('communications.push.send_unread_badge_push') as push:
+            for _ in range(5):
+                scheduler.schedule(self.user1.id, reason='chat.read', conversation_id=self.conv.id)
+            push.assert_not_called()
+            scheduler.flush()
+            push.assert_called_once_with(self.user1.id, 2, reason='chat.read', conversation_id=self.conv.id)
+        self.assertEqual(scheduler.stats['requested'], 5)
+
+        # the real push records what the devices now show; simulate that
+        from .badge_sync import remember_badge
+        remember_badge(self.user1.id, 2)
+        with mock.patch('communications.push.send_unread_badge_push') as push:
+            scheduler.schedule(self.user1.id, reason='chat.read')
+            scheduler.flush()
+            push.assert_not_called()
+        self.assertEqual(scheduler.stats['skipped_unchanged'], 1)
+
+    @override_settings(SHARED_CACHE=False)
+    def test_unchanged_count_is_sent_without_a_shared_cache(self):
+        from unittest import mock
+        from .badge_sync import BadgeSyncScheduler, remember_badge
+        scheduler = BadgeSyncScheduler(delay=60)
+        remember_badge(self.user1.id, 2)
+        with mock.patch('communications.push.send_unread_badge_push') as push:
+            scheduler.schedule(self.user1.id, reason='chat.read')
+            scheduler.flush()
+            push.assert_called_once()
+        self.assertEqual(scheduler.stats['skipped_unchanged'], 0)
+
+
+class PushBundlingTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from accounts.models import UserDevice
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user1 = User.objects.create_user(username='bundle_u1', password='pass12345')
+        self.user2 = User.objects.create_user(username='bundle_u2', password='pass12345')
+        self.conv = Conversation.objects.create(user_a=self.user1, user_b=self.user2)
+        UserDevice.objects.create(user=self.user2, status=UserDevice.Status.PRIMARY, push_token='tok-bundle-u2')
+
+    def test_burst_sends_first_push_then_one_summary(self):
+        from unittest import mock
+        from .push import send_message_push
+        from .push_bundler import PushBundler
+        bundler = PushBundler(window=60)
+        self.addCleanup(bundler.reset)
+        with mock.patch('communications.push.get_bundler', return_value=bundler), \
+                mock.patch('communications.push.send_push_messages') as send:
+            for i in range(4):
+                msg = Message.objects.create(conversation=self.conv, sender=self.user1, body=f'tx {i}', type='transaction')
+                send_message_push(self.conv, msg, title='bundle_u1', body=f'tx {i}', data={'kind': 'transaction'})
+            self.assertEqual(send.call_count, 1)
+            bundler.flush()
+            self.assertEqual(send.call_count, 2)
+        summary = send.call_args.args[0][0]
+        self.assertEqual(summary.to, 'tok-bundle-u2')
+        self.assertEqual(summary.body, 'معاملات جديدة: 3')
+        self.assertEqual(summary.data['bundle_count'], 3)
+        self.assertEqual(summary.data['conversation_id'], self.conv.id)
+        self.assertEqual(summary.data['message_id'], msg.id)
+        self.assertEqual(summary.badge, 4)
+        self.assertEqual(bundler.stats, {'immediate': 1, 'bundled': 3, 'summaries': 1})
+
+
+class DeadlinesTests(TestCase):
+    def test_windows_share_one_thread_and_cancelled_callbacks_never_run(self):
+        import threading
+        from unittest import mock
+        from .badge_sync import BadgeSyncScheduler
+        from .deadlines import Deadlines
+        from .push_bundler import PushBundler
+        deadlines = Deadlines('test-deadlines')
+        bundler = PushBundler(window=60, deadlines=deadlines)
+        scheduler = BadgeSyncScheduler(delay=60, deadlines=deadlines)
+        before = threading.active_count()
+        for uid in range(1, 51):
+            bundler.admit(uid, 1, title='t')
+            scheduler.schedule(uid)
+        self.assertLessEqual(threading.active_count(), before + 1)
+        self.assertEqual(len(deadlines), 100)
+        bundler.reset()
+        with mock.patch.object(scheduler, '_deliver'):
+            scheduler.flush()
+        self.assertEqual(len(deadlines), 0)
+
+        ran, fired = [], threading.Event()
+        handle = deadlines.call_later(0.05, ran.append, 'cancelled')
+        deadlines.call_later(0.1, fired.set)
+        deadlines.cancel(handle)
+        self.assertTrue(fired.wait(2))
+        self.assertEqual(ran, [])
+
+    def test_slow_delivery_does_not_hold_up_other_deadlines(self):
+        import threading
+        from .deadlines import Deadlines
+        deadlines = Deadlines('test-deadlines', workers=2)
+        release, fired = threading.Event(), threading.Event()
+        self.addCleanup(release.set)
+        deadlines.call_later(0, release.wait, 5)
+        deadlines.call_later(0.05, fired.set)
+        self.assertTrue(fired.wait(2))
+        self.assertFalse(release.is_set())
+
+
+@override_settings(SHARED_CACHE=True)
+class PushTargetRegistryTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        from accounts.models import UserDevice
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user1 = User.objects.create_user(username='reg_u1', password='pass12345')
+        self.user2 = User.objects.create_user(username='reg_u2', password='pass12345')
+        self.user3 = User.objects.create_user(username='reg_u3', password='pass12345')
+        self.conv = Conversation.objects.create(user_a=self.user1, user_b=self.user2)
+        UserDevice.objects.create(user=self.user2, status=UserDevice.Status.PRIMARY, push_token='tok-reg-u2')
+        self.client = APIClient()
+        self.client.login(username='reg_u2', password='pass12345')
+
+    def test_warm_target_resolution_is_query_free_and_mute_invalidates(self):
+        from accounts.push import get_active_device_tokens
+        from .push import _muted_user_ids, _push_viewer_ids
+
+        def resolve():
+            viewers = [uid for uid in _push_viewer_ids(self.conv) if uid != self.user1.id]
+            tokens = get_active_device_tokens(viewers)
+            return tokens, _muted_user_ids(self.conv.id, tokens.keys())
+
+        resolve()
+        with self.assertNumQueries(0):
+            tokens, muted = resolve()
+        self.assertEqual(tokens, {self.user2.id: ['tok-reg-u2']})
+        self.assertEqual(muted, set())
+
+        self.assertEqual(self.client.post(f'/api/conversations/{self.conv.id}/mute/').status_code, 200)
+        self.assertEqual(resolve()[1], {self.user2.id})
+        self.assertEqual(self.client.delete(f'/api/conversations/{self.conv.id}/mute/').status_code, 200)
+        self.assertEqual(resolve()[1], set())
+
+        ConversationMember.objects.create(conversation=self.conv, member_user=self.user3, added_by=self.user1)
+        self.assertIn(self.user3.id, _push_viewer_ids(self.conv))
+
+    @override_settings(SHARED_CACHE=False)
+    def test_registry_is_bypassed_without_a_shared_cache(self):
+        from django.core.cache import cache
+        from accounts.push import get_active_device_tokens
+        from .push import _muted_user_ids, _push_viewer_ids
+        _push_viewer_ids(self.conv)
+        get_active_device_tokens([self.user2.id])
+        _muted_user_ids(self.conv.id, [self.user2.id])
+        self.assertEqual(cache.get_many(['push:viewers:%d' % self.conv.id, 'push:tokens:%d' % self.user2.id, 'push:mutes:%d' % self.user2.id]), {})
+
+
+class ProviderGuardTests(TestCase):
+    def setUp(self):
+        from . import providers
+        providers.reset_breakers()
+        self.addCleanup(providers.reset_breakers)
+
+    def test_breaker_opens_queues_and_closes_after_probe(self):
+        from unittest import mock
+        from .models import ProviderCircuit, ProviderRetry
+        from .providers import PUSHER, ProviderUnavailable, call_provider, get_breaker
+
+        def boom(*args):
+            raise ConnectionError('down')
+
+        with self.settings(PROVIDER_BREAKER_FAILURES=2, PROVIDER_BREAKER_RESET=30):
+            for _ in range(2):
+                with self.assertRaises(ProviderUnavailable):
+                    call_provider(PUSHER, boom, retry={'batch': []})
+            self.assertEqual(get_breaker(PUSHER).state, 'open')
+            self.assertEqual(ProviderCircuit.objects.get(provider=PUSHER).state, 'open')
+
+            fn = mock.Mock()
+            with self.assertRaises(ProviderUnavailable):
+                call_provider(PUSHER, fn, retry={'batch': [{'channel': 'c', 'name': 'n', 'data': {}}]})
+            fn.assert_not_called()
+            self.assertEqual(ProviderRetry.objects.filter(provider=PUSHER).count(), 3)
+            self.assertEqual(ProviderRetry.objects.latest('id').last_error, 'circuit open')
+
+            breaker = get_breaker(PUSHER)
+            breaker.opened_at -= 31
+            self.assertEqual(call_provider(PUSHER, lambda: 'ok'), 'ok')
+            self.assertEqual(breaker.state, 'closed')
+            self.assertEqual(ProviderCircuit.objects.get(provider=PUSHER).state, 'closed')
+
+    def test_rejected_fcm_tokens_are_pruned_without_tripping_the_breaker(self):
+        from unittest import mock
+        from firebase_admin import exceptions, messaging
+        from accounts.models import UserDevice
+        from accounts.push import PushMessage, send_push_messages
+        from .models import ProviderRetry
+        from .providers import FCM, get_breaker
+        owner = User.objects.create_user(username='fcm_owner', password='pass12345')
+        rejections = {
+            'tok-invalid': exceptions.InvalidArgumentError('The registration token is not a valid FCM registration token'),
+            'tok-sender': messaging.SenderIdMismatchError('SenderId mismatch', None, None),
+            'ExponentPushToken[abc]': exceptions.InvalidArgumentError('Invalid registration'),
+        }
+        for token in rejections:
+            UserDevice.objects.create(user=owner, push_token=token, status=UserDevice.Status.PENDING)
+
+        def send(message):
+            raise rejections[message.token]
+
+        with self.settings(PROVIDER_BREAKER_FAILURES=1), \
+                mock.patch('accounts.push.FCM_AVAILABLE', True), \
+                mock.patch('accounts.fcm_push._initialize_firebase', return_value=object()), \
+                mock.patch('accounts.fcm_push.messaging.send', side_effect=send):
+            send_push_messages([PushMessage(to=token, title='t', body='b') for token in rejections])
+            self.assertEqual(get_breaker(FCM).state, 'closed')
+
+            with mock.patch('accounts.fcm_push.messaging.send', side_effect=exceptions.UnavailableError('backend down')):
+                send_push_messages([PushMessage(to='tok-live', title='t', body='b')])
+            self.assertEqual(get_breaker(FCM).state, 'open')
+        self.assertFalse(UserDevice.objects.filter(push_token__in=list(rejections)).exists())
+        self.assertEqual(list(ProviderRetry.objects.filter(provider=FCM).values_list('payload__to', flat=True)), ['tok-live'])
+
+    def test_retry_command_replays_and_backs_off(self):
+        from io import StringIO
+        from unittest import mock
+        from django.core.management import call_command
+        from .models import ProviderRetry
+
+        ok = ProviderRetry.objects.create(provider='pusher', payload={'batch': [{'channel': 'c', 'name': 'n', 'data': {}}]})
+        bad = ProviderRetry.objects.create(provider='webpush', payload={'subscription_id': 1, 'data': '{}'})
+        handlers = {
+            'pusher': mock.Mock(),
+            'webpush': mock.Mock(side_effect=ConnectionError('still down')),
+        }
+        with mock.patch('communications.providers.import_string', side_effect=lambda path: handlers['pusher' if path.startswith('communications.pusher_client') else 'webpush']):
+            out = StringIO()
+            call_command('retry_provider_sends', stdout=out)
+        handlers['pusher'].assert_called_once_with(ok.payload)
+        self.assertIn('sent=1 failed=1 dropped=0', out.getvalue())
+        self.assertFalse(ProviderRetry.objects.filter(id=ok.id).exists())
+        bad.refresh_from_db()
+        self.assertEqual(bad.attempts, 1)
+        self.assertGreater(bad.next_attempt_at, timezone.now())
+        self.assertIn('still down', bad.last_error)
+
+
+class StartupImportTests(TestCase):
+    HEAVY_SDKS = ('firebase_admin', 'googleapiclient', 'pusher', 'pywebpush', 'pyotp', 'requests')
+
+    def _importtime(self, code):
+        import os
+        import subprocess
+        import sys
+        from django.conf import settings
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE='mujard.settings', SDK_WARMUP='0')
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            cwd=str(settings.BASE_DIR), env=env, capture_output=True, text=True, timeout=120,
+        )
+        self.assertEqual(proc.returncode, 0, proc.stderr[-2000:])
+        cumulative = {}
+        for line in proc.stderr.splitlines():
+            if not line.startswith('import time:') or '|' not in line:
+                continue
+            _, cum, name = line.split('|', 2)
+            if cum.strip().isdigit():
+                cumulative[name.strip()] = int(cum.strip())
+        return cumulative
+
+    def test_asgi_import_skips_provider_sdks_and_fits_budget(self):
+        import os
+        modules = self._importtime('import mujard.asgi')
+        self.assertIn('mujard.asgi', modules)
+        self.assertEqual([m for m in self.HEAVY_SDKS if m in modules], [])
+        budget_ms = int(os.getenv('ASGI_IMPORT_BUDGET_MS', '3000'))
+        self.assertLess(modules['mujard.asgi'] / 1000, budget_ms)
+
+    def test_sdk_loads_on_first_use(self):
+        from . import sdk
+        otp = sdk.lazy('pyotp')
+        self.assertTrue(sdk.available('pyotp'))
+        self.assertTrue(otp.TOTP('JBSWY3DPEHPK3PXP').now().isdigit())
+        self.assertIs(sdk.load('pyotp'), sdk.load('pyotp'))
+        self.assertTrue(sdk.loaded()['pyotp'])
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        from .instrumentation import registry
+        registry.reset()
+        self.addCleanup(registry.reset)
+        self.user1 = User.objects.create_user(username='ins_u1', password='pass12345')
+        self.user2 = User.objects.create_user(username='ins_u2', password='pass12345')
+        self.conv = Conversation.objects.create(user_a=self.user1, user_b=self.user2)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user1)
+
+    def test_http_metrics_are_recorded_per_route_and_exported(self):
+        from .instrumentation import registry
+        self.assertEqual(self.client.get('/api/conversations/').status_code, 200)
+        labels = {'route': 'api/conversations/', 'method': 'GET'}
+        self.assertEqual(registry.histogram_count('http_duration_seconds', labels), 1)
+        self.assertGreater(registry.counter_value('http_db_seconds_total', labels), 0)
+        self.assertEqual(registry.counter_value('http_requests_total', {**labels, 'status': '2xx'}), 1)
+
+        anonymous = APIClient()
+        self.assertEqual(anonymous.get('/metrics').status_code, 403)
+        with self.settings(METRICS_TOKEN='scrape-secret'):
+            self.assertEqual(anonymous.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            res = anonymous.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret')
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = res.content.decode()
+        self.assertIn('# TYPE mutabaka_http_duration_seconds histogram', text)
+        self.assertIn('mutabaka_http_requests_total{method="GET",route="api/conversations/",status="2xx"} 1', text)
+        self.assertIn('mutabaka_http_db_queries_bucket{method="GET",route="api/conversations/",le="+Inf"} 1', text)
+
+    def test_slow_requests_log_their_sql(self):
+        with self.settings(METRICS_SLOW_REQUEST_MS=0, METRICS_SLOW_SAMPLE_RATE=1.0):
+            with self.assertLogs('communications.instrumentation', 'WARNING') as logs:
+                self.client.get('/api/conversations/')
+        record = logs.records[0]
+        self.assertEqual(record.event, 'slow_request')
+        self.assertGreater(record.queries, 0)
+        self.assertTrue(any('communications_conversation' in s['sql'] for s in record.slowest_sql))
+
+    def test_ws_events_record_queries_and_group_sends(self):
+        from asgiref.sync import async_to_sync
+        from channels.testing import WebsocketCommunicator
+        from .consumers import ConversationConsumer
+        from .instrumentation import registry
+
+        async def run():
+            app = ConversationConsumer.as_asgi()
+            comm = WebsocketCommunicator(app, f'/ws/conversations/{self.conv.id}/')
+            comm.scope['user'] = self.user1
+            comm.scope['url_route'] = {'kwargs': {'conversation_id': self.conv.id}}
+            connected, _ = await comm.connect()
+            self.assertTrue(connected)
+            await comm.send_json_to({'type': 'text', 'body': 'hello'})
+            while (await comm.receive_json_from(timeout=2))['type'] != 'chat.message':
+                pass
+            await comm.disconnect()
+
+        async_to_sync(run)()
+        labels = {'consumer': 'ConversationConsumer', 'event': 'text'}
+        self.assertEqual(registry.histogram_count('ws_duration_seconds', labels), 1)
+        self.assertGreater(registry.counter_value('ws_db_seconds_total', labels), 0)
+        self.assertGreaterEqual(registry.counter_value('ws_group_sends_total', labels), 1)
+        self.assertEqual(registry.histogram_count('ws_duration_seconds', {'consumer': 'ConversationConsumer', 'event': 'connect'}), 1)
+        self.assertGreaterEqual(registry.counter_value('channel_group_sends_total', {'group': 'conv'}), 1)
+
+
+class BenchmarkSuiteTests(TestCase):
+    def test_suite_runs_at_tiny_scale_and_compare_flags_query_growth(self):
+        import copy
+        from .benchmarks import Scale, compare, run_suite
+        scale = Scale(users=4, conversations=3, messages=3, iterations=2, ws_clients=1, ws_rounds=1)
+        report = run_suite(scale)
+        self.assertEqual(set(report['results']), {'inbox', 'messages', 'send', 'read', 'transaction', 'ws_loop'})
+        self.assertEqual(report['results']['send']['n'], 2)
+        self.assertGreater(report['results']['transaction']['queries_per_op'], 0)
+        self.assertEqual(report['results']['ws_loop']['ack']['n'], 1)
+        self.assertEqual([r['name'] for r in compare(report, report) if r['regression']], [])
+
+        baseline = copy.deepcopy(report)
+        baseline['results']['send']['queries_per_op'] -= 1
+        flagged = [r['name'] for r in compare(report, baseline) if r['regression']]
+        self.assertEqual(flagged, ['send'])
+
+    def test_read_endpoint_persists_read_state(self):
+        from datetime import timedelta
+        from subscriptions.models import SubscriptionPlan, UserSubscription
+        u1 = User.objects.create_user(username='bn_u1', password='pass12345')
+        u2 = User.objects.create_user(username='bn_u2', password='pass12345')
+        plan, _ = SubscriptionPlan.objects.get_or_create(code='king')
+        UserSubscription.objects.update_or_create(user=u1, defaults={'plan': plan, 'start_at': timezone.now() - timedelta(days=1), 'end_at': timezone.now() + timedelta(days=1)})
+        conv = Conversation.objects.create(user_a=u1, user_b=u2)
+        msg = Message.objects.create(conversation=conv, sender=u2, body='hi', delivery_status=1)
+        client = APIClient()
+        client.force_authenticate(u1)
+        self.assertEqual(client.post(f'/api/conversations/{conv.id}/read/').status_code, 200)
+        self.assertEqual(ConversationReadMarker.objects.get(conversation=conv, user=u1).last_read_message_id, msg.id)
+        # The sender sees the tick, derived from the marker
+        client.force_authenticate(u2)
+        row = client.get(f'/api/conversations/{conv.id}/messages/').json()[0]
+        self.assertEqual((row['delivery_status'], row['status']), (2, 'read'))
+        self.assertIsNotNone(row['read_at'])
+
+
+
+@override_settings(SHARED_CACHE=True)
+class QueryBudgetTests(TestCase):
+    """Query and channel-layer send budgets for hot endpoints.
+
+    Each endpoint is measured at a small and a large data size; the counts must
+    match (nothing per row) and stay under the budget. A reintroduced N+1 in a
+    serializer method field fails here.
+    """
+
+    def setUp(self):
+        from datetime import timedelta
+        from django.core.cache import cache
+        from subscriptions.models import SubscriptionPlan, UserSubscription
+        cache.clear()
+        self.owner = User.objects.create_user(username='qb_owner', password='pass12345')
+        self.peer = User.objects.create_user(username='qb_peer', password='pass12345')
+        plan, _ = SubscriptionPlan.objects.get_or_create(code='king')
+        UserSubscription.objects.update_or_create(user=self.owner, defaults={'plan': plan, 'start_at': timezone.now() - timedelta(days=1), 'end_at': timezone.now() + timedelta(days=30)})
+        self.conv = Conversation.objects.create(user_a=self.owner, user_b=self.peer)
+        self.currency = Currency.objects.create(code='QBC', symbol='Q', name='Budget', precision=2)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def measure(self, fn):
+        """(queries, group_sends) issued by ``fn``."""
+        from unittest import mock
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from . import channel_layers
+        groups = []
+        record = channel_layers.record_group_send
+
+        def counting(group):
+            groups.append(group)
+            record(group)
+
+        with mock.patch.object(channel_layers, 'record_group_send', side_effect=counting):
+            with CaptureQueriesContext(connection) as ctx:
+                resp = fn()
+        self.assertLess(resp.status_code, 300, resp.content[:300])
+        return len(ctx.captured_queries), len(groups)
+
+    def assertBudget(self, small, large, queries, group_sends):
+        self.assertEqual(small[0], large[0], f"query count grows with data size: {small[0]} -> {large[0]}")
+        self.assertLessEqual(large[0], queries)
+        self.assertLessEqual(large[1], group_sends)
+
+    def add_users(self, prefix, count):
+        User.objects.bulk_create([User(username=f'{prefix}{i}', password='!') for i in range(count)])
+        return list(User.objects.filter(username__startswith=prefix).order_by('id'))
+
+    def add_inbound(self, count):
+        Message.objects.bulk_create([
+            Message(conversation=self.conv, sender=self.peer, body=f'm{i}', delivery_status=0)
+            for i in range(count)
+        ])
+
+    def add_viewers(self, count):
+        for viewer in self.add_users('qb_viewer', count):
+            ConversationMember.objects.create(conversation=self.conv, member_user=viewer, added_by=self.owner)
+
+    def test_messages_page_20_vs_200_rows(self):
+        url = f'/api/conversations/{self.conv.id}/messages/?mark_read=1'
+        self.client.post(f'/api/conversations/{self.conv.id}/send/', {'body': 'hi'}, format='json')
+        self.add_inbound(1)
+        self.client.get(url)  # read markers and reconciliation settled from here on
+        self.add_inbound(20)
+        small = self.measure(lambda: self.client.get(url))
+        self.add_inbound(180)
+        large = self.measure(lambda: self.client.get(url))
+        self.assertEqual(len(self.client.get(url).json()), 200)
+        # one delivered frame per message (clients match status by id) + read range + chat.read
+        self.assertEqual((small[1], large[1]), (22, 182))
+        self.assertBudget(small, large, queries=20, group_sends=182)
+
+    def test_conversation_list_10_vs_100_conversations(self):
+        url = '/api/conversations/?limit=100'
+        others = self.add_users('qb_contact', 99)
+        Conversation.objects.bulk_create([Conversation(user_a=self.owner, user_b=u) for u in others[:9]])
+        small = self.measure(lambda: self.client.get(url))
+        Conversation.objects.bulk_create([Conversation(user_a=self.owner, user_b=u, delete_requested_by=u, delete_requested_at=timezone.now()) for u in others[9:]])
+        self.conv.mutes.create(user=self.owner)
+        large = self.measure(lambda: self.client.get(url))
+        self.assertEqual(len(self.client.get(url).json()['results']), 100)
+        self.assertBudget(small, large, queries=5, group_sends=0)
+
+    def test_send_with_three_extra_viewers(self):
+        send = lambda: self.client.post(f'/api/conversations/{self.conv.id}/send/', {'body': 'hello'}, format='json')
+        send()
+        small = self.measure(send)
+        self.add_viewers(3)
+        send()
+        large = self.measure(send)
+        # One inbox frame per recipient is inherent; everything else is shared
+        self.assertBudget(small, large, queries=12, group_sends=6)
+        self.assertEqual(large[1] - small[1], 3)
+
+    def test_create_transaction_with_history_and_viewers(self):
+        post = lambda: self.client.post('/api/transactions/', {
+            'conversation': self.conv.id, 'currency_id': self.currency.id, 'amount': '1.5', 'direction': 'lna',
+        }, format='json')
+        post()
+        small = self.measure(post)
+        self.add_viewers(3)
+        for _ in range(10):
+            post()
+        large = self.measure(post)
+        self.assertBudget(small, large, queries=25, group_sends=5)
+
+
+class SeedLoadDataTests(TestCase):
+    def test_small_data_set_is_consistent(self):
+        import io
+        from collections import defaultdict
+        from decimal import Decimal
+        from django.core.management import call_command
+        from accounts.models import UserDevice
+        from subscriptions.models import UserSubscription
+        out = io.StringIO()
+        call_command(
+            'seed_load_data', users=12, conversations=20, messages=300, transactions=40, currencies='LDA,LDB',
+            team_ratio=0.25, batch_size=50, prefix='ld', force=True, stdout=out, stderr=io.StringIO(),
+        )
+        self.assertIn('messages=300', out.getvalue())
+        users = User.objects.filter(username__startswith='ld_')
+        self.assertEqual(users.count(), 12)
+        self.assertEqual(UserSubscription.objects.filter(user__in=users).count(), 12)
+        self.assertEqual(UserDevice.objects.filter(user__in=users, status='primary').count(), 12)
+        convs = Conversation.objects.filter(user_a__in=users)
+        self.assertEqual(Message.objects.filter(conversation__in=convs, type='text').count(), 300)
+        self.assertEqual(Transaction.objects.filter(conversation__in=convs, message__isnull=False).count(), 40)
+        self.assertFalse(Message.objects.filter(conversation__in=convs, type='transaction', tx_meta__isnull=True).exists())
+
+        # Wallets hold exactly the sum of each user's transaction legs; the ledger nets to zero
+        expected = defaultdict(Decimal)
+        for t in Transaction.objects.filter(conversation__in=convs):
+            sign = 1 if t.direction == 'lna' else -1
+            expected[(t.from_user_id, t.currency_id)] += sign * t.amount
+            expected[(t.to_user_id, t.currency_id)] -= sign * t.amount
+        wallets = Wallet.objects.filter(user__in=users, currency__code__in=['LDA', 'LDB'])
+        self.assertEqual(wallets.count(), 24)
+        for w in wallets:
+            self.assertEqual(w.balance, expected.get((w.user_id, w.currency_id), Decimal('0')))
+        self.assertEqual(sum(w.balance for w in wallets), 0)
+        latest = Transaction.objects.filter(conversation__in=convs).order_by('-created_at', '-id').first()
+        self.assertEqual(Wallet.objects.get(user_id=latest.from_user_id, currency_id=latest.currency_id).balance, latest.balance_after_from)
+
+        # Read markers never point past what the user has read
+        for marker in ConversationReadMarker.objects.filter(conversation__in=convs):
+            unread_below = Message.objects.filter(
+                conversation_id=marker.conversation_id, id__lte=marker.last_read_message_id, read_at__isnull=True,
+            ).exclude(sender_id=marker.user_id)
+            self.assertFalse(unread_below.exists())
+        self.assertTrue(ConversationMember.objects.filter(conversation__in=convs, member_team__isnull=False).exists())
+
+
+class TransactionMetaTests(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='txm_u1', password='pass12345')
+        self.user2 = User.objects.create_user(username='txm_u2', password='pass12345')
+        self.currency = Currency.objects.create(code='TXM', symbol='T', name='Meta', precision=2)
+        self.conv = Conversation.objects.create(user_a=self.user1, user_b=self.user2)
+
+    def test_create_transaction_stores_meta_on_message(self):
+        txn = Transaction.create_transaction(self.conv, self.user1, self.currency, 12.5, 'lkm', note='rent')
+        msg = Message.objects.get(conversation=self.conv, type='transaction')
+        self.assertEqual(msg.tx_meta, txn.build_message_meta())
+        self.assertEqual(msg.tx_meta['symbol'], 'T')
+
+    def test_history_serializes_tx_without_joining_transactions(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        Transaction.create_transaction(self.conv, self.user1, self.currency, 5, 'lna', note='n')
+        client = APIClient()
+        client.force_authenticate(self.user1)
+        with CaptureQueriesContext(connection) as ctx:
+            resp = client.get(f'/api/conversations/{self.conv.id}/messages/')
+        self.assertEqual(resp.status_code, 200)
+        rows = resp.json()
+        rows = rows.get('results', rows) if isinstance(rows, dict) else rows
+        tx = [m['tx'] for m in rows if m.get('type') == 'transaction']
+        self.assertEqual(tx[0]['amount'], 5.0)
+        self.assertEqual(tx[0]['note'], 'n')
+        self.assertFalse([q['sql'] for q in ctx.captured_queries if 'communications_transaction' in q['sql']])
+
+    def test_backfill_command_fills_legacy_rows(self):
+        from io import StringIO
+        from django.core.management import call_command
+        txn = Transaction.create_transaction(self.conv, self.user1, self.currency, 7, 'lna')
+        legacy = Message.objects.create(conversation=self.conv, sender=self.user2, type='transaction', body='معاملة: لكم 3.50 $ - old')
+        Message.objects.filter(conversation=self.conv).update(tx_meta=None)
+
+        out = StringIO()
+        call_command('backfill_tx_meta', '--dry-run', stdout=out)
+        self.assertIn('scanned=2', out.getvalue())
+        self.assertFalse(Message.objects.filter(tx_meta__isnull=False).exists())
+
+        out = StringIO()
+        call_command('backfill_tx_meta', stdout=out)
+        self.assertIn('from_transaction=1 from_body=1', out.getvalue())
+        self.assertEqual(Message.objects.get(pk=txn.message_id).tx_meta, txn.build_message_meta())
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.tx_meta['direction'], 'lkm')
+        self.assertEqual(legacy.tx_meta['amount'], 3.5)
+        self.assertEqual(legacy.tx_meta['note'], 'old')
+
+
+class ReadMarkerStateTests(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='rm_u1', password='pass12345')
+        self.user2 = User.objects.create_user(username='rm_u2', password='pass12345')
+        self.conv = Conversation.objects.create(user_a=self.user1, user_b=self.user2)
+        self.inbound = [Message.objects.create(conversation=self.conv, sender=self.user2, body=f'm{i}') for i in range(3)]
+
+    def test_advance_is_monotonic(self):
+        first, second, third = (m.id for m in self.inbound)
+        self.assertEqual(ConversationReadMarker.advance(self.conv.id, self.user1.id, second), 0)
+        self.assertIsNone(ConversationReadMarker.advance(self.conv.id, self.user1.id, first))
+        self.assertEqual(ConversationReadMarker.advance(self.conv.id, self.user1.id, third), second)
+        self.assertEqual(ConversationReadMarker.objects.get(conversation=self.conv, user=self.user1).last_read_message_id, third)
+        reads = SyncChange.objects.filter(conversation_id=self.conv.id, kind=SyncChange.KIND_READ).values_list('message_id', flat=True)
+        self.assertEqual(sorted(set(reads)), [second, third])
+
+    def test_read_writes_one_marker_row_and_no_messages(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        client = APIClient()
+        client.force_authenticate(self.user1)
+        for _ in range(2):
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(client.post(f'/api/conversations/{self.conv.id}/read/').status_code, 200)
+            writes = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE') and 'communications_message' in q['sql']]
+            self.assertEqual(writes, [])
+        self.assertTrue(all(m.read_at is None for m in Message.objects.filter(conversation=self.conv)))
+        rows = client.get(f'/api/conversations/{self.conv.id}/messages/').json()
+        self.assertEqual({r['status'] for r in rows}, {'read'})
+
+    def test_message_list_reports_outgoing_reads_from_markers(self):
+        reader = APIClient()
+        reader.force_authenticate(self.user1)
+        self.assertEqual(reader.post(f'/api/conversations/{self.conv.id}/read/').status_code, 200)
+        other = Conversation.objects.create(user_a=self.user2, user_b=User.objects.create_user(username='rm_u3', password='pass12345'))
+        Message.objects.create(conversation=other, sender=self.user2, body='elsewhere')
+        sender = APIClient()
+        sender.force_authenticate(self.user2)
+        rows = sender.get('/api/messages/', {'conversation': self.conv.id}).json()['results']
+        self.assertEqual(sorted(r['id'] for r in rows), [m.id for m in self.inbound])
+        self.assertEqual({(r['status'], r['delivery_status']) for r in rows}, {('read', 2)})
+        self.assertTrue(all(r['read_at'] for r in rows))
+        detail = sender.get(f'/api/messages/{self.inbound[0].id}/').json()
+        self.assertEqual(detail['status'], 'read')
+
+    def test_migration_lifts_markers_from_legacy_read_rows(self):
+        import importlib
+        from django.apps import apps
+        legacy = importlib.import_module('communications.migrations.0035_read_markers_from_messages')
+        Message.objects.filter(id=self.inbound[1].id).update(delivery_status=2, read_at=timezone.now())
+        legacy.lift_markers(apps, None)
+        self.assertEqual(ConversationReadMarker.objects.get(conversation=self.conv, user=self.user1).last_read_message_id, self.inbound[1].id)
+        self.assertFalse(ConversationReadMarker.objects.filter(conversation=self.conv, user=self.user2).exists())
+
+
+class ConversationPurgeTests(TestCase):
+    def setUp(self):
+        from django.test import override_settings
+        override = override_settings(PURGE_IN_BACKGROUND=False, PURGE_BATCH_SIZE=2)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user1 = User.objects.create_user(username='pg_u1', password='pass12345')
+        self.user2 = User.objects.create_user(username='pg_u2', password='pass12345')
+        self.currency = Currency.objects.create(code='PGC', symbol='P', name='Purge', precision=2)
+        self.conv = Conversation.objects.create(user_a=self.user1, user_b=self.user2)
+        for i in range(5):
+            Message.objects.create(conversation=self.conv, sender=self.user2, body=f'm{i}')
+        self.txn = Transaction.create_transaction(self.conv, self.user1, self.currency, 5, 'lna')
+        ConversationSettlement.objects.create(conversation=self.conv, transaction=self.txn, settled_at=timezone.now())
+        self.client = APIClient()
+        self.client.force_authenticate(self.user1)
+
+    def test_clear_hides_history_then_purges_it_in_batches(self):
+        from .models import ConversationPurge
+        with self.captureOnCommitCallbacks() as callbacks:
+            resp = self.client.post(f'/api/conversations/{self.conv.id}/clear/')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()['deleted_messages'], 6)
+        # Tombstoned: nothing visible or unread before the job has run
+        self.assertEqual(self.client.get(f'/api/conversations/{self.conv.id}/messages/').json(), [])
+        self.assertEqual(self.client.get('/api/inbox/unread_count').json()['unread_count'], 0)
+        self.assertEqual(Message.objects.filter(conversation=self.conv).count(), 6)
+        later = Message.objects.create(conversation=self.conv, sender=self.user2, body='after clear')
+
+        for callback in callbacks:
+            callback()
+        job = ConversationPurge.objects.get(conversation_id=self.conv.id)
+        self.assertEqual((job.status, job.progress), (ConversationPurge.STATUS_DONE, {'messages': 6}))
+        self.assertEqual(list(Message.objects.filter(conversation=self.conv).values_list('id', flat=True)), [later.id])
+        # The ledger survives; the transaction just loses its chat bubble
+        self.txn.refresh_from_db()
+        self.assertIsNone(self.txn.message_id)
+        self.assertTrue(ConversationSettlement.objects.filter(transaction=self.txn).exists())
+        self.assertEqual(self.client.get(f'/api/purges/{job.id}').json()['status'], 'done')
+
+    def test_approve_delete_tombstones_then_purges_every_table(self):
+        from .models import ConversationPurge
+        ConversationReadMarker.advance(self.conv.id, self.user1.id, self.txn.message_id)
+        Conversation.objects.filter(pk=self.conv.pk).update(delete_requested_by=self.user2)
+        with self.captureOnCommitCallbacks() as callbacks:
+            resp = self.client.post(f'/api/conversations/{self.conv.id}/approve_delete/')
+        self.assertEqual(resp.status_code, 200)
+        job_id = resp.json()['purge']['id']
+        self.assertNotIn(self.conv.id, [c['id'] for c in self.client.get('/api/conversations/?limit=100').json()['results']])
+        self.assertEqual(self.client.get(f'/api/conversations/{self.conv.id}/messages/').status_code, 404)
+        self.client.force_authenticate(self.user2)
+        self.assertEqual(self.client.get('/api/inbox/unread_count').json()['unread_count'], 0)
+
+        for callback in callbacks:
+            callback()
+        job = ConversationPurge.objects.get(id=job_id)
+        self.assertEqual(job.status, ConversationPurge.STATUS_DONE)
+        self.assertEqual(job.progress, {'settlements': 1, 'transactions': 1, 'messages': 6, 'read_markers': 1, 'conversation': 1})
+        self.assertFalse(Conversation.objects.filter(pk=self.conv.pk).exists())
+        self.assertFalse(Message.objects.filter(conversation_id=self.conv.id).exists())
+        self.assertFalse(Transaction.objects.filter(conversation_id=self.conv.id).exists())
+        self.assertEqual(self.client.get(f'/api/purges/{job_id}').json()['progress']['messages'], 6)
+
+    def test_recreating_a_tombstoned_pair_finishes_the_purge_first(self):
+        from datetime import timedelta
+        from subscriptions.models import SubscriptionPlan, UserSubscription
+        plan, _ = SubscriptionPlan.objects.get_or_create(code='king')
+        UserSubscription.objects.update_or_create(user=self.user1, defaults={'plan': plan, 'start_at': timezone.now() - timedelta(days=1), 'end_at': timezone.now() + timedelta(days=30)})
+        Conversation.objects.filter(pk=self.conv.pk).update(delete_requested_by=self.user2)
+        self.client.post(f'/api/conversations/{self.conv.id}/approve_delete/')  # job left pending
+        resp = self.client.post('/api/conversations/', {'other_user_id': self.user2.id}, format='json')
+        self.assertEqual(resp.status_code, 201)
+        self.assertNotEqual(resp.json()['id'], self.conv.id)
+        self.assertFalse(Message.objects.filter(conversation_id=self.conv.id).exists())
+
+    def test_run_purges_command_resumes_failed_jobs(self):
+        from io import StringIO
+        from unittest import mock
+        from django.core.management import call_command
+        from . import purge
+        from .models import ConversationPurge
+        Conversation.objects.filter(pk=self.conv.pk).update(delete_requested_by=self.user2)
+        self.client.post(f'/api/conversations/{self.conv.id}/approve_delete/')
+        job = ConversationPurge.objects.get(conversation_id=self.conv.id)
+        with mock.patch.object(purge, '_raw_delete', side_effect=[1, RuntimeError('lock timeout')]):
+            purge.run_purge(job.id)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.progress), (ConversationPurge.STATUS_FAILED, {'settlements': 1}))
+        self.assertIn('lock timeout', job.last_error)
+
+        out = StringIO()
+        call_command('run_purges', stdout=out)
+        self.assertIn('Summary: done=1 failed=0 skipped=0', out.getvalue())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (ConversationPurge.STATUS_DONE, 2))
+        self.assertFalse(Conversation.objects.filter(pk=self.conv.pk).exists())
+
+
+class AttachmentGCTests(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        from django.test import override_settings
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, True)
+        override = override_settings(MEDIA_ROOT=media, PURGE_IN_BACKGROUND=False)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user1 = User.objects.create_user(username='gc_u1', password='pass12345')
+        self.user2 = User.objects.create_user(username='gc_u2', password='pass12345')
+        self.conv = Conversation.objects.create(user_a=self.user1, user_b=self.user2)
+
+    def _attach(self, name):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        return Message.objects.create(
+            conversation=self.conv, sender=self.user1,
+            attachment=SimpleUploadedFile(name, b'%PDF-1.4 data', content_type='application/pdf'),
+            attachment_name=name, attachment_size=13,
+        )
+
+    def test_purged_attachments_are_deleted_after_the_grace_period(self):
+        from datetime import timedelta
+        from .attachment_gc import run_gc
+        from .models import AttachmentFile
+        msg = self._attach('a.pdf')
+        path = msg.attachment.name
+        storage = msg.attachment.storage
+        self.assertTrue(path.startswith('attachments/'))
+        self.assertEqual(AttachmentFile.objects.get(path=path).message_id, msg.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.force_login(self.user1)
+            self.assertEqual(self.client.post(f'/api/conversations/{self.conv.id}/clear/').status_code, 200)
+        self.assertIsNotNone(AttachmentFile.objects.get(path=path).orphaned_at)
+
+        sweep = run_gc()
+        self.assertEqual(sweep.counts['deleted'], 0)
+        self.assertTrue(storage.exists(path))
+        sweep = run_gc(now=timezone.now() + timedelta(hours=25))
+        self.assertEqual((sweep.counts['deleted'], sweep.counts['bytes_freed']), (1, 13))
+        self.assertFalse(storage.exists(path))
+        self.assertFalse(AttachmentFile.objects.filter(path=path).exists())
+
+    def test_scan_and_mark_find_orphans_incrementally(self):
+        import os
+        import time
+        from datetime import timedelta
+        from io import StringIO
+        from django.core.files.base import ContentFile
+        from django.core.management import call_command
+        from .attachment_gc import run_gc
+        from .models import AttachmentFile, AttachmentSweep
+        kept = self._attach('kept.pdf')
+        gone = self._attach('gone.pdf')
+        gone_path = gone.attachment.name
+        Message.objects.filter(id=gone.id).delete()  # cascade-style delete, no purge involved
+        storage = kept.attachment.storage
+        stray = storage.save('attachments/2020/01/stray.pdf', ContentFile(b'old'))
+        old = time.time() - 3 * 86400
+        os.utime(storage.path(stray), (old, old))
+
+        dry = run_gc(dry_run=True, dirs=1)
+        self.assertIsNone(dry.pk)
+        self.assertEqual((dry.counts['orphaned'], dry.counts['discovered']), (1, 0))
+        self.assertFalse(AttachmentFile.objects.filter(orphaned_at__isnull=False).exists())
+
+        # One directory per run: the legacy root first, then the month directories in order
+        first = run_gc(dirs=1, grace=timedelta(0))
+        self.assertEqual(first.scan_cursor, 'attachments')
+        self.assertEqual(first.counts['deleted'], 1)
+        self.assertFalse(storage.exists(gone_path))
+        self.assertTrue(storage.exists(stray))
+        second = run_gc(dirs=1, grace=timedelta(0))
+        self.assertEqual((second.scan_cursor, second.counts['discovered'], second.counts['deleted']), ('attachments/2020/01', 1, 1))
+        self.assertFalse(storage.exists(stray))
+        self.assertEqual(AttachmentSweep.objects.filter(dry_run=False).count(), 2)
+
+        out = StringIO()
+        call_command('gc_attachments', '--grace-hours', '0', stdout=out)
+        self.assertIn('Summary: checked=1 orphaned=0', out.getvalue())
+        self.assertTrue(storage.exists(kept.attachment.name))
+        self.assertEqual(list(AttachmentFile.objects.values_list('path', flat=True)), [kept.attachment.name])
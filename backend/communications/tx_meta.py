@@ -0,0 +1,109 @@
+"""Transaction metadata stored on chat messages.
+
+``Message.tx_meta`` holds the ``tx`` payload of a transaction message (id,
+direction, amount, currency code/symbol, note). ``Transaction.create_transaction``
+writes it together with the message, so serializing history never joins
+Transaction/Currency nor parses the message body.
+
+``backfill`` fills the column for rows written before it existed. It only
+uses plain fields, so the data migration can run it with historical models;
+``manage.py backfill_tx_meta`` runs it against the live models.
+"""
+from __future__ import annotations
+
+import re
+from typing import Dict, Optional
+
+TRANSACTION_BODY_RE = re.compile(r'^معاملة:\s*(لنا|لكم)\s*([0-9]+(?:\.[0-9]+)?)\s*([^\s]+)(?:\s*-\s*(.*))?$', re.DOTALL | re.MULTILINE)
+
+
+def _to_float(value) -> float:
+    try:
+        return float(value)
+    except Exception:
+        try:
+            return float(str(value).replace(',', '.'))
+        except Exception:
+            return 0.0
+
+
+def parse_transaction_body(body: str | None) -> Optional[dict]:
+    """Best-effort payload from a transaction message body (legacy rows without a Transaction)."""
+    if not body:
+        return None
+    try:
+        text = body.strip()
+    except Exception:
+        return None
+    m = TRANSACTION_BODY_RE.match(text)
+    if not m:
+        return None
+    symbol = (m.group(3) or '').strip()
+    return {
+        'direction': 'lna' if m.group(1) == 'لنا' else 'lkm',
+        'amount': _to_float(m.group(2)),
+        'currency': symbol,
+        'symbol': symbol,
+        'note': (m.group(4) or '').strip(),
+    }
+
+
+def meta_from_values(txn_id, direction, amount, currency_code, currency_symbol, note) -> dict:
+    """Same shape as ``Transaction.build_message_meta``, from plain column values."""
+    code = currency_code or ''
+    return {
+        'id': txn_id,
+        'direction': direction,
+        'amount': _to_float(amount),
+        'currency': code,
+        'symbol': (currency_symbol or '').strip() or code,
+        'note': note or '',
+    }
+
+
+def backfill(message_model=None, transaction_model=None, *, batch_size: int = 1000,
+             rebuild: bool = False, dry_run: bool = False) -> Dict[str, int]:
+    """Fill ``tx_meta`` on transaction messages, walking them by id in batches.
+
+    Rows linked to a Transaction get its values; the rest fall back to the
+    body. With ``rebuild`` rows that already have meta are rewritten too.
+    Returns counts: scanned, from_transaction, from_body, unparsed.
+    """
+    if message_model is None or transaction_model is None:
+        from .models import Message, Transaction
+        message_model = message_model or Message
+        transaction_model = transaction_model or Transaction
+    counts = {'scanned': 0, 'from_transaction': 0, 'from_body': 0, 'unparsed': 0}
+    qs = message_model.objects.filter(type='transaction')
+    if not rebuild:
+        qs = qs.filter(tx_meta__isnull=True)
+    last_id = 0
+    while True:
+        rows = list(qs.filter(id__gt=last_id).order_by('id').only('id', 'body')[:batch_size])
+        if not rows:
+            break
+        last_id = rows[-1].id
+        txns = {
+            row['message_id']: row
+            for row in transaction_model.objects.filter(message_id__in=[m.id for m in rows]).values(
+                'id', 'message_id', 'direction', 'amount', 'currency__code', 'currency__symbol', 'note',
+            )
+        }
+        changed = []
+        for message in rows:
+            counts['scanned'] += 1
+            row = txns.get(message.id)
+            if row is not None:
+                meta = meta_from_values(row['id'], row['direction'], row['amount'], row['currency__code'], row['currency__symbol'], row['note'])
+                counts['from_transaction'] += 1
+            else:
+                meta = parse_transaction_body(message.body)
+                if not meta:
+                    counts['unparsed'] += 1
+                    continue
+                counts['from_body'] += 1
+            message.tx_meta = meta
+            changed.append(message)
+        if changed and not dry_run:
+            message_model.objects.bulk_update(changed, ['tx_meta'], batch_size=batch_size)
+    return counts
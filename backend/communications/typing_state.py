@@ -0,0 +1,88 @@
+"""Per-connection typing indicator coalescing.
+
+Clients send ``{"type": "typing"}`` on every keystroke. Instead of relaying each
+frame to the whole conversation group, a consumer keeps one ``TypingCoalescer``
+and forwards only state transitions (start/stop), at most once per
+``WS_TYPING_INTERVAL`` seconds per conversation. While a user keeps typing, a
+"start" is re-sent once per interval so peers' UI timeouts do not hide the
+indicator. A "start" that is not refreshed within ``WS_TYPING_EXPIRE`` seconds
+turns into "stop" server-side, so a client that vanishes mid-typing does not leave
+a stuck indicator.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from django.conf import settings
+
+Emit = Callable[[int, str], Awaitable[None]]
+
+
+class _State:
+    __slots__ = ('desired', 'sent', 'last_emit', 'flush_task', 'expire_task')
+
+    def __init__(self):
+        self.desired: str = 'stop'
+        self.sent: Optional[str] = None
+        self.last_emit: float = 0.0
+        self.flush_task: Optional[asyncio.Task] = None
+        self.expire_task: Optional[asyncio.Task] = None
+
+
+class TypingCoalescer:
+    def __init__(self, emit: Emit, interval: Optional[float] = None, expire: Optional[float] = None):
+        self.emit = emit
+        self.interval = float(getattr(settings, 'WS_TYPING_INTERVAL', 2.0) if interval is None else interval)
+        self.expire = float(getattr(settings, 'WS_TYPING_EXPIRE', 6.0) if expire is None else expire)
+        self._states: Dict[int, _State] = {}
+
+    async def update(self, conversation_id: int, state: str) -> None:
+        st = self._states.setdefault(conversation_id, _State())
+        st.desired = 'start' if state == 'start' else 'stop'
+        if st.expire_task:
+            st.expire_task.cancel()
+            st.expire_task = None
+        if st.desired == 'start':
+            st.expire_task = asyncio.ensure_future(self._expire_later(conversation_id, st))
+        await self._flush(conversation_id, st)
+
+    async def _flush(self, conversation_id: int, st: _State) -> None:
+        now = time.monotonic()
+        if st.desired == 'stop':
+            if st.sent != 'start':
+                # Nothing is shown to peers; no need to announce a stop
+                return
+        elif st.sent == 'start' and now - st.last_emit < self.interval:
+            # Still typing and peers were told recently
+            return
+        wait = self.interval - (now - st.last_emit)
+        if wait > 0:
+            if st.flush_task is None or st.flush_task.done():
+                st.flush_task = asyncio.ensure_future(self._flush_later(conversation_id, st, wait))
+            return
+        st.sent = st.desired
+        st.last_emit = now
+        await self.emit(conversation_id, st.desired)
+
+    async def _flush_later(self, conversation_id: int, st: _State, wait: float) -> None:
+        await asyncio.sleep(wait)
+        st.flush_task = None
+        await self._flush(conversation_id, st)
+
+    async def _expire_later(self, conversation_id: int, st: _State) -> None:
+        await asyncio.sleep(self.expire)
+        st.expire_task = None
+        st.desired = 'stop'
+        await self._flush(conversation_id, st)
+
+    async def close(self) -> None:
+        """Cancel timers and emit a final stop for any conversation still showing "start"."""
+        states, self._states = self._states, {}
+        for conversation_id, st in states.items():
+            for task in (st.flush_task, st.expire_task):
+                if task:
+                    task.cancel()
+            if st.sent == 'start':
+                await self.emit(conversation_id, 'stop')
@@ -9,6 +9,9 @@ from .views import (
     TermsOfUseView,
     EnsureAdminConversationView, TeamMemberViewSet, TeamLoginView,
     InboxUnreadCountView,
+    SyncView,
+    PurgeStatusView,
+    RealtimeMetricsView,
 )
 from finance.views import WalletViewSet, CurrencyViewSet
 
@@ -37,5 +40,8 @@ urlpatterns = [
     path('ensure_admin_conversation', EnsureAdminConversationView.as_view(), name='ensure_admin_conversation'),
     path('auth/team/login', TeamLoginView.as_view(), name='team_login'),
     path('inbox/unread_count', InboxUnreadCountView.as_view(), name='inbox_unread_count'),
+    path('sync', SyncView.as_view(), name='sync'),
+    path('purges/<int:pk>', PurgeStatusView.as_view(), name='purge_status'),
+    path('realtime/metrics', RealtimeMetricsView.as_view(), name='realtime_metrics'),
     path('', include(router.urls))
 ]
@@ -5,7 +5,7 @@ from django.conf import settings
 from django.core.exceptions import ValidationError
 import mimetypes
 from django.core.files.storage import default_storage
-from django.db.models import Q
+from django.db.models import F, Q
 from django.db import models as dj_models, transaction
 from django.contrib.auth import get_user_model
 import re
@@ -23,9 +23,15 @@ from .models import (
     PrivacyPolicy,
     ContactLink,
     CustomEmoji,
+    ConversationReadMarker,
+    ConversationPurge,
+    SyncChange,
     get_conversation_viewer_ids,
 )
-from .push import send_message_push, _total_unread_for_user, send_unread_badge_push
+from .badge_sync import schedule_badge_sync
+from . import sdk
+from .providers import WEBPUSH, ProviderUnavailable, call_provider, provider_timeout
+from .push import send_message_push, _total_unread_by_user, _total_unread_for_user, _unread_counts_by_conversation
 from .serializers import (
     PublicUserSerializer, ContactRelationSerializer, ConversationSerializer,
     MessageSerializer, TransactionSerializer, PushSubscriptionSerializer,
@@ -142,7 +148,7 @@ def _count_non_admin_conversations(user) -> int:
                 admin_ids.append(aid)
     except Exception:
         pass
-    qs = Conversation.objects.filter(Q(user_a=user) | Q(user_b=user))
+    qs = Conversation.objects.filter(Q(user_a=user) | Q(user_b=user), deleted_at__isnull=True)
     if admin_ids:
         qs = qs.exclude(Q(user_a_id__in=admin_ids) | Q(user_b_id__in=admin_ids))
     return qs.count()
@@ -191,26 +197,20 @@ def _ensure_can_message_or_contact(user, other=None, conversation: Conversation
 
 def _is_conversation_muted_for(user, conversation_id) -> bool:
     try:
-        m = ConversationMute.objects.filter(user=user, conversation_id=conversation_id).first()
-        if not m:
-            return False
-        if m.muted_until is None:
-            return True
-        from django.utils import timezone
-        return m.muted_until > timezone.now()
+        from .push import _muted_user_ids
+        return user.id in _muted_user_ids(int(conversation_id), [user.id])
     except Exception:
         return False
 
-def send_web_push_to_user(user, payload: dict):
+def send_web_push_to_user(user, payload: dict, encoded: str | None = None):
     """Send a web push to all subscriptions of a user. Remove dead ones.
 
-    Payload is a JSON-serializable dict. Failures 404/410 prune the subscription.
+    Payload is a JSON-serializable dict; pass ``encoded`` when the same payload goes
+    to several users so it is serialized once. Failures 404/410 prune the subscription.
     """
-    try:
-        from pywebpush import webpush, WebPushException
-        import json
-    except Exception:
+    if not sdk.available('webpush'):
         return 0
+    import json
     # Ensure VAPID keys available
     if not getattr(settings, 'VAPID_PRIVATE_KEY', None) or not getattr(settings, 'VAPID_PUBLIC_KEY', None):
         return 0
@@ -223,37 +223,55 @@ def send_web_push_to_user(user, payload: dict):
     if conv_id and _is_conversation_muted_for(user, conv_id):
         return 0
     subs = list(PushSubscription.objects.filter(user=user))
-    vapid_claims = {"sub": settings.VAPID_CONTACT_EMAIL}
+    if not subs:
+        return 0
+    data = encoded if encoded is not None else json.dumps(payload)
     sent = 0
     for s in subs:
         try:
-            webpush(
-                subscription_info={
-                    "endpoint": s.endpoint,
-                    "keys": {"p256dh": s.keys_p256dh, "auth": s.keys_auth},
-                },
-                data=json.dumps(payload),
-                vapid_private_key=settings.VAPID_PRIVATE_KEY,
-                vapid_public_key=settings.VAPID_PUBLIC_KEY,
-                vapid_claims=vapid_claims,
-            )
+            call_provider(WEBPUSH, _web_push_one, s, data, retry={'subscription_id': s.id, 'data': data})
             sent += 1
-        except Exception as e:  # includes WebPushException
-            # Remove stale/invalid endpoints (HTTP 404/410 or general invalid)
-            try:
-                msg = getattr(e, 'message', str(e))
-                status_code = getattr(e, 'response', None).status_code if getattr(e, 'response', None) else None
-            except Exception:
-                status_code = None
-            if status_code in [404, 410]:
-                try:
-                    s.delete()
-                except Exception:
-                    pass
-            # ignore other failures silently for now
+        except ProviderUnavailable:
+            # Queued for retry_provider_sends (or the subscription was pruned)
             continue
     return sent
 
+
+def _web_push_one(sub, data: str) -> None:
+    """Deliver to one subscription; 404/410 prune it and count as handled, not as a provider failure."""
+    pywebpush = sdk.load('webpush')
+    try:
+        pywebpush.webpush(
+            subscription_info={
+                "endpoint": sub.endpoint,
+                "keys": {"p256dh": sub.keys_p256dh, "auth": sub.keys_auth},
+            },
+            data=data,
+            vapid_private_key=settings.VAPID_PRIVATE_KEY,
+            vapid_public_key=settings.VAPID_PUBLIC_KEY,
+            vapid_claims={"sub": settings.VAPID_CONTACT_EMAIL},
+            timeout=provider_timeout(WEBPUSH),
+        )
+    except pywebpush.WebPushException as e:
+        response = getattr(e, 'response', None)
+        status_code = getattr(response, 'status_code', None) if response is not None else None
+        # Remove stale/invalid endpoints (HTTP 404/410)
+        if status_code in [404, 410]:
+            try:
+                sub.delete()
+            except Exception:
+                pass
+            return
+        raise
+
+
+def replay_web_push(payload) -> None:
+    """Re-send a queued web push (see ``providers.REPLAY_HANDLERS``)."""
+    sub = PushSubscription.objects.filter(id=payload.get('subscription_id')).first()
+    if sub is None:
+        return
+    _web_push_one(sub, payload.get('data') or '')
+
 User = get_user_model()
 
 class UserSearchViewSet(viewsets.ReadOnlyModelViewSet):
@@ -310,27 +328,42 @@ class TeamMemberViewSet(viewsets.ModelViewSet):
         kwargs['context']['request'] = self.request
         return super().get_serializer(*args, **kwargs)
 
+def _visible_conversations(request):
+    """Conversations the request's actor may see (shared by the viewset and delta sync)."""
+    user = request.user
+    # If acting as a team member, only list conversations the team member was explicitly added to,
+    # plus the owner's conversation with admin (support).
+    acting_team_id = getattr(getattr(request, 'auth', None), 'payload', {}).get('team_member_id') if getattr(request, 'auth', None) else None
+    base = Conversation.objects.filter(deleted_at__isnull=True).select_related('user_a', 'user_b')
+    if acting_team_id:
+        admin_pair = (
+            (Q(user_a=user) & (Q(user_b__is_superuser=True) | Q(user_b__username__iexact='admin')))
+            | (Q(user_b=user) & (Q(user_a__is_superuser=True) | Q(user_a__username__iexact='admin')))
+        )
+        return base.filter(
+            Q(extra_members__member_team_id=acting_team_id) | admin_pair
+        ).distinct()
+    return base.filter(
+        Q(user_a=user) | Q(user_b=user) | Q(extra_members__member_user=user) | Q(extra_members__member_team__owner=user)
+    ).distinct()
+
+
 class ConversationViewSet(viewsets.ModelViewSet):
     serializer_class = ConversationSerializer
     permission_classes = [IsParticipant]
 
     def get_queryset(self):
-        user = self.request.user
-        # If acting as a team member, only list conversations the team member was explicitly added to,
-        # plus the owner's conversation with admin (support).
-        acting_team_id = getattr(getattr(self.request, 'auth', None), 'payload', {}).get('team_member_id') if getattr(self.request, 'auth', None) else None
-        base = Conversation.objects.select_related('user_a', 'user_b')
-        if acting_team_id:
-            admin_pair = (
-                (Q(user_a=user) & (Q(user_b__is_superuser=True) | Q(user_b__username__iexact='admin')))
-                | (Q(user_b=user) & (Q(user_a__is_superuser=True) | Q(user_a__username__iexact='admin')))
+        qs = _visible_conversations(self.request)
+        if self.action in ('list', 'retrieve'):
+            # Viewer's mute row and the delete requester are read per conversation by the serializer
+            qs = qs.select_related('delete_requested_by').prefetch_related(
+                dj_models.Prefetch(
+                    'mutes',
+                    queryset=ConversationMute.objects.filter(user_id=self.request.user.id),
+                    to_attr='viewer_mutes',
+                )
             )
-            return base.filter(
-                Q(extra_members__member_team_id=acting_team_id) | admin_pair
-            ).distinct()
-        return base.filter(
-            Q(user_a=user) | Q(user_b=user) | Q(extra_members__member_user=user) | Q(extra_members__member_team__owner=user)
-        ).distinct()
+        return qs
 
     def create(self, request, *args, **kwargs):
         user = request.user
@@ -355,6 +388,11 @@ class ConversationViewSet(viewsets.ModelViewSet):
         # normalize ordering
         a, b = (user, other) if user.id < other.id else (other, user)
         existing = Conversation.objects.filter(user_a=a, user_b=b).first()
+        if existing and existing.deleted_at:
+            # The pair's previous conversation is still being purged; finish that first
+            from .purge import finish_tombstoned
+            finish_tombstoned(existing)
+            existing = None
         if existing:
             serializer = self.get_serializer(existing)
             headers = self.get_success_headers(serializer.data)
@@ -385,10 +423,7 @@ class ConversationViewSet(viewsets.ModelViewSet):
     def request_delete(self, request, pk=None):
         conv = self.get_object()
         # Enforce OTP for sensitive action if user enabled TOTP
-        try:
-            import pyotp as _pyotp
-        except Exception:
-            _pyotp = None
+        _pyotp = sdk.load('pyotp')
         if getattr(request.user, 'totp_enabled', False):
             code = (request.headers.get('X-OTP-Code') or request.data.get('otp') or '').strip()
             if not code:
@@ -474,9 +509,11 @@ class ConversationViewSet(viewsets.ModelViewSet):
         requested_by_username = getattr(conv.delete_requested_by, 'username', None)
         requested_by_display = getattr(conv.delete_requested_by, 'display_name', '') or requested_by_username or ''
         viewer_ids = set(get_conversation_viewer_ids(conv))
-        # احذف المحادثة وجميع رسائلها
+        # احذف المحادثة وجميع رسائلها: تُخفى فوراً وتُحذف الصفوف على دفعات في الخلفية
         cid = conv.id
-        conv.delete()
+        from .purge import progress_payload, start_purge
+        job = start_purge(conv, ConversationPurge.KIND_DELETE, requested_by=user, user_ids=viewer_ids)
+        SyncChange.record(cid, SyncChange.KIND_DELETED, user_ids=viewer_ids)
         payload = {
             'type': 'delete.approved',
             'conversation_id': cid,
@@ -532,7 +569,7 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 )
         except Exception:
             pass
-        return Response({'status': 'ok'})
+        return Response({'status': 'ok', 'purge': progress_payload(job)})
 
     @action(detail=True, methods=['post'])
     def decline_delete(self, request, pk=None):
@@ -606,37 +643,33 @@ class ConversationViewSet(viewsets.ModelViewSet):
         try:
             # Use delivery_status as the source of truth (not delivered_at NULLability)
             undelivered_qs = conv.messages.filter(delivery_status__lt=1).exclude(sender_id=request.user.id)
-            ids_to_broadcast = list(undelivered_qs.order_by('id').values_list('id', flat=True)[:300])
-            if undelivered_qs.exists():
+            # Clients tick status frames by exact id, so each message still gets its own (newest 300)
+            ids_to_broadcast = list(undelivered_qs.order_by('-id').values_list('id', flat=True)[:300])
+            if ids_to_broadcast:
                 undelivered_qs.update(
                     delivered_at=timezone.now(),
                     delivery_status=dj_models.Case(
                         dj_models.When(delivery_status__lt=1, then=dj_models.Value(1)),
-                        default=dj_models.F('delivery_status')
+                        default=dj_models.F('delivery_status'),
+                        output_field=dj_models.PositiveSmallIntegerField(),
                     )
                 )
                 try:
                     from channels.layers import get_channel_layer
                     from asgiref.sync import async_to_sync
+                    from .realtime import status_event
                     channel_layer = get_channel_layer()
                     if channel_layer is not None:
                         group = f"conv_{conv.id}"
-                        for mid in ids_to_broadcast:
+                        for mid in reversed(ids_to_broadcast):
                             async_to_sync(channel_layer.group_send)(group, {
                                 'type': 'broadcast.message',
-                                'data': { 'type': 'message.status', 'id': int(mid), 'delivery_status': 1, 'status': 'delivered' }
+                                'data': status_event(mid, 1, conversation_id=conv.id),
                             })
                 except Exception:
                     pass
         except Exception:
             pass
-        # Consistency guard: ensure any message already marked read_at has delivery_status=2
-        try:
-            conv.messages.filter(read_at__isnull=False, delivery_status__lt=2).update(
-                delivery_status=dj_models.Value(2)
-            )
-        except Exception:
-            pass
         # Optional: mark inbound as read when explicitly requested by client on open
         try:
             mark_read = request.query_params.get('mark_read') in ['1', 'true', 'True']
@@ -645,38 +678,22 @@ class ConversationViewSet(viewsets.ModelViewSet):
         if mark_read:
             try:
                 last_id = conv.messages.order_by('-id').values_list('id', flat=True).first()
-                if last_id:
-                    now = timezone.now()
-                    conv.messages.exclude(sender_id=request.user.id).filter(id__lte=last_id, delivery_status__lt=2).update(
-                        read_at=now, delivered_at=now,
-                        delivery_status=dj_models.Case(
-                            dj_models.When(delivery_status__lt=2, then=dj_models.Value(2)),
-                            default=dj_models.F('delivery_status')
-                        )
-                    )
-                    # Persist / advance read marker for this user (threshold = last_id)
-                    try:
-                        from .models import ConversationReadMarker
-                        ConversationReadMarker.objects.update_or_create(
-                            conversation_id=conv.id,
-                            user_id=request.user.id,
-                            defaults={'last_read_message_id': int(last_id)}
-                        )
-                    except Exception:
-                        pass
-                    # Optional broadcast: per-message read status capped
+                # A read only advances the viewer's marker; message rows are not rewritten
+                previous = ConversationReadMarker.advance(conv.id, request.user.id, last_id) if last_id else None
+                if previous is not None:
                     try:
                         from channels.layers import get_channel_layer
                         from asgiref.sync import async_to_sync
                         channel_layer = get_channel_layer()
                         if channel_layer is not None:
+                            from .realtime import status_range_event
                             group = f"conv_{conv.id}"
-                            ids = list(conv.messages.exclude(sender_id=request.user.id).filter(id__lte=last_id).order_by('-id').values_list('id', flat=True)[:300])
-                            read_iso = now.isoformat()
-                            for mid in ids:
+                            newly_read = conv.messages.exclude(sender_id=request.user.id).filter(id__gt=previous, id__lte=last_id)
+                            span = newly_read.aggregate(first=dj_models.Min('id'), last=dj_models.Max('id'), n=dj_models.Count('id'))
+                            if span['n']:
                                 async_to_sync(channel_layer.group_send)(group, {
                                     'type': 'broadcast.message',
-                                    'data': { 'type': 'message.status', 'id': int(mid), 'delivery_status': 2, 'status': 'read', 'read_at': read_iso }
+                                    'data': status_range_event(conv.id, span['first'], span['last'], 2, count=span['n'], read_at=timezone.now().isoformat()),
                                 })
                             async_to_sync(channel_layer.group_send)(group, {
                                 'type': 'broadcast.message',
@@ -698,7 +715,10 @@ class ConversationViewSet(viewsets.ModelViewSet):
             limit = int(limit) if limit is not None else 200
         except (TypeError, ValueError):
             limit = 200
-        base_qs = conv.messages.select_related('sender', 'sender_team_member', 'transaction_record__currency')
+        base_qs = conv.messages.select_related('sender', 'sender_team_member')
+        if conv.cleared_up_to_id:
+            # Cleared history is hidden while its purge job removes it
+            base_qs = base_qs.filter(id__gt=conv.cleared_up_to_id)
         if since_id:
             qs = base_qs.filter(id__gt=since_id).order_by('created_at')[:limit]
         elif before:
@@ -710,64 +730,19 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 qs = base_qs.order_by('-created_at')[:limit]
         else:
             qs = base_qs.order_by('-created_at')[:limit]
-        # Inject counterpart last_read marker so serializer can freeze blue ticks
+        # Ticks come from the read markers; nothing is written back to the messages
         other_last_read_id = 0
         viewer_id = request.user.id
+        read_markers = {}
         try:
-            from .models import ConversationReadMarker, Message
+            read_markers = ConversationReadMarker.for_conversations([conv.id]).get(conv.id, {})
             other_id = conv.user_b_id if viewer_id == conv.user_a_id else conv.user_a_id
-            marker = ConversationReadMarker.objects.filter(conversation_id=conv.id, user_id=other_id).first()
-            marker_val = int(marker.last_read_message_id) if (marker and marker.last_read_message_id) else 0
-            # Fallback 1 (always compute): max id of my messages with read_at
-            fallback1 = Message.objects.filter(conversation_id=conv.id, sender_id=viewer_id, read_at__isnull=False).order_by('-id').values_list('id', flat=True).first()
-            fallback1_val = int(fallback1) if fallback1 else 0
-            # Fallback 2 (always compute): if other has sent newer messages, treat my prior messages as seen
-            latest_other_msg_id = Message.objects.filter(conversation_id=conv.id, sender_id=other_id).order_by('-id').values_list('id', flat=True).first()
-            fallback2_val = 0
-            if latest_other_msg_id:
-                latest_my_before = Message.objects.filter(conversation_id=conv.id, sender_id=viewer_id, id__lte=latest_other_msg_id).order_by('-id').values_list('id', flat=True).first()
-                if latest_my_before:
-                    fallback2_val = int(latest_my_before)
-            # Effective last read is max of all signals
-            effective = max(marker_val, fallback1_val, fallback2_val)
-            other_last_read_id = effective
-            # Reconciliation ALWAYS:
-            # حتى إذا لم يتقدم marker (marker_val) الآن، نضمن أن جميع رسائلي حتى 'effective' تمت ترقيتها إلى READ (2)
-            # هذا يمنع اختفاء العلامتين الزرقاء بعد إعادة التحميل إذا كان marker ترقى سابقاً عبر WS لكن الرسائل نفسها لم تحدث.
-            if effective:
-                try:
-                    if effective > marker_val:
-                        ConversationReadMarker.objects.update_or_create(
-                            conversation_id=conv.id,
-                            user_id=other_id,
-                            defaults={'last_read_message_id': effective}
-                        )
-                    from django.utils import timezone
-                    from django.db import models as dj_models
-                    now = timezone.now()
-                    stale_qs = Message.objects.filter(
-                        conversation_id=conv.id,
-                        sender_id=viewer_id,
-                        id__lte=effective,
-                        delivery_status__lt=2
-                    )
-                    if stale_qs.exists():
-                        stale_qs.update(
-                            read_at=now,
-                            delivered_at=dj_models.Case(
-                                dj_models.When(delivered_at__isnull=True, then=dj_models.Value(now)),
-                                default=dj_models.F('delivered_at')
-                            ),
-                            delivery_status=dj_models.Case(
-                                dj_models.When(delivery_status__lt=2, then=dj_models.Value(2)),
-                                default=dj_models.F('delivery_status')
-                            )
-                        )
-                except Exception:
-                    pass
+            # A counterpart who has replied has seen everything before the reply
+            latest_other_msg_id = conv.messages.filter(sender_id=other_id).order_by('-id').values_list('id', flat=True).first()
+            other_last_read_id = max((read_markers.get(other_id) or (0, None))[0], int(latest_other_msg_id or 0))
         except Exception:
             pass
-        return Response(MessageSerializer(qs, many=True, context={'request': request, 'other_last_read_id': other_last_read_id, 'viewer_id': viewer_id}).data)
+        return Response(MessageSerializer(qs, many=True, context={'request': request, 'other_last_read_id': other_last_read_id, 'viewer_id': viewer_id, 'read_markers': read_markers}).data)
 
     @action(detail=True, methods=['post'])
     def send(self, request, pk=None):
@@ -792,11 +767,7 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 except ValidationError as ve:
                     return Response({'detail': ve.message_dict.get('detail') if hasattr(ve, 'message_dict') else 'غير مسموح'}, status=403)
         # Enforce OTP for sensitive action if user enabled TOTP
-        try:
-            from django.contrib.auth import get_user_model  # noqa: F401
-            import pyotp as _pyotp
-        except Exception:
-            _pyotp = None
+        _pyotp = sdk.load('pyotp')
         if getattr(request.user, 'totp_enabled', False):
             code = (request.headers.get('X-OTP-Code') or request.data.get('otp') or '').strip()
             if not code:
@@ -822,167 +793,57 @@ class ConversationViewSet(viewsets.ModelViewSet):
             except Exception:
                 pass
         msg = Message.objects.create(**msg_kwargs)
-        # Persist: when user sends a message while viewing a conversation, consider prior inbound as read
-        read_timestamp = None
-        try:
-            from django.utils import timezone
-            from django.db import models as dj_models
-            inbound_qs = conv.messages.exclude(sender_id=request.user.id).filter(delivery_status__lt=2)
-            ids_read = list(inbound_qs.values_list('id', flat=True)[:300])
-            if ids_read:
-                read_now = timezone.now()
-                inbound_qs.update(
-                    read_at=read_now, delivered_at=read_now,
-                    delivery_status=dj_models.Case(
-                        dj_models.When(delivery_status__lt=2, then=dj_models.Value(2)),
-                        default=dj_models.F('delivery_status')
-                    )
-                )
-                read_timestamp = read_now.isoformat()
-        except Exception:
-            ids_read = []
-            read_timestamp = None
-        # broadcast via WS for realtime delivery
+        # When user sends a message while viewing a conversation, consider prior inbound as read:
+        # the sender's read marker moves up to the latest inbound message
+        read_span = None
         try:
-            from channels.layers import get_channel_layer
-            from asgiref.sync import async_to_sync
-            channel_layer = get_channel_layer()
-            if channel_layer is not None:
-                group = f"conv_{conv.id}"
-                sender_display = ''
-                try:
-                    tm = getattr(msg, 'sender_team_member', None)
-                    if tm:
-                        sender_display = tm.display_name or tm.username
-                    else:
-                        sender_display = getattr(request.user, 'display_name', '') or request.user.username
-                except Exception:
-                    sender_display = getattr(request.user, 'display_name', '') or request.user.username
-                payload = {
-                    'type': 'chat.message',
-                    'id': msg.id,
-                    'conversation_id': conv.id,
-                    'sender': request.user.username,
-                    'senderDisplay': sender_display,
-                    'body': msg.body,
-                    'message': msg.body,
-                    'created_at': msg.created_at.isoformat(),
-                    'kind': 'text',
-                    'seq': msg.id,
-                    'status': 'delivered',
-                    'delivery_status': 1,
-                    'client_id': msg.client_id,
-                }
-                async_to_sync(channel_layer.group_send)(group, {'type': 'broadcast.message', 'data': payload})
-                # Emit explicit numeric status=1 for clients listening for status events
-                try:
-                    async_to_sync(channel_layer.group_send)(group, {'type': 'broadcast.message', 'data': { 'type': 'message.status', 'id': msg.id, 'delivery_status': 1, 'status': 'delivered' }})
-                except Exception:
-                    pass
-                # Broadcast read updates from this sender's perspective for any prior inbound messages
-                try:
-                    read_iso = read_timestamp or timezone.now().isoformat()
-                    for mid in ids_read:
-                        async_to_sync(channel_layer.group_send)(group, {
-                            'type': 'broadcast.message',
-                            'data': { 'type': 'message.status', 'id': int(mid), 'delivery_status': 2, 'status': 'read', 'read_at': read_iso }
-                        })
-                    if ids_read:
-                        async_to_sync(channel_layer.group_send)(group, {
-                            'type': 'broadcast.message',
-                            'data': { 'type': 'chat.read', 'reader': request.user.username, 'last_read_id': int(max(ids_read)) }
-                        })
-                except Exception:
-                    pass
-                # Try to set delivery/read status based on connectivity
-                try:
-                    from .group_registry import get_count
-                    recipient_id = conv.user_b_id if request.user.id == conv.user_a_id else conv.user_a_id
-                    inbox_group = f"user_{recipient_id}"
-                    recipient_online = get_count(inbox_group) > 0
-                    recipient_in_conv = get_count(group) > 1
-                    from django.utils import timezone
-                    if recipient_in_conv:
-                        # Upgrade to READ (2) monotonic
-                        read_now = timezone.now()
-                        Message.objects.filter(id=msg.id).update(delivery_status=dj_models.Case(
-                            dj_models.When(delivery_status__lt=2, then=dj_models.Value(2)), default=dj_models.F('delivery_status')
-                        ), read_at=read_now, delivered_at=read_now)
-                        async_to_sync(channel_layer.group_send)(group, {'type':'broadcast.message','data': {'type':'message.status','id': msg.id,'delivery_status': 2, 'status':'read', 'read_at': read_now.isoformat()}})
-                    elif recipient_online:
-                        # Upgrade to DELIVERED (1) if below
-                        Message.objects.filter(id=msg.id).update(delivery_status=dj_models.Case(
-                            dj_models.When(delivery_status__lt=1, then=dj_models.Value(1)), default=dj_models.F('delivery_status')
-                        ), delivered_at=timezone.now())
-                        async_to_sync(channel_layer.group_send)(group, {'type':'broadcast.message','data': {'type':'message.status','id': msg.id,'delivery_status': 1, 'status':'delivered'}})
-                except Exception:
-                    pass
-                # notify all viewers' inboxes (except sender)
-                from .push import _total_unread_for_user
-                for uid in get_conversation_viewer_ids(conv):
-                    if uid == request.user.id:
-                        continue
-                    # Calculate real unread count for this user
-                    user_unread = _total_unread_for_user(uid)
-                    import logging
-                    logger = logging.getLogger(__name__)
-                    logger.info(f"📨 [WS] Sending inbox.update to user {uid}: unread_count={user_unread}")
-                    async_to_sync(channel_layer.group_send)(f"user_{uid}", {
-                        'type': 'broadcast.message',
-                        'data': {
-                            'type': 'inbox.update',
-                            'conversation_id': conv.id,
-                            'last_message_preview': msg.body[:80],
-                            'last_message_at': msg.created_at.isoformat(),
-                            'unread_count': user_unread,
-                        }
-                    })
+            last_inbound_id = conv.messages.exclude(sender_id=request.user.id).filter(id__lt=msg.id).order_by('-id').values_list('id', flat=True).first()
+            previous = ConversationReadMarker.advance(conv.id, request.user.id, last_inbound_id) if last_inbound_id else None
+            if previous is not None:
+                read_span = (previous + 1, last_inbound_id)
         except Exception:
-            pass
-        # Also trigger Pusher 'message' event for unified realtime on the frontend
+            read_span = None
+        viewer_ids = [uid for uid in get_conversation_viewer_ids(conv) if uid != request.user.id]
+        sender_display = getattr(request.user, 'display_name', '') or request.user.username
+        # Realtime fan-out (Channels + Pusher): each event is built and encoded once
         try:
-            from .pusher_client import pusher_client
-            if pusher_client:
-                sender_display = ''
-                try:
-                    tm = getattr(msg, 'sender_team_member', None)
-                    if tm:
-                        sender_display = tm.display_name or tm.username
-                    else:
-                        sender_display = getattr(request.user, 'display_name', '') or request.user.username
-                except Exception:
-                    sender_display = getattr(request.user, 'display_name', '') or request.user.username
-                pusher_payload = {
-                    'type': payload.get('type', 'chat.message'),
-                    'id': payload.get('id'),
-                    'conversation_id': conv.id,
-                    'username': request.user.username,
-                    'sender': request.user.username,
-                    'display_name': sender_display,
-                    'senderDisplay': sender_display,
-                    'body': payload.get('body', ''),
-                    'message': payload.get('body', ''),
-                    'created_at': payload.get('created_at'),
-                    'kind': payload.get('kind'),
-                    'seq': payload.get('seq'),
-                    'status': payload.get('status'),
-                    'delivery_status': payload.get('delivery_status'),
-                    'client_id': msg.client_id,
-                }
-                pusher_client.trigger(f"chat_{conv.id}", 'message', pusher_payload)
-                # notify all viewers
-                for uid in get_conversation_viewer_ids(conv):
-                    if uid == request.user.id:
-                        continue
-                    pusher_client.trigger(f"user_{uid}", 'notify', {
-                        'type': 'message',
-                        'conversation_id': conv.id,
-                        'from': getattr(request.user, 'display_name', '') or request.user.username,
-                        'preview': msg.body[:80],
-                        'last_message_at': msg.created_at.isoformat(),
-                    })
+            from django.utils import timezone
+            from .group_registry import get_count
+            from .realtime import get_dispatcher, message_event, new_message_entries, notify_event, status_event, status_range_event
+            tm = getattr(msg, 'sender_team_member', None)
+            bubble_display = (tm.display_name or tm.username) if tm else sender_display
+            # Emit explicit numeric status=1 for clients listening for status events
+            status_events = [status_event(msg.id, 1)]
+            # Read updates from this sender's perspective for any prior inbound messages
+            if read_span:
+                status_events.append(status_range_event(conv.id, read_span[0], read_span[1], 2, read_at=timezone.now().isoformat()))
+                status_events.append({'type': 'chat.read', 'reader': request.user.username, 'last_read_id': int(read_span[1])})
+            # Try to set delivery/read status based on connectivity
+            try:
+                recipient_id = conv.user_b_id if request.user.id == conv.user_a_id else conv.user_a_id
+                recipient_online = get_count(f"user_{recipient_id}") > 0
+                recipient_in_conv = get_count(f"conv_{conv.id}") > 1
+                if recipient_in_conv:
+                    # Recipient is looking at the chat: READ (2) through their marker
+                    ConversationReadMarker.advance(conv.id, recipient_id, msg.id)
+                    status_events.append(status_event(msg.id, 2, read_at=timezone.now().isoformat()))
+                elif recipient_online:
+                    # New messages are stored delivered (1) already; just tell the clients
+                    status_events.append(status_event(msg.id, 1))
+            except Exception:
+                pass
+            get_dispatcher().publish_many(new_message_entries(
+                conv.id,
+                message_event(msg, sender=request.user, sender_display=bubble_display, kind='text'),
+                viewer_unread=_total_unread_by_user(viewer_ids),
+                preview=msg.body,
+                last_message_at=msg.created_at,
+                notify=notify_event('message', conv.id, sender_display, msg.body, msg.created_at),
+                status_events=status_events,
+            ))
         except Exception:
-            pass
+            import logging
+            logging.getLogger(__name__).exception("Realtime fan-out failed", extra={"conversation_id": conv.id, "message_id": msg.id})
         # Web Push notification to recipient
         try:
             display = getattr(request.user, 'display_name', '') or request.user.username
@@ -1001,13 +862,12 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 "title": display,
                 "body": preview,
             }
-            # push to all viewers except sender
-            for uid in get_conversation_viewer_ids(conv):
-                if uid == request.user.id:
-                    continue
+            # push to all viewers except sender (payload encoded once for every subscription)
+            from .realtime import encode_event
+            encoded = encode_event(payload)
+            for user_obj in get_user_model().objects.filter(id__in=viewer_ids):
                 try:
-                    user_obj = get_user_model().objects.get(id=uid)
-                    send_web_push_to_user(user_obj, payload)
+                    send_web_push_to_user(user_obj, payload, encoded=encoded)
                 except Exception:
                     pass
         except Exception:
@@ -1096,10 +956,7 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 except ValidationError as ve:
                     return Response({'detail': ve.message_dict.get('detail') if hasattr(ve, 'message_dict') else 'غير مسموح'}, status=403)
         # Enforce OTP for sensitive action if user enabled TOTP
-        try:
-            import pyotp as _pyotp
-        except Exception:
-            _pyotp = None
+        _pyotp = sdk.load('pyotp')
         if getattr(request.user, 'totp_enabled', False):
             code = (request.headers.get('X-OTP-Code') or request.data.get('otp') or '').strip()
             if not code:
@@ -1157,129 +1014,41 @@ class ConversationViewSet(viewsets.ModelViewSet):
             attachment_url = None
         if attachment_url:
             attachment_payload['url'] = attachment_url
-        # Realtime broadcast via channels (if configured)
-        try:
-            from channels.layers import get_channel_layer
-            from asgiref.sync import async_to_sync
-            channel_layer = get_channel_layer()
-            if channel_layer is not None:
-                group = f"conv_{conv.id}"
-                sender_display = ''
-                try:
-                    tm = getattr(msg, 'sender_team_member', None)
-                    if tm:
-                        sender_display = tm.display_name or tm.username
-                    else:
-                        sender_display = getattr(request.user, 'display_name', '') or request.user.username
-                except Exception:
-                    sender_display = getattr(request.user, 'display_name', '') or request.user.username
-                payload = {
-                    'type': 'chat.message',
-                    'id': msg.id,
-                    'conversation_id': conv.id,
-                    'sender': request.user.username,
-                    'senderDisplay': sender_display,
-                    'body': sanitized_body,
-                    'message': sanitized_body,
-                    'created_at': msg.created_at.isoformat(),
-                    'kind': 'text',
-                    'seq': msg.id,
-                    'status': 'delivered',
-                    'delivery_status': 1,
-                    'attachment': attachment_payload,
-                    'client_id': msg.client_id,
-                }
-                async_to_sync(channel_layer.group_send)(group, {'type': 'broadcast.message', 'data': payload})
-                # Initial numeric status event (delivered)
-                try:
-                    async_to_sync(channel_layer.group_send)(group, {'type': 'broadcast.message', 'data': { 'type': 'message.status', 'id': msg.id, 'delivery_status': 1, 'status': 'delivered' }})
-                except Exception:
-                    pass
-                # Connectivity-based status
-                try:
-                    from .group_registry import get_count
-                    recipient_id = conv.user_b_id if request.user.id == conv.user_a_id else conv.user_a_id
-                    inbox_group = f"user_{recipient_id}"
-                    recipient_online = get_count(inbox_group) > 0
-                    recipient_in_conv = get_count(group) > 1
-                    from django.utils import timezone
-                    if recipient_in_conv:
-                        read_now = timezone.now()
-                        Message.objects.filter(id=msg.id).update(delivery_status=dj_models.Case(
-                            dj_models.When(delivery_status__lt=2, then=dj_models.Value(2)), default=dj_models.F('delivery_status')
-                        ), read_at=read_now, delivered_at=read_now)
-                        async_to_sync(channel_layer.group_send)(group, {'type':'broadcast.message','data': {'type':'message.status','id': msg.id,'delivery_status': 2, 'status':'read', 'read_at': read_now.isoformat()}})
-                    elif recipient_online:
-                        Message.objects.filter(id=msg.id).update(delivery_status=dj_models.Case(
-                            dj_models.When(delivery_status__lt=1, then=dj_models.Value(1)), default=dj_models.F('delivery_status')
-                        ), delivered_at=timezone.now())
-                        async_to_sync(channel_layer.group_send)(group, {'type':'broadcast.message','data': {'type':'message.status','id': msg.id,'delivery_status': 1, 'status':'delivered'}})
-                except Exception:
-                    pass
-                from .push import _total_unread_for_user
-                for uid in get_conversation_viewer_ids(conv):
-                    if uid == request.user.id:
-                        continue
-                    user_unread = _total_unread_for_user(uid)
-                    import logging
-                    logger = logging.getLogger(__name__)
-                    logger.info(f"📨 [WS] Sending inbox.update to user {uid}: unread_count={user_unread}")
-                    async_to_sync(channel_layer.group_send)(f"user_{uid}", {
-                        'type': 'broadcast.message',
-                        'data': {
-                            'type': 'inbox.update',
-                            'conversation_id': conv.id,
-                            'last_message_preview': preview_label[:80],
-                            'last_message_at': msg.created_at.isoformat(),
-                            'unread_count': user_unread,
-                        }
-                    })
-        except Exception:
-            pass
-        # Pusher trigger for unified realtime
+        viewer_ids = [uid for uid in get_conversation_viewer_ids(conv) if uid != request.user.id]
+        sender_display = getattr(request.user, 'display_name', '') or request.user.username
+        # Realtime fan-out (Channels + Pusher): each event is built and encoded once
         try:
-            from .pusher_client import pusher_client
-            if pusher_client:
-                sender_display = ''
-                try:
-                    tm = getattr(msg, 'sender_team_member', None)
-                    if tm:
-                        sender_display = tm.display_name or tm.username
-                    else:
-                        sender_display = getattr(request.user, 'display_name', '') or request.user.username
-                except Exception:
-                    sender_display = getattr(request.user, 'display_name', '') or request.user.username
-                pusher_payload = {
-                    'type': 'chat.message',
-                    'id': msg.id,
-                    'conversation_id': conv.id,
-                    'username': request.user.username,
-                    'sender': request.user.username,
-                    'display_name': sender_display,
-                    'senderDisplay': sender_display,
-                    'body': sanitized_body,
-                    'message': sanitized_body,
-                    'created_at': msg.created_at.isoformat(),
-                    'kind': 'text',
-                    'seq': msg.id,
-                    'status': 'delivered',
-                    'delivery_status': 1,
-                    'attachment': attachment_payload,
-                    'client_id': msg.client_id,
-                }
-                pusher_client.trigger(f"chat_{conv.id}", 'message', pusher_payload)
-                for uid in get_conversation_viewer_ids(conv):
-                    if uid == request.user.id:
-                        continue
-                    pusher_client.trigger(f"user_{uid}", 'notify', {
-                        'type': 'message',
-                        'conversation_id': conv.id,
-                        'from': getattr(request.user, 'display_name', '') or request.user.username,
-                        'preview': preview_label[:80],
-                        'last_message_at': msg.created_at.isoformat(),
-                    })
+            from django.utils import timezone
+            from .group_registry import get_count
+            from .realtime import get_dispatcher, message_event, new_message_entries, notify_event, status_event
+            tm = getattr(msg, 'sender_team_member', None)
+            bubble_display = (tm.display_name or tm.username) if tm else sender_display
+            # Initial numeric status event (delivered)
+            status_events = [status_event(msg.id, 1)]
+            # Connectivity-based status
+            try:
+                recipient_id = conv.user_b_id if request.user.id == conv.user_a_id else conv.user_a_id
+                recipient_online = get_count(f"user_{recipient_id}") > 0
+                recipient_in_conv = get_count(f"conv_{conv.id}") > 1
+                if recipient_in_conv:
+                    ConversationReadMarker.advance(conv.id, recipient_id, msg.id)
+                    status_events.append(status_event(msg.id, 2, read_at=timezone.now().isoformat()))
+                elif recipient_online:
+                    status_events.append(status_event(msg.id, 1))
+            except Exception:
+                pass
+            get_dispatcher().publish_many(new_message_entries(
+                conv.id,
+                message_event(msg, sender=request.user, sender_display=bubble_display, body=sanitized_body, kind='text', attachment=attachment_payload),
+                viewer_unread=_total_unread_by_user(viewer_ids),
+                preview=preview_label,
+                last_message_at=msg.created_at,
+                notify=notify_event('message', conv.id, sender_display, preview_label, msg.created_at),
+                status_events=status_events,
+            ))
         except Exception:
-            pass
+            import logging
+            logging.getLogger(__name__).exception("Realtime fan-out failed", extra={"conversation_id": conv.id, "message_id": msg.id})
         # Web Push notification
         try:
             display = getattr(request.user, 'display_name', '') or request.user.username
@@ -1298,12 +1067,12 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 "title": display,
                 "body": preview,
             }
-            for uid in get_conversation_viewer_ids(conv):
-                if uid == request.user.id:
-                    continue
+            # push to all viewers except sender (payload encoded once for every subscription)
+            from .realtime import encode_event
+            encoded = encode_event(payload)
+            for user_obj in get_user_model().objects.filter(id__in=viewer_ids):
                 try:
-                    user_obj = get_user_model().objects.get(id=uid)
-                    send_web_push_to_user(user_obj, payload)
+                    send_web_push_to_user(user_obj, payload, encoded=encoded)
                 except Exception:
                     pass
         except Exception:
@@ -1404,14 +1173,12 @@ class ConversationViewSet(viewsets.ModelViewSet):
     def clear(self, request, pk=None):
         """Delete all chat messages in this conversation without touching transactions.
         Resets last message preview/timestamps. Useful for 'clear chat content'.
+        The messages are hidden right away and removed in batches by a purge job (communications.purge).
         """
         conv = self.get_object()
-        deleted, _ = Message.objects.filter(conversation=conv).delete()
-        Conversation.objects.filter(pk=conv.pk).update(
-            last_message_at=None,
-            last_activity_at=None,
-            last_message_preview="",
-        )
+        from .purge import progress_payload, start_purge
+        job = start_purge(conv, ConversationPurge.KIND_CLEAR, requested_by=request.user, user_ids=get_conversation_viewer_ids(conv))
+        SyncChange.record(conv.id, SyncChange.KIND_CLEARED)
         # Optionally notify inbox to refresh ordering/preview (set empty)
         try:
             from channels.layers import get_channel_layer
@@ -1432,35 +1199,28 @@ class ConversationViewSet(viewsets.ModelViewSet):
                     })
         except Exception:
             pass
-        return Response({'status': 'ok', 'deleted_messages': deleted})
+        return Response({'status': 'ok', 'deleted_messages': job.estimated_messages, 'purge': progress_payload(job)})
 
     @action(detail=True, methods=['post'])
     def read(self, request, pk=None):
-        """Mark conversation as read and persist read_at for messages the user has seen.
+        """Mark conversation as read by advancing the user's read marker to the latest message.
+        Message rows are not rewritten; ticks are derived from the marker.
         Also notifies inbox and broadcasts a chat.read event to the conversation group.
         """
         conv = self.get_object()
-        read_status_ids: list[int] = []
+        read_span = None
         read_iso: str | None = None
-        # Persist read_at for messages from the other participant up to latest id
+        last_id = None
         try:
-            last_msg = conv.messages.order_by('-id').first()
-            if last_msg:
-                from django.utils import timezone
-                from django.db import models as dj_models
-                qs = conv.messages.filter(id__lte=last_msg.id).exclude(sender_id=request.user.id)
-                read_status_ids = list(qs.order_by('-id').values_list('id', flat=True)[:300])
-                read_now = timezone.now()
-                qs.update(
-                    read_at=read_now, delivered_at=read_now,
-                    delivery_status=dj_models.Case(
-                        dj_models.When(delivery_status__lt=2, then=dj_models.Value(2)),
-                        default=dj_models.F('delivery_status')
-                    )
+            last_id = conv.messages.order_by('-id').values_list('id', flat=True).first()
+            previous = ConversationReadMarker.advance(conv.id, request.user.id, last_id) if last_id else None
+            if previous is not None:
+                read_span = conv.messages.filter(id__gt=previous, id__lte=last_id).exclude(sender_id=request.user.id).aggregate(
+                    first=dj_models.Min('id'), last=dj_models.Max('id'), n=dj_models.Count('id'),
                 )
-                read_iso = read_now.isoformat()
+                read_iso = timezone.now().isoformat()
         except Exception:
-            read_status_ids = []
+            read_span = None
             read_iso = None
         # Notify via channels/pusher so inbox badge disappears
         try:
@@ -1479,21 +1239,16 @@ class ConversationViewSet(viewsets.ModelViewSet):
                     }
                 })
                 # Broadcast read receipt to conversation group
-                last_id = None
-                try:
-                    last_id = conv.messages.order_by('-id').values_list('id', flat=True).first()
-                except Exception:
-                    last_id = None
                 group_name = f"conv_{conv.id}"
-                if read_status_ids and read_iso:
-                    for mid in read_status_ids:
-                        try:
-                            async_to_sync(channel_layer.group_send)(group_name, {
-                                'type': 'broadcast.message',
-                                'data': { 'type': 'message.status', 'id': int(mid), 'delivery_status': 2, 'status': 'read', 'read_at': read_iso }
-                            })
-                        except Exception:
-                            pass
+                if read_span and read_span['n'] and read_iso:
+                    try:
+                        from .realtime import status_range_event
+                        async_to_sync(channel_layer.group_send)(group_name, {
+                            'type': 'broadcast.message',
+                            'data': status_range_event(conv.id, read_span['first'], read_span['last'], 2, count=read_span['n'], read_at=read_iso),
+                        })
+                    except Exception:
+                        pass
                 async_to_sync(channel_layer.group_send)(group_name, {
                     'type': 'broadcast.message',
                     'data': {
@@ -1521,10 +1276,8 @@ class ConversationViewSet(viewsets.ModelViewSet):
 
             def push_after_commit() -> None:
                 try:
-                    refreshed = _total_unread_for_user(request.user.id)
-                    send_unread_badge_push(
+                    schedule_badge_sync(
                         request.user.id,
-                        refreshed,
                         reason="conversation.read",
                         conversation_id=conv.id,
                     )
@@ -1728,7 +1481,8 @@ class ConversationViewSet(viewsets.ModelViewSet):
                 removed_display = getattr(u, 'display_name', '') or u.username
             except Exception:
                 removed_display = 'مستخدم'
-            ConversationMember.objects.filter(conversation=conv, member_user_id=member_id).delete()
+            if ConversationMember.objects.filter(conversation=conv, member_user_id=member_id).delete()[0]:
+                SyncChange.record(conv.id, SyncChange.KIND_DELETED, payload={'reason': 'removed'}, user_ids=[member_id])
         # Create a system message noting the removal
         try:
             owner_display = getattr(request.user, 'display_name', '') or request.user.username
@@ -1802,13 +1556,33 @@ class MessageViewSet(viewsets.ReadOnlyModelViewSet):
     def get_queryset(self):
         user = self.request.user
         acting_team_id = getattr(getattr(self.request, 'auth', None), 'payload', {}).get('team_member_id') if getattr(self.request, 'auth', None) else None
-        base = Message.objects.select_related('conversation', 'sender')
+        base = Message.objects.select_related('conversation', 'sender').filter(
+            conversation__deleted_at__isnull=True, id__gt=F('conversation__cleared_up_to_id'),
+        )
+        conversation_id = self.request.query_params.get('conversation')
+        if conversation_id:
+            try:
+                base = base.filter(conversation_id=int(conversation_id))
+            except (TypeError, ValueError):
+                return base.none()
         if acting_team_id:
             return base.filter(Q(conversation__extra_members__member_team_id=acting_team_id)).distinct()
         return base.filter(
             Q(conversation__user_a=user) | Q(conversation__user_b=user) | Q(conversation__extra_members__member_user=user) | Q(conversation__extra_members__member_team__owner=user)
         ).distinct()
 
+    def get_serializer(self, *args, **kwargs):
+        # Read state lives in ConversationReadMarker rows; load them for the conversations being rendered
+        instance = args[0] if args else None
+        if instance is not None:
+            rows = [instance] if isinstance(instance, Message) else list(instance)
+            kwargs['context'] = {
+                **self.get_serializer_context(),
+                'viewer_id': self.request.user.id,
+                'read_markers_by_conversation': ConversationReadMarker.for_conversations({m.conversation_id for m in rows}),
+            }
+        return super().get_serializer(*args, **kwargs)
+
 class TransactionViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
     serializer_class = TransactionSerializer
     permission_classes = [IsParticipant]
@@ -1817,7 +1591,7 @@ class TransactionViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, viewset
     def get_queryset(self):
         user = self.request.user
         acting_team_id = getattr(getattr(self.request, 'auth', None), 'payload', {}).get('team_member_id') if getattr(self.request, 'auth', None) else None
-        base = Transaction.objects.select_related('conversation', 'currency', 'from_user', 'to_user')
+        base = Transaction.objects.select_related('conversation', 'currency', 'from_user', 'to_user').filter(conversation__deleted_at__isnull=True)
         if acting_team_id:
             base = base.filter(Q(conversation__extra_members__member_team_id=acting_team_id)).distinct()
         else:
@@ -1862,7 +1636,7 @@ class TransactionViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, viewset
 
 
 from rest_framework.views import APIView
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from django.urls import reverse
 from .models import NotificationSetting
 from django.contrib.auth.hashers import check_password
@@ -1894,6 +1668,165 @@ class InboxUnreadCountView(APIView):
         return Response({"unread_count": total})
 
 
+class PurgeStatusView(APIView):
+    """Progress of a clear/delete purge job (``GET /api/purges/<id>``), for the conversation's viewers."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        from .purge import progress_payload
+        job = ConversationPurge.objects.filter(pk=pk).first()
+        if job is None or (request.user.id not in (job.user_ids or []) and job.requested_by_id != request.user.id):
+            return Response({'detail': 'Not found'}, status=404)
+        return Response(progress_payload(job))
+
+
+class SyncView(APIView):
+    """Delta sync for reconnecting clients.
+
+    ``GET /api/sync?cursor=<id>`` returns everything visible to the user that
+    changed after ``cursor`` (new messages across all conversations, read marker
+    moves, cleared/deleted conversations and refreshed inbox rows) in a single
+    bounded response. Clients store the returned ``cursor`` and keep calling while
+    ``has_more`` is true. ``reset`` means the cursor is missing, unknown or older
+    than the retained change log and a full reload is required.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        raw_cursor = request.query_params.get('cursor')
+        try:
+            cursor = int(raw_cursor) if raw_cursor not in (None, '') else -1
+        except (TypeError, ValueError):
+            return Response({'detail': 'cursor must be an integer'}, status=400)
+        default_limit = int(getattr(settings, 'SYNC_PAGE_SIZE', 200))
+        try:
+            limit = int(request.query_params.get('limit') or default_limit)
+        except (TypeError, ValueError):
+            limit = default_limit
+        limit = max(1, min(limit, int(getattr(settings, 'SYNC_MAX_PAGE_SIZE', 500))))
+
+        user = request.user
+        head = SyncChange.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        oldest = SyncChange.objects.order_by('id').values_list('id', flat=True).first() or 0
+        if cursor < 0 or cursor > head or (oldest and cursor < oldest - 1):
+            return Response({
+                'cursor': head,
+                'has_more': False,
+                'reset': True,
+                'messages': [],
+                'reads': [],
+                'cleared': [],
+                'removed': [],
+                'inbox': [],
+                'unread_count': _total_unread_for_user(user.id),
+            })
+
+        conv_ids = set(_visible_conversations(request).values_list('id', flat=True))
+        changes = list(
+            SyncChange.objects.filter(id__gt=cursor)
+            .filter(Q(user__isnull=True, conversation_id__in=conv_ids) | Q(user_id=user.id))
+            .order_by('id')[:limit + 1]
+        )
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+
+        message_ids: list[int] = []
+        reads: dict[tuple[int, int], int] = {}
+        cleared: list[int] = []
+        removed: dict[int, str] = {}
+        for change in changes:
+            cid = change.conversation_id
+            if change.kind == SyncChange.KIND_MESSAGE and change.message_id:
+                message_ids.append(change.message_id)
+            elif change.kind == SyncChange.KIND_READ:
+                reader_id = (change.payload or {}).get('reader_id')
+                key = (cid, reader_id)
+                reads[key] = max(reads.get(key, 0), change.message_id or 0)
+            elif change.kind == SyncChange.KIND_CLEARED and cid not in cleared:
+                cleared.append(cid)
+            elif change.kind == SyncChange.KIND_DELETED:
+                removed[cid] = (change.payload or {}).get('reason') or 'deleted'
+        touched = {c.conversation_id for c in changes if c.conversation_id in conv_ids and c.conversation_id not in removed}
+
+        messages_out: list[dict] = []
+        if message_ids:
+            qs = (
+                Message.objects.filter(id__in=message_ids, conversation_id__in=touched, id__gt=F('conversation__cleared_up_to_id'))
+                .select_related('sender', 'sender_team_member')
+                .order_by('id')
+            )
+            markers = ConversationReadMarker.for_conversations(touched)
+            by_conv: dict[int, list] = {}
+            for msg in qs:
+                by_conv.setdefault(msg.conversation_id, []).append(msg)
+            for cid, items in by_conv.items():
+                messages_out.extend(MessageSerializer(items, many=True, context={
+                    'request': request,
+                    'viewer_id': user.id,
+                    'read_markers': markers.get(cid, {}),
+                }).data)
+            messages_out.sort(key=lambda m: m['id'])
+
+        inbox: list[dict] = []
+        if touched:
+            unread = _unread_counts_by_conversation(user.id, touched)
+            rows = Conversation.objects.filter(id__in=touched).values('id', 'last_message_preview', 'last_message_at')
+            for row in rows:
+                inbox.append({
+                    'conversation_id': row['id'],
+                    'last_message_preview': (row['last_message_preview'] or '')[:80],
+                    'last_message_at': row['last_message_at'].isoformat() if row['last_message_at'] else None,
+                    'unread_count': unread.get(row['id'], 0),
+                })
+
+        return Response({
+            'cursor': changes[-1].id if changes else cursor,
+            'has_more': has_more,
+            'reset': False,
+            'messages': messages_out,
+            'reads': [
+                {'conversation_id': cid, 'reader_id': reader_id, 'last_read_id': last_id}
+                for (cid, reader_id), last_id in reads.items()
+                if cid not in removed
+            ],
+            'cleared': [cid for cid in cleared if cid not in removed],
+            'removed': [{'conversation_id': cid, 'reason': reason} for cid, reason in removed.items()],
+            'inbox': inbox,
+            'unread_count': _total_unread_for_user(user.id),
+        })
+
+
+class RealtimeMetricsView(APIView):
+    """Per-backend realtime fan-out counters, WebSocket outbound queue counters and provider breakers (staff only)."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        from .outbound import metrics_snapshot as outbound_snapshot
+        from .providers import breaker_states
+        from .realtime import metrics_snapshot
+        return Response({'backends': metrics_snapshot(), 'websocket': outbound_snapshot(), 'providers': breaker_states()})
+
+
+def prometheus_metrics(request):
+    """Prometheus text exposition of ``communications.instrumentation`` metrics.
+
+    Scrapers authenticate with ``Authorization: Bearer <METRICS_TOKEN>``; staff
+    sessions may read it from the browser.
+    """
+    import hmac
+    from django.http import HttpResponse
+    from .instrumentation import render_prometheus
+    token = getattr(settings, 'METRICS_TOKEN', '') or ''
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    authorized = bool(token) and header.startswith('Bearer ') and hmac.compare_digest(header[7:].strip(), token)
+    if not authorized:
+        user = getattr(request, 'user', None)
+        authorized = bool(user is not None and user.is_authenticated and user.is_staff)
+    if not authorized:
+        return HttpResponse('forbidden\n', status=403, content_type='text/plain')
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 class PushSubscribeView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -2108,6 +2041,10 @@ class EnsureAdminConversationView(APIView):
         # normalize pair
         a, b = (user, admin) if user.id < admin.id else (admin, user)
         existing = Conversation.objects.filter(user_a=a, user_b=b).first()
+        if existing and existing.deleted_at:
+            from .purge import finish_tombstoned
+            finish_tombstoned(existing)
+            existing = None
         if existing:
             return Response({'created': False, 'conversation_id': existing.id})
         conv = Conversation.objects.create(user_a=a, user_b=b)
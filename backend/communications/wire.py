@@ -0,0 +1,157 @@
+"""WebSocket wire formats.
+
+JSON with the full payload shape stays the default. Clients on slow links can
+negotiate a compact format, either through ``Sec-WebSocket-Protocol`` (the
+server echoes the chosen protocol) or with ``?encoding=`` on the socket URL:
+
+``mutabaka.compact.v1`` / ``?encoding=compact``
+    JSON text frames with short keys (``KEY_MAP``), duplicated fields dropped
+    (``message_id``/``seq`` equal to ``id``, ``message`` equal to ``body``, ...),
+    the textual ``status`` dropped in favour of ``delivery_status`` and ISO
+    timestamps sent as epoch milliseconds.
+``mutabaka.msgpack.v1`` / ``?encoding=msgpack``
+    The same compact payload as MessagePack binary frames. Clients may send
+    their own frames as MessagePack too (regular, long keys).
+
+Unknown keys pass through unchanged, so new event fields never need a codec
+change to reach compact clients.
+"""
+from __future__ import annotations
+
+import json
+from datetime import datetime
+from typing import Any, Optional, Tuple
+from urllib.parse import parse_qs
+
+import msgpack
+import orjson
+
+JSON = 'json'
+COMPACT = 'compact'
+MSGPACK = 'msgpack'
+
+SUBPROTOCOLS = {
+    'mutabaka.compact.v1': COMPACT,
+    'mutabaka.msgpack.v1': MSGPACK,
+}
+
+KEY_MAP = {
+    'type': 't',
+    'id': 'i',
+    'conversation_id': 'c',
+    'sender': 's',
+    'senderDisplay': 'sd',
+    'body': 'b',
+    'created_at': 'ca',
+    'delivered_at': 'da',
+    'read_at': 'ra',
+    'kind': 'k',
+    'delivery_status': 'ds',
+    'client_id': 'ci',
+    'event_seq': 'e',
+    'last_message_preview': 'p',
+    'last_message_at': 'la',
+    'unread_count': 'u',
+    'unread_total': 'ut',
+    'from_id': 'f',
+    'to_id': 'to',
+    'count': 'n',
+    'reader': 'r',
+    'last_read_id': 'lr',
+    'last_seq': 'ls',
+    'user': 'us',
+    'state': 'sa',
+    'detail': 'd',
+}
+
+TIMESTAMP_KEYS = frozenset({'created_at', 'delivered_at', 'read_at', 'last_message_at'})
+
+# (redundant key, key it duplicates)
+_DUPLICATES = (
+    ('message_id', 'id'),
+    ('seq', 'id'),
+    ('message', 'body'),
+    ('username', 'sender'),
+    ('display_name', 'senderDisplay'),
+)
+
+
+def _epoch_ms(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    if isinstance(value, str):
+        try:
+            return int(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp() * 1000)
+        except ValueError:
+            return value
+    return value
+
+
+def compact(data: Any) -> Any:
+    """Short-key representation of an event payload (see module docstring)."""
+    if not isinstance(data, dict):
+        return data
+    out = {}
+    for key, value in data.items():
+        if value is None:
+            continue
+        if key == 'status' and 'delivery_status' in data:
+            continue
+        if any(key == dup and data.get(src) == value for dup, src in _DUPLICATES):
+            continue
+        if key in TIMESTAMP_KEYS:
+            value = _epoch_ms(value)
+        elif isinstance(value, dict):
+            value = compact(value)
+        out[KEY_MAP.get(key, key)] = value
+    return out
+
+
+class WireCodec:
+    """Encodes outgoing frames for one connection; JSON by default."""
+
+    def __init__(self, fmt: str = JSON, subprotocol: Optional[str] = None):
+        self.format = fmt
+        self.subprotocol = subprotocol
+
+    @property
+    def binary(self) -> bool:
+        return self.format == MSGPACK
+
+    def encode(self, data: Any, text: Optional[str] = None) -> Tuple[Optional[str], Optional[bytes]]:
+        """Return ``(text_data, bytes_data)`` for ``AsyncWebsocketConsumer.send``.
+
+        ``text`` is the pre-encoded JSON from the realtime dispatcher, reused as-is
+        for JSON connections.
+        """
+        if self.format == JSON:
+            return (text or json.dumps(data)), None
+        payload = compact(data)
+        if self.format == MSGPACK:
+            return None, msgpack.packb(payload, default=str, use_bin_type=True)
+        return orjson.dumps(payload, default=str).decode(), None
+
+    def decode(self, text_data: Optional[str], bytes_data: Optional[bytes]) -> Optional[str]:
+        """Normalise an incoming frame to JSON text for the existing handlers."""
+        if text_data or not bytes_data:
+            return text_data
+        try:
+            return json.dumps(msgpack.unpackb(bytes_data, raw=False))
+        except Exception:
+            return None
+
+
+def negotiate(scope) -> WireCodec:
+    """Pick the codec from the offered subprotocols, then the ``encoding`` query flag."""
+    for offered in scope.get('subprotocols') or ():
+        fmt = SUBPROTOCOLS.get(offered)
+        if fmt:
+            return WireCodec(fmt, subprotocol=offered)
+    try:
+        qs = parse_qs((scope.get('query_string') or b'').decode())
+        requested = (qs.get('encoding') or [''])[0].lower()
+    except Exception:
+        requested = ''
+    if requested in (COMPACT, MSGPACK):
+        return WireCodec(requested)
+    return WireCodec()
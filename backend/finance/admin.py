@@ -1,5 +1,6 @@
 from django.contrib import admin
 from .models import Currency, Wallet
+from .wallets import ensure_wallets
 
 @admin.register(Currency)
 class CurrencyAdmin(admin.ModelAdmin):
@@ -7,6 +8,14 @@ class CurrencyAdmin(admin.ModelAdmin):
     list_filter = ("is_active",)
     search_fields = ("code", "name")
 
+    def save_model(self, request, obj, form, change):
+        activated = obj.is_active and (not change or 'is_active' in form.changed_data)
+        super().save_model(request, obj, form, change)
+        if activated:
+            # Every user gets a wallet in a new (or re-activated) currency
+            created = ensure_wallets(currencies=[obj])
+            self.message_user(request, f"Created {created} wallets for {obj.code}")
+
 @admin.register(Wallet)
 class WalletAdmin(admin.ModelAdmin):
     list_display = ("id", "user", "currency", "balance", "updated_at")
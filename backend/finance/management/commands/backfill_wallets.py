@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from finance.models import Currency
+from finance.wallets import ensure_wallets
+
+
+class Command(BaseCommand):
+    help = "Create missing wallets for every user in the active currencies (or the given codes), in set-based batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('codes', nargs='*', help='Currency codes (default: all active currencies)')
+        parser.add_argument('--batch', type=int, default=2000, help='Users per batch')
+
+    def handle(self, *args, **options):
+        codes = [c.upper() for c in options['codes']]
+        currencies = None
+        if codes:
+            currencies = list(Currency.objects.filter(code__in=codes))
+            missing = set(codes) - {c.code for c in currencies}
+            if missing:
+                raise CommandError(f"Unknown currency code(s): {', '.join(sorted(missing))}")
+        created = ensure_wallets(currencies=currencies, batch_size=max(1, options['batch']))
+        self.stdout.write(f"Summary: wallets_created={created}")
@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
 from finance.models import Currency
+from finance.wallets import ensure_wallets
 
 DEFAULTS = [
     {"code": "USD", "name": "دولار", "symbol": "$", "precision": 2},
@@ -12,9 +13,10 @@ class Command(BaseCommand):
     help = "Seed default currencies if they don't exist"
 
     def handle(self, *args, **options):
-        created = 0
+        created = []
         for data in DEFAULTS:
             obj, was_created = Currency.objects.get_or_create(code=data["code"], defaults=data)
             if was_created:
-                created += 1
-        self.stdout.write(self.style.SUCCESS(f"Currencies seeding complete. Newly created: {created}"))
+                created.append(obj)
+        wallets = ensure_wallets(currencies=created) if created else 0
+        self.stdout.write(self.style.SUCCESS(f"Currencies seeding complete. Newly created: {len(created)}, wallets backfilled: {wallets}"))
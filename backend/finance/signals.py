@@ -1,7 +1,7 @@
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.conf import settings
-from .models import Wallet, Currency
+from .wallets import ensure_wallets
 
 User = settings.AUTH_USER_MODEL
 
@@ -9,6 +9,4 @@ User = settings.AUTH_USER_MODEL
 def create_wallets_for_new_user(sender, instance, created, **kwargs):
     if not created:
         return
-    currencies = Currency.objects.filter(is_active=True)
-    for cur in currencies:
-        Wallet.objects.get_or_create(user=instance, currency=cur)
+    ensure_wallets([instance.id])
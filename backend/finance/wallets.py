@@ -0,0 +1,56 @@
+"""Set-based wallet creation.
+
+``ensure_wallets`` creates the missing (user, currency) wallets with one
+lookup and one ``bulk_create`` per batch of users, instead of a
+``get_or_create`` per pair. It backs the post_save signal for new users, bulk
+user provisioning (``accounts.provisioning``) and the backfill that runs when a
+currency is added (admin, ``seed_currencies``, ``backfill_wallets``).
+"""
+from __future__ import annotations
+
+from typing import Iterable, List, Optional
+
+from django.contrib.auth import get_user_model
+
+from .models import Currency, Wallet
+
+
+def _batches(ids: Iterable[int], size: int) -> Iterable[List[int]]:
+    batch: List[int] = []
+    for value in ids:
+        batch.append(value)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ensure_wallets(user_ids: Optional[Iterable[int]] = None, currencies: Optional[Iterable] = None,
+                   batch_size: int = 2000) -> int:
+    """Create missing wallets; returns how many were created.
+
+    ``user_ids`` defaults to every user, ``currencies`` (instances or ids) to the
+    active currencies.
+    """
+    if currencies is None:
+        currency_ids = list(Currency.objects.filter(is_active=True).values_list('id', flat=True))
+    else:
+        currency_ids = [getattr(c, 'id', c) for c in currencies]
+    if not currency_ids:
+        return 0
+    if user_ids is None:
+        user_ids = get_user_model().objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=batch_size)
+    created = 0
+    for batch in _batches(user_ids, batch_size):
+        existing = set(
+            Wallet.objects.filter(user_id__in=batch, currency_id__in=currency_ids).values_list('user_id', 'currency_id')
+        )
+        rows = [
+            Wallet(user_id=uid, currency_id=cid, balance=0)
+            for uid in batch for cid in currency_ids if (uid, cid) not in existing
+        ]
+        # ignore_conflicts: a concurrent request may have created one of them meanwhile
+        Wallet.objects.bulk_create(rows, batch_size=batch_size, ignore_conflicts=True)
+        created += len(rows)
+    return created
@@ -23,6 +23,13 @@ django_app = get_asgi_application()
 from communications.ws_auth import JWTAuthMiddlewareStack  # noqa: E402
 from communications.consumers import ConversationConsumer  # noqa: E402
 from communications.inbox_consumer import InboxConsumer  # noqa: E402
+from communications.mux_consumer import MultiplexConsumer  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+if getattr(settings, 'SDK_WARMUP', False):
+    # Load push/realtime SDKs off the startup path so the first send is not slow
+    from communications.sdk import start_warm_up  # noqa: E402
+    start_warm_up()
 
 application = ProtocolTypeRouter({
     'http': django_app,
@@ -30,6 +37,8 @@ application = ProtocolTypeRouter({
         URLRouter([
             path('ws/conversations/<int:conversation_id>/', ConversationConsumer.as_asgi()),
             path('ws/inbox/', InboxConsumer.as_asgi()),
+            # Single multiplexed socket: inbox + subscribe/unsubscribe per conversation
+            path('ws/stream/', MultiplexConsumer.as_asgi()),
         ])
     )
 })
@@ -90,6 +90,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so latency covers the whole middleware stack
+    'communications.instrumentation.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -124,17 +126,101 @@ REDIS_URL = os.environ.get('REDIS_URL')
 if REDIS_URL:
     CHANNEL_LAYERS = {
         'default': {
-            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'BACKEND': 'communications.channel_layers.JournaledRedisChannelLayer',
             'CONFIG': { 'hosts': [REDIS_URL] }
         }
     }
 else:
     CHANNEL_LAYERS = {
         'default': {
-            'BACKEND': 'channels.layers.InMemoryChannelLayer'
+            'BACKEND': 'communications.channel_layers.JournaledInMemoryChannelLayer'
         }
     }
 
+# Same Redis as the cache, so every worker sees one copy of cached push targets,
+# badge values and the stats refresh flag. Without it the cache is per process.
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+# Cached state that other workers invalidate (push registry, last badge) is only used
+# when the cache is shared; set explicitly when CACHES points at another shared backend
+SHARED_CACHE = _to_bool(os.getenv('SHARED_CACHE'), bool(REDIS_URL))
+
+# Per-conversation realtime event journal (WebSocket ?resume_from=<seq>)
+WS_EVENT_JOURNAL_SIZE = int(os.getenv('WS_EVENT_JOURNAL_SIZE', '500'))
+WS_EVENT_JOURNAL_TTL = int(os.getenv('WS_EVENT_JOURNAL_TTL', '3600'))
+# Max conversations a single multiplexed socket (ws/stream/) may subscribe to
+WS_MUX_MAX_SUBSCRIPTIONS = int(os.getenv('WS_MUX_MAX_SUBSCRIPTIONS', '50'))
+# Typing indicator coalescing: min seconds between typing frames per (user, conversation)
+# and how long an unrefreshed "start" lives before the server turns it into "stop"
+WS_TYPING_INTERVAL = float(os.getenv('WS_TYPING_INTERVAL', '2.0'))
+WS_TYPING_EXPIRE = float(os.getenv('WS_TYPING_EXPIRE', '6.0'))
+# Cap on inbound messages upgraded to "delivered" per socket connect (older ones follow on next connect)
+WS_DELIVERY_UPGRADE_LIMIT = int(os.getenv('WS_DELIVERY_UPGRADE_LIMIT', '2000'))
+# Per-connection outbound queue: frames buffered for a slow client before it is
+# disconnected with a resync hint, and the longest a single send may take
+WS_OUTBOUND_QUEUE_SIZE = int(os.getenv('WS_OUTBOUND_QUEUE_SIZE', '256'))
+WS_SEND_TIMEOUT = float(os.getenv('WS_SEND_TIMEOUT', '10'))
+# Badge refresh pushes are collapsed per user over this window (seconds); 0 sends immediately
+BADGE_SYNC_DELAY = float(os.getenv('BADGE_SYNC_DELAY', '2.0'))
+# Message pushes per (recipient, conversation): first one immediate, the rest of a burst within
+# this window (seconds) go out as one summary push; 0 disables bundling
+PUSH_BUNDLE_WINDOW = float(os.getenv('PUSH_BUNDLE_WINDOW', '30'))
+# Threads delivering due bundle summaries and badge syncs (the window timing itself is one thread)
+PUSH_DELIVERY_WORKERS = int(os.getenv('PUSH_DELIVERY_WORKERS', '4'))
+# Lifetime (seconds) of cached push tokens / mute windows / extra viewers; writes invalidate explicitly
+PUSH_REGISTRY_TTL = int(os.getenv('PUSH_REGISTRY_TTL', '300'))
+# External provider guards (communications.providers): per-call timeouts in seconds,
+# breaker opens after N consecutive failures and probes again after RESET seconds
+PROVIDER_TIMEOUTS = {
+    'pusher': float(os.getenv('PUSHER_TIMEOUT', '3')),
+    'expo': float(os.getenv('EXPO_TIMEOUT', '5')),
+    'fcm': float(os.getenv('FCM_TIMEOUT', '5')),
+    'webpush': float(os.getenv('WEBPUSH_TIMEOUT', '5')),
+}
+PROVIDER_BREAKER_FAILURES = int(os.getenv('PROVIDER_BREAKER_FAILURES', '5'))
+PROVIDER_BREAKER_RESET = float(os.getenv('PROVIDER_BREAKER_RESET', '30'))
+# Queued sends are replayed by `manage.py retry_provider_sends` with exponential backoff
+PROVIDER_RETRY_BACKOFF = float(os.getenv('PROVIDER_RETRY_BACKOFF', '30'))
+PROVIDER_RETRY_MAX_ATTEMPTS = int(os.getenv('PROVIDER_RETRY_MAX_ATTEMPTS', '5'))
+# Conversation clear/delete purges (communications.purge): rows removed per batch, and whether jobs
+# run in a thread after the request (off: inline); `manage.py run_purges` resumes pending/failed jobs
+PURGE_BATCH_SIZE = int(os.getenv('PURGE_BATCH_SIZE', '2000'))
+PURGE_IN_BACKGROUND = _to_bool(os.getenv('PURGE_IN_BACKGROUND'), True)
+# Orphaned attachment files (communications.attachment_gc, `manage.py gc_attachments`): files are only
+# deleted after being unreferenced for this many hours; index rows/files handled per query batch
+ATTACHMENT_GC_GRACE_HOURS = float(os.getenv('ATTACHMENT_GC_GRACE_HOURS', '24'))
+ATTACHMENT_GC_BATCH_SIZE = int(os.getenv('ATTACHMENT_GC_BATCH_SIZE', '500'))
+# Admin system stats are served from a snapshot (stats.system_utils); opening the page refreshes it
+# in a background thread once older than this many seconds (off: inline). Cron can run `collect_system_stats`
+SYSTEM_STATS_MAX_AGE = int(os.getenv('SYSTEM_STATS_MAX_AGE', '3600'))
+SYSTEM_STATS_IN_BACKGROUND = _to_bool(os.getenv('SYSTEM_STATS_IN_BACKGROUND'), True)
+# Provider SDKs are imported lazily (communications.sdk); ASGI workers can pre-load them in the background
+SDK_WARMUP = _to_bool(os.getenv('SDK_WARMUP'), False)
+SDK_WARMUP_MODULES = _env_list('SDK_WARMUP_MODULES') or None
+# Per-route/WS-event latency, query and group_send metrics (communications.instrumentation),
+# scraped at /metrics with `Authorization: Bearer $METRICS_TOKEN` (or as a staff session)
+METRICS_ENABLED = _to_bool(os.getenv('METRICS_ENABLED'), True)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+# Requests/WS events slower than this are logged with their SQL, for this fraction of them
+METRICS_SLOW_REQUEST_MS = float(os.getenv('METRICS_SLOW_REQUEST_MS', '1000'))
+METRICS_SLOW_SAMPLE_RATE = float(os.getenv('METRICS_SLOW_SAMPLE_RATE', '1.0'))
+# Realtime fan-out backends (communications.realtime); e.g. add NullBackend/RecordingBackend in tests
+REALTIME_BACKENDS = _env_list('REALTIME_BACKENDS') or [
+    'communications.realtime.ChannelsBackend',
+    'communications.realtime.PusherBackend',
+]
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
@@ -434,3 +520,12 @@ CKEDITOR_CONFIGS = {
 # Set via environment variable: EXPO_FCM_SERVER_KEY
 EXPO_ACCESS_TOKEN = os.getenv("EXPO_FCM_SERVER_KEY")
 EXPO_PUSH_URL = "https://exp.host/--/api/v2/push/send"
+
+# ============================================================================
+# Delta sync (/api/sync)
+# ============================================================================
+SYNC_PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", "200"))
+SYNC_MAX_PAGE_SIZE = int(os.getenv("SYNC_MAX_PAGE_SIZE", "500"))
+# Change log rows older than this are removed by `manage.py prune_sync_changes`;
+# clients holding an older cursor receive reset=true and reload fully.
+SYNC_CHANGELOG_RETENTION_DAYS = int(os.getenv("SYNC_CHANGELOG_RETENTION_DAYS", "14"))
@@ -51,6 +51,7 @@ from accounts.qr_login_views import (
     LoginQrApproveView,
 )
 from django.utils import timezone
+from communications.views import prometheus_metrics
 
 
 class MeView(APIView):
@@ -150,6 +151,8 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     # Health check endpoint
     path('health', lambda request: JsonResponse({"status": "ok"})),
+    # Prometheus scrape endpoint (bearer METRICS_TOKEN or staff session)
+    path('metrics', prometheus_metrics, name='prometheus_metrics'),
     # Auth endpoints MUST come before the catch-all /api/ include
     path('api/auth/token/', EmailOrUsernameTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
@@ -158,6 +161,7 @@ urlpatterns = [
     # App includes
     path('api/', include('communications.urls')),
     path('api/subscriptions/', include('subscriptions.urls')),
+    path('api/stats/', include('stats.urls')),
     # TOTP endpoints
     path('api/auth/totp/status', TOTPStatusView.as_view(), name='totp_status'),
     path('api/auth/totp/setup', TOTPSetupView.as_view(), name='totp_setup'),
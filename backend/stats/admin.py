@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.utils.html import format_html
 from django.shortcuts import render
 from .models import SystemStats, RevenueStats
-from .system_utils import get_all_stats
+from .system_utils import get_disk_usage, get_stats_snapshot
 from .revenue_utils import get_subscription_revenue_data, get_revenue_summary, get_revenue_by_plan
 
 
@@ -20,13 +20,19 @@ class SystemStatsAdmin(admin.ModelAdmin):
         return False
     
     def changelist_view(self, request, extra_context=None):
-        """Override to show custom statistics page."""
-        stats = get_all_stats()
+        """Override to show custom statistics page (from the cached snapshot)."""
+        snapshot, refreshing = get_stats_snapshot(force_refresh=request.GET.get('refresh') == '1')
+        stats = dict(snapshot.data) if snapshot else {}
+        # A single statvfs call, cheap enough to stay live
+        stats['disk'] = get_disk_usage()
         
         context = {
             **self.admin_site.each_context(request),
             'title': 'إحصائيات النظام',
             'stats': stats,
+            'computed_at': snapshot.computed_at if snapshot else None,
+            'duration_ms': snapshot.duration_ms if snapshot else None,
+            'refreshing': refreshing,
             'opts': self.model._meta,
             'has_view_permission': True,
         }
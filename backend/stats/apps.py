@@ -5,3 +5,6 @@ class StatsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'stats'
     verbose_name = 'الإحصائيات'  # Arabic name for admin
+
+    def ready(self):  # pragma: no cover - import side effects
+        from . import signals  # noqa: F401
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from stats.system_utils import collect_system_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the system statistics shown in the admin (database, media, static and project sizes) "
+        "and store them as the current snapshot. Meant for cron; the admin page only reads the snapshot."
+    )
+
+    def handle(self, *args, **options):
+        snapshot = collect_system_stats()
+        data = snapshot.data
+        self.stdout.write(
+            f"Summary: database={data['database']['bytes']} media={data['media']['bytes']} "
+            f"media_files={data['media']['file_count']} static={data['static']['bytes']} "
+            f"project={data['project']['bytes']} duration_ms={snapshot.duration_ms}"
+        )
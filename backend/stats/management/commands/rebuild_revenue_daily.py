@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from stats.revenue_utils import rebuild_revenue_daily
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the RevenueDaily rollup (approved renewals per day, plan and period) from RenewalRequest. "
+        "Approvals keep it current; run this after editing approved renewals directly."
+    )
+
+    def handle(self, *args, **options):
+        rows = rebuild_revenue_daily()
+        self.stdout.write(f"Summary: rows={rows}")
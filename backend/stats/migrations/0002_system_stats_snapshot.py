@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-19 08:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SystemStatsSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.JSONField(default=dict)),
+                ('computed_at', models.DateTimeField()),
+                ('duration_ms', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+    ]
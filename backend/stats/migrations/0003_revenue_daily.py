@@ -0,0 +1,36 @@
+# Generated by Django 5.2.6 on 2026-10-19 08:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_rollup(apps, schema_editor):
+    from stats.revenue_utils import rebuild_revenue_daily
+    rebuild_revenue_daily(apps.get_model('subscriptions', 'RenewalRequest'), apps.get_model('stats', 'RevenueDaily'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0002_system_stats_snapshot'),
+        ('subscriptions', '0005_alter_subscriptionplan_code'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevenueDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('period', models.CharField(max_length=20)),
+                ('renewals', models.IntegerField(default=0)),
+                ('new_customers', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('plan', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='+', to='subscriptions.subscriptionplan')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'plan', 'period'), name='revenue_daily_day_plan_period')],
+            },
+        ),
+        migrations.RunPython(build_rollup, migrations.RunPython.noop),
+    ]
@@ -15,6 +15,23 @@ class SystemStats(models.Model):
         app_label = 'stats'
 
 
+class SystemStatsSnapshot(models.Model):
+    """Last computed system statistics (``stats.system_utils.collect_system_stats``).
+
+    A single row; the admin page renders it instead of walking the disk.
+    """
+    SINGLETON_ID = 1
+    data = models.JSONField(default=dict)
+    computed_at = models.DateTimeField()
+    duration_ms = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        app_label = 'stats'
+
+    def __str__(self):  # pragma: no cover
+        return f"SystemStatsSnapshot({self.computed_at})"
+
+
 class RevenueStats(models.Model):
     """Proxy model for revenue/profits statistics in admin."""
     class Meta:
@@ -24,3 +41,27 @@ class RevenueStats(models.Model):
         app_label = 'stats'
 
 
+class RevenueDaily(models.Model):
+    """Approved renewals rolled up per day, plan and period.
+
+    Kept current as renewals are approved (``stats.signals``) and rebuilt from
+    scratch by ``manage.py rebuild_revenue_daily``; the revenue time-series
+    endpoints read these rows instead of ``RenewalRequest``.
+    """
+    day = models.DateField()
+    plan = models.ForeignKey('subscriptions.SubscriptionPlan', on_delete=models.PROTECT, related_name='+')
+    period = models.CharField(max_length=20)
+    renewals = models.IntegerField(default=0)
+    # Renewals that were the user's first approved one
+    new_customers = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        app_label = 'stats'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'plan', 'period'], name='revenue_daily_day_plan_period'),
+        ]
+
+    def __str__(self):  # pragma: no cover
+        return f"RevenueDaily({self.day} plan={self.plan_id} {self.period}: {self.renewals}/{self.revenue})"
+
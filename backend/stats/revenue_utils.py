@@ -1,14 +1,30 @@
 """
 Utility functions for calculating revenue and profits from subscriptions.
+
+The admin page helpers run a fixed number of grouped queries whatever the
+number of customers. Time series (renewals per plan per day, MRR, churn)
+read the ``RevenueDaily`` rollup, which ``record_renewal`` keeps current as
+renewals are approved and ``rebuild_revenue_daily`` recomputes.
 """
-from django.db.models import Sum, Count, Q
+from datetime import date
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Exists, F, OuterRef, Q, Sum, Window
+from django.db.models.functions import RowNumber, TruncDate, TruncMonth
 from django.utils import timezone
 from subscriptions.models import UserSubscription, RenewalRequest, SubscriptionPlan
 from django.contrib.auth import get_user_model
 
+from .models import RevenueDaily
+
 User = get_user_model()
 
 
+def _approved_renewals():
+    return RenewalRequest.objects.filter(status=RenewalRequest.STATUS_APPROVED)
+
+
 def get_subscription_revenue_data():
     """
     Get revenue data for all users with subscriptions.
@@ -22,41 +38,33 @@ def get_subscription_revenue_data():
     - current_price: Current subscription price
     - total_paid: Total amount paid by this user across all renewals
     """
+    # Totals per user in one grouped query, last approved amount per user via ROW_NUMBER()
+    totals = dict(
+        _approved_renewals().values('user_id').annotate(total=Sum('amount')).values_list('user_id', 'total')
+    )
+    last_amounts = dict(
+        _approved_renewals()
+        .annotate(rank=Window(
+            RowNumber(),
+            partition_by=[F('user_id')],
+            order_by=[F('approved_at').desc(nulls_last=True), F('id').desc()],
+        ))
+        .filter(rank=1)
+        .values_list('user_id', 'amount')
+    )
+    now = timezone.now()
     revenue_data = []
-    
-    # Get all users who have or had subscriptions
-    users_with_subs = UserSubscription.objects.select_related('user', 'plan').all()
-    
-    for subscription in users_with_subs:
+    for subscription in UserSubscription.objects.select_related('user', 'plan'):
         user = subscription.user
-        
-        # Get user's display name
+        plan = subscription.plan
         display_name = getattr(user, 'display_name', None) or getattr(user, 'username', 'N/A')
-        
-        # Calculate days remaining
-        now = timezone.now()
         days_remaining = (subscription.end_at - now).days if subscription.end_at > now else 0
-        
-        # Get total paid by this user from all approved renewal requests
-        total_paid = RenewalRequest.objects.filter(
-            user=user,
-            status=RenewalRequest.STATUS_APPROVED
-        ).aggregate(total=Sum('amount'))['total'] or 0
-        
-        # Get current subscription price
-        plan = subscription.plan
-        # Estimate current price based on last renewal request or plan defaults
-        last_renewal = RenewalRequest.objects.filter(
-            user=user,
-            status=RenewalRequest.STATUS_APPROVED
-        ).order_by('-approved_at').first()
-        
-        if last_renewal and last_renewal.amount:
-            current_price = float(last_renewal.amount)
+        last_amount = last_amounts.get(user.id)
+        if last_amount:
+            current_price = float(last_amount)
         else:
             # Fallback to plan monthly price
             current_price = float(plan.monthly_price) if plan.monthly_price else 0
-        
         revenue_data.append({
             'user': user,
             'display_name': display_name,
@@ -64,7 +72,7 @@ def get_subscription_revenue_data():
             'renewal_date': subscription.end_at,
             'days_remaining': max(0, days_remaining),
             'current_price': current_price,
-            'total_paid': float(total_paid),
+            'total_paid': float(totals.get(user.id) or 0),
             'status': subscription.status,
         })
     
@@ -81,25 +89,18 @@ def get_revenue_summary():
     - active_subscriptions: Number of currently active subscriptions
     - expired_subscriptions: Number of expired subscriptions
     """
-    total_users = UserSubscription.objects.values('user').distinct().count()
-    
-    total_revenue = RenewalRequest.objects.filter(
-        status=RenewalRequest.STATUS_APPROVED
-    ).aggregate(total=Sum('amount'))['total'] or 0
-    
-    active_count = UserSubscription.objects.filter(
-        status=UserSubscription.STATUS_ACTIVE
-    ).count()
-    
-    expired_count = UserSubscription.objects.filter(
-        status=UserSubscription.STATUS_EXPIRED
-    ).count()
+    counts = UserSubscription.objects.aggregate(
+        total_users=Count('user', distinct=True),
+        active=Count('id', filter=Q(status=UserSubscription.STATUS_ACTIVE)),
+        expired=Count('id', filter=Q(status=UserSubscription.STATUS_EXPIRED)),
+    )
+    total_revenue = _approved_renewals().aggregate(total=Sum('amount'))['total'] or 0
     
     return {
-        'total_users': total_users,
+        'total_users': counts['total_users'],
         'total_revenue': float(total_revenue),
-        'active_subscriptions': active_count,
-        'expired_subscriptions': expired_count,
+        'active_subscriptions': counts['active'],
+        'expired_subscriptions': counts['expired'],
     }
 
 
@@ -109,20 +110,157 @@ def get_revenue_by_plan():
     
     Returns list of dicts with plan_name and total_revenue.
     """
-    plans_revenue = []
-    
-    for plan in SubscriptionPlan.objects.all():
-        revenue = RenewalRequest.objects.filter(
-            plan=plan,
-            status=RenewalRequest.STATUS_APPROVED
-        ).aggregate(total=Sum('amount'))['total'] or 0
-        
-        user_count = UserSubscription.objects.filter(plan=plan).count()
-        
-        plans_revenue.append({
+    revenue = dict(_approved_renewals().values('plan_id').annotate(total=Sum('amount')).values_list('plan_id', 'total'))
+    users = dict(UserSubscription.objects.values('plan_id').annotate(count=Count('id')).values_list('plan_id', 'count'))
+    return [
+        {
             'plan_name': plan.name or plan.code,
-            'total_revenue': float(revenue),
-            'user_count': user_count,
+            'total_revenue': float(revenue.get(plan.id) or 0),
+            'user_count': users.get(plan.id, 0),
+        }
+        for plan in SubscriptionPlan.objects.all()
+    ]
+
+
+def record_renewal(renewal, sign=1):
+    """Add an approved renewal's count and amount to its ``RevenueDaily`` row (``sign=-1`` takes it back out).
+
+    ``new_customers`` is not touched here: it follows the user's earliest approval,
+    which any approval change can move (see ``new_customer_credits``).
+    """
+    _bump(timezone.localdate(renewal.approved_at or timezone.now()), renewal.plan_id, renewal.period,
+          renewals=F('renewals') + sign, revenue=F('revenue') + sign * (renewal.amount or Decimal('0')))
+
+
+def _bump(day, plan_id, period, **changes):
+    row, _ = RevenueDaily.objects.get_or_create(day=day, plan_id=plan_id, period=period)
+    RevenueDaily.objects.filter(pk=row.pk).update(**changes)
+
+
+def new_customer_credits(user_ids):
+    """``{(day, plan_id, period): n}`` of the users' earliest approvals, the renewals counted as new customers.
+
+    Same rule as ``rebuild_revenue_daily``: no approval of that user strictly earlier.
+    """
+    user_ids = {uid for uid in user_ids if uid}
+    if not user_ids:
+        return {}
+    approved = _approved_renewals().filter(user_id__in=user_ids, approved_at__isnull=False)
+    earlier = approved.filter(user_id=OuterRef('user_id'), approved_at__lt=OuterRef('approved_at'))
+    credits = {}
+    for plan_id, period, approved_at in approved.filter(~Exists(earlier)).values_list('plan_id', 'period', 'approved_at'):
+        key = (timezone.localdate(approved_at), plan_id, period)
+        credits[key] = credits.get(key, 0) + 1
+    return credits
+
+
+def move_new_customer_credits(before, after):
+    """Apply the difference between two ``new_customer_credits`` results to the rollup."""
+    for key in set(before) | set(after):
+        delta = after.get(key, 0) - before.get(key, 0)
+        if delta:
+            _bump(*key, new_customers=F('new_customers') + delta)
+
+
+def rebuild_revenue_daily(renewal_model=None, rollup_model=None):
+    """Recompute every rollup row from approved renewals with one grouped query; returns the row count.
+
+    Only plain fields are used, so the data migration can pass historical models.
+    """
+    renewal_model = renewal_model or RenewalRequest
+    rollup_model = rollup_model or RevenueDaily
+    approved = renewal_model.objects.filter(status=RenewalRequest.STATUS_APPROVED)
+    earlier = approved.filter(user_id=OuterRef('user_id'), approved_at__lt=OuterRef('approved_at'))
+    grouped = (
+        approved.annotate(day=TruncDate('approved_at'))
+        .values('day', 'plan_id', 'period')
+        .annotate(
+            renewals=Count('id'),
+            new_customers=Count('id', filter=~Exists(earlier)),
+            revenue=Sum('amount'),
+        )
+        .order_by()
+    )
+    rows = [
+        rollup_model(
+            day=row['day'], plan_id=row['plan_id'], period=row['period'],
+            renewals=row['renewals'], new_customers=row['new_customers'], revenue=row['revenue'] or 0,
+        )
+        for row in grouped if row['day'] is not None
+    ]
+    with transaction.atomic():
+        rollup_model.objects.all().delete()
+        rollup_model.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def daily_series(start, end, plan_id=None):
+    """Renewals and revenue per plan per day between ``start`` and ``end`` (inclusive)."""
+    qs = RevenueDaily.objects.filter(day__gte=start, day__lte=end)
+    if plan_id:
+        qs = qs.filter(plan_id=plan_id)
+    return [
+        {
+            'day': row['day'].isoformat(),
+            'plan': row['plan__code'],
+            'renewals': row['renewals'],
+            'new_customers': row['new_customers'],
+            'revenue': float(row['revenue'] or 0),
+        }
+        for row in qs.values('day', 'plan__code').annotate(
+            renewals=Sum('renewals'), new_customers=Sum('new_customers'), revenue=Sum('revenue'),
+        ).order_by('day', 'plan__code')
+    ]
+
+
+def _month_index(value):
+    return value.year * 12 + value.month - 1
+
+
+def monthly_series(start, end):
+    """MRR and churn per month between ``start`` and ``end``, from the rollup.
+
+    MRR counts monthly payments in their month and spreads yearly payments
+    over the twelve months they cover. Churn compares the payments falling due
+    in a month (monthly ones from the previous month, yearly ones from a year
+    before) with the renewals of returning customers in that month.
+    """
+    first = _month_index(start)
+    last = _month_index(end)
+    lookback = date((first - 12) // 12, (first - 12) % 12 + 1, 1)
+    buckets = {}
+    for row in (
+        RevenueDaily.objects.filter(day__gte=lookback, day__lte=end)
+        .annotate(month=TruncMonth('day'))
+        .values('month', 'period')
+        .annotate(renewals=Sum('renewals'), new_customers=Sum('new_customers'), revenue=Sum('revenue'))
+        .order_by()
+    ):
+        buckets[(_month_index(row['month']), row['period'])] = row
+
+    def value(month, period, field):
+        row = buckets.get((month, period))
+        return (row[field] or 0) if row else 0
+
+    periods = (RenewalRequest.PERIOD_MONTHLY, RenewalRequest.PERIOD_YEARLY)
+    series = []
+    for month in range(first, last + 1):
+        yearly = sum(value(month - k, RenewalRequest.PERIOD_YEARLY, 'revenue') for k in range(12))
+        mrr = Decimal(value(month, RenewalRequest.PERIOD_MONTHLY, 'revenue')) + Decimal(yearly) / 12
+        renewals = sum(value(month, p, 'renewals') for p in periods)
+        new_customers = sum(value(month, p, 'new_customers') for p in periods)
+        due = value(month - 1, RenewalRequest.PERIOD_MONTHLY, 'renewals') + value(month - 12, RenewalRequest.PERIOD_YEARLY, 'renewals')
+        retained = renewals - new_customers
+        churned = max(0, due - retained)
+        series.append({
+            'month': f"{month // 12:04d}-{month % 12 + 1:02d}",
+            'mrr': round(float(mrr), 2),
+            'revenue': float(sum(Decimal(value(month, p, 'revenue')) for p in periods)),
+            'renewals': renewals,
+            'new_customers': new_customers,
+            'due': due,
+            'retained': min(retained, due),
+            'churned': churned,
+            'churn_rate': round(churned / due, 4) if due else 0.0,
         })
-    
-    return plans_revenue
+    return series
@@ -0,0 +1,64 @@
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from subscriptions.models import RenewalRequest
+
+# Fields that place an approved renewal in its RevenueDaily row
+ROLLUP_FIELDS = ('amount', 'plan_id', 'period', 'approved_at')
+
+
+def _touches_rollup(previous, instance):
+    was_approved = previous is not None and previous.status == RenewalRequest.STATUS_APPROVED
+    is_approved = instance.status == RenewalRequest.STATUS_APPROVED
+    if was_approved != is_approved:
+        return True
+    return is_approved and any(getattr(previous, name) != getattr(instance, name) for name in ROLLUP_FIELDS + ('user_id',))
+
+
+def _users(*renewals):
+    return {renewal.user_id for renewal in renewals if renewal is not None}
+
+
+@receiver(pre_save, sender=RenewalRequest)
+def remember_renewal_status(sender, instance, **kwargs):
+    from .revenue_utils import new_customer_credits
+    instance._rollup_prev = previous = (
+        RenewalRequest.objects.filter(pk=instance.pk).only('status', 'user', 'plan', 'period', 'amount', 'approved_at').first()
+        if instance.pk else None
+    )
+    # The user's earliest approval may move with this save; remember who was credited as new
+    instance._rollup_credits = new_customer_credits(_users(previous, instance)) if _touches_rollup(previous, instance) else None
+
+
+@receiver(post_save, sender=RenewalRequest)
+def update_revenue_rollup(sender, instance, **kwargs):
+    # Covers RenewalRequest.approve() and approvals or edits made through the admin form
+    from .revenue_utils import move_new_customer_credits, new_customer_credits, record_renewal
+    previous = getattr(instance, '_rollup_prev', None)
+    credits = getattr(instance, '_rollup_credits', None)
+    if credits is None:
+        return
+    if previous is not None and previous.status == RenewalRequest.STATUS_APPROVED:
+        record_renewal(previous, sign=-1)
+    if instance.status == RenewalRequest.STATUS_APPROVED:
+        record_renewal(instance)
+    move_new_customer_credits(credits, new_customer_credits(_users(previous, instance)))
+
+
+@receiver(pre_delete, sender=RenewalRequest)
+def remember_deleted_renewal_credits(sender, instance, **kwargs):
+    from .revenue_utils import new_customer_credits
+    instance._rollup_credits = (
+        new_customer_credits({instance.user_id}) if instance.status == RenewalRequest.STATUS_APPROVED else None
+    )
+
+
+@receiver(post_delete, sender=RenewalRequest)
+def remove_from_revenue_rollup(sender, instance, **kwargs):
+    from .revenue_utils import move_new_customer_credits, new_customer_credits, record_renewal
+    credits = getattr(instance, '_rollup_credits', None)
+    if credits is None:
+        return
+    record_renewal(instance, sign=-1)
+    # Deleting the first approval makes the user's next one the new-customer renewal
+    move_new_customer_credits(credits, new_customer_credits({instance.user_id}))
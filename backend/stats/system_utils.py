@@ -1,10 +1,32 @@
 """
 Utility functions for system statistics and disk usage.
+
+Walking the static and project trees is slow, so the admin page never calls
+``get_all_stats`` itself: ``collect_system_stats`` stores the result as the
+``SystemStatsSnapshot`` row, refreshed in a background thread once it is
+older than ``SYSTEM_STATS_MAX_AGE`` (or by ``manage.py collect_system_stats``
+from cron), and the page renders that snapshot with its timestamp.
 """
+import logging
 import os
 import shutil
-from pathlib import Path
+import threading
+import time
+from datetime import timedelta
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Largest tables listed with the PostgreSQL database size
+TOP_TABLES = 10
+# Held in the cache, so it coordinates workers once CACHES is shared (Redis with REDIS_URL);
+# without REDIS_URL the channel layer is in-memory too and the app runs as one process
+_REFRESH_KEY = 'stats:system:refreshing'
+# A collection that died without clearing its flag stops blocking refreshes after this long
+_REFRESH_LOCK_TTL = 15 * 60
 
 
 def get_size_format(size_bytes):
@@ -30,56 +52,122 @@ def get_directory_size(path):
     return total
 
 
+def _postgres_database_size(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT current_database(), pg_database_size(current_database())")
+        name, size_bytes = cursor.fetchone()
+        cursor.execute(
+            "SELECT c.relname, pg_total_relation_size(c.oid) FROM pg_class c "
+            "JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE c.relkind IN ('r', 'p', 'm') AND n.nspname = current_schema() "
+            "ORDER BY 2 DESC LIMIT %s",
+            [TOP_TABLES],
+        )
+        tables = [
+            {'name': table, 'bytes': table_bytes, 'formatted': get_size_format(table_bytes)}
+            for table, table_bytes in cursor.fetchall()
+        ]
+    return {
+        'bytes': size_bytes,
+        'formatted': get_size_format(size_bytes),
+        'path': f'PostgreSQL: {name}',
+        'tables': tables,
+    }
+
+
 def get_database_size():
-    """Get the size of the database file."""
+    """Get the size of the database (pg_database_size on PostgreSQL, the file on SQLite)."""
+    from django.db import connection
     try:
+        if connection.vendor == 'postgresql':
+            return _postgres_database_size(connection)
         db_path = settings.DATABASES['default']['NAME']
-        if os.path.exists(db_path):
+        if connection.vendor == 'sqlite' and os.path.exists(db_path):
             size_bytes = os.path.getsize(db_path)
             return {
                 'bytes': size_bytes,
                 'formatted': get_size_format(size_bytes),
-                'path': db_path
+                'path': str(db_path),
+                'tables': [],
             }
     except Exception as e:
         return {
             'bytes': 0,
             'formatted': 'N/A',
-            'path': str(e)
+            'path': str(e),
+            'tables': [],
         }
     return {
         'bytes': 0,
         'formatted': 'N/A',
-        'path': 'Database file not found'
+        'path': 'Database file not found',
+        'tables': [],
     }
 
 
+def _file_field_usage(model, field_name):
+    """Count and size of the files referenced by a file field with few rows (logos, icons, sounds)."""
+    storage = model._meta.get_field(field_name).storage
+    count = size_bytes = 0
+    for name in model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True}).values_list(field_name, flat=True).iterator():
+        count += 1
+        try:
+            size_bytes += storage.size(name)
+        except Exception:
+            pass
+    return count, size_bytes
+
+
+def _media_categories():
+    from django.contrib.auth import get_user_model
+    from django.db.models import Count, Sum
+    from accounts.models import SiteSettings
+    from communications.models import AttachmentFile, BrandingSetting, LoginPageSetting, Message, NotificationSetting
+
+    attachments = Message.objects.exclude(attachment='').exclude(attachment__isnull=True).aggregate(
+        count=Count('id'), bytes=Sum('attachment_size'),
+    )
+    orphaned = AttachmentFile.objects.filter(orphaned_at__isnull=False).aggregate(count=Count('id'), bytes=Sum('size'))
+    categories = [
+        ('attachments', 'مرفقات الرسائل', attachments['count'], attachments['bytes'] or 0),
+        ('orphaned_attachments', 'مرفقات بانتظار الحذف', orphaned['count'], orphaned['bytes'] or 0),
+        ('user_logos', 'شعارات المستخدمين', *_file_field_usage(get_user_model(), 'logo')),
+    ]
+    branding = [_file_field_usage(BrandingSetting, 'logo'), _file_field_usage(LoginPageSetting, 'login_logo')]
+    categories.append(('branding', 'الهوية البصرية', sum(c for c, _ in branding), sum(b for _, b in branding)))
+    categories.append(('notification_sounds', 'أصوات الإشعارات', *_file_field_usage(NotificationSetting, 'sound')))
+    categories.append(('notification_icons', 'أيقونات الإشعارات', *_file_field_usage(SiteSettings, 'notification_icon')))
+    return [
+        {'key': key, 'label': label, 'count': count, 'bytes': size_bytes, 'formatted': get_size_format(size_bytes)}
+        for key, label, count, size_bytes in categories
+    ]
+
+
 def get_media_size():
-    """Get the total size of media files."""
+    """Get media usage per category from the database instead of walking MEDIA_ROOT.
+
+    Message attachments are summed from ``attachment_size`` and files waiting
+    for the attachment collector from ``AttachmentFile.size``; the remaining
+    categories hold a few files each, sized through storage.
+    """
     try:
-        media_root = settings.MEDIA_ROOT
-        if os.path.exists(media_root):
-            size_bytes = get_directory_size(media_root)
-            file_count = sum(1 for _ in Path(media_root).rglob('*') if _.is_file())
-            return {
-                'bytes': size_bytes,
-                'formatted': get_size_format(size_bytes),
-                'path': media_root,
-                'file_count': file_count
-            }
+        categories = _media_categories()
+        size_bytes = sum(c['bytes'] for c in categories)
+        return {
+            'bytes': size_bytes,
+            'formatted': get_size_format(size_bytes),
+            'path': str(settings.MEDIA_ROOT),
+            'file_count': sum(c['count'] for c in categories),
+            'categories': categories,
+        }
     except Exception as e:
         return {
             'bytes': 0,
             'formatted': 'N/A',
             'path': str(e),
-            'file_count': 0
+            'file_count': 0,
+            'categories': [],
         }
-    return {
-        'bytes': 0,
-        'formatted': 'N/A',
-        'path': 'Media directory not found',
-        'file_count': 0
-    }
 
 
 def get_static_size():
@@ -167,3 +255,60 @@ def get_all_stats():
         'project': get_project_size(),
         'disk': get_disk_usage()
     }
+
+
+def collect_system_stats():
+    """Compute every statistic now and store it as the current snapshot."""
+    from .models import SystemStatsSnapshot
+    started = time.monotonic()
+    data = get_all_stats()
+    snapshot, _ = SystemStatsSnapshot.objects.update_or_create(
+        pk=SystemStatsSnapshot.SINGLETON_ID,
+        defaults={
+            'data': data,
+            'computed_at': timezone.now(),
+            'duration_ms': int((time.monotonic() - started) * 1000),
+        },
+    )
+    return snapshot
+
+
+def _collect_in_thread():
+    try:
+        collect_system_stats()
+    except Exception:
+        logger.exception("System stats collection failed")
+    finally:
+        cache.delete(_REFRESH_KEY)
+        # The thread got its own DB connection; don't leak it
+        connections.close_all()
+
+
+def refresh_system_stats():
+    """Start a collection unless one is already running; returns False when one was."""
+    if not cache.add(_REFRESH_KEY, 1, _REFRESH_LOCK_TTL):
+        return False
+    if getattr(settings, 'SYSTEM_STATS_IN_BACKGROUND', True):
+        threading.Thread(target=_collect_in_thread, name='system-stats', daemon=True).start()
+    else:
+        try:
+            collect_system_stats()
+        finally:
+            cache.delete(_REFRESH_KEY)
+    return True
+
+
+def get_stats_snapshot(force_refresh=False):
+    """Latest snapshot (or None) and whether a refresh is in progress.
+
+    A missing or stale snapshot, or ``force_refresh``, schedules a collection;
+    the caller still gets the snapshot as it was when it asked.
+    """
+    from .models import SystemStatsSnapshot
+    snapshot = SystemStatsSnapshot.objects.filter(pk=SystemStatsSnapshot.SINGLETON_ID).first()
+    max_age = timedelta(seconds=getattr(settings, 'SYSTEM_STATS_MAX_AGE', 3600))
+    if force_refresh or snapshot is None or snapshot.computed_at < timezone.now() - max_age:
+        refresh_system_stats()
+        if not getattr(settings, 'SYSTEM_STATS_IN_BACKGROUND', True):
+            snapshot = SystemStatsSnapshot.objects.filter(pk=SystemStatsSnapshot.SINGLETON_ID).first()
+    return snapshot, cache.get(_REFRESH_KEY) is not None
@@ -1,3 +1,206 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from communications.models import AttachmentFile, Conversation, Message
+
+from .models import SystemStatsSnapshot
+from .system_utils import get_media_size
+
+User = get_user_model()
+
+FAKE_STATS = {
+    'database': {'bytes': 10, 'formatted': '10.00 B', 'path': 'db', 'tables': []},
+    'media': {'bytes': 20, 'formatted': '20.00 B', 'path': 'media', 'file_count': 2, 'categories': []},
+    'static': {'bytes': 30, 'formatted': '30.00 B', 'path': 'static'},
+    'project': {'bytes': 40, 'formatted': '40.00 B', 'path': 'project'},
+}
+
+
+class MediaSizeTests(TestCase):
+    def test_media_usage_comes_from_aggregates(self):
+        user1 = User.objects.create_user(username='st_u1', password='pass12345')
+        user2 = User.objects.create_user(username='st_u2', password='pass12345')
+        conv = Conversation.objects.create(user_a=user1, user_b=user2)
+        Message.objects.bulk_create([
+            Message(conversation=conv, sender=user1, attachment=f'attachments/{size}.pdf', attachment_size=size)
+            for size in (100, 250)
+        ])
+        AttachmentFile.objects.create(path='attachments/old.pdf', size=50, orphaned_at=conv.created_at)
+        with mock.patch('stats.system_utils.os.scandir') as scandir:
+            media = get_media_size()
+        scandir.assert_not_called()
+        categories = {c['key']: (c['count'], c['bytes']) for c in media['categories']}
+        self.assertEqual(categories['attachments'], (2, 350))
+        self.assertEqual(categories['orphaned_attachments'], (1, 50))
+        self.assertEqual((media['bytes'], media['file_count']), (400, 3))
+
+
+@override_settings(SYSTEM_STATS_IN_BACKGROUND=False, SYSTEM_STATS_MAX_AGE=3600)
+class SystemStatsSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(username='st_admin', password='pass12345')
+        self.client.force_login(self.admin)
+        self.url = reverse('admin:stats_systemstats_changelist')
+
+    def test_admin_page_reads_the_snapshot_and_refreshes_on_request(self):
+        with mock.patch('stats.system_utils.get_all_stats', return_value=FAKE_STATS) as collect:
+            resp = self.client.get(self.url)
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(collect.call_count, 1)
+            self.assertEqual(resp.context['stats']['project']['bytes'], 40)
+            self.assertIn('percent_used', resp.context['stats']['disk'])
+
+            self.client.get(self.url)
+            self.assertEqual(collect.call_count, 1)
+
+            self.client.get(self.url, {'refresh': '1'})
+            self.assertEqual(collect.call_count, 2)
+        self.assertEqual(SystemStatsSnapshot.objects.count(), 1)
+
+    def test_stale_snapshot_is_recomputed(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        SystemStatsSnapshot.objects.create(pk=SystemStatsSnapshot.SINGLETON_ID, data=FAKE_STATS, computed_at=timezone.now() - timedelta(hours=2))
+        with mock.patch('stats.system_utils.get_all_stats', return_value=FAKE_STATS) as collect:
+            self.client.get(self.url)
+        self.assertEqual(collect.call_count, 1)
+        self.assertGreater(SystemStatsSnapshot.objects.get().computed_at, timezone.now() - timedelta(minutes=1))
+
+    def test_collect_command_prints_summary(self):
+        from io import StringIO
+        from django.core.management import call_command
+        out = StringIO()
+        with mock.patch('stats.system_utils.get_all_stats', return_value=FAKE_STATS):
+            call_command('collect_system_stats', stdout=out)
+        self.assertIn('Summary: database=10 media=20 media_files=2 static=30 project=40', out.getvalue())
+
+
+class RevenueRollupTests(TestCase):
+    def setUp(self):
+        from decimal import Decimal
+        from subscriptions.models import RenewalRequest, SubscriptionPlan
+        self.silver, _ = SubscriptionPlan.objects.get_or_create(code='silver', defaults={'monthly_price': Decimal('10')})
+        self.king, _ = SubscriptionPlan.objects.get_or_create(code='king', defaults={'monthly_price': Decimal('50')})
+        self.admin = User.objects.create_superuser(username='rv_admin', password='pass12345')
+        self.users = [User.objects.create_user(username=f'rv_u{i}', password='pass12345') for i in range(3)]
+        self.renewal_model = RenewalRequest
+
+    def _approve(self, user, plan, amount, period='monthly'):
+        renewal = self.renewal_model.objects.create(user=user, plan=plan, period=period, amount=amount)
+        renewal.approve(self.admin)
+        return renewal
+
+    def test_approvals_update_the_rollup_incrementally(self):
+        from .models import RevenueDaily
+        from .revenue_utils import rebuild_revenue_daily
+        self._approve(self.users[0], self.silver, 10)
+        self._approve(self.users[0], self.silver, 10)
+        self._approve(self.users[1], self.king, 600, period='yearly')
+        pending = self.renewal_model.objects.create(user=self.users[2], plan=self.king, period='monthly', amount=50)
+        pending.reject(self.admin)
+
+        rows = {(r.plan_id, r.period): (r.renewals, r.new_customers, r.revenue) for r in RevenueDaily.objects.all()}
+        self.assertEqual(rows, {(self.silver.id, 'monthly'): (2, 1, 20), (self.king.id, 'yearly'): (1, 1, 600)})
+        self.assertEqual(rebuild_revenue_daily(), 2)
+        rebuilt = {(r.plan_id, r.period): (r.renewals, r.new_customers, r.revenue) for r in RevenueDaily.objects.all()}
+        self.assertEqual(rebuilt, rows)
+
+    def test_editing_an_approved_renewal_moves_it_between_rows(self):
+        from datetime import timedelta
+        from .models import RevenueDaily
+        from .revenue_utils import rebuild_revenue_daily
+        renewal = self._approve(self.users[0], self.silver, 10)
+        renewal.amount, renewal.plan, renewal.period = 120, self.king, 'yearly'
+        renewal.approved_at -= timedelta(days=3)
+        renewal.save()
+        rows = {(r.day, r.plan_id, r.period): (r.renewals, r.new_customers, r.revenue) for r in RevenueDaily.objects.exclude(renewals=0)}
+        self.assertEqual(list(rows.values()), [(1, 1, 120)])
+        rebuild_revenue_daily()
+        rebuilt = {(r.day, r.plan_id, r.period): (r.renewals, r.new_customers, r.revenue) for r in RevenueDaily.objects.all()}
+        self.assertEqual(rebuilt, rows)
+
+    def test_deleting_an_approved_renewal_takes_it_out(self):
+        from .models import RevenueDaily
+        self._approve(self.users[0], self.silver, 10)
+        second = self._approve(self.users[0], self.silver, 15)
+        second.delete()
+        row = RevenueDaily.objects.get(plan=self.silver)
+        self.assertEqual((row.renewals, row.new_customers, row.revenue), (1, 1, 10))
+
+    def _rollup(self):
+        from .models import RevenueDaily
+        return {
+            (r.day, r.plan_id, r.period): (r.renewals, r.new_customers, r.revenue)
+            for r in RevenueDaily.objects.exclude(renewals=0, new_customers=0, revenue=0)
+        }
+
+    def test_first_approval_changes_move_the_new_customer_credit(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .revenue_utils import rebuild_revenue_daily
+        first = self._approve(self.users[0], self.silver, 10)
+        second = self._approve(self.users[0], self.king, 50)
+        second.approved_at += timedelta(days=2)
+        second.save()
+        third = self._approve(self.users[1], self.silver, 10)
+
+        first.delete()
+        incremental = self._rollup()
+        self.assertEqual(incremental[(timezone.localdate(second.approved_at), self.king.id, 'monthly')], (1, 1, 50))
+        rebuild_revenue_daily()
+        self.assertEqual(incremental, self._rollup())
+
+        # Back-dating an approval before the user's first one takes the credit from it
+        third.approved_at -= timedelta(days=5)
+        third.save()
+        late = self._approve(self.users[1], self.king, 50)
+        late.approved_at -= timedelta(days=9)
+        late.save()
+        incremental = self._rollup()
+        rebuild_revenue_daily()
+        self.assertEqual(incremental, self._rollup())
+
+        late.status = self.renewal_model.STATUS_REJECTED
+        late.save()
+        incremental = self._rollup()
+        rebuild_revenue_daily()
+        self.assertEqual(incremental, self._rollup())
+
+    def test_admin_revenue_helpers_use_a_fixed_number_of_queries(self):
+        from .revenue_utils import get_revenue_by_plan, get_revenue_summary, get_subscription_revenue_data
+        for user in self.users:
+            self._approve(user, self.king, 50)
+        self._approve(self.users[0], self.king, 55)
+        with self.assertNumQueries(3):
+            data = {row['user'].username: row for row in get_subscription_revenue_data()}
+        self.assertEqual((data['rv_u0']['total_paid'], data['rv_u0']['current_price']), (105.0, 55.0))
+        with self.assertNumQueries(2):
+            summary = get_revenue_summary()
+        self.assertEqual(summary['total_revenue'], 205.0)
+        with self.assertNumQueries(3):
+            by_plan = {row['plan_name']: row for row in get_revenue_by_plan()}
+        self.assertEqual(by_plan['king']['total_revenue'], 205.0)
+
+    def test_time_series_endpoints_read_the_rollup(self):
+        from datetime import date
+        from decimal import Decimal
+        from .models import RevenueDaily
+        RevenueDaily.objects.create(day=date(2026, 1, 5), plan=self.silver, period='monthly', renewals=4, new_customers=4, revenue=Decimal('40'))
+        RevenueDaily.objects.create(day=date(2026, 1, 9), plan=self.king, period='yearly', renewals=1, new_customers=1, revenue=Decimal('1200'))
+        RevenueDaily.objects.create(day=date(2026, 2, 5), plan=self.silver, period='monthly', renewals=3, new_customers=0, revenue=Decimal('30'))
+
+        self.client.force_login(self.users[0])
+        self.assertEqual(self.client.get('/api/stats/revenue/mrr').status_code, 403)
+        self.client.force_login(self.admin)
+        daily = self.client.get('/api/stats/revenue/daily', {'from': '2026-01-01', 'to': '2026-01-31'}).json()['results']
+        self.assertEqual([(r['day'], r['plan'], r['renewals']) for r in daily], [('2026-01-05', 'silver', 4), ('2026-01-09', 'king', 1)])
+        mrr = self.client.get('/api/stats/revenue/mrr', {'from': '2026-01-01', 'to': '2026-02-28'}).json()['results']
+        self.assertEqual([(r['month'], r['mrr']) for r in mrr], [('2026-01', 140.0), ('2026-02', 130.0)])
+        churn = self.client.get('/api/stats/revenue/churn', {'from': '2026-02-01', 'to': '2026-02-28'}).json()['results']
+        self.assertEqual(churn, [{'month': '2026-02', 'due': 4, 'retained': 3, 'churned': 1, 'churn_rate': 0.25}])
+        self.assertEqual(self.client.get('/api/stats/revenue/mrr', {'from': '2026-13-01'}).status_code, 400)
@@ -0,0 +1,10 @@
+from django.urls import path
+
+from .views import RevenueChurnView, RevenueDailyView, RevenueMRRView
+
+
+urlpatterns = [
+    path('revenue/daily', RevenueDailyView.as_view(), name='stats_revenue_daily'),
+    path('revenue/mrr', RevenueMRRView.as_view(), name='stats_revenue_mrr'),
+    path('revenue/churn', RevenueChurnView.as_view(), name='stats_revenue_churn'),
+]
@@ -1,3 +1,69 @@
-from django.shortcuts import render
+from datetime import timedelta
 
-# Create your views here.
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from rest_framework import status
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from .revenue_utils import daily_series, monthly_series
+
+
+class _RevenueSeriesView(APIView):
+    """Revenue time series for admins, read from the ``RevenueDaily`` rollup.
+
+    ``from``/``to`` are ISO dates (inclusive); ``default_days`` sets the range when ``from`` is omitted.
+    """
+    permission_classes = [IsAdminUser]
+    default_days = 365
+
+    def _range(self, request):
+        end = timezone.localdate()
+        start = end - timedelta(days=self.default_days)
+        raw_from = request.query_params.get('from')
+        raw_to = request.query_params.get('to')
+        try:
+            if raw_to:
+                end = parse_date(raw_to)
+            if raw_from:
+                start = parse_date(raw_from)
+            elif raw_to:
+                start = end - timedelta(days=self.default_days)
+        except ValueError:
+            start = end = None
+        if start is None or end is None or start > end:
+            return None
+        return start, end
+
+    def get(self, request):
+        dates = self._range(request)
+        if dates is None:
+            return Response({'detail': 'Invalid date range; use from/to as YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+        start, end = dates
+        return Response({'from': start.isoformat(), 'to': end.isoformat(), 'results': self.series(request, start, end)})
+
+
+class RevenueDailyView(_RevenueSeriesView):
+    """Renewals and revenue per plan per day; ``?plan=<id>`` narrows to one plan."""
+    default_days = 30
+
+    def series(self, request, start, end):
+        plan = request.query_params.get('plan')
+        return daily_series(start, end, plan_id=int(plan) if plan and plan.isdigit() else None)
+
+
+class RevenueMRRView(_RevenueSeriesView):
+    def series(self, request, start, end):
+        return [
+            {key: row[key] for key in ('month', 'mrr', 'revenue', 'renewals', 'new_customers')}
+            for row in monthly_series(start, end)
+        ]
+
+
+class RevenueChurnView(_RevenueSeriesView):
+    def series(self, request, start, end):
+        return [
+            {key: row[key] for key in ('month', 'due', 'retained', 'churned', 'churn_rate')}
+            for row in monthly_series(start, end)
+        ]
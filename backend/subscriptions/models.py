@@ -62,6 +62,42 @@ class UserSubscription(models.Model):
         now = timezone.now()
         return self.status == self.STATUS_ACTIVE and self.start_at <= now <= self.end_at
 
+    @staticmethod
+    def trial_plan() -> Optional[SubscriptionPlan]:
+        # If no explicit trial plan exists, fallback to lowest tier available
+        return SubscriptionPlan.objects.filter(code="trial").first() or SubscriptionPlan.objects.order_by("code").first()
+
+    @classmethod
+    def grant_trials(cls, users, plan: Optional[SubscriptionPlan] = None, batch_size: int = 1000) -> int:
+        """Give a 1-month trial to each user without a subscription; returns how many were created.
+
+        Set-based: one lookup of existing subscriptions and a ``bulk_create``.
+        The trial starts at the user's ``date_joined``.
+        """
+        users = [u for u in users if getattr(u, "pk", None)]
+        if not users:
+            return 0
+        plan = plan or cls.trial_plan()
+        if plan is None:
+            return 0  # no plans configured yet
+        existing = set(cls.objects.filter(user_id__in=[u.pk for u in users]).values_list("user_id", flat=True))
+        now = timezone.now()
+        rows = []
+        for user in users:
+            if user.pk in existing:
+                continue
+            start = getattr(user, "date_joined", None) or now
+            rows.append(cls(
+                user_id=user.pk,
+                plan=plan,
+                start_at=start,
+                end_at=start + timedelta(days=30),
+                status=cls.STATUS_ACTIVE,
+                notes="Auto-granted 1-month trial",
+            ))
+        cls.objects.bulk_create(rows, batch_size=batch_size, ignore_conflicts=True)
+        return len(rows)
+
     def update_status_from_dates(self):
         now = timezone.now()
         if self.status == self.STATUS_CANCELLED:
@@ -61,28 +61,8 @@ def apply_extension_on_manual_approval(sender, instance: RenewalRequest, created
 def grant_trial_on_user_creation(sender, instance, created, **kwargs):
     if not created:
         return
-    user = instance
-    # Skip if any subscription already exists
-    if hasattr(user, "subscription") and user.subscription is not None:
-        return
     try:
-        plan = SubscriptionPlan.objects.filter(code="trial").first()
-        # If no explicit trial plan exists, fallback to lowest tier available
-        if plan is None:
-            plan = SubscriptionPlan.objects.order_by("code").first()
-        if plan is None:
-            return  # no plans configured yet
-        now = timezone.now()
-        start = getattr(user, "date_joined", None) or now
-        end = start + timezone.timedelta(days=30)
-        UserSubscription.objects.create(
-            user=user,
-            plan=plan,
-            start_at=start,
-            end_at=end,
-            status=UserSubscription.STATUS_ACTIVE,
-            notes="Auto-granted 1-month trial",
-        )
+        UserSubscription.grant_trials([instance])
     except Exception:
         # Avoid blocking user creation due to subscription issues
         pass